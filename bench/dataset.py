@@ -0,0 +1,327 @@
+# -*- coding: UTF-8 -*-
+
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+"""Synthetic dataset generator for the benchmarks.
+
+Builds a Bloodhound (or plain Trac) environment populated with
+products, tickets with custom fields and change history, relations,
+wiki pages using macros, attachments and a local git repository. The
+content only depends on the sizes and the random seed, so that the
+benchmarks of different commits run against the same data.
+"""
+
+from __future__ import with_statement
+
+import os
+import random
+import subprocess
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from trac.util.datefmt import utc
+
+DEFAULT_SIZES = {
+    'products': 3,
+    'tickets': 200,
+    'custom_fields': 4,
+    'changes': 4,
+    'relations': 50,
+    'wiki_pages': 30,
+    'attachments': 20,
+    'commits': 50,
+}
+
+# Configuration of the environments created by bloodhound_setup, without
+# the account manager and with the git repository support
+BLOODHOUND_OPTIONS = [
+    ('components', 'bhtheme.*', 'enabled'),
+    ('components', 'bhdashboard.*', 'enabled'),
+    ('components', 'multiproduct.*', 'enabled'),
+    ('components', 'permredirect.*', 'enabled'),
+    ('components', 'themeengine.api.*', 'enabled'),
+    ('components', 'themeengine.web_ui.*', 'enabled'),
+    ('components', 'bhsearch.*', 'enabled'),
+    ('components', 'bhrelations.*', 'enabled'),
+    ('components', 'trac.ticket.web_ui.ticketmodule', 'disabled'),
+    ('components', 'trac.ticket.report.reportmodule', 'disabled'),
+    ('theme', 'theme', 'bloodhound'),
+    ('trac', 'environment_factory',
+     'multiproduct.hooks.MultiProductEnvironmentFactory'),
+    ('trac', 'request_factory', 'multiproduct.hooks.ProductRequestFactory'),
+    ('bhsearch', 'is_default', 'true'),
+]
+
+COMMON_OPTIONS = [
+    ('components', 'tracopt.versioncontrol.git.*', 'enabled'),
+    ('git', 'cached_repository', 'true'),
+    ('logging', 'log_type', 'none'),
+    ('trac', 'server_timing', 'enabled'),
+]
+
+WORDS = """lorem ipsum dolor sit amet consectetur adipiscing elit sed do
+eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad minim
+veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea
+commodo consequat duis aute irure reprehenderit voluptate velit esse
+cillum fugiat nulla pariatur excepteur sint occaecat cupidatat non
+proident sunt culpa qui officia deserunt mollit anim id est laborum
+""".split()
+
+USERS = ['admin', 'alice', 'bob', 'carol', 'dave', 'erin']
+
+WIKI_TEMPLATE = """= %(title)s =
+[[PageOutline]]
+
+%(paragraph)s
+
+== Open tickets ==
+[[TicketQuery(status=!closed,max=10,format=table,col=summary|owner|status)]]
+
+== Related ==
+ * See #%(ticket)s and [wiki:%(other)s].
+ * Recently changed pages: [[RecentChanges(Bench,5)]]
+
+== Details ==
+||= Field =||= Value =||
+|| owner || %(owner)s ||
+|| milestone || [milestone:"%(milestone)s"] ||
+
+{{{#!python
+def bench_%(index)d(value):
+    return [value * i for i in range(%(index)d)]
+}}}
+
+'''%(word)s''' and ''%(word)s'': %(paragraph)s
+"""
+
+
+class DatasetGenerator(object):
+    """Create and populate a benchmark environment in `path`.
+
+    `sizes` overrides the entries of `DEFAULT_SIZES`. When `bloodhound`
+    is `False`, a plain Trac environment is created and the products and
+    relations are skipped.
+    """
+
+    def __init__(self, path, sizes=None, bloodhound=True, seed=1):
+        self.path = os.path.abspath(path)
+        self.sizes = dict(DEFAULT_SIZES)
+        self.sizes.update(sizes or {})
+        self.bloodhound = bloodhound
+        self.random = random.Random(seed)
+        self.start = datetime.now(utc) - timedelta(days=30)
+        self.events = 0
+
+    def create(self):
+        """Create the environment and return it."""
+        from trac.env import Environment
+        from trac.perm import PermissionSystem
+        if self.bloodhound:
+            import multiproduct.env  # replaces `trac.env.Environment`
+            Environment = multiproduct.env.Environment
+        options = COMMON_OPTIONS + [
+            ('repositories', 'bench.dir',
+             os.path.join(self.path, 'git', '.git')),
+            ('repositories', 'bench.type', 'git'),
+        ]
+        for i in xrange(self.sizes['custom_fields']):
+            if i % 2:
+                options += [('ticket-custom', 'bench%d' % i, 'select'),
+                            ('ticket-custom', 'bench%d.options' % i,
+                             '|'.join(WORDS[:5]))]
+            else:
+                options.append(('ticket-custom', 'bench%d' % i, 'text'))
+        if self.bloodhound:
+            options += BLOODHOUND_OPTIONS
+        self._create_git_repository(os.path.join(self.path, 'git'))
+        env = Environment(self.path, create=True, options=options)
+        if env.needs_upgrade():
+            env.upgrade()
+        PermissionSystem(env).grant_permission('admin', 'TRAC_ADMIN')
+        for target in self._create_products(env):
+            self._populate(target)
+        self._sync_repository(env)
+        if self.bloodhound:
+            from bhsearch.api import BloodhoundSearchApi
+            BloodhoundSearchApi(env).rebuild_index()
+        return env
+
+    def get_product_prefixes(self):
+        """Return the prefixes of the created products."""
+        if not self.bloodhound:
+            return []
+        return ['P%d' % i for i in xrange(self.sizes['products'])]
+
+    # Internal methods
+
+    def _next_time(self):
+        """Return increasing timestamps spread over the last 30 days."""
+        self.events += 1
+        return self.start + timedelta(seconds=self.events * 60)
+
+    def _words(self, count):
+        return ' '.join(self.random.choice(WORDS) for i in xrange(count))
+
+    def _create_products(self, env):
+        if not self.bloodhound:
+            return [env]
+        from multiproduct.env import ProductEnvironment
+        from multiproduct.model import Product
+        targets = []
+        for prefix in self.get_product_prefixes():
+            product = Product(env)
+            product._data.update({'prefix': prefix,
+                                  'name': 'Product %s' % prefix,
+                                  'description': self._words(20),
+                                  'owner': 'admin'})
+            product.insert()
+            targets.append(ProductEnvironment(env, prefix))
+        return targets
+
+    def _populate(self, env):
+        from trac.ticket.model import Component, Milestone
+        milestones = []
+        for i in xrange(4):
+            milestone = Milestone(env)
+            milestone.name = 'Bench %d.0' % i
+            milestone.due = self.start + timedelta(days=15 * i)
+            milestone.description = self._words(30)
+            milestone.insert()
+            milestones.append(milestone.name)
+        components = []
+        for i in xrange(3):
+            component = Component(env)
+            component.name = 'bench-component%d' % i
+            component.owner = self.random.choice(USERS)
+            component.insert()
+            components.append(component.name)
+        tickets = self._create_tickets(env, milestones, components)
+        self._create_relations(env, tickets)
+        pages = self._create_wiki_pages(env, tickets, milestones)
+        self._create_attachments(env, tickets, pages)
+
+    def _create_tickets(self, env, milestones, components):
+        from trac.ticket.model import Ticket
+        tickets = []
+        count = self.sizes['tickets'] // max(1, len(self.get_product_prefixes()))
+        for i in xrange(max(1, count)):
+            ticket = Ticket(env)
+            ticket.populate({
+                'summary': 'Bench ' + self._words(6),
+                'description': '%s\n\n * item #%d\n * %s' % (
+                    self._words(60), max(1, i), self._words(8)),
+                'reporter': self.random.choice(USERS),
+                'owner': self.random.choice(USERS),
+                'status': 'new',
+                'type': self.random.choice(['defect', 'enhancement', 'task']),
+                'priority': self.random.choice(['major', 'minor',
+                                                'critical']),
+                'milestone': self.random.choice(milestones),
+                'component': self.random.choice(components),
+                'keywords': self._words(2),
+            })
+            for j in xrange(self.sizes['custom_fields']):
+                ticket['bench%d' % j] = self.random.choice(WORDS[:5])
+            ticket.insert(when=self._next_time())
+            for j in xrange(self.sizes['changes']):
+                if j == self.sizes['changes'] - 1 and i % 3 == 0:
+                    ticket['status'] = 'closed'
+                    ticket['resolution'] = 'fixed'
+                else:
+                    ticket['owner'] = self.random.choice(USERS)
+                    ticket['priority'] = self.random.choice(['major',
+                                                             'minor'])
+                ticket.save_changes(self.random.choice(USERS),
+                                    self._words(25), self._next_time())
+            tickets.append(ticket)
+        return tickets
+
+    def _create_relations(self, env, tickets):
+        if not self.bloodhound or len(tickets) < 2:
+            return
+        from bhrelations.api import RelationsSystem
+        from bhrelations.validation import ValidationError
+        relations = RelationsSystem(env)
+        count = self.sizes['relations'] // len(self.get_product_prefixes())
+        for i in xrange(count):
+            # Only depend on older tickets, as cycles are not allowed
+            source, destination = sorted(self.random.sample(tickets, 2),
+                                         key=lambda t: -t.id)
+            try:
+                relations.add(source, destination, 'dependson',
+                              self._words(5), 'admin', self._next_time())
+            except ValidationError:
+                pass
+
+    def _create_wiki_pages(self, env, tickets, milestones):
+        from trac.wiki.model import WikiPage
+        names = ['BenchPage%d' % i for i in xrange(self.sizes['wiki_pages'])]
+        for i, name in enumerate(names):
+            page = WikiPage(env, name)
+            for version in xrange(1 + i % 3):
+                page.text = WIKI_TEMPLATE % {
+                    'title': name, 'index': i, 'word': WORDS[i % len(WORDS)],
+                    'paragraph': self._words(80),
+                    'ticket': self.random.choice(tickets).id,
+                    'other': self.random.choice(names),
+                    'owner': self.random.choice(USERS),
+                    'milestone': self.random.choice(milestones)}
+                page.save(self.random.choice(USERS), self._words(4),
+                          '127.0.0.1', self._next_time())
+        return names
+
+    def _create_attachments(self, env, tickets, pages):
+        from trac.attachment import Attachment
+        for i in xrange(self.sizes['attachments']):
+            if i % 2 and pages:
+                attachment = Attachment(env, 'wiki', pages[i % len(pages)])
+            else:
+                attachment = Attachment(env, 'ticket',
+                                        tickets[i % len(tickets)].id)
+            attachment.description = self._words(5)
+            attachment.author = self.random.choice(USERS)
+            data = '\n'.join(self._words(12) for line in xrange(50 + i))
+            attachment.insert('bench%d.txt' % i, StringIO(data), len(data),
+                              t=self._next_time())
+
+    def _create_git_repository(self, path):
+        os.makedirs(path)
+        environ = dict(os.environ, GIT_AUTHOR_NAME='admin',
+                       GIT_AUTHOR_EMAIL='admin@example.org',
+                       GIT_COMMITTER_NAME='admin',
+                       GIT_COMMITTER_EMAIL='admin@example.org')
+        def git(*args):
+            subprocess.check_call(('git',) + args, cwd=path, env=environ,
+                                  stdout=open(os.devnull, 'w'))
+        git('init', '-q')
+        for i in xrange(self.sizes['commits']):
+            name = os.path.join(path, 'module%d.py' % (i % 10))
+            with open(name, 'a') as f:
+                f.write('def function_%d():\n    return %r\n\n'
+                        % (i, self._words(5)))
+            date = self._next_time().strftime('%Y-%m-%dT%H:%M:%S +0000')
+            environ['GIT_AUTHOR_DATE'] = environ['GIT_COMMITTER_DATE'] = date
+            git('add', '.')
+            git('commit', '-q', '-m', 'Bench commit %d: %s, refs #%d'
+                % (i, self._words(6), 1 + i % 10))
+
+    def _sync_repository(self, env):
+        from trac.versioncontrol.api import RepositoryManager
+        repos = RepositoryManager(env).get_repository('bench')
+        if repos is not None:
+            repos.sync()
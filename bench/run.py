@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+"""Benchmark representative requests against a synthetic environment.
+
+The requests are dispatched in-process through
+`trac.web.main.dispatch_request`, and the results are written as JSON,
+so that they can be compared between commits with `--compare`.
+"""
+
+from __future__ import with_statement
+
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+from StringIO import StringIO
+
+from dataset import DEFAULT_SIZES, DatasetGenerator
+
+# name, path, query string; `%(product)s` is the product URL prefix
+SCENARIOS = [
+    ('dashboard', '/dashboard', ''),
+    ('ticket', '%(product)s/ticket/1', ''),
+    ('query', '%(product)s/query',
+     'status=!closed&order=priority&col=id&col=summary&col=status'
+     '&col=owner&col=bench0'),
+    ('roadmap', '%(product)s/roadmap', ''),
+    ('timeline', '/timeline', 'daysback=90'),
+    ('search', '/bhsearch', 'q=bench'),
+    ('wiki', '%(product)s/wiki/BenchPage1', ''),
+]
+
+_sql_re = re.compile(r'sql;dur=([\d.]+);desc="SQL \((\d+)\)"')
+
+
+def percentile(values, p):
+    """Return the `p`-th percentile of `values` (nearest rank)."""
+    values = sorted(values)
+    index = max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def get_scenarios(bloodhound, names=None):
+    product = '/products/P0' if bloodhound else ''
+    scenarios = []
+    for name, path, query in SCENARIOS:
+        if names and name not in names:
+            continue
+        if not bloodhound:
+            if name == 'dashboard':
+                continue
+            if name == 'search':
+                path, query = '/search', 'q=bench&ticket=on&wiki=on'
+        scenarios.append((name, path % {'product': product}, query))
+    return scenarios
+
+
+def request(env_path, path, query):
+    """Dispatch a GET request and return the status, the `Server-Timing`
+    header and the size of the response."""
+    from trac.web.main import dispatch_request
+    environ = {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path,
+        'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1', 'REMOTE_USER': 'admin',
+        'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': False,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        'trac.env_path': env_path,
+    }
+    response = {'size': 0}
+    def write(data):
+        response['size'] += len(data)
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split()[0])
+        response['headers'] = dict(headers)
+        return write
+    body = dispatch_request(environ, start_response)
+    try:
+        for chunk in body:
+            write(chunk)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return (response['status'],
+            response['headers'].get('Server-Timing', ''), response['size'])
+
+
+def run_scenario(env_path, path, query, iterations, warmup):
+    for i in xrange(warmup):
+        request(env_path, path, query)
+    latencies = []
+    sql_counts = []
+    sql_times = []
+    for i in xrange(iterations):
+        start = time.time()
+        status, server_timing, size = request(env_path, path, query)
+        latencies.append((time.time() - start) * 1000)
+        match = _sql_re.search(server_timing)
+        if match:
+            sql_times.append(float(match.group(1)))
+            sql_counts.append(int(match.group(2)))
+    result = {
+        'url': path + ('?' + query if query else ''),
+        'status': status,
+        'size': size,
+        'iterations': iterations,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'mean_ms': sum(latencies) / len(latencies),
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if sql_counts:
+        result.update(sql_count=percentile(sql_counts, 50),
+                      sql_p50_ms=percentile(sql_times, 50))
+    return result
+
+
+def get_commit():
+    try:
+        git = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.PIPE)
+        return git.communicate()[0].strip()
+    except OSError:
+        return None
+
+
+def compare(baseline, results, threshold):
+    """Print the relative changes from `baseline` and return the names of
+    the scenarios whose p95 latency increased by more than `threshold`."""
+    regressions = []
+    print >> sys.stderr, '%-10s %10s %10s %8s %10s %10s' % (
+        'scenario', 'p50 (ms)', 'p95 (ms)', 'change', 'SQL', 'RSS (KiB)')
+    for name, result in sorted(results['results'].iteritems()):
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+        change = result['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0
+        if change > threshold:
+            regressions.append(name)
+        print >> sys.stderr, \
+            '%-10s %10.1f %10.1f %+7.0f%% %4s->%-5s %10s' % (
+                name, result['p50_ms'], result['p95_ms'], change * 100,
+                old.get('sql_count', '-'), result.get('sql_count', '-'),
+                result['maxrss_kb'] - old['maxrss_kb'])
+    return regressions
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--env', dest='env',
+                      help='run against an existing benchmark environment '
+                           'instead of generating one')
+    parser.add_option('--keep', dest='keep', action='store_true',
+                      help="don't remove the generated environment")
+    parser.add_option('--no-bloodhound', dest='bloodhound',
+                      action='store_false', default=True,
+                      help='generate a plain Trac environment')
+    for name, value in sorted(DEFAULT_SIZES.iteritems()):
+        parser.add_option('--' + name.replace('_', '-'), dest=name,
+                          type='int', default=value,
+                          help='number of %s (default: %d)'
+                               % (name.replace('_', ' '), value))
+    parser.add_option('--seed', dest='seed', type='int', default=1)
+    parser.add_option('-n', '--iterations', dest='iterations', type='int',
+                      default=20, help='measured requests per scenario')
+    parser.add_option('--warmup', dest='warmup', type='int', default=2,
+                      help='unmeasured requests per scenario')
+    parser.add_option('-s', '--scenario', dest='scenarios', action='append',
+                      help='run only the given scenario (repeatable)')
+    parser.add_option('-o', '--output', dest='output',
+                      help='write the results to this file')
+    parser.add_option('--compare', dest='compare',
+                      help='compare with the results in this file')
+    parser.add_option('--threshold', dest='threshold', type='float',
+                      default=0.2, help='p95 increase reported as a '
+                                        'regression (default: 0.2)')
+    options, args = parser.parse_args(args)
+
+    sizes = dict((name, getattr(options, name)) for name in DEFAULT_SIZES)
+    env_path = options.env
+    tempdir = None
+    if not env_path:
+        tempdir = tempfile.mkdtemp(prefix='bhbench-')
+        env_path = os.path.join(tempdir, 'env')
+        start = time.time()
+        env = DatasetGenerator(env_path, sizes, options.bloodhound,
+                               options.seed).create()
+        env.shutdown()
+        print >> sys.stderr, 'Generated %s in %.1fs' % (env_path,
+                                                       time.time() - start)
+    try:
+        results = {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'dataset': sizes if not options.env else None,
+            'bloodhound': options.bloodhound,
+            'seed': options.seed,
+            'results': {},
+        }
+        for name, path, query in get_scenarios(options.bloodhound,
+                                               options.scenarios):
+            result = run_scenario(env_path, path, query, options.iterations,
+                                  options.warmup)
+            results['results'][name] = result
+            print >> sys.stderr, '%-10s %3d p50=%.1fms p95=%.1fms sql=%s' % (
+                name, result['status'], result['p50_ms'], result['p95_ms'],
+                result.get('sql_count', '-'))
+    finally:
+        if tempdir and not options.keep:
+            shutil.rmtree(tempdir)
+        elif tempdir:
+            print >> sys.stderr, 'Environment kept in %s' % env_path
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+"""Replay the SQL statements of recorded requests, with and without the
+statement cache of `trac.db.util`.
+
+The trace is recorded by dispatching the scenarios of `run.py` against a
+benchmark environment, or read from a file written by `--record`. It is
+replayed in a transaction which is rolled back, so that the environment
+is left unchanged.
+"""
+
+from __future__ import with_statement
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from dataset import DEFAULT_SIZES, DatasetGenerator
+from run import get_scenarios, request
+
+
+def record(env_path, scenarios):
+    """Dispatch the `scenarios` and return the `(sql, args)` of the
+    statements they executed."""
+    from trac.web import main
+    trace = []
+
+    class RecordingTimings(main.RequestTimings):
+        def statement_executed(self, sql, args, duration, rows):
+            super(RecordingTimings, self).statement_executed(sql, args,
+                                                             duration, rows)
+            trace.append((sql, list(args) if args else None))
+
+    timings_class = main.RequestTimings
+    main.RequestTimings = RecordingTimings
+    try:
+        for name, path, query in scenarios:
+            request(env_path, path, query)
+    finally:
+        main.RequestTimings = timings_class
+    return trace
+
+
+def get_caches():
+    from trac.db import sqlite_backend
+    from trac.db.util import statements
+    caches = [statements]
+    if hasattr(sqlite_backend, '_qmark_statements'):
+        caches.append(sqlite_backend._qmark_statements)
+    return caches
+
+
+def replay(env_path, trace, passes):
+    """Execute the statements of the `trace` `passes` times, with the
+    statement caches disabled and enabled, and return the timings."""
+    from trac.db.api import DatabaseManager
+    from trac.env import open_environment
+    try:
+        from multiproduct.dbcursor import BloodhoundIterableCursor
+    except ImportError:
+        pass
+    else:
+        # The recorded statements are already translated
+        BloodhoundIterableCursor.set_env(None)
+
+    env = open_environment(env_path, use_cache=False)
+    caches = get_caches()
+    maxsizes = [cache.maxsize for cache in caches]
+    results = {}
+    try:
+        for label, enabled in (('uncached', False), ('cached', True)):
+            for cache, maxsize in zip(caches, maxsizes):
+                cache.clear()
+                cache.maxsize = maxsize if enabled else 0
+            prepare_times = []
+            execute_times = []
+            errors = 0
+            db = DatabaseManager(env).get_connection()
+            try:
+                for i in xrange(passes):
+                    start = time.time()
+                    for sql, args in trace:
+                        db.check_select(sql)
+                        caches[0].get(sql)
+                    prepare_times.append(time.time() - start)
+                    cursor = db.cursor()
+                    start = time.time()
+                    for sql, args in trace:
+                        try:
+                            cursor.execute(sql, args)
+                            if cursor.description:
+                                cursor.fetchall()
+                        except env.db_exc.Error:
+                            # The failed statement rolled back the
+                            # transaction, which may close the cursor
+                            errors += 1
+                            cursor = db.cursor()
+                    execute_times.append(time.time() - start)
+                    # Replay each pass against the same data
+                    db.rollback()
+            finally:
+                db.rollback()
+                db.close()
+            stats = caches[0].get_stats()
+            results[label] = {
+                'prepare_us': min(prepare_times) * 1e6 / len(trace),
+                'execute_us': min(execute_times) * 1e6 / len(trace),
+                'hits': stats['hits'], 'misses': stats['misses'],
+                'errors': errors,
+            }
+    finally:
+        for cache, maxsize in zip(caches, maxsizes):
+            cache.maxsize = maxsize
+        env.shutdown()
+    return results
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--env', dest='env',
+                      help='use an existing benchmark environment instead '
+                           'of generating one')
+    parser.add_option('--no-bloodhound', dest='bloodhound',
+                      action='store_false', default=True,
+                      help='generate a plain Trac environment')
+    parser.add_option('--trace', dest='trace',
+                      help='replay the trace of this file instead of '
+                           'recording one')
+    parser.add_option('--record', dest='record',
+                      help='write the recorded trace to this file')
+    parser.add_option('-s', '--scenario', dest='scenarios', action='append',
+                      help='record only the given scenario (repeatable)')
+    parser.add_option('-n', '--passes', dest='passes', type='int',
+                      default=5, help='number of replays of the trace')
+    options, args = parser.parse_args(args)
+
+    env_path = options.env
+    tempdir = None
+    if not env_path:
+        tempdir = tempfile.mkdtemp(prefix='bhbench-')
+        env_path = os.path.join(tempdir, 'env')
+        DatasetGenerator(env_path, DEFAULT_SIZES,
+                         options.bloodhound).create().shutdown()
+    try:
+        if options.trace:
+            with open(options.trace) as f:
+                trace = json.load(f)
+        else:
+            trace = record(env_path, get_scenarios(options.bloodhound,
+                                                   options.scenarios))
+            if options.record:
+                with open(options.record, 'w') as f:
+                    json.dump(trace, f, indent=1, default=unicode)
+        if not trace:
+            print >> sys.stderr, 'No statements to replay'
+            return 1
+        results = replay(env_path, trace, options.passes)
+    finally:
+        if tempdir:
+            shutil.rmtree(tempdir)
+
+    print >> sys.stderr, '%d statements, %d distinct' % (
+        len(trace), len(set(sql for sql, args in trace)))
+    for label in ('uncached', 'cached'):
+        result = results[label]
+        print >> sys.stderr, \
+            '%-9s prepare=%.2fus execute=%.1fus hits=%d misses=%d' % (
+                label, result['prepare_us'], result['execute_us'],
+                result['hits'], result['misses'])
+    print json.dumps(results, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+"""Measure the warm-up time of the wiki parsers of many products, with
+and without the compiled rules shared by `trac.wiki.parser.WikiParser`.
+
+Each product environment has its own `WikiParser` component, which
+compiles its rules the first time a wiki text is formatted. With
+Bloodhound installed, the products of a generated environment are used,
+otherwise independent `EnvironmentStub` instances stand in for them.
+"""
+
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from dataset import DatasetGenerator
+
+
+def get_environments(tempdir, count, bloodhound):
+    """Return `count` environments with the same wiki syntax."""
+    if bloodhound:
+        try:
+            from multiproduct.env import ProductEnvironment
+        except ImportError:
+            bloodhound = False
+    if not bloodhound:
+        from trac.test import EnvironmentStub
+        return [EnvironmentStub() for i in xrange(count)]
+    sizes = dict.fromkeys(('tickets', 'changes', 'relations', 'wiki_pages',
+                           'attachments'), 0)
+    sizes.update(products=count, commits=1)
+    generator = DatasetGenerator(os.path.join(tempdir, 'env'), sizes)
+    env = generator.create()
+    return [ProductEnvironment(env, prefix)
+            for prefix in generator.get_product_prefixes()]
+
+
+def warm_up(envs, shared):
+    """Compile the rules of the parser of each environment and return the
+    duration and the number of distinct compiled rules."""
+    from trac.util import LRUCache
+    from trac.wiki.parser import WikiParser
+    shared_rules = WikiParser._shared_rules
+    WikiParser._shared_rules = LRUCache(len(envs) if shared else 0)
+    try:
+        parsers = [WikiParser(env) for env in envs]
+        for parser in parsers:
+            parser._compiled_rules = None
+        re.purge()
+        duration = 0
+        for parser in parsers:
+            if not shared:
+                # don't let the cache of the `re` module share the rules
+                re.purge()
+            start = time.time()
+            parser.rules
+            duration += time.time() - start
+    finally:
+        WikiParser._shared_rules = shared_rules
+    return duration, len(set(id(parser.rules) for parser in parsers))
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--products', dest='products', type='int',
+                      default=100, help='number of products')
+    parser.add_option('--no-bloodhound', dest='bloodhound',
+                      action='store_false', default=True,
+                      help='use environment stubs instead of products')
+    parser.add_option('-n', '--passes', dest='passes', type='int',
+                      default=3, help='number of measures')
+    options, args = parser.parse_args(args)
+
+    tempdir = tempfile.mkdtemp(prefix='bhbench-')
+    try:
+        envs = get_environments(tempdir, options.products, options.bloodhound)
+        results = {}
+        for label, shared in (('unshared', False), ('shared', True)):
+            durations = []
+            for i in xrange(options.passes):
+                duration, compiled = warm_up(envs, shared)
+                durations.append(duration)
+            results[label] = {'total_ms': min(durations) * 1e3,
+                              'per_product_ms': min(durations) * 1e3 /
+                                                len(envs),
+                              'compiled': compiled}
+    finally:
+        shutil.rmtree(tempdir)
+
+    print >> sys.stderr, '%d products' % len(envs)
+    for label in ('unshared', 'shared'):
+        result = results[label]
+        print >> sys.stderr, \
+            '%-9s total=%.1fms per product=%.2fms compiled=%d' % (
+                label, result['total_ms'], result['per_product_ms'],
+                result['compiled'])
+    print json.dumps(results, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,6 +28,7 @@ from bhdashboard.wiki import GUIDE_NAME
 from bhdashboard.util.translation import _
 
 class UserGuideTocMacro(WikiMacroBase):
+    _dependencies = ()
     _description = cleandoc_("""Display a Guide table of contents
 
     This macro provides the table-of-contents specific to the user Guide
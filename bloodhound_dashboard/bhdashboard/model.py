@@ -162,7 +162,12 @@ class ModelBase(object):
 
 
     def insert(self):
-        """Create new record in the database"""
+        """Create new record in the database
+
+        Records are inserted one at a time: each one is checked against
+        the existing keys and unique fields, and notifies the resource
+        change listeners.
+        """
         sdata = None
         if self._exists or len(self.select(self._env, where =
                                 dict([(k,self._data[k])
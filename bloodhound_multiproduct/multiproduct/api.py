@@ -25,7 +25,7 @@ from genshi.builder import tag, Element
 from genshi.core import escape, Markup, unescape
 
 from pkg_resources import resource_filename
-from trac.attachment import Attachment
+from trac.attachment import Attachment, AttachmentBlobStore
 from trac.config import Option, PathOption
 from trac.core import Component, TracError, implements, Interface
 from trac.db import Table, Column, DatabaseManager, Index
@@ -390,6 +390,7 @@ class MultiProductSystem(Component):
         # permission table specifics: 'anonymous' and 'authenticated' users
         # should by default have a PRODUCT_VIEW permission for all products
         self.log.info("Migrating system tables to a new schema")
+        product_view = []
         for table in self.MIGRATE_TABLES:
             if table == 'wiki':
                 continue
@@ -400,22 +401,19 @@ class MultiProductSystem(Component):
                 db("""INSERT INTO %s (%s, product) SELECT %s,'%s' FROM %s""" %
                    (table, cols, cols, product.prefix, temp_table_name))
                 if table == 'permission':
-                    db.executemany(
-                        """INSERT INTO permission (username, action, product)
-                           VALUES (%s, %s, %s)""",
-                        [('anonymous', 'PRODUCT_VIEW', product.prefix),
-                         ('authenticated', 'PRODUCT_VIEW', product.prefix)])
+                    product_view += [
+                        ('anonymous', 'PRODUCT_VIEW', product.prefix),
+                        ('authenticated', 'PRODUCT_VIEW', product.prefix)]
 
             if table == 'permission':
                 self.log.info("Populating table '%s' for global scope", table)
                 db("""INSERT INTO %s (%s, product) SELECT %s,'%s' FROM %s""" %
                    (table, cols, cols, '', temp_table_name))
             self._drop_temp_table(db, temp_table_name)
-        db.executemany(
-            """INSERT INTO permission (username, action, product)
-                VALUES (%s, %s, %s)""",
-            [('anonymous', 'PRODUCT_VIEW', ''),
-             ('authenticated', 'PRODUCT_VIEW', '')])
+        product_view += [('anonymous', 'PRODUCT_VIEW', ''),
+                         ('authenticated', 'PRODUCT_VIEW', '')]
+        db.bulk_execute("""INSERT INTO permission (username, action, product)
+                           VALUES (%s, %s, %s)""", product_view)
 
 
     def _upgrade_wikis(self, db, create_temp_table):
@@ -446,12 +444,22 @@ class MultiProductSystem(Component):
         self._drop_temp_table(db, temp_table_name)
 
     def _migrate_attachments(self, attachments, to_product=None, copy=False):
+        store = AttachmentBlobStore(self.env)
         for type, id, filename in attachments:
             old_path = Attachment._get_path(self.env.path, type, id, filename)
             new_path = self.env.path
             if to_product:
                 new_path = os.path.join(new_path, 'products', to_product)
             new_path = Attachment._get_path(new_path, type, id, filename)
+            # the content store is shared by the products, only the
+            # location of the content changes
+            if store.get_hash(old_path):
+                if not store.get_hash(new_path):
+                    if copy:
+                        store.copy(old_path, new_path)
+                    else:
+                        store.move(old_path, new_path)
+                continue
             dirname = os.path.dirname(new_path)
             if not os.path.exists(old_path):
                 self.log.warning(
@@ -486,12 +494,13 @@ class MultiProductSystem(Component):
                                       WHERE name='name'"""):
             if id in repositories_linked:
                 continue
-            db("""INSERT INTO repository (id, name, value)
-                          VALUES (%s, 'product', '%s')""" %
-               (id, self.default_product_prefix))
             repositories_linked.append(id)
             self.log.info("Repository '%s' (%s) soft linked to default product",
                           name, id)
+        db.bulk_execute("""INSERT INTO repository (id, name, value)
+                           VALUES (%s, 'product', %s)""",
+                        [(id, self.default_product_prefix)
+                         for id in repositories_linked])
 
     def _upgrade_table_system(self, SYSTEM_TABLES, create_temp_table, db):
         # Update system tables
@@ -586,7 +595,7 @@ class MultiProductSystem(Component):
                 self.log.debug("  -> %s" % table[0])
                 cols = table[1] + ('product', )
                 rows = [p + (product.prefix, ) for p in table[2]]
-                db.executemany(
+                db.bulk_execute(
                     "INSERT INTO %s (%s) VALUES (%s)" %
                     (table[0], ','.join(cols), ','.join(['%s' for c in cols])),
                     rows)
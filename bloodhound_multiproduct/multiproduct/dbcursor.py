@@ -35,7 +35,8 @@ SKIP_TABLES = ['auth_cookie',
                'cache',
                'repository', 'revision', 'node_change',
                'bloodhound_product', 'bloodhound_productresourcemap', 'bloodhound_productconfig',
-               'sqlite_master', 'bloodhound_relations'
+               'sqlite_master', 'bloodhound_relations',
+               'attachment_blob', 'attachment_blob_ref',
                ]
 TRANSLATE_TABLES = ['system',
                     'ticket', 'ticket_change', 'ticket_custom',
@@ -80,8 +81,9 @@ class BloodhoundIterableCursor(trac.db.util.IterableCursor):
     __slots__ = trac.db.util.IterableCursor.__slots__ + ['_translator']
     _tls = concurrency.ThreadLocal(env=None)
 
-    def __init__(self, cursor, log=None):
-        super(BloodhoundIterableCursor, self).__init__(cursor, log=log)
+    def __init__(self, cursor, log=None, profiler=None):
+        super(BloodhoundIterableCursor, self).__init__(cursor, log=log,
+                                                       profiler=profiler)
 
     def execute(self, sql, args=None):
         return super(BloodhoundIterableCursor, self).execute(translate_sql(self.env, sql), args=args)
@@ -127,6 +129,18 @@ class BloodhoundConnectionWrapper(object):
         BloodhoundIterableCursor.set_env(self.env)
         return self.connection.executemany(query, params=params)
 
+    def bulk_execute(self, query, params, chunk_size=1000):
+        # The product context is set again for each chunk, as `params`
+        # may be a generator running queries in another context
+        if self.connection.check_select(query):
+            raise ValueError("bulk_execute can't be used with a SELECT")
+        cursor = self.cursor()
+        try:
+            return trac.db.util.bulk_execute(cursor, query, params,
+                                             chunk_size)
+        finally:
+            cursor.close()
+
     def cursor(self):
         return BloodhoundCursorWrapper(self.connection.cursor(), self.env)
 
@@ -199,6 +213,18 @@ class ProductEnvContextManager(object):
         BloodhoundIterableCursor.set_env(self.env)
         return self.db_context.executemany(sql, params=params)
 
+    def bulk_execute(self, sql, params, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = self.db_context.dbmgr.bulk_chunk_size
+        with self as db:
+            return db.bulk_execute(sql, params, chunk_size)
+
+    def stream(self, sql, params=None, batch_size=None):
+        # The query is executed right away, in the current product context
+        BloodhoundIterableCursor.set_env(self.env)
+        return self.db_context.stream(sql, params=params,
+                                      batch_size=batch_size)
+
 
 class BloodhoundProductSQLTranslate(object):
     _join_statements = ['LEFT JOIN', 'LEFT OUTER JOIN',
@@ -22,6 +22,7 @@ import re
 from datetime import datetime
 from pkg_resources import resource_filename
 
+from trac.cache import cached
 from trac.config import OrderedExtensionsOption, Option
 from trac.core import Component, ExtensionPoint, Interface, TracError, \
                       implements
@@ -235,6 +236,12 @@ class RelationsSystem(Component):
     def get_ends(self):
         return self._links
 
+    @cached
+    def _relations_generation(self):
+        # Invalidated when the relations change, so that the entity tags
+        # of the ticket pages showing them change as well
+        return object()
+
     def add(self,
             source_resource_instance,
             destination_resource_instance,
@@ -276,6 +283,7 @@ class RelationsSystem(Component):
 
             for listener in self.changing_listeners:
                 listener.adding_relation(relation)
+            del self._relations_generation
 
     def delete(self, relation_id, when=None):
         if when is None:
@@ -295,6 +303,7 @@ class RelationsSystem(Component):
                     type=other_end,
                 ))
                 reverted_relation.delete()
+            del self._relations_generation
 
             for listener in self.changing_listeners:
                 listener.deleting_relation(cloned_relation, when)
@@ -309,6 +318,7 @@ class RelationsSystem(Component):
             self.env, resource_instance)
         with self.env.db_transaction as db:
             db(sql, (full_resource_id, full_resource_id))
+            del self._relations_generation
 
     def _debug_select(self):
         """The method is used for debug purposes"""
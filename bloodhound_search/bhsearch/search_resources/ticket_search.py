@@ -24,7 +24,7 @@ from bhsearch.api import (ISearchParticipant, BloodhoundSearchApi,
 from bhsearch.search_resources.base import BaseIndexer, BaseSearchParticipant
 from bhsearch.utils import get_product
 from genshi.builder import tag
-from trac.ticket.api import TicketSystem
+from trac.ticket.api import ITicketBatchChangeListener, TicketSystem
 from trac.ticket import Ticket
 from trac.config import ListOption, Option
 from trac.core import implements
@@ -43,7 +43,8 @@ class TicketFields(IndexFields):
     OWNER = 'owner'
 
 class TicketIndexer(BaseIndexer):
-    implements(IResourceChangeListener, IIndexParticipant)
+    implements(IResourceChangeListener, ITicketBatchChangeListener,
+               IIndexParticipant)
 
     optional_fields = {
         'component': TicketFields.COMPONENT,
@@ -88,6 +89,21 @@ class TicketIndexer(BaseIndexer):
     def resource_version_deleted(self, resource, context):
         pass
 
+    #ITicketBatchChangeListener methods
+    def tickets_changed(self, changes, comment, author):
+        # pylint: disable=unused-argument
+        try:
+            search_api = BloodhoundSearchApi(self.env)
+            with search_api.start_operation() as operation_context:
+                for ticket, old_values in changes:
+                    self._index_ticket(ticket, search_api, operation_context)
+        except Exception, e:
+            if self.silence_on_error:
+                self.log.error("Error occurs during batch ticket indexing. \
+                    The error will not be propagated. Exception: %s", e)
+            else:
+                raise
+
     def _component_changed(self, component, old_values):
         if "name" in old_values:
             old_name = old_values["name"]
@@ -140,7 +156,7 @@ class TicketIndexer(BaseIndexer):
             conditions.append(key + "=%s")
         if conditions:
             sql = sql + " WHERE " + " AND ".join(conditions)
-        for row in self.env.db_query(sql, args):
+        for row in self.env.db_query.stream(sql, args):
             yield int(row[0])
 
     def _index_ticket(self, ticket, search_api=None, operation_context=None):
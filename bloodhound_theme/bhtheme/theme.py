@@ -125,6 +125,7 @@ class BloodhoundTheme(ThemeBase):
 
         # Attachment
         'attachment.html': ('bh_attachment.html', None),
+        'attachment_items.html': ('bh_attachment_items.html', None),
         'preview_file.html': ('bh_preview_file.html', None),
 
         # Version control
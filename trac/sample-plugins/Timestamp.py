@@ -35,6 +35,7 @@ from trac.wiki.macros import WikiMacroBase
 
 class TimestampMacro(WikiMacroBase):
     _description = "Inserts the current time (in seconds) into the wiki page."
+    _dependencies = ('time',)
 
     def expand_macro(self, formatter, name, args):
         t = datetime.now(utc)
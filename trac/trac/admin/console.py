@@ -530,6 +530,7 @@ Congratulations!
 
 class TracAdminHelpMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ()
     _description = cleandoc_(
     """Display help for trac-admin commands.
 
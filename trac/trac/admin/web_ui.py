@@ -30,13 +30,16 @@ except ImportError:
 from genshi import HTML
 from genshi.builder import tag
 
-from trac.admin.api import IAdminPanelProvider
+from trac.admin.api import (AdminCommandError, IAdminCommandProvider,
+                            IAdminPanelProvider)
 from trac.core import *
+from trac.db.api import DatabaseManager
 from trac.loader import get_plugin_info, get_plugins_dir
 from trac.perm import PermissionSystem, IPermissionRequestor
 from trac.util.datefmt import all_timezones
-from trac.util.text import exception_to_unicode, \
-                            unicode_to_base64, unicode_from_base64
+from trac.util.text import exception_to_unicode, print_table, printout, \
+                            shorten_line, unicode_to_base64, \
+                            unicode_from_base64
 from trac.util.translation import _, get_available_locales, ngettext
 from trac.web import HTTPNotFound, IRequestHandler
 from trac.web.chrome import add_notice, add_stylesheet, \
@@ -355,6 +358,110 @@ class LoggingAdminPanel(Component):
         return 'admin_logging.html', {'log': data}
 
 
+class ConnectionPoolAdminPanel(Component):
+    """Shows the statistics of the database connection pool."""
+
+    implements(IAdminPanelProvider)
+
+    # IAdminPanelProvider methods
+
+    def get_admin_panels(self, req):
+        if 'TRAC_ADMIN' in req.perm and not getattr(self.env, 'parent', None):
+            yield ('general', _('General'), 'dbpool', _('Connection Pool'))
+
+    def render_admin_panel(self, req, cat, page, path_info):
+        if getattr(self.env, 'parent', None):
+            raise PermissionError()
+        req.perm.require('TRAC_ADMIN')
+        dbm = DatabaseManager(self.env)
+        # Statistics of the worker pool of tracd
+        server_stats = req.environ.get('tracd.stats')
+        return 'admin_dbpool.html', {
+            'stats': dbm.get_pool_stats() or {},
+            'statements': dbm.get_statement_cache_stats(),
+            'server': server_stats() if server_stats else None}
+
+
+class SlowQueryAdminPanel(Component):
+    """Shows the SQL statements recorded in the slow query log, see the
+    `[trac] slow_query_threshold` option.
+    """
+
+    implements(IAdminCommandProvider, IAdminPanelProvider)
+
+    # IAdminPanelProvider methods
+
+    def get_admin_panels(self, req):
+        if 'TRAC_ADMIN' in req.perm and not getattr(self.env, 'parent', None):
+            yield ('general', _('General'), 'slowqueries', _('Slow Queries'))
+
+    def render_admin_panel(self, req, cat, page, path_info):
+        if getattr(self.env, 'parent', None):
+            raise PermissionError()
+        req.perm.require('TRAC_ADMIN')
+        profiler = DatabaseManager(self.env).profiler
+
+        if req.method == 'POST' and profiler:
+            if req.args.get('clear'):
+                profiler.clear()
+                add_notice(req, _("The slow query log has been cleared."))
+            req.redirect(req.href.admin(cat, page))
+
+        data = {'enabled': profiler is not None,
+                'statements': profiler.get_statements() if profiler else []}
+        return 'admin_slowqueries.html', data
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('slowquery list', '',
+               """List the statements recorded in the slow query log
+
+               Statements are aggregated by fingerprint, i.e. with their
+               literal values replaced by "?", and by label (e.g. the
+               report which executed the statement).
+               """,
+               None, self._do_list)
+        yield ('slowquery show', '<number>',
+               'Show a statement of the slow query log and its query plan',
+               None, self._do_show)
+        yield ('slowquery clear', '',
+               'Remove all the statements from the slow query log',
+               None, self._do_clear)
+
+    def _get_statements(self):
+        profiler = DatabaseManager(self.env).profiler
+        if profiler is None:
+            raise AdminCommandError(_("The slow query log is disabled."))
+        return profiler.get_statements()
+
+    def _do_list(self):
+        print_table([(i + 1, stmt['label'] or '', stmt['count'],
+                      '%.3f' % stmt['total'], '%.3f' % stmt['max'],
+                      stmt['rows'], shorten_line(stmt['fingerprint'], 60))
+                     for i, stmt in enumerate(self._get_statements())],
+                    ['#', _('Label'), _('Count'), _('Total (s)'),
+                     _('Max (s)'), _('Rows'), _('Statement')])
+
+    def _do_show(self, number):
+        statements = self._get_statements()
+        try:
+            stmt = statements[int(number) - 1]
+        except (ValueError, IndexError):
+            raise AdminCommandError(_("Invalid statement number %(num)s",
+                                      num=number))
+        printout(stmt['sql'])
+        printout(_("Arguments: %(args)r", args=stmt['args']))
+        for line in stmt['plan'] or []:
+            printout('  ' + line)
+
+    def _do_clear(self):
+        profiler = DatabaseManager(self.env).profiler
+        if profiler is None:
+            raise AdminCommandError(_("The slow query log is disabled."))
+        profiler.clear()
+
+
 class PermissionAdminPanel(Component):
 
     implements(IAdminPanelProvider, IPermissionRequestor)
@@ -18,14 +18,15 @@
 
 from __future__ import with_statement
 
-from cStringIO import StringIO
 from datetime import datetime
 import errno
+from hashlib import sha256
 import os.path
 import posixpath
 import re
 import shutil
 import sys
+import tempfile
 import unicodedata
 
 from genshi.builder import tag
@@ -38,19 +39,22 @@ from trac.mimeview import *
 from trac.perm import PermissionError, IPermissionPolicy
 from trac.resource import *
 from trac.search import search_to_sql, shorten_result
-from trac.util import content_disposition, get_reporter_id
+from trac.util import ZipStreamWriter, content_disposition, \
+                      get_reporter_id, rename
 from trac.util.compat import sha1
 from trac.util.datefmt import format_datetime, from_utimestamp, \
-                              to_datetime, to_utimestamp, utc
+                              pretty_timedelta, to_datetime, to_utimestamp, \
+                              utc
 from trac.util.text import exception_to_unicode, path_to_unicode, \
-                           pretty_size, print_table, unicode_unquote
+                           pretty_size, print_table, printout, \
+                           unicode_unquote
 from trac.util.translation import _, tag_
 from trac.web import HTTPBadRequest, IRequestHandler, RequestDone
 from trac.web.chrome import (INavigationContributor, add_ctxtnav, add_link,
                              add_stylesheet, web_context, add_warning)
 from trac.web.href import Href
 from trac.wiki.api import IWikiSyntaxProvider
-from trac.wiki.formatter import format_to
+from trac.wiki.formatter import depends_on, format_to
 
 
 class InvalidAttachment(TracError):
@@ -201,8 +205,34 @@ class Attachment(object):
 
     @property
     def path(self):
-        return self._get_path(self.env.path, self.parent_realm, self.parent_id,
-                              self.filename)
+        """The path of the file holding the content of the attachment.
+
+        :since 1.0.2: if the content is in the `AttachmentBlobStore`,
+        this is the path of the file of the store.
+        """
+        path = self._resource_path
+        if self.filename:
+            store = AttachmentBlobStore(self.env)
+            hash = store.get_hash(path)
+            if hash:
+                return store.get_blob_path(hash)
+        return path
+
+    @property
+    def content_hash(self):
+        """The SHA-256 hash of the content of the attachment, if it is
+        in the `AttachmentBlobStore`, `None` otherwise.
+
+        :since 1.0.2:
+        """
+        return AttachmentBlobStore(self.env).get_hash(self._resource_path)
+
+    @property
+    def _resource_path(self):
+        # the path of the file of the attachment in the directory of its
+        # parent, also recorded as its location in the content store
+        return self._get_path(self.env.path, self.parent_realm,
+                              self.parent_id, self.filename)
 
     @property
     def title(self):
@@ -222,8 +252,15 @@ class Attachment(object):
             db("""
                 DELETE FROM attachment WHERE type=%s AND id=%s AND filename=%s
                     """, (self.parent_realm, self.parent_id, self.filename))
-            path = self.path
-            if os.path.isfile(path):
+            path = self._resource_path
+            try:
+                stored = AttachmentBlobStore(self.env).remove(path)
+            except OSError, e:
+                self.env.log.error("Failed to delete attachment content "
+                                   "of %s: %s", path,
+                                   exception_to_unicode(e, traceback=True))
+                raise TracError(_("Could not delete attachment"))
+            if not stored and os.path.isfile(path):
                 try:
                     os.unlink(path)
                 except OSError, e:
@@ -255,7 +292,8 @@ class Attachment(object):
                               '%(realm)s:%(id)s is invalid',
                               att=self.filename, realm=new_realm, id=new_id))
 
-        if os.path.exists(new_path):
+        store = AttachmentBlobStore(self.env)
+        if os.path.exists(new_path) or store.get_hash(new_path):
             raise TracError(_('Cannot reparent attachment "%(att)s" as '
                               'it already exists in %(realm)s:%(id)s',
                               att=self.filename, realm=new_realm, id=new_id))
@@ -264,11 +302,12 @@ class Attachment(object):
                   WHERE type=%s AND id=%s AND filename=%s
                   """, (new_realm, new_id, self.parent_realm, self.parent_id,
                         self.filename))
-            dirname = os.path.dirname(new_path)
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-            path = self.path
-            if os.path.isfile(path):
+            path = self._resource_path
+            # the content in the store only needs its location updated
+            if not store.move(path, new_path) and os.path.isfile(path):
+                dirname = os.path.dirname(new_path)
+                if not os.path.exists(dirname):
+                    os.makedirs(dirname)
                 try:
                     os.rename(path, new_path)
                 except OSError, e:
@@ -322,20 +361,35 @@ class Attachment(object):
                               att=filename, realm=self.parent_realm,
                               id=self.parent_id))
 
-        if not os.access(dir, os.F_OK):
-            os.makedirs(dir)
-        filename, targetfile = self._create_unique_file(dir, filename)
-        with targetfile:
+        store = AttachmentBlobStore(self.env)
+        if store.enabled:
             with self.env.db_transaction as db:
+                filename = self._get_unique_filename(dir, filename)
                 db("INSERT INTO attachment VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
                    (self.parent_realm, self.parent_id, filename, self.size,
                     to_utimestamp(t), self.description, self.author,
                     self.ipnr))
-                shutil.copyfileobj(fileobj, targetfile)
                 self.resource.id = self.filename = filename
+                store.add(self._resource_path, fileobj)
 
                 self.env.log.info("New attachment: %s by %s", self.title,
                                   self.author)
+        else:
+            if not os.access(dir, os.F_OK):
+                os.makedirs(dir)
+            filename, targetfile = self._create_unique_file(dir, filename)
+            with targetfile:
+                with self.env.db_transaction as db:
+                    db("""INSERT INTO attachment
+                          VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                          """, (self.parent_realm, self.parent_id, filename,
+                                self.size, to_utimestamp(t),
+                                self.description, self.author, self.ipnr))
+                    shutil.copyfileobj(fileobj, targetfile)
+                    self.resource.id = self.filename = filename
+
+                    self.env.log.info("New attachment: %s by %s", self.title,
+                                      self.author)
 
         for listener in AttachmentModule(self.env).change_listeners:
             listener.attachment_added(self)
@@ -359,6 +413,90 @@ class Attachment(object):
             attachment._from_database(*row)
             yield attachment
 
+    _select_order = {'name': 'filename', 'size': 'size', 'time': 'time'}
+
+    @classmethod
+    def select_page(cls, env, parent_realm, parent_id, order='time',
+                    desc=False, offset=0, limit=None, **filters):
+        """Return the list of the `Attachment` instances attached to the
+        resource identified by `parent_realm` and `parent_id`, sorted
+        and filtered in the database.
+
+        :param order: sort key, one of `'name'`, `'size'` or `'time'`
+        :param desc: sort in descending order if `True`
+        :param offset: number of attachments to skip
+        :param limit: maximum number of attachments to return, or
+                      `None` for all of them
+        :param filters: `name` (a substring of the filename),
+                        `min_size` and `max_size` (in bytes), and
+                        `start` and `stop` (`datetime` bounds of the
+                        date of the attachment)
+
+        :since 1.0.2:
+        """
+        if order not in cls._select_order:
+            raise ValueError("Invalid attachment order '%s'" % order)
+        order = cls._select_order[order]
+        if desc:
+            order += ' DESC'
+        if order != 'filename':
+            order += ', filename'
+        with env.db_query as db:
+            where, args = cls._select_where(db, parent_realm, parent_id,
+                                            **filters)
+            query = """
+                SELECT filename, description, size, time, author, ipnr
+                FROM attachment WHERE %s ORDER BY %s
+                """ % (where, order)
+            if limit is not None or offset:
+                # not all backends accept an OFFSET without a LIMIT
+                query += " LIMIT %d OFFSET %d" % (
+                         sys.maxint if limit is None else limit, offset)
+            attachments = []
+            for row in db(query, args):
+                attachment = Attachment(env, parent_realm, parent_id)
+                attachment._from_database(*row)
+                attachments.append(attachment)
+            return attachments
+
+    @classmethod
+    def count(cls, env, parent_realm, parent_id, **filters):
+        """Return the number and the total size of the attachments of
+        the resource identified by `parent_realm` and `parent_id`, with
+        the `filters` of `select_page`.
+
+        :since 1.0.2:
+        """
+        with env.db_query as db:
+            where, args = cls._select_where(db, parent_realm, parent_id,
+                                            **filters)
+            for count, size in db("""
+                    SELECT COUNT(*), SUM(size) FROM attachment WHERE %s
+                    """ % where, args):
+                return count, size or 0
+
+    @classmethod
+    def _select_where(cls, db, parent_realm, parent_id, name=None,
+                      min_size=None, max_size=None, start=None, stop=None):
+        clauses = ['type=%s', 'id=%s']
+        args = [parent_realm, unicode(parent_id)]
+        if name:
+            clauses.append('filename %s' % db.like())
+            args.append('%' + db.like_escape(name) + '%')
+        if min_size is not None:
+            clauses.append('size>=%s')
+            args.append(min_size)
+        if max_size is not None:
+            clauses.append('size<=%s')
+            args.append(max_size)
+        if start is not None:
+            clauses.append('time>=%s')
+            args.append(to_utimestamp(start))
+        if stop is not None:
+            clauses.append('time<%s')
+            args.append(to_utimestamp(stop))
+        return ' AND '.join(clauses), args
+
     @classmethod
     def delete_all(cls, env, parent_realm, parent_id, db=None):
         """Delete all attachments of a given resource.
@@ -370,9 +508,9 @@ class Attachment(object):
         attachment_dir = None
         with env.db_transaction as db:
             for attachment in cls.select(env, parent_realm, parent_id, db):
-                attachment_dir = os.path.dirname(attachment.path)
+                attachment_dir = os.path.dirname(attachment._resource_path)
                 attachment.delete()
-        if attachment_dir:
+        if attachment_dir and os.path.isdir(attachment_dir):
             try:
                 os.rmdir(attachment_dir)
             except OSError, e:
@@ -386,9 +524,9 @@ class Attachment(object):
         with env.db_transaction as db:
             for attachment in list(cls.select(env, parent_realm, parent_id,
                                               db)):
-                attachment_dir = os.path.dirname(attachment.path)
+                attachment_dir = os.path.dirname(attachment._resource_path)
                 attachment.reparent(new_realm, new_id)
-        if attachment_dir:
+        if attachment_dir and os.path.isdir(attachment_dir):
             try:
                 os.rmdir(attachment_dir)
             except OSError, e:
@@ -405,6 +543,20 @@ class Attachment(object):
                                      filename=self.filename))
         return fd
 
+    def _get_unique_filename(self, dir, filename):
+        parts = os.path.splitext(filename)
+        store = AttachmentBlobStore(self.env)
+        for idx in xrange(2, 101):
+            path = os.path.join(dir, self._get_hashed_filename(filename))
+            if not os.path.exists(path) and not store.get_hash(path) and \
+                    not self.env.db_query("""
+                        SELECT filename FROM attachment
+                        WHERE type=%s AND id=%s AND filename=%s
+                        """, (self.parent_realm, self.parent_id, filename)):
+                return filename
+            filename = '%s.%d%s' % (parts[0], idx, parts[1])
+        raise Exception('Failed to create unique name: ' + path)
+
     def _create_unique_file(self, dir, filename):
         parts = os.path.splitext(filename)
         flags = os.O_CREAT + os.O_WRONLY + os.O_EXCL
@@ -425,6 +577,181 @@ class Attachment(object):
                 filename = '%s.%d%s' % (parts[0], idx, parts[1])
 
 
+class AttachmentBlobStore(Component):
+    """Content-addressed store for the content of attachments.
+
+    Each distinct content is stored once, in a file named after its
+    SHA-256 hash. The `attachment_blob_ref` table maps the location of
+    the file of an attachment to the hash of its content, and the
+    `attachment_blob` table counts the references to each content, so
+    that its file is deleted with the last attachment having it.
+
+    :since 1.0.2:
+    """
+
+    enabled = BoolOption('attachment', 'content_store', 'false',
+        """Store the content of new attachments in a content-addressed
+        store, where identical files are only stored once. Existing
+        attachments can be moved to the store with the
+        `trac-admin $ENV attachment convert` command.
+        (''since 1.0.2'')""")
+
+    blocksize = 65536
+
+    @property
+    def root(self):
+        """The directory relative to which the locations are recorded."""
+        # the products of a multi-product environment share the store
+        # of the global environment
+        env = getattr(self.env, 'parent', None) or self.env
+        return os.path.normpath(env.path)
+
+    @property
+    def dir(self):
+        return os.path.join(self.root, 'files', 'blobs')
+
+    def get_location(self, path):
+        """Return the location recorded for the attachment file `path`."""
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def get_blob_path(self, hash):
+        """Return the path of the file holding the content of `hash`."""
+        return os.path.join(self.dir, hash[0:2], hash)
+
+    def get_hash(self, path):
+        """Return the hash of the content of the attachment file `path`,
+        or `None` if its content isn't in the store.
+        """
+        for hash, in self.env.db_query("""
+                SELECT hash FROM attachment_blob_ref WHERE location=%s
+                """, (self.get_location(path),)):
+            return hash
+
+    def add(self, path, fileobj):
+        """Store the content of `fileobj` as the content of the
+        attachment file `path`, and return its hash.
+
+        The content is hashed while it is written to a temporary file,
+        which is then renamed, unless the store already has that content.
+        """
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        fd, temp = tempfile.mkstemp(prefix='tmp-', dir=self.dir)
+        try:
+            hash = sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    data = fileobj.read(self.blocksize)
+                    if not data:
+                        break
+                    hash.update(data)
+                    size += len(data)
+                    f.write(data)
+            hash = hash.hexdigest()
+            with self.env.db_transaction as db:
+                if self._add_ref(db, path, hash, size):
+                    self._move_to_blob(temp, hash)
+                    temp = None
+        finally:
+            if temp:
+                os.unlink(temp)
+        return hash
+
+    def convert(self, path):
+        """Move the existing attachment file `path` to the store, and
+        return its hash.
+        """
+        hash = sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(self.blocksize)
+                if not data:
+                    break
+                hash.update(data)
+                size += len(data)
+        hash = hash.hexdigest()
+        with self.env.db_transaction as db:
+            if self._add_ref(db, path, hash, size):
+                self._move_to_blob(path, hash)
+            else:
+                os.unlink(path)
+        return hash
+
+    def copy(self, path, new_path):
+        """Reference the content of the attachment file `path` from the
+        attachment file `new_path` as well.
+
+        Return `False` if the content of `path` isn't in the store.
+        """
+        with self.env.db_transaction as db:
+            hash = self.get_hash(path)
+            if hash is None:
+                return False
+            self._add_ref(db, new_path, hash, None)
+        return True
+
+    def move(self, path, new_path):
+        """Record the content of the attachment file `path` as the
+        content of `new_path`, without moving any file.
+
+        Return `False` if the content of `path` isn't in the store.
+        """
+        with self.env.db_transaction as db:
+            if self.get_hash(path) is None:
+                return False
+            db("UPDATE attachment_blob_ref SET location=%s WHERE location=%s",
+               (self.get_location(new_path), self.get_location(path)))
+        return True
+
+    def remove(self, path):
+        """Remove the reference from the attachment file `path` to its
+        content, and delete the content if it was the last reference.
+
+        Return `False` if the content of `path` isn't in the store.
+        """
+        with self.env.db_transaction as db:
+            hash = self.get_hash(path)
+            if hash is None:
+                return False
+            db("DELETE FROM attachment_blob_ref WHERE location=%s",
+               (self.get_location(path),))
+            db("""UPDATE attachment_blob SET refcount=refcount-1
+                  WHERE hash=%s""", (hash,))
+            for refcount, in db("""
+                    SELECT refcount FROM attachment_blob WHERE hash=%s
+                    """, (hash,)):
+                if refcount <= 0:
+                    db("DELETE FROM attachment_blob WHERE hash=%s", (hash,))
+                    blob_path = self.get_blob_path(hash)
+                    if os.path.isfile(blob_path):
+                        os.unlink(blob_path)
+        return True
+
+    def _add_ref(self, db, path, hash, size):
+        """Add a reference to the content `hash`, and return `True` if
+        the store doesn't have that content yet."""
+        db("INSERT INTO attachment_blob_ref (location, hash) VALUES (%s,%s)",
+           (self.get_location(path), hash))
+        if db("SELECT refcount FROM attachment_blob WHERE hash=%s", (hash,)):
+            db("""UPDATE attachment_blob SET refcount=refcount+1
+                  WHERE hash=%s""", (hash,))
+            if os.path.isfile(self.get_blob_path(hash)):
+                return False
+        else:
+            db("""INSERT INTO attachment_blob (hash, size, refcount)
+                  VALUES (%s,%s,1)""", (hash, size))
+        return True
+
+    def _move_to_blob(self, path, hash):
+        blob_path = self.get_blob_path(hash)
+        dirname = os.path.dirname(blob_path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        rename(path, blob_path)
+
+
 class AttachmentModule(Component):
 
     implements(IRequestHandler, INavigationContributor, IWikiSyntaxProvider,
@@ -444,6 +771,11 @@ class AttachmentModule(Component):
         downloadable as a `.zip`. Set this to -1 to disable download as `.zip`.
         (''since 1.0'')""")
 
+    list_page_size = IntOption('attachment', 'list_page_size', 50,
+        """Maximum number of attachments listed on the page of a resource.
+        The remaining attachments are loaded on demand. Set this to 0 to
+        always list all the attachments. (''since 1.0.2'')""")
+
     render_unsafe_content = BoolOption('attachment', 'render_unsafe_content',
                                        'false',
         """Whether attachments should be rendered in the browser, or
@@ -541,28 +873,63 @@ class AttachmentModule(Component):
 
     # Public methods
 
-    def viewable_attachments(self, context):
+    def viewable_attachments(self, context, offset=0, limit=None, **kwargs):
         """Return the list of viewable attachments in the given context.
 
         :param context: the `~trac.mimeview.api.RenderingContext`
                         corresponding to the parent
                         `~trac.resource.Resource` for the attachments
+        :param offset: number of attachments to skip (''since 1.0.2'')
+        :param limit: maximum number of attachments to return, or `None`
+                      for all of them (''since 1.0.2'')
+        :param kwargs: the sort order and filters of
+                       `Attachment.select_page` (''since 1.0.2'')
         """
         parent = context.resource
-        attachments = []
-        for attachment in Attachment.select(self.env, parent.realm, parent.id):
-            if 'ATTACHMENT_VIEW' in context.perm(attachment.resource):
-                attachments.append(attachment)
-        return attachments
-
-    def attachment_data(self, context):
+        # Check the permission for the attachments of the parent at once,
+        # before checking the permission of each attachment
+        if 'ATTACHMENT_VIEW' not in context.perm(parent.child('attachment')):
+            return []
+        return [attachment for attachment
+                in Attachment.select_page(self.env, parent.realm, parent.id,
+                                          offset=offset, limit=limit,
+                                          **kwargs)
+                if 'ATTACHMENT_VIEW' in context.perm(attachment.resource)]
+
+    def attachment_data(self, context, limit=None):
         """Return a data dictionary describing the list of viewable
         attachments in the current context.
+
+        Only the viewable attachments among the first `limit` ones are
+        listed, by default `[attachment] list_page_size`. When more
+        viewable attachments follow, the `offset` to load them from is
+        returned and the `total` number of viewable attachments is `None`,
+        as only the listed attachments are checked for permissions
+        (''since 1.0.2'').
         """
-        attachments = self.viewable_attachments(context)
+        if limit is None:
+            limit = self.list_page_size
         parent = context.resource
-        total_size = sum(attachment.size for attachment in attachments)
         new_att = parent.child('attachment')
+        attachments = []
+        offset = None
+        if 'ATTACHMENT_VIEW' in context.perm(new_att):
+            page = Attachment.select_page(self.env, parent.realm, parent.id,
+                                          limit=limit or None)
+            attachments = [attachment for attachment in page
+                           if 'ATTACHMENT_VIEW'
+                              in context.perm(attachment.resource)]
+            if limit and len(page) == limit and \
+                    self._has_viewable_attachments(context, limit):
+                offset = limit
+        if offset is None:
+            total = len(attachments)
+            total_size = sum(attachment.size for attachment in attachments)
+        else:
+            # the size of all the attachments bounds the viewable ones
+            total = None
+            total_size = Attachment.count(self.env, parent.realm,
+                                          parent.id)[1]
         return {'attach_href': get_resource_url(self.env, new_att,
                                                 context.href),
                 'download_href': get_resource_url(self.env, new_att,
@@ -570,8 +937,40 @@ class AttachmentModule(Component):
                                  if total_size <= self.max_zip_size else None,
                 'can_create': 'ATTACHMENT_CREATE' in context.perm(new_att),
                 'attachments': attachments,
+                'total': total,
+                'offset': offset,
                 'parent': context.resource}
 
+    def _has_viewable_attachments(self, context, offset):
+        """Return whether a viewable attachment follows the first `offset`
+        attachments, checking them by pages of `offset` attachments.
+        """
+        parent = context.resource
+        limit = offset
+        while True:
+            page = Attachment.select_page(self.env, parent.realm, parent.id,
+                                          offset=offset, limit=limit)
+            if any('ATTACHMENT_VIEW' in context.perm(attachment.resource)
+                   for attachment in page):
+                return True
+            if len(page) < limit:
+                return False
+            offset += limit
+
+    def attachment_validator(self, parent):
+        """Return the list of values the attachment list of the `parent`
+        resource depends on, for validating a response which shows it
+        (see `~trac.web.api.IRequestValidator`).
+
+        :since 1.0.2:
+        """
+        return [Attachment.count(self.env, parent.realm, parent.id)] + \
+               [(attachment.filename, attachment.size, attachment.date,
+                 pretty_timedelta(attachment.date), attachment.author,
+                 attachment.description)
+                for attachment in Attachment.select_page(self.env,
+                    parent.realm, parent.id, limit=self.list_page_size or None)]
+
     def get_history(self, start, stop, realm):
         """Return an iterable of tuples describing changes to attachments on
         a particular object realm.
@@ -601,6 +1000,20 @@ class AttachmentModule(Component):
             if 'ATTACHMENT_VIEW' in req.perm(attachment):
                 yield ('attachment', time, author, (attachment, descr), self)
 
+    def get_timeline_validator(self, resource_realm, start, stop):
+        """Return a validator for the events of `get_timeline_events`,
+        suitable for `ITimelineEventValidator`: the `(time, count)` of the
+        most recent attachment and of the attachments in the range.
+
+        :since 1.0.2:
+        """
+        for ts, count in self.env.db_query("""
+                SELECT MAX(time), COUNT(*) FROM attachment
+                WHERE time > %s AND time < %s AND type = %s
+                """, (to_utimestamp(start), to_utimestamp(stop),
+                      resource_realm.realm)):
+            return (from_utimestamp(ts) if count else None), count
+
     def render_timeline_event(self, context, field, event):
         attachment, descr = event[3]
         if field == 'url':
@@ -823,37 +1236,48 @@ class AttachmentModule(Component):
         req.send_header('Content-Disposition',
                         content_disposition('inline', filename))
 
-        from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
-
-        buf = StringIO()
-        zipfile = ZipFile(buf, 'w', ZIP_DEFLATED)
+        # The archive is written as it is built, so that its size doesn't
+        # have to be known in advance
+        req.end_headers(streaming=True)
+        zipfile = ZipStreamWriter(req.write)
         for attachment in attachments:
-            zipinfo = ZipInfo()
-            zipinfo.filename = attachment.filename.encode('utf-8')
-            zipinfo.flag_bits |= 0x800 # filename is encoded with utf-8
-            zipinfo.date_time = attachment.date.utctimetuple()[:6]
-            zipinfo.compress_type = ZIP_DEFLATED
-            if attachment.description:
-                zipinfo.comment = attachment.description.encode('utf-8')
-            zipinfo.external_attr = 0644 << 16L # needed since Python 2.5
             try:
-                with attachment.open() as fd:
-                    zipfile.writestr(zipinfo, fd.read())
+                fd = attachment.open()
             except ResourceNotFound:
-                pass # skip missing files
+                continue # skip missing files
+            with fd:
+                zipfile.add_file(attachment.filename, fd,
+                                 attachment.date.utctimetuple()[:6],
+                                 size=attachment.size,
+                                 comment=attachment.description)
         zipfile.close()
-
-        zip_str = buf.getvalue()
-        req.send_header("Content-Length", len(zip_str))
-        req.end_headers()
-        req.write(zip_str)
         raise RequestDone()
 
     def _render_list(self, req, parent):
+        context = web_context(req, parent)
+        if req.get_header('X-Requested-With') == 'XMLHttpRequest':
+            # render the attachments following the first page only
+            order = req.args.get('order', 'time')
+            if order not in Attachment._select_order:
+                raise HTTPBadRequest(_("Invalid attachment order"))
+            try:
+                offset = max(int(req.args.get('offset', 0)), 0)
+            except ValueError:
+                raise HTTPBadRequest(_("Invalid attachment offset"))
+            data = {
+                'attachments': self.viewable_attachments(context,
+                    offset=offset, order=order,
+                    desc=req.args.get('desc') in ('1', 'true'),
+                    name=req.args.get('name')),
+                'compact': req.args.get('compact') in ('1', 'true'),
+                'context': context,
+            }
+            return 'attachment_items.html', data, None
+
         data = {
             'mode': 'list',
             'attachment': None, # no specific attachment
-            'attachments': self.attachment_data(web_context(req, parent))
+            'attachments': self.attachment_data(context, limit=0)
         }
 
         return 'attachment.html', data, None
@@ -936,6 +1360,7 @@ class AttachmentModule(Component):
                                                                 ids[2])
         else: # local attachment: TracLinks (filename)
             attachment = formatter.resource.child('attachment', link)
+        depends_on(formatter.context, 'attachments')
         if attachment and 'ATTACHMENT_VIEW' in formatter.perm(attachment):
             try:
                 model = Attachment(self.env, attachment)
@@ -1036,6 +1461,14 @@ class AttachmentAdmin(Component):
                destination is specified, the attachment is output to stdout.
                """,
                self._complete_export, self._do_export)
+        yield ('attachment convert', '',
+               """Move the attachment files to the content store
+
+               The content of each attachment is moved to the store of the
+               `[attachment] content_store` option, where identical files
+               are only stored once.
+               """,
+               None, self._do_convert)
 
     def get_realm_list(self):
         rs = ResourceSystem(self.env)
@@ -1114,3 +1547,30 @@ class AttachmentAdmin(Component):
                 if destination is not None:
                     output.close()
 
+    def _do_convert(self):
+        store = AttachmentBlobStore(self.env)
+        converted = missing = 0
+        for realm, id, filename in self.env.db_query("""
+                SELECT type, id, filename FROM attachment
+                ORDER BY type, id, filename"""):
+            attachment = Attachment(self.env, realm, id)
+            attachment.filename = filename
+            path = attachment._resource_path
+            if store.get_hash(path):
+                continue
+            if not os.path.isfile(path):
+                missing += 1
+                continue
+            store.convert(path)
+            converted += 1
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass # other attachments of the parent are left
+        stored, size = self.env.db_query("""
+            SELECT COUNT(*), SUM(size) FROM attachment_blob""")[0]
+        printout(_("%(converted)s attachments converted, %(missing)s missing "
+                   "files. The store contains %(stored)s files (%(size)s).",
+                   converted=converted, missing=missing, stored=stored,
+                   size=pretty_size(size or 0)))
+
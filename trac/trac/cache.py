@@ -64,18 +64,26 @@ class CachedSingletonProperty(CachedPropertyBase):
     def __get__(self, instance, owner):
         if instance is None:
             return self
-        try:
-            id = self.id
-        except AttributeError:
-            id = self.id = key_to_id(self.make_key(owner))
-        return CacheManager(instance.env).get(id, self.retriever, instance)
+        return CacheManager(instance.env).get(self.get_id(owner),
+                                              self.retriever, instance)
 
     def __delete__(self, instance):
+        CacheManager(instance.env).invalidate(self.get_id(instance.__class__))
+
+    def get_id(self, cls):
         try:
-            id = self.id
+            return self.id
         except AttributeError:
-            id = self.id = key_to_id(self.make_key(instance.__class__))
-        CacheManager(instance.env).invalidate(id)
+            self.id = key_to_id(self.make_key(cls))
+            return self.id
+
+    def update(self, instance, updater):
+        """Update the cached value in place, see `CacheManager.update`.
+
+        :since 1.0.2:
+        """
+        CacheManager(instance.env).update(self.get_id(instance.__class__),
+                                          updater)
 
 
 class CachedProperty(CachedPropertyBase):
@@ -195,6 +203,22 @@ class CacheManager(Component):
         """Reset per-request cache metadata."""
         self._local.meta = self._local.cache = None
 
+    def get_generations(self):
+        """Return the generations of all the cached data, as a sorted
+        list of `(id, generation)` tuples.
+
+        The generations are retrieved once per request, like for `get`,
+        so this is cheap enough to tell whether anything cached changed
+        since a previous request.
+
+        :since 1.0.2:
+        """
+        if self._local.meta is None:
+            meta = self.env.db_query("SELECT id, generation FROM cache")
+            self._local.meta = dict(meta)
+            self._local.cache = self._cache.copy()
+        return sorted(self._local.meta.iteritems())
+
     def get(self, id, retriever, instance):
         """Get cached or fresh data for the given id."""
         # Get cache metadata
@@ -246,6 +270,50 @@ class CacheManager(Component):
                 local_meta[id] = db_generation
                 return data
 
+    def update(self, id, updater):
+        """Update cached data for the given id, and invalidate it in
+        other processes.
+
+        When this process holds the latest data, `updater` is called
+        with it once the current transaction is committed, and returns
+        the updated data, which stays valid in this process. Otherwise,
+        or if the transaction is rolled back, the data is only
+        invalidated.
+
+        :since 1.0.2:
+        """
+        with self.env.db_transaction as db:
+            with self._lock:
+                entry = self._cache.get(id)
+                self.invalidate(id)
+                if entry is None:
+                    return
+                # The generation can't change until the end of the
+                # transaction, now that it has been incremented
+                for generation, in db(
+                        "SELECT generation FROM cache WHERE id=%s", (id,)):
+                    break
+                if entry[1] != generation - 1:
+                    return
+
+            def install():
+                with self._lock:
+                    if id in self._cache:
+                        return # reloaded since the commit
+                    for db_generation, in self.env.db_query(
+                            "SELECT generation FROM cache WHERE id=%s",
+                            (id,)):
+                        break
+                    else:
+                        return
+                    if db_generation != generation:
+                        return # changed in another process
+                    data = updater(entry[0])
+                    new_entry = self._cache[id] = (data, generation)
+                    if self._local.cache is not None:
+                        self._local.cache[id] = new_entry
+            self.env.db_transaction.after_commit(install)
+
     def invalidate(self, id):
         """Invalidate cached data for the given id."""
         with self.env.db_transaction as db:
@@ -20,14 +20,15 @@ import os
 import time
 import urllib
 
-from trac.config import BoolOption, IntOption, Option
+from trac.config import BoolOption, FloatOption, IntOption, Option
 from trac.core import *
 from trac.util.concurrency import ThreadLocal
 from trac.util.text import unicode_passwd
 from trac.util.translation import _
 
 from .pool import ConnectionPool
-from .util import ConnectionWrapper
+from .profiler import SQLProfiler
+from .util import ConnectionWrapper, sql_escape_percent, statements
 
 
 def with_transaction(env, db=None):
@@ -98,10 +99,14 @@ def with_transaction(env, db=None):
                 ldb.commit()
                 _transaction_local.wdb = None
             except:
-                _transaction_local.wdb = None
+                _transaction_local.wdb = _transaction_local.callbacks = None
                 ldb.rollback()
                 ldb = None
                 raise
+            callbacks = _transaction_local.callbacks
+            _transaction_local.callbacks = None
+            for callback in callbacks or ():
+                callback()
     return transaction_wrapper
 
 
@@ -128,6 +133,28 @@ class DbContextManager(object):
         with self as db:
             return db.executemany(query, params)
 
+    def bulk_execute(self, query, params, chunk_size=None):
+        """Shortcut for executing a query on many tuples of parameters,
+        in chunks of `chunk_size` tuples (`[trac] bulk_chunk_size` by
+        default).
+
+        :see: `~trac.db.util.ConnectionWrapper.bulk_execute`
+        :since 1.0.2:
+        """
+        if chunk_size is None:
+            chunk_size = self.dbmgr.bulk_chunk_size
+        with self as db:
+            return db.bulk_execute(query, params, chunk_size)
+
+    def stream(self, query, params=None, batch_size=None):
+        """Shortcut for iterating over the rows of a SELECT query without
+        loading them all in memory.
+
+        :see: `DatabaseManager.stream`
+        :since 1.0.2:
+        """
+        return self.dbmgr.stream(query, params, batch_size)
+
 
 class TransactionContextManager(DbContextManager):
     """Transactioned Database Context Manager for retrieving a
@@ -137,26 +164,50 @@ class TransactionContextManager(DbContextManager):
     normal exit or a rollback after an exception.
     """
 
+    owned = False
+
     def __enter__(self):
         db = self.dbmgr._transaction_local.wdb # outermost writable db
         if not db:
             db = self.dbmgr._transaction_local.rdb # reuse wrapped connection
-            if db:
+            if db and not self.dbmgr._reader_pool:
                 db = ConnectionWrapper(db.cnx, db.log)
-            else:
+            else: # no connection yet, or a connection only for reading
                 db = self.dbmgr.get_connection()
+                self.owned = True
             self.dbmgr._transaction_local.wdb = self.db = db
         return db
 
     def __exit__(self, et, ev, tb):
         if self.db:
             self.dbmgr._transaction_local.wdb = None
+            callbacks = self.dbmgr._transaction_local.callbacks
+            self.dbmgr._transaction_local.callbacks = None
             if et is None:
                 self.db.commit()
             else:
                 self.db.rollback()
-            if not self.dbmgr._transaction_local.rdb:
+                callbacks = None
+            if self.owned:
                 self.db.close()
+            for callback in callbacks or ():
+                callback()
+
+    def after_commit(self, callback):
+        """Call `callback` without arguments once the current
+        transaction is committed, or right away if there's no current
+        transaction. The call is skipped if the transaction is rolled
+        back.
+
+        :since 1.0.2:
+        """
+        local = self.dbmgr._transaction_local
+        if not local.wdb:
+            callback()
+        elif local.callbacks is None:
+            local.callbacks = [callback]
+        else:
+            local.callbacks.append(callback)
 
 
 class QueryContextManager(DbContextManager):
@@ -165,6 +216,10 @@ class QueryContextManager(DbContextManager):
     """
 
     def __enter__(self):
+        wdb = self.dbmgr._transaction_local.wdb
+        if wdb and self.dbmgr._reader_pool:
+            # read the changes made in the transaction
+            return ConnectionWrapper(wdb.cnx, wdb.log, readonly=True)
         db = self.dbmgr._transaction_local.rdb # outermost readonly db
         if not db:
             db = self.dbmgr._transaction_local.wdb # reuse wrapped connection
@@ -240,9 +295,37 @@ class DatabaseManager(Component):
         """Show the SQL queries in the Trac log, at DEBUG level.
         ''(Since 0.11.5)''""")
 
+    slow_query_threshold = FloatOption('trac', 'slow_query_threshold', 0,
+        """Duration in seconds above which SQL statements are recorded in
+        the slow query log, along with their query plan. Set to 0 to
+        disable the slow query log. ''(Since 1.0.2)''""")
+
+    slow_query_log = Option('trac', 'slow_query_log', 'slow-queries.log',
+        """Path of the slow query log. A relative path is resolved
+        against the log directory of the environment. ''(Since 1.0.2)''
+        """)
+
+    slow_query_log_size = IntOption('trac', 'slow_query_log_size', 1048576,
+        """Maximum size in bytes of the slow query log. When it is
+        exceeded, the log is renamed with a `.1` suffix, replacing the
+        previous one, and a new log is started. ''(Since 1.0.2)''""")
+
+    stream_batch_size = IntOption('trac', 'stream_batch_size', 1000,
+        """Number of rows fetched at once by the operations iterating
+        over large query results, like the reindexing of the search
+        index. ''(Since 1.0.2)''""")
+
+    bulk_chunk_size = IntOption('trac', 'bulk_chunk_size', 1000,
+        """Number of rows written by each "executemany" call of the bulk
+        inserts, like the import of permissions or the upgrade of the
+        database. ''(Since 1.0.2)''""")
+
     def __init__(self):
         self._cnx_pool = None
-        self._transaction_local = ThreadLocal(wdb=None, rdb=None)
+        self._reader_pool = None
+        self._transaction_local = ThreadLocal(wdb=None, rdb=None,
+                                              callbacks=None)
+        self._profiler = None
 
     def init_db(self):
         connector, args = self.get_connector()
@@ -255,11 +338,25 @@ class DatabaseManager(Component):
 
         If `readonly` is `True`, the returned connection will purposedly
         lack the `rollback` and `commit` methods.
+
+        :since 1.0.2: if the connector has a `use_readers` method
+                      returning `True`, the connections for reading are
+                      taken from a separate pool, unless the thread is in
+                      a transaction.
         """
         if not self._cnx_pool:
             connector, args = self.get_connector()
             self._cnx_pool = ConnectionPool(5, connector, **args)
-        db = self._cnx_pool.get_cnx(self.timeout or None)
+            if getattr(connector, 'use_readers', None) and \
+                    connector.use_readers(**args):
+                self._reader_pool = ConnectionPool(5, connector,
+                                                   readonly=True, **args)
+        pool = self._cnx_pool
+        if readonly and self._reader_pool and \
+                not self._transaction_local.wdb:
+            pool = self._reader_pool
+        db = pool.get_cnx(self.timeout or None)
+        db.cnx.profiler = self.profiler
         if readonly:
             db = ConnectionWrapper(db, readonly=True)
         return db
@@ -267,18 +364,116 @@ class DatabaseManager(Component):
     def get_exceptions(self):
         return self.get_connector()[0].get_exceptions()
 
+    def stream(self, query, params=None, batch_size=None):
+        """Execute the SELECT `query` and return an iterator over the
+        rows, which are fetched in batches of `batch_size` rows
+        (`[trac] stream_batch_size` by default) instead of being all
+        loaded in memory.
+
+        The query is executed immediately, on a connection dedicated to
+        the iteration and closed once the iterator is exhausted or
+        discarded. Hence the commits made meanwhile by the thread don't
+        invalidate the iteration, but the uncommitted changes of the
+        current transaction are not seen.
+
+        :since 1.0.2:
+        """
+        if batch_size is None:
+            batch_size = self.stream_batch_size
+        connector, args = self.get_connector()
+        if args.get('path') == ':memory:':
+            # The in-memory database can't be opened by another connection
+            return iter(QueryContextManager(self.env).execute(query, params))
+        db = connector.get_connection(**args)
+        db.profiler = self.profiler
+        try:
+            rows = db.stream(query, params, batch_size)
+        except:
+            db.close()
+            raise
+        return _closing_rows(rows, db)
+
+    def get_pool_stats(self):
+        """Return the statistics of the connection pool for the database
+        of the environment, or `None` if no connection has been made yet.
+
+        :see: `~trac.db.pool.ConnectionPool.get_stats`
+        :since 1.0.2:
+        """
+        if self._cnx_pool:
+            return self._cnx_pool.get_stats()
+
+    def get_statement_cache_stats(self):
+        """Return the statistics of the cache of the prepared SQL
+        statements of the process.
+
+        :see: `~trac.db.util.StatementCache.get_stats`
+        :since 1.0.2:
+        """
+        return statements.get_stats()
+
+    @property
+    def profiler(self):
+        """The `~trac.db.profiler.SQLProfiler` recording the slow SQL
+        statements, or `None` if the slow query log is disabled.
+        """
+        if self.slow_query_threshold <= 0:
+            return None
+        if self._profiler is None:
+            path = self.slow_query_log
+            if not os.path.isabs(path):
+                path = os.path.join(self.env.get_log_dir(), path)
+            self._profiler = SQLProfiler(path, self.slow_query_threshold,
+                                         self.explain, self.log,
+                                         self.slow_query_log_size)
+        return self._profiler
+
+    def profiling(self, label):
+        """Return a context manager associating `label` (e.g. the
+        identifier of a report) to the statements recorded in the slow
+        query log while in its scope.
+        """
+        profiler = self.profiler
+        if profiler is None:
+            return _no_label
+        return profiler.labelled(label)
+
+    def explain(self, sql, args=None):
+        """Return the query plan of the `sql` SELECT statement, as a list
+        of rows.
+        """
+        scheme = _parse_db_str(self.connection_uri)[0]
+        explain = 'EXPLAIN QUERY PLAN ' if scheme == 'sqlite' else 'EXPLAIN '
+        db = self.get_connection()
+        try:
+            # Bypass the `IterableCursor` wrapper, as `sql` is logged in
+            # the form it has been passed to the DB-API cursor
+            cursor = db.cursor().cursor
+            if args:
+                cursor.execute(explain + sql_escape_percent(sql), args)
+            else:
+                cursor.execute(explain + sql)
+            return cursor.fetchall()
+        finally:
+            db.close()
+
     def shutdown(self, tid=None):
         if self._cnx_pool:
             self._cnx_pool.shutdown(tid)
             if not tid:
-                self._cnx_pool = None
+                self._cnx_pool = self._reader_pool = None
 
-    def backup(self, dest=None):
+    def backup(self, dest=None, progress=None):
         """Save a backup of the database.
 
         :param dest: base filename to write to.
+        :param progress: optional callable reporting the progress of the
+                         backup, passed to the connectors supporting it
+                         (see `SQLiteConnector.backup`).
 
         Returns the file actually written.
+
+        :since 1.0.2: added the `progress` parameter
         """
         connector, args = self.get_connector()
         if not dest:
@@ -294,6 +489,8 @@ class DatabaseManager(Component):
             backup_dir = os.path.dirname(dest)
         if not os.path.exists(backup_dir):
             os.makedirs(backup_dir)
+        if progress:
+            return connector.backup(dest, progress=progress)
         return connector.backup(dest)
 
     def get_connector(self):
@@ -329,6 +526,27 @@ class DatabaseManager(Component):
     _get_connector = get_connector  # For 0.11 compatibility
 
 
+def _closing_rows(rows, db):
+    try:
+        for row in rows:
+            yield row
+    finally:
+        if hasattr(rows, 'close'):
+            rows.close()
+        db.close()
+
+
+class _NoLabel(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, et, ev, tb):
+        pass
+
+_no_label = _NoLabel()
+
+
 def get_column_names(cursor):
     """Retrieve column names from a cursor, if possible."""
     return [unicode(d[0], 'utf-8') if isinstance(d[0], str) else d[0]
@@ -21,7 +21,7 @@ from genshi.core import Markup
 from trac.core import *
 from trac.config import Option
 from trac.db.api import IDatabaseConnector, _parse_db_str
-from trac.db.util import ConnectionWrapper, IterableCursor
+from trac.db.util import ConnectionWrapper, IterableCursor, fetch_batches
 from trac.util import as_int, get_pkginfo
 from trac.util.compat import close_fds
 from trac.util.text import exception_to_unicode, to_unicode
@@ -34,21 +34,30 @@ try:
     import MySQLdb.cursors
     has_mysqldb = True
 
-    class MySQLUnicodeCursor(MySQLdb.cursors.Cursor):
+    class MySQLUnicodeCursorMixin(object):
         def _convert_row(self, row):
             return tuple(v.decode('utf-8') if isinstance(v, str) else v
                          for v in row)
         def fetchone(self):
-            row = super(MySQLUnicodeCursor, self).fetchone()
+            row = super(MySQLUnicodeCursorMixin, self).fetchone()
             return self._convert_row(row) if row else None
         def fetchmany(self, num):
-            rows = super(MySQLUnicodeCursor, self).fetchmany(num)
+            rows = super(MySQLUnicodeCursorMixin, self).fetchmany(num)
             return [self._convert_row(row) for row in rows] \
                    if rows is not None else []
         def fetchall(self):
-            rows = super(MySQLUnicodeCursor, self).fetchall()
+            rows = super(MySQLUnicodeCursorMixin, self).fetchall()
             return [self._convert_row(row) for row in rows] \
                    if rows is not None else []
+
+    class MySQLUnicodeCursor(MySQLUnicodeCursorMixin,
+                             MySQLdb.cursors.Cursor):
+        pass
+
+    # Unbuffered cursor, the rows are retrieved from the server on demand
+    class MySQLUnicodeSSCursor(MySQLUnicodeCursorMixin,
+                               MySQLdb.cursors.SSCursor):
+        pass
 except ImportError:
     has_mysqldb = False
 
@@ -318,4 +327,18 @@ class MySQLConnection(ConnectionWrapper):
             self._is_closed = True
 
     def cursor(self):
-        return IterableCursor(MySQLUnicodeCursor(self.cnx), self.log)
+        return IterableCursor(MySQLUnicodeCursor(self.cnx), self.log,
+                              self.profiler)
+
+    def stream(self, query, params=None, batch_size=1000):
+        """Execute the SELECT `query` with an unbuffered cursor and
+        return an iterator over the rows, fetched in batches of
+        `batch_size` rows.
+
+        :since 1.0.2:
+        """
+        self.check_select(query)
+        cursor = IterableCursor(MySQLUnicodeSSCursor(self.cnx), self.log,
+                                self.profiler)
+        cursor.execute(query, params)
+        return fetch_batches(cursor, batch_size)
@@ -16,6 +16,8 @@
 
 from __future__ import with_statement
 
+from collections import deque
+import logging
 import os
 import time
 
@@ -54,78 +56,87 @@ class PooledConnection(ConnectionWrapper):
 
 
 
+class _KeyPool(object):
+    """The connections of a `ConnectionPoolBackend` sharing the same
+    connection key, i.e. connected to the same database.
+    """
+
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+        self.lock = threading.Lock()
+        self.active = {}        # tid -> (cnx, num)
+        self.idle = deque()     # (cnx, time), least recently used first
+        self.stats = dict.fromkeys(('hits', 'misses', 'waits', 'timeouts',
+                                    'created'), 0)
+        self.stats['wait_time'] = 0.0
+
+
 class ConnectionPoolBackend(object):
     """A process-wide LRU-based connection pool.
+
+    The connections are kept in separate pools for each connection key,
+    each pool having its own lock, so that the threads don't contend for
+    a single lock. Only when the total number of connections reaches
+    `maxsize`, the threads have to synchronize for waiting on a
+    connection to become available, or for replacing the least recently
+    used connection of another key.
     """
     def __init__(self, maxsize):
-        self._available = threading.Condition(threading.RLock())
         self._maxsize = maxsize
-        self._active = {}
-        self._pool = []
-        self._pool_key = []
-        self._pool_time = []
+        self._pools = {}
+        self._lock = threading.Lock() # protects `_pools` and `_size`
+        self._size = 0                # number of active and idle cnx
+        self._available = threading.Condition(threading.Lock())
         self._waiters = 0
 
     def get_cnx(self, connector, kwargs, timeout=None):
-        cnx = None
         log = kwargs.get('log')
         key = unicode(kwargs)
         start = time.time()
         tid = threading._get_ident()
-        # Get a Connection, either directly or a deferred one
-        with self._available:
-            # First choice: Return the same cnx already used by the thread
-            if (tid, key) in self._active:
-                cnx, num = self._active[(tid, key)]
-                num += 1
-            else:
-                if self._waiters == 0:
-                    cnx = self._take_cnx(connector, kwargs, key, tid)
-                if not cnx:
-                    self._waiters += 1
-                    self._available.wait()
-                    self._waiters -= 1
-                    cnx = self._take_cnx(connector, kwargs, key, tid)
-                num = 1
-            if cnx:
-                self._active[(tid, key)] = (cnx, num)
-
-        deferred = num == 1 and isinstance(cnx, tuple)
+        pool = self._get_pool(key, kwargs)
+        # First choice: Return the same cnx already used by the thread
+        with pool.lock:
+            if tid in pool.active:
+                cnx, num = pool.active[tid]
+                pool.active[tid] = (cnx, num + 1)
+                return PooledConnection(self, cnx, key, tid, log)
+            # Don't get ahead of the threads already waiting
+            op, cnx = self._take_cnx(pool) if not self._waiters \
+                      else (None, None)
+        if not op:
+            op, cnx = self._wait_cnx(pool, timeout, log)
+
+        # Potentially lenghty operations must be done without lock held
         err = None
-        if deferred:
-            # Potentially lenghty operations must be done without lock held
-            op, cnx = cnx
-            try:
-                if op == 'ping':
-                    cnx.ping()
-                elif op == 'close':
-                    cnx.close()
-                if op in ('close', 'create'):
-                    cnx = connector.get_connection(**kwargs)
-            except TracError, e:
-                err = e
-                cnx = None
-            except Exception, e:
-                if log:
-                    log.error('Exception caught on %s', op, exc_info=True)
-                err = e
-                cnx = None
+        try:
+            if op == 'ping':
+                cnx.ping()
+            elif op == 'close':
+                cnx.close()
+            if op in ('close', 'create'):
+                cnx = connector.get_connection(**kwargs)
+        except TracError, e:
+            err = e
+            cnx = None
+        except Exception, e:
+            if log:
+                log.error('Exception caught on %s', op, exc_info=True)
+            err = e
+            cnx = None
 
         if cnx:
-            if deferred:
-                # replace placeholder with real Connection
-                with self._available:
-                    self._active[(tid, key)] = (cnx, num)
+            with pool.lock:
+                pool.active[tid] = (cnx, 1)
+                if op in ('close', 'create'):
+                    pool.stats['created'] += 1
             return PooledConnection(self, cnx, key, tid, log)
 
-        if deferred:
-            # cnx couldn't be reused, clear placeholder
-            with self._available:
-                del self._active[(tid, key)]
-            if op == 'ping': # retry
-                return self.get_cnx(connector, kwargs)
-
-        # if we didn't get a cnx after wait(), something's fishy...
+        # cnx couldn't be reused, give back its slot
+        self._release_slot()
+        if op == 'ping': # retry
+            return self.get_cnx(connector, kwargs, timeout)
         timeout = time.time() - start
         errmsg = _("Unable to get database connection within %(time)d seconds.",
                    time=timeout)
@@ -133,70 +144,190 @@ class ConnectionPoolBackend(object):
             errmsg += " (%s)" % exception_to_unicode(err)
         raise TimeoutError(errmsg)
 
-    def _take_cnx(self, connector, kwargs, key, tid):
-        """Note: _available lock must be held when calling this method."""
+    def get_stats(self, key=None):
+        """Return the statistics of the pool for the given connection key,
+        or for all the connection keys.
+
+        The statistics are a `dict` with the `hits`, `misses`, `waits`,
+        `wait_time` (in seconds), `timeouts` and `created` counters, as
+        well as the current number of `active` and `idle` connections.
+
+        :since 1.0.2:
+        """
+        stats = dict.fromkeys(('hits', 'misses', 'waits', 'timeouts',
+                               'created', 'active', 'idle'), 0)
+        stats['wait_time'] = 0.0
+        for pool in self._pools.values():
+            if key is None or pool.key == key:
+                with pool.lock:
+                    for name, value in pool.stats.iteritems():
+                        stats[name] += value
+                    stats['active'] += len(pool.active)
+                    stats['idle'] += len(pool.idle)
+        return stats
+
+    def _get_pool(self, key, kwargs):
+        try:
+            return self._pools[key]
+        except KeyError:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = self._pools[key] = _KeyPool(key,
+                                                       kwargs.get('path'))
+                return pool
+
+    def _take_cnx(self, pool):
+        """Note: the `pool` lock must be held when calling this method."""
         # Second best option: Reuse a live pooled connection
-        if key in self._pool_key:
-            idx = self._pool_key.index(key)
-            self._pool_key.pop(idx)
-            self._pool_time.pop(idx)
-            cnx = self._pool.pop(idx)
+        if pool.idle:
+            cnx, when = pool.idle.pop()
+            pool.stats['hits'] += 1
             # If possible, verify that the pooled connection is
             # still available and working.
             if hasattr(cnx, 'ping'):
-                return ('ping', cnx)
-            return cnx
+                return 'ping', cnx
+            return 'reuse', cnx
         # Third best option: Create a new connection
-        elif len(self._active) + len(self._pool) < self._maxsize:
-            return ('create', None)
-        # Forth best option: Replace a pooled connection with a new one
-        elif len(self._active) < self._maxsize:
-            # Remove the LRU connection in the pool
-            cnx = self._pool.pop(0)
-            self._pool_key.pop(0)
-            self._pool_time.pop(0)
-            return ('close', cnx)
+        with self._lock:
+            if self._size < self._maxsize:
+                self._size += 1
+                pool.stats['misses'] += 1
+                return 'create', None
+        return None, None
 
-    def _return_cnx(self, cnx, key, tid):
-        # Decrement active refcount, clear slot if 1
+    def _evict_cnx(self):
+        """Remove the least recently used idle connection of all the
+        pools, and return it.
+
+        Note: the `_available` lock must be held when calling this method,
+        but no `pool` lock.
+        """
+        while True:
+            lru = None
+            for pool in self._pools.values():
+                try:
+                    when = pool.idle[0][1]
+                except IndexError:
+                    continue
+                if lru is None or when < lru[1]:
+                    lru = (pool, when)
+            if lru is None:
+                return None
+            pool = lru[0]
+            with pool.lock:
+                if pool.idle:
+                    return pool.idle.popleft()[0]
+
+    def _wait_cnx(self, pool, timeout, log):
+        """Wait for a connection to become available in the pool, or for
+        a connection slot to be freed.
+        """
+        start = time.time()
+        waited = False
         with self._available:
-            assert (tid, key) in self._active
-            cnx, num = self._active[(tid, key)]
-            if num == 1:
-                del self._active[(tid, key)]
-            else:
-                self._active[(tid, key)] = (cnx, num - 1)
-        if num == 1:
-            # Reset connection outside of critical section
+            self._waiters += 1
             try:
-                cnx.rollback() # resets the connection
-            except Exception:
-                cnx.close()
-                cnx = None
-            # Connection available, from reuse or from creation of a new one
+                while True:
+                    with pool.lock:
+                        op, cnx = self._take_cnx(pool)
+                    if op:
+                        break
+                    # Forth best option: Replace a pooled connection with
+                    # a new one
+                    cnx = self._evict_cnx()
+                    if cnx:
+                        with pool.lock:
+                            pool.stats['misses'] += 1
+                        op = 'close'
+                        break
+                    if not waited:
+                        waited = True
+                        with pool.lock:
+                            pool.stats['waits'] += 1
+                    if timeout:
+                        remaining = start + timeout - time.time()
+                        if remaining <= 0:
+                            break
+                        self._available.wait(remaining)
+                    else:
+                        self._available.wait()
+            finally:
+                self._waiters -= 1
+        if waited:
+            duration = time.time() - start
+            with pool.lock:
+                pool.stats['wait_time'] += duration
+                if not op:
+                    pool.stats['timeouts'] += 1
+            if log:
+                stats = self.get_stats(pool.key)
+                log.log(logging.WARNING if not op else logging.DEBUG,
+                        "Waited %.3fs for a database connection (%s)",
+                        duration, ', '.join('%s: %s' % item
+                                            for item in sorted(stats.items())))
+        if not op:
+            # if we didn't get a cnx after wait(), something's fishy...
+            errmsg = _("Unable to get database connection within "
+                       "%(time)d seconds.", time=time.time() - start)
+            raise TimeoutError(errmsg)
+        return op, cnx
+
+    def _release_slot(self, count=1):
+        with self._lock:
+            self._size -= count
+        self._notify()
+
+    def _notify(self):
+        if self._waiters:
             with self._available:
-                if cnx and cnx.poolable:
-                    self._pool.append(cnx)
-                    self._pool_key.append(key)
-                    self._pool_time.append(time.time())
                 self._available.notify()
 
+    def _return_cnx(self, cnx, key, tid):
+        pool = self._pools[key]
+        # Decrement active refcount, clear slot if 1
+        with pool.lock:
+            if tid not in pool.active:
+                return # already closed by a global shutdown
+            cnx, num = pool.active[tid]
+            if num > 1:
+                pool.active[tid] = (cnx, num - 1)
+                return
+            del pool.active[tid]
+        # Reset connection outside of critical section
+        try:
+            cnx.rollback() # resets the connection
+        except Exception:
+            cnx.close()
+            cnx = None
+        # Connection available, from reuse or from creation of a new one
+        if cnx and cnx.poolable:
+            with pool.lock:
+                pool.idle.append((cnx, time.time()))
+            self._notify()
+        else:
+            self._release_slot()
+
     def shutdown(self, tid=None):
         """Close pooled connections not used in a while"""
         delay = 120
         if tid is None:
             delay = 0
         when = time.time() - delay
-        with self._available:
-            if tid is None: # global shutdown, also close active connections
-                for db, num in self._active.values():
+        closed = 0
+        for pool in self._pools.values():
+            with pool.lock:
+                if tid is None: # global shutdown, also close active cnx
+                    for db, num in pool.active.values():
+                        db.close()
+                    closed += len(pool.active)
+                    pool.active = {}
+                while pool.idle and pool.idle[0][1] <= when:
+                    db, t = pool.idle.popleft()
                     db.close()
-                self._active = {}
-            while self._pool_time and self._pool_time[0] <= when:
-                db = self._pool.pop(0)
-                db.close()
-                self._pool_key.pop(0)
-                self._pool_time.pop(0)
+                    closed += 1
+        if closed:
+            self._release_slot(closed)
 
 
 _pool_size = int(os.environ.get('TRAC_DB_POOL_SIZE', 10))
@@ -212,6 +343,19 @@ class ConnectionPool(object):
     def get_cnx(self, timeout=None):
         return _backend.get_cnx(self._connector, self._kwargs, timeout)
 
+    def get_stats(self):
+        """Return the statistics of the pool for the connections to this
+        database, see `ConnectionPoolBackend.get_stats`. The `size` and
+        `maxsize` entries give the number of connections of the whole
+        process and its limit.
+
+        :since 1.0.2:
+        """
+        stats = _backend.get_stats(unicode(self._kwargs))
+        stats['size'] = _backend._size
+        stats['maxsize'] = _backend._maxsize
+        return stats
+
     def shutdown(self, tid=None):
         _backend.shutdown(tid)
 
@@ -21,7 +21,7 @@ from genshi import Markup
 from trac.core import *
 from trac.config import Option
 from trac.db.api import IDatabaseConnector, _parse_db_str
-from trac.db.util import ConnectionWrapper, IterableCursor
+from trac.db.util import ConnectionWrapper, IterableCursor, fetch_batches
 from trac.util import get_pkginfo
 from trac.util.compat import close_fds
 from trac.util.text import empty, exception_to_unicode, to_unicode
@@ -259,5 +259,18 @@ class PostgreSQLConnection(ConnectionWrapper):
             """ % (table, column, column, table))
 
     def cursor(self):
-        return IterableCursor(self.cnx.cursor(), self.log)
+        return IterableCursor(self.cnx.cursor(), self.log, self.profiler)
+
+    def stream(self, query, params=None, batch_size=1000):
+        """Execute the SELECT `query` with a server-side cursor and
+        return an iterator over the rows, fetched in batches of
+        `batch_size` rows.
+
+        :since 1.0.2:
+        """
+        self.check_select(query)
+        cursor = IterableCursor(self.cnx.cursor('trac_stream'), self.log,
+                                self.profiler)
+        cursor.execute(query, params)
+        return fetch_batches(cursor, batch_size)
 
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from __future__ import with_statement
+
+import json
+import os
+import re
+import time
+
+from trac.util.concurrency import ThreadLocal, threading
+from trac.util.text import exception_to_unicode, to_unicode
+
+__all__ = ['SQLProfiler', 'sql_fingerprint']
+
+
+_literal_re = re.compile(r"'(?:[^']|'')*'")
+_number_re = re.compile(r'\b\d+(?:\.\d+)?\b')
+_value_list_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+def sql_fingerprint(sql):
+    """Normalize a SQL statement, so that statements only differing by
+    their literal values or parameters share the same fingerprint.
+
+    >>> sql_fingerprint("SELECT * FROM ticket WHERE id IN (1, 2,3)")
+    'SELECT * FROM ticket WHERE id IN (?)'
+    >>> sql_fingerprint('''SELECT name FROM t1
+    ...                    WHERE name=%s AND value='a''b' ''')
+    'SELECT name FROM t1 WHERE name=? AND value=?'
+    """
+    sql = _literal_re.sub('?', sql)
+    sql = _number_re.sub('?', sql.replace('%s', '?'))
+    sql = _value_list_re.sub('(?)', sql)
+    return ' '.join(sql.split())
+
+
+class SQLProfiler(object):
+    """Records the SQL statements taking longer than `threshold` seconds
+    to execute in a log file, along with the query plan of the SELECT
+    statements as returned by the `explain` function.
+
+    The statements executed by a thread can be associated to a label
+    (e.g. `'report:1'`), using the `labelled` context manager.
+
+    When the log file exceeds `max_size` bytes, it is renamed with a
+    `.1` suffix, replacing the previous one, and a new log file is
+    started.
+
+    :since 1.0.2:
+    """
+
+    def __init__(self, path, threshold, explain=None, log=None,
+                 max_size=1048576):
+        self.path = path
+        self.threshold = threshold
+        self.explain = explain
+        self.log = log
+        self.max_size = max_size
+        self._local = ThreadLocal(label=None, explaining=False)
+        self._lock = threading.Lock()
+
+    def labelled(self, label):
+        """Return a context manager associating `label` to the statements
+        executed by the current thread in its scope."""
+        return _Label(self._local, label)
+
+    def statement_executed(self, sql, args, duration, rows):
+        """Called by the `IterableCursor` after a statement is executed."""
+        if duration < self.threshold or self._local.explaining:
+            return
+        record = {'time': time.time(), 'sql': sql, 'args': args,
+                  'duration': duration, 'rows': rows,
+                  'label': self._local.label, 'plan': None}
+        if self.explain and sql.lstrip().upper().startswith('SELECT'):
+            self._local.explaining = True
+            try:
+                record['plan'] = [' '.join(unicode(v) for v in row)
+                                  for row in self.explain(sql, args)]
+            except Exception, e:
+                record['plan'] = [exception_to_unicode(e)]
+            finally:
+                self._local.explaining = False
+        try:
+            line = json.dumps(record, default=unicode)
+        except (TypeError, ValueError):
+            # e.g. binary arguments, which are not valid UTF-8
+            record.update(sql=to_unicode(sql), args=repr(args))
+            line = json.dumps(record, default=repr)
+        try:
+            with self._lock:
+                with open(self.path, 'a') as f:
+                    f.write(line + '\n')
+                    size = f.tell()
+                if self.max_size > 0 and size > self.max_size:
+                    self._rotate()
+        except (IOError, OSError), e:
+            if self.log:
+                self.log.warning("Can't write to slow query log %s: %s",
+                                 self.path, exception_to_unicode(e))
+
+    def _rotate(self):
+        rotated = self.path + '.1'
+        if os.path.exists(rotated):
+            os.unlink(rotated)
+        os.rename(self.path, rotated)
+
+    def get_statements(self):
+        """Return the recorded statements aggregated by fingerprint and
+        label, the most time consuming first.
+
+        Each statement is a `dict` with the `fingerprint`, `label`,
+        `count`, `total`, `max` and `rows` keys, as well as the `sql`,
+        `args` and `plan` of the last occurrence of the statement.
+        Only the current and the previous log files are read.
+        """
+        statements = {}
+        with self._lock:
+            for path in (self.path + '.1', self.path):
+                self._aggregate(path, statements)
+        return sorted(statements.itervalues(), key=lambda s: -s['total'])
+
+    def _aggregate(self, path, statements):
+        try:
+            f = open(path)
+        except IOError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                fingerprint = sql_fingerprint(record['sql'])
+                key = (fingerprint, record['label'])
+                stmt = statements.get(key)
+                if stmt is None:
+                    stmt = statements[key] = {
+                        'fingerprint': fingerprint, 'label': record['label'],
+                        'count': 0, 'total': 0, 'max': 0, 'rows': 0}
+                stmt['count'] += 1
+                stmt['total'] += record['duration']
+                stmt['max'] = max(stmt['max'], record['duration'])
+                if record['rows'] > 0:
+                    stmt['rows'] += record['rows']
+                stmt.update(sql=record['sql'], args=record['args'],
+                            plan=record['plan'])
+
+    def clear(self):
+        """Remove all the recorded statements."""
+        with self._lock:
+            for path in (self.path, self.path + '.1'):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+class _Label(object):
+
+    def __init__(self, local, label):
+        self.local = local
+        self.label = label
+
+    def __enter__(self):
+        self.previous = self.local.label
+        self.local.label = self.label
+
+    def __exit__(self, et, ev, tb):
+        self.local.label = self.previous
@@ -14,14 +14,18 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+from __future__ import with_statement
+
 import os
 import re
+import shutil
 import weakref
 
-from trac.config import ListOption
+from trac.config import ChoiceOption, IntOption, ListOption
 from trac.core import *
 from trac.db.api import IDatabaseConnector
-from trac.db.util import ConnectionWrapper, IterableCursor
+from trac.db.util import ConnectionWrapper, IterableCursor, StatementCache, \
+                         fetch_batches
 from trac.util import get_pkginfo, getuser
 from trac.util.translation import _
 
@@ -37,6 +41,11 @@ except ImportError:
     except ImportError:
         have_pysqlite = 0
 
+try:
+    import apsw
+except ImportError:
+    apsw = None
+
 if have_pysqlite == 2:
     # Force values to integers because PySQLite 2.2.0 had (2, 2, '0')
     sqlite_version = tuple([int(x) for x in sqlite.sqlite_version_info])
@@ -51,13 +60,13 @@ if have_pysqlite == 2:
                 raise
         def execute(self, sql, args=None):
             if args:
-                sql = sql % (('?',) * len(args))
+                sql = _qmark_statements.get((sql, len(args)))
             return self._rollback_on_error(sqlite.Cursor.execute, sql,
                                            args or [])
         def executemany(self, sql, args):
             if not args:
                 return
-            sql = sql % (('?',) * len(args[0]))
+            sql = _qmark_statements.get((sql, len(args[0])))
             return self._rollback_on_error(sqlite.Cursor.executemany, sql,
                                            args)
 
@@ -102,6 +111,15 @@ if have_pysqlite == 2:
             return result
 
 
+def _to_qmark(key):
+    sql, nargs = key
+    return sql % (('?',) * nargs)
+
+# The statements converted to the `qmark` parameter style, keyed by the
+# `pyformat` statement and the number of parameters
+_qmark_statements = StatementCache(_to_qmark)
+
+
 # Mapping from "abstract" SQL types to DB-specific types
 _type_map = {
     'int': 'integer',
@@ -144,12 +162,48 @@ class SQLiteConnector(Component):
         doc="""Paths to sqlite extensions, relative to Trac environment's
         directory or absolute. (''since 0.12'')""")
 
+    journal_mode = ChoiceOption('sqlite', 'journal_mode',
+        ['', 'DELETE', 'TRUNCATE', 'PERSIST', 'WAL'],
+        """Journal mode of the database. With `WAL` (write-ahead
+        logging, SQLite 3.7.0 or later), readers no longer block the
+        writer and the other way round, and separate connections are
+        used for reading. Leave empty for keeping the journal mode of
+        the database, `DELETE` by default. (''since 1.0.2'')""")
+
+    synchronous = ChoiceOption('sqlite', 'synchronous',
+        ['', 'OFF', 'NORMAL', 'FULL'],
+        """How carefully SQLite waits for the data to be written to disk.
+        `NORMAL` is safe with the `WAL` journal mode and much faster than
+        the default `FULL`. Leave empty for the SQLite default.
+        (''since 1.0.2'')""")
+
+    mmap_size = IntOption('sqlite', 'mmap_size', 0,
+        """Maximum number of bytes of the database accessed using
+        memory-mapped I/O (SQLite 3.7.17 or later). Leave to 0 for the
+        SQLite default. (''since 1.0.2'')""")
+
+    cache_size = IntOption('sqlite', 'cache_size', 0,
+        """Number of database pages kept in memory by each connection,
+        or the cache size in KiB if negative. Leave to 0 for the SQLite
+        default. (''since 1.0.2'')""")
+
+    backup_pages = IntOption('sqlite', 'backup_pages', 1000,
+        """Number of database pages copied at each step of the online
+        backup of the database, e.g. by `trac-admin hotcopy`. The writers
+        are only blocked while a step is copied. (''since 1.0.2'')""")
+
+    cached_statements = IntOption('sqlite', 'cached_statements', 100,
+        """Number of compiled statements kept by each connection, so that
+        they don't have to be parsed again when they are executed.
+        (''since 1.0.2'')""")
+
     memory_cnx = None
 
     def __init__(self):
         self._version = None
         self.error = None
         self._extensions = None
+        self._pragmas = None
 
     def get_supported_schemes(self):
         if not have_pysqlite:
@@ -163,7 +217,9 @@ class SQLiteConnector(Component):
                            "2.5.5 or higher")
         yield ('sqlite', -1 if self.error else 1)
 
-    def get_connection(self, path, log=None, params={}):
+    def get_connection(self, path, log=None, params={}, readonly=False):
+        # `readonly` connections are only used for reading and pooled
+        # separately, see `use_readers()`
         if not self._version:
             self._version = get_pkginfo(sqlite).get(
                 'version', '%d.%d.%s' % sqlite.version_info)
@@ -178,6 +234,10 @@ class SQLiteConnector(Component):
                     extpath = os.path.join(self.env.path, extpath)
                 self._extensions.append(extpath)
         params['extensions'] = self._extensions
+        if self._pragmas is None:
+            self._pragmas = self._get_pragmas()
+        params['pragmas'] = self._pragmas
+        params['cached_statements'] = self.cached_statements
         if path == ':memory:':
             if not self.memory_cnx:
                 self.memory_cnx = SQLiteConnection(path, log, params)
@@ -185,9 +245,33 @@ class SQLiteConnector(Component):
         else:
             return SQLiteConnection(path, log, params)
 
+    def use_readers(self, path, log=None, params={}):
+        """Return `True` if separate connections should be used for
+        reading, i.e. when the database is in `WAL` journal mode.
+
+        :since 1.0.2:
+        """
+        return path != ':memory:' and self.journal_mode == 'WAL'
+
     def get_exceptions(self):
         return sqlite
 
+    def _get_pragmas(self):
+        pragmas = []
+        for name, value, version in (
+                ('journal_mode', self.journal_mode, (3, 7, 0)),
+                ('synchronous', self.synchronous, (3, 0, 0)),
+                ('mmap_size', self.mmap_size, (3, 7, 17)),
+                ('cache_size', self.cache_size, (3, 0, 0))):
+            if not value:
+                continue
+            if sqlite_version < version:
+                self.log.warning("[sqlite] %s requires SQLite %s or later",
+                                 name, '.'.join(map(str, version)))
+                continue
+            pragmas.append('PRAGMA %s=%s' % (name, value))
+        return pragmas
+
     def init_db(self, path, schema=None, log=None, params={}):
         if path != ':memory:':
             # make the directory to hold the database
@@ -228,23 +312,165 @@ class SQLiteConnector(Component):
                                           'implemented' % (from_, to))
         return ()
 
-    def backup(self, dest_file):
-        """Simple SQLite-specific backup of the database.
+    def backup(self, dest_file, progress=None):
+        """Online backup of the database.
+
+        The database is copied by steps of `[sqlite] backup_pages` pages
+        so that the writers are only blocked during a step, with the
+        backup API of SQLite when the Python bindings (or apsw) provide
+        it. Else, in the rollback journal modes, the pages are read from
+        the database file under a read lock taken for each step, and the
+        copy starts over if the database was modified between two steps.
+        In the `WAL` mode, where the readers don't block the writer, it
+        is copied with `VACUUM INTO` (SQLite 3.27.0 or later). As a last
+        resort, the file is copied while the database is locked for
+        writing, so that copy is not incremental.
 
         @param dest_file: Destination file basename
+        @param progress: optional callable, called with the number of
+                         pages copied so far and the total number of
+                         pages (''since 1.0.2'')
         """
-        import shutil
         db_str = self.config.get('trac', 'database')
         try:
             db_str = db_str[:db_str.index('?')]
         except ValueError:
             pass
         db_name = os.path.join(self.env.path, db_str[7:])
-        shutil.copy(db_name, dest_file)
+        if os.path.exists(dest_file):
+            os.remove(dest_file)
+        if hasattr(sqlite.Connection, 'backup'):
+            self._backup_steps(db_name, dest_file, progress)
+        elif apsw:
+            self._backup_apsw(db_name, dest_file, progress)
+        elif self._get_journal_mode(db_name) != 'wal':
+            self._copy_pages(db_name, dest_file, progress)
+        elif sqlite_version >= (3, 27, 0):
+            self._vacuum_into(db_name, dest_file, progress)
+        else:
+            self._copy_locked(db_name, dest_file)
         if not os.path.exists(dest_file):
             raise TracError(_("No destination file created"))
         return dest_file
 
+    def _connect(self, path):
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        return sqlite.connect(path, timeout=10)
+
+    def _backup_steps(self, db_name, dest_file, progress):
+        def callback(status, remaining, total):
+            progress(total - remaining, total)
+        src = self._connect(db_name)
+        try:
+            dest = self._connect(dest_file)
+            try:
+                src.backup(dest, pages=max(self.backup_pages, 1),
+                           progress=callback if progress else None)
+            finally:
+                dest.close()
+        finally:
+            src.close()
+
+    def _backup_apsw(self, db_name, dest_file, progress):
+        src = apsw.Connection(db_name)
+        try:
+            dest = apsw.Connection(dest_file)
+            try:
+                with dest.backup('main', src, 'main') as backup:
+                    while not backup.done:
+                        backup.step(max(self.backup_pages, 1))
+                        if progress:
+                            progress(backup.pagecount - backup.remaining,
+                                     backup.pagecount)
+            finally:
+                dest.close()
+        finally:
+            src.close()
+
+    def _get_journal_mode(self, db_name):
+        cnx = self._connect(db_name)
+        try:
+            cursor = cnx.cursor()
+            cursor.execute("PRAGMA journal_mode")
+            return cursor.fetchone()[0].lower()
+        finally:
+            cnx.close()
+
+    def _copy_pages(self, db_name, dest_file, progress):
+        # The file change counter of the database header is incremented by
+        # each transaction modifying the database in the rollback journal
+        # modes. After a few restarts, the remaining pages are copied in a
+        # single step so that the copy always ends.
+        max_restarts = 3
+        step = max(self.backup_pages, 1)
+        cnx = self._connect(db_name)
+        cnx.isolation_level = None
+        try:
+            cursor = cnx.cursor()
+            with open(db_name, 'rb') as src:
+                with open(dest_file, 'wb') as dest:
+                    counter = None
+                    restarts = copied = 0
+                    while True:
+                        cursor.execute("BEGIN")
+                        try:
+                            # acquire the shared lock
+                            cursor.execute("SELECT 1 FROM sqlite_master")
+                            cursor.fetchall()
+                            cursor.execute("PRAGMA page_size")
+                            page_size = cursor.fetchone()[0]
+                            cursor.execute("PRAGMA page_count")
+                            total = cursor.fetchone()[0]
+                            src.seek(24)
+                            current = src.read(4)
+                            if current != counter:
+                                if counter is not None:
+                                    restarts += 1
+                                counter = current
+                                copied = 0
+                                dest.seek(0)
+                                dest.truncate()
+                            if restarts < max_restarts:
+                                end = min(copied + step, total)
+                            else:
+                                end = total
+                            src.seek(copied * page_size)
+                            while copied < end:
+                                pages = min(step, end - copied)
+                                dest.write(src.read(pages * page_size))
+                                copied += pages
+                        finally:
+                            cursor.execute("COMMIT")
+                        if progress:
+                            progress(copied, total)
+                        if copied >= total:
+                            break
+        finally:
+            cnx.close()
+
+    def _copy_locked(self, db_name, dest_file):
+        # Bogus statement to lock the database while copying the files
+        with self.env.db_transaction as db:
+            db("UPDATE system SET name=NULL WHERE name IS NULL")
+            shutil.copy(db_name, dest_file)
+            if os.path.exists(db_name + '-wal'):
+                shutil.copy(db_name + '-wal', dest_file + '-wal')
+
+    def _vacuum_into(self, db_name, dest_file, progress):
+        cnx = self._connect(db_name)
+        try:
+            cursor = cnx.cursor()
+            cursor.execute("PRAGMA page_count")
+            total = cursor.fetchone()[0]
+            if progress:
+                progress(0, total)
+            cursor.execute("VACUUM INTO ?", (dest_file,))
+            if progress:
+                progress(total, total)
+        finally:
+            cnx.close()
+
 
 class SQLiteConnection(ConnectionWrapper):
     """Connection wrapper for SQLite."""
@@ -276,9 +502,12 @@ class SQLiteConnection(ConnectionWrapper):
         # eager is default, can be turned off by specifying ?cursor=
         if isinstance(path, unicode): # needed with 2.4.0
             path = path.encode('utf-8')
+        # pysqlite keeps the last `cached_statements` statements compiled
         cnx = sqlite.connect(path, detect_types=sqlite.PARSE_DECLTYPES,
                              check_same_thread=sqlite_version < (3, 3, 1),
-                             timeout=timeout)
+                             timeout=timeout,
+                             cached_statements=params.get('cached_statements',
+                                                          100))
         # load extensions
         extensions = params.get('extensions', [])
         if len(extensions) > 0:
@@ -286,6 +515,11 @@ class SQLiteConnection(ConnectionWrapper):
             for ext in extensions:
                 cnx.load_extension(ext)
             cnx.enable_load_extension(False)
+        if path != ':memory:':
+            cursor = cnx.cursor()
+            for pragma in params.get('pragmas', []):
+                cursor.execute(pragma)
+            cursor.close()
 
         ConnectionWrapper.__init__(self, cnx, log)
 
@@ -293,7 +527,53 @@ class SQLiteConnection(ConnectionWrapper):
         cursor = self.cnx.cursor((PyFormatCursor, EagerCursor)[self._eager])
         self._active_cursors[cursor] = True
         cursor.cnx = self
-        return IterableCursor(cursor, self.log)
+        return IterableCursor(cursor, self.log, self.profiler)
+
+    def stream(self, query, params=None, batch_size=1000):
+        """Execute the SELECT `query` with a lazy cursor and return an
+        iterator over the rows, fetched in batches of `batch_size` rows.
+
+        Except in WAL mode, where readers don't block the writers, the
+        rows are first copied batch by batch to a temporary table, so
+        that the database is only locked for the time of the copy and
+        not for the whole iteration.
+
+        :since 1.0.2:
+        """
+        self.check_select(query)
+        raw = self.cnx.cursor(PyFormatCursor)
+        raw.cnx = self
+        raw.execute("PRAGMA journal_mode")
+        snapshot = raw.fetchone()[0].lower() != 'wal'
+        cursor = self.cnx.cursor(PyFormatCursor)
+        cursor.cnx = self
+        cursor = IterableCursor(cursor, self.log, self.profiler)
+        cursor.execute(query, params)
+        if not snapshot:
+            raw.close()
+            return fetch_batches(cursor, batch_size)
+        table = 'trac_stream_%d' % id(raw)
+        ncols = len(cursor.description)
+        raw.execute("CREATE TEMP TABLE %s (%s)"
+                    % (table, ','.join('c%d' % i for i in xrange(ncols))))
+        insert = "INSERT INTO %s VALUES (%s)" % (table,
+                                                 ','.join(['%s'] * ncols))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            raw.executemany(insert, rows)
+        cursor.close()
+        self.cnx.commit()
+        raw.execute("SELECT * FROM %s ORDER BY rowid" % table)
+        return self._stream_snapshot(raw, table, batch_size)
+
+    def _stream_snapshot(self, cursor, table, batch_size):
+        try:
+            for row in fetch_batches(cursor, batch_size):
+                yield row
+        finally:
+            self.cnx.execute("DROP TABLE temp.%s" % table)
 
     def rollback(self):
         for cursor in self._active_cursors.keys():
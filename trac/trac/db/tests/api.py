@@ -30,7 +30,8 @@ class Error(Exception):
 def make_env(get_cnx):
     return Mock(components={DatabaseManager:
              Mock(get_connection=get_cnx,
-                  _transaction_local=ThreadLocal(wdb=None, rdb=None))})
+                  _transaction_local=ThreadLocal(wdb=None, rdb=None,
+                                                 callbacks=None))})
 
 
 class WithTransactionTest(unittest.TestCase):
@@ -342,11 +343,102 @@ class ConnectionTestCase(unittest.TestCase):
                 "SELECT id FROM report WHERE author='next-id'")[0][0])
 
 
+    def test_after_commit(self):
+        calls = []
+        self.env.db_transaction.after_commit(lambda: calls.append(0))
+        self.assertEqual([0], calls)
+        with self.env.db_transaction as db:
+            self.env.db_transaction.after_commit(lambda: calls.append(1))
+            with self.env.db_transaction as db:
+                self.env.db_transaction.after_commit(lambda: calls.append(2))
+            self.assertEqual([0], calls)
+        self.assertEqual([0, 1, 2], calls)
+
+    def test_after_commit_rollback(self):
+        calls = []
+        try:
+            with self.env.db_transaction as db:
+                self.env.db_transaction.after_commit(lambda: calls.append(1))
+                raise Error()
+        except Error:
+            pass
+        with self.env.db_transaction as db:
+            pass
+        self.assertEqual([], calls)
+
+
+class BulkExecuteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.rows = [(u'bulk-%03d' % i, u'välue %d %%' % i)
+                     for i in xrange(25)]
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _select(self):
+        return self.env.db_query("""
+            SELECT name, value FROM system WHERE name LIKE 'bulk-%%'
+            ORDER BY name""")
+
+    def test_bulk_same_as_row_by_row(self):
+        with self.env.db_transaction as db:
+            for row in self.rows:
+                db("INSERT INTO system (name,value) VALUES (%s,%s)", row)
+        expected = self._select()
+        self.env.db_transaction("DELETE FROM system WHERE name LIKE 'bulk-%'")
+
+        count = self.env.db_transaction.bulk_execute(
+            "INSERT INTO system (name,value) VALUES (%s,%s)", self.rows,
+            chunk_size=10)
+        self.assertEqual(25, count)
+        self.assertEqual(expected, self._select())
+        self.assertEqual(self.rows, self._select())
+
+    def test_chunks(self):
+        executed = []
+        class Cursor(object):
+            def executemany(self, query, params):
+                executed.append(len(params))
+            def close(self):
+                pass
+        from trac.db.util import bulk_execute
+        self.assertEqual(25, bulk_execute(Cursor(), 'INSERT', iter(self.rows),
+                                          10))
+        self.assertEqual([10, 10, 5], executed)
+
+    def test_generator_and_default_chunk_size(self):
+        self.env.config.set('trac', 'bulk_chunk_size', 7)
+        count = self.env.db_transaction.bulk_execute(
+            "INSERT INTO system (name,value) VALUES (%s,%s)",
+            (row for row in self.rows))
+        self.assertEqual(25, count)
+        self.assertEqual(self.rows, self._select())
+
+    def test_empty(self):
+        self.assertEqual(0, self.env.db_transaction.bulk_execute(
+            "INSERT INTO system (name,value) VALUES (%s,%s)", []))
+
+    def test_rollback(self):
+        rows = self.rows + [self.rows[0]]
+        self.assertRaises(self.env.db_exc.IntegrityError,
+                          self.env.db_transaction.bulk_execute,
+                          "INSERT INTO system (name,value) VALUES (%s,%s)",
+                          rows, 10)
+        self.assertEqual([], self._select())
+
+    def test_select_not_allowed(self):
+        self.assertRaises(ValueError, self.env.db_transaction.bulk_execute,
+                          "SELECT * FROM system WHERE name=%s", [('x',)])
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ParseConnectionStringTestCase, 'test'))
     suite.addTest(unittest.makeSuite(StringsTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ConnectionTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(BulkExecuteTestCase, 'test'))
     suite.addTest(unittest.makeSuite(WithTransactionTest, 'test'))
     return suite
 
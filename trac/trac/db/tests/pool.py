@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.db.pool import ConnectionPoolBackend, TimeoutError
+from trac.util.concurrency import threading
+
+
+class MockConnection(object):
+
+    poolable = True
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class MockConnector(object):
+
+    def get_connection(self, path, log=None):
+        return MockConnection(path)
+
+
+class ConnectionPoolBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = ConnectionPoolBackend(2)
+        self.connector = MockConnector()
+
+    def _get_cnx(self, path, timeout=None):
+        return self.backend.get_cnx(self.connector, {'path': path}, timeout)
+
+    def _get_stats(self, path):
+        stats = self.backend.get_stats(unicode({'path': path}))
+        return dict((name, stats[name])
+                    for name in ('hits', 'misses', 'created', 'waits',
+                                 'timeouts', 'active', 'idle'))
+
+    def test_same_thread_reuses_cnx(self):
+        db1 = self._get_cnx('db')
+        db2 = self._get_cnx('db')
+        self.assertTrue(db1.cnx is db2.cnx)
+        db2.close()
+        db1.close()
+        self.assertEqual({'hits': 0, 'misses': 1, 'created': 1, 'waits': 0,
+                          'timeouts': 0, 'active': 0, 'idle': 1},
+                         self._get_stats('db'))
+
+    def test_pooled_cnx_reused(self):
+        db = self._get_cnx('db')
+        cnx = db.cnx
+        db.close()
+        db = self._get_cnx('db')
+        self.assertTrue(cnx is db.cnx)
+        self.assertEqual({'hits': 1, 'misses': 1, 'created': 1, 'waits': 0,
+                          'timeouts': 0, 'active': 1, 'idle': 0},
+                         self._get_stats('db'))
+
+    def test_lru_cnx_replaced(self):
+        db1 = self._get_cnx('db1')
+        db2 = self._get_cnx('db2')
+        cnx1 = db1.cnx
+        db1.close()
+        db2.close()
+        db3 = self._get_cnx('db3')
+        self.assertTrue(cnx1.closed)
+        self.assertEqual('db3', db3.cnx.path)
+        self.assertEqual(0, self._get_stats('db1')['idle'])
+        self.assertEqual(1, self._get_stats('db2')['idle'])
+
+    def test_timeout(self):
+        db1 = self._get_cnx('db1')
+        db2 = self._get_cnx('db2')
+        self.assertRaises(TimeoutError, self._get_cnx, 'db3', 0.05)
+        self.assertEqual({'hits': 0, 'misses': 0, 'created': 0, 'waits': 1,
+                          'timeouts': 1, 'active': 0, 'idle': 0},
+                         self._get_stats('db3'))
+
+    def test_wait_for_cnx(self):
+        db1 = self._get_cnx('db1')
+        db2 = self._get_cnx('db2')
+        acquired = threading.Event()
+        result = []
+        def get_cnx():
+            result.append(self._get_cnx('db1', 10))
+            acquired.set()
+        thread = threading.Thread(target=get_cnx)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05) or acquired.isSet())
+        cnx = db1.cnx
+        db1.close()
+        thread.join()
+        self.assertTrue(cnx is result[0].cnx)
+        stats = self._get_stats('db1')
+        self.assertEqual(1, stats['waits'])
+        self.assertEqual(1, stats['hits'])
+
+    def test_global_shutdown(self):
+        db = self._get_cnx('db1')
+        cnx = db.cnx
+        self.backend.shutdown()
+        self.assertTrue(cnx.closed)
+        self.assertEqual(0, self._get_stats('db1')['active'])
+        db2 = self._get_cnx('db2')
+        db3 = self._get_cnx('db3')
+
+
+def suite():
+    return unittest.makeSuite(ConnectionPoolBackendTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import doctest
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import trac.db.profiler
+from trac.db.api import DatabaseManager
+from trac.test import EnvironmentStub
+
+
+class SQLProfilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.path = tempfile.mkdtemp(prefix='trac-tempenv-')
+        os.mkdir(self.env.get_log_dir())
+        self.env.config.set('trac', 'slow_query_threshold', '0.000001')
+        self.dbm = DatabaseManager(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+        shutil.rmtree(self.env.path)
+
+    def test_disabled(self):
+        self.env.config.set('trac', 'slow_query_threshold', '0')
+        self.assertEqual(None, self.dbm.profiler)
+        with self.dbm.profiling('report:1'):
+            self.env.db_query("SELECT name FROM system")
+
+    def test_statements_aggregated(self):
+        with self.dbm.profiling('report:1'):
+            for name in ('a', 'b'):
+                self.env.db_query("SELECT value FROM system WHERE name=%s",
+                                  (name,))
+        statements = [stmt for stmt in self.dbm.profiler.get_statements()
+                      if stmt['label'] == 'report:1']
+        self.assertEqual(1, len(statements))
+        stmt = statements[0]
+        self.assertEqual('SELECT value FROM system WHERE name=?',
+                         stmt['fingerprint'])
+        self.assertEqual(2, stmt['count'])
+        self.assertEqual(['b'], stmt['args'])
+        self.assertTrue(stmt['plan'])
+
+    def test_binary_args(self):
+        profiler = self.dbm.profiler
+        profiler.statement_executed("SELECT %s", ('\xff\xfe',), 1, 1)
+        statements = [stmt for stmt in profiler.get_statements()
+                      if stmt['fingerprint'] == 'SELECT ?']
+        self.assertEqual(1, len(statements))
+        self.assertEqual(repr(('\xff\xfe',)), statements[0]['args'])
+
+    def test_log_rotated(self):
+        profiler = self.dbm.profiler
+        profiler.explain = None
+        profiler.max_size = 500
+        for i in xrange(10):
+            profiler.statement_executed("SELECT %d" % i, (), 1, 1)
+        # The log is rotated after the line which exceeds the size
+        self.assertTrue(not os.path.exists(profiler.path) or
+                        os.path.getsize(profiler.path) <= 500)
+        self.assertTrue(os.path.getsize(profiler.path + '.1') < 1000)
+        counts = sum(stmt['count'] for stmt in profiler.get_statements()
+                     if stmt['fingerprint'] == 'SELECT ?')
+        self.assertTrue(0 < counts < 10)
+        profiler.clear()
+        self.assertFalse(os.path.exists(profiler.path + '.1'))
+
+    def test_clear(self):
+        self.env.db_query("SELECT name FROM system")
+        self.assertNotEqual([], self.dbm.profiler.get_statements())
+        self.dbm.profiler.clear()
+        self.assertEqual([], self.dbm.profiler.get_statements())
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(doctest.DocTestSuite(trac.db.profiler))
+    suite.addTest(unittest.makeSuite(SQLProfilerTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
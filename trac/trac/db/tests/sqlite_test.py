@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from __future__ import with_statement
+
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from trac.db.api import DatabaseManager
+from trac.db.sqlite_backend import SQLiteConnector, sqlite, sqlite_version
+from trac.env import Environment, EnvironmentAdmin
+from trac.test import EnvironmentStub
+from trac.util.concurrency import threading
+
+
+class StreamTestCase(unittest.TestCase):
+
+    options = []
+
+    def setUp(self):
+        self.env = Environment(tempfile.mkdtemp(prefix='trac-tempenv-'),
+                               create=True, options=self.options)
+        self.env.db_transaction.executemany(
+            "INSERT INTO system (name, value) VALUES (%s, %s)",
+            [('stream%03d' % i, str(i)) for i in xrange(50)])
+
+    def tearDown(self):
+        self.env.shutdown()
+        shutil.rmtree(self.env.path)
+
+    def _stream(self, batch_size=7):
+        return self.env.db_query.stream("""
+            SELECT name, value FROM system WHERE name LIKE %s ORDER BY name
+            """, ('stream%',), batch_size)
+
+    def test_rows(self):
+        self.assertEqual([('stream%03d' % i, str(i)) for i in xrange(50)],
+                         list(self._stream()))
+
+    def test_commit_while_streaming(self):
+        rows = []
+        for name, value in self._stream():
+            rows.append(value)
+            with self.env.db_transaction as db:
+                db("DELETE FROM system WHERE name=%s", (name,))
+                db("INSERT INTO system (name, value) VALUES (%s, %s)",
+                   ('stream999.' + value, value))
+        self.assertEqual([str(i) for i in xrange(50)], rows)
+        self.assertEqual([(50,)], self.env.db_query("""
+            SELECT COUNT(*) FROM system WHERE name LIKE 'stream999.%'"""))
+
+    def test_discard_iterator(self):
+        rows = self._stream()
+        self.assertEqual(('stream000', '0'), rows.next())
+        rows.close()
+        with self.env.db_transaction as db:
+            db("DELETE FROM system WHERE name LIKE 'stream%'")
+        self.assertEqual([], list(self._stream()))
+
+    def test_in_memory_database(self):
+        env = EnvironmentStub()
+        try:
+            self.assertEqual([('database_version',)], list(
+                env.db_query.stream("""
+                    SELECT name FROM system WHERE name='database_version'
+                    """)))
+        finally:
+            env.reset_db()
+
+
+class WALStreamTestCase(StreamTestCase):
+
+    options = [('sqlite', 'journal_mode', 'WAL')]
+
+
+class SQLiteWALTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = Environment(tempfile.mkdtemp(prefix='trac-tempenv-'),
+                               create=True,
+                               options=[('sqlite', 'journal_mode', 'WAL'),
+                                        ('sqlite', 'synchronous', 'NORMAL'),
+                                        ('sqlite', 'cache_size', '-4096')])
+        self.dbm = DatabaseManager(self.env)
+
+    def tearDown(self):
+        self.env.shutdown()
+        shutil.rmtree(self.env.path)
+
+    def test_pragmas(self):
+        with self.env.db_query as db:
+            cursor = db.cursor()
+            for pragma, value in (('journal_mode', 'wal'),
+                                  ('synchronous', 1), ('cache_size', -4096)):
+                cursor.execute("PRAGMA %s" % pragma)
+                self.assertEqual((value,), cursor.fetchone())
+
+    def test_reader_connection(self):
+        with self.env.db_query as rdb:
+            with self.env.db_transaction as db:
+                self.assertFalse(db.cnx is rdb.cnx.cnx)
+                db("INSERT INTO system (name, value) VALUES ('foo', 'bar')")
+                # reads in a transaction use the writer connection
+                self.assertEqual([('bar',)], self.env.db_query(
+                    "SELECT value FROM system WHERE name='foo'"))
+                self.assertEqual([], rdb(
+                    "SELECT value FROM system WHERE name='foo'"))
+            self.assertEqual([('bar',)], rdb(
+                "SELECT value FROM system WHERE name='foo'"))
+
+    def test_concurrent_readers_and_writers(self):
+        """Readers and writers access the database at the same time
+        without "database is locked" errors."""
+        errors = []
+        num_writers, num_readers, num_rows = 3, 5, 30
+        def write(n):
+            try:
+                for i in xrange(num_rows):
+                    with self.env.db_transaction as db:
+                        db("INSERT INTO system (name, value) VALUES (%s, %s)",
+                           ('writer%d.%d' % (n, i), str(i)))
+                        db("SELECT COUNT(*) FROM system")
+            except Exception, e:
+                errors.append(e)
+        def read():
+            try:
+                for i in xrange(num_rows * 2):
+                    with self.env.db_query as db:
+                        for name, value in db("""
+                                SELECT name, value FROM system
+                                WHERE name LIKE 'writer%'"""):
+                            self.assertEqual(name.split('.')[1], value)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=write, args=(n,))
+                   for n in xrange(num_writers)] + \
+                  [threading.Thread(target=read)
+                   for n in xrange(num_readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual([(num_writers * num_rows,)], self.env.db_query("""
+            SELECT COUNT(*) FROM system WHERE name LIKE 'writer%'"""))
+
+
+class BackupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='trac-tempenv-')
+        self.env = Environment(os.path.join(self.dir, 'env'), create=True,
+                               options=[('sqlite', 'backup_pages', '2')])
+        self.env.db_transaction.executemany(
+            "INSERT INTO system (name, value) VALUES (%s, %s)",
+            [('backup%04d' % i, 'x' * 200) for i in xrange(100)])
+
+    def tearDown(self):
+        self.env.shutdown()
+        shutil.rmtree(self.dir)
+
+    def _get_rows(self, path):
+        cnx = sqlite.connect(path)
+        try:
+            return cnx.execute("SELECT name, value FROM system "
+                               "ORDER BY name").fetchall()
+        finally:
+            cnx.close()
+
+    def test_backup(self):
+        progress = []
+        dest = os.path.join(self.dir, 'backup.db')
+        self.assertEqual(dest, DatabaseManager(self.env).backup(
+            dest, progress=lambda pages, total: progress.append((pages,
+                                                                 total))))
+        self.assertEqual(self._get_rows(os.path.join(self.env.path, 'db',
+                                                     'trac.db')),
+                         self._get_rows(dest))
+        pages, total = progress[-1]
+        self.assertTrue(total > 1)
+        self.assertEqual(total, pages)
+
+    def test_backup_restarts_after_write(self):
+        written = []
+        def progress(pages, total):
+            # the writers are not blocked between two steps
+            if len(written) < 2:
+                name = 'written%d' % len(written)
+                self.env.db_transaction("""
+                    INSERT INTO system (name, value) VALUES (%s, 'x')
+                    """, (name,))
+                written.append(name)
+        dest = os.path.join(self.dir, 'backup.db')
+        DatabaseManager(self.env).backup(dest, progress=progress)
+        rows = self._get_rows(dest)
+        self.assertEqual(self._get_rows(os.path.join(self.env.path, 'db',
+                                                     'trac.db')), rows)
+        self.assertTrue(('written1', 'x') in rows)
+
+    def test_backup_wal(self):
+        if sqlite_version < (3, 27, 0):
+            return
+        DatabaseManager(self.env).shutdown()
+        cnx = sqlite.connect(os.path.join(self.env.path, 'db', 'trac.db'))
+        try:
+            cnx.execute("PRAGMA journal_mode=WAL")
+        finally:
+            cnx.close()
+        dest = os.path.join(self.dir, 'backup.db')
+        self.env.db_transaction("""
+            INSERT INTO system (name, value) VALUES ('wal', 'x')
+            """)
+        DatabaseManager(self.env).backup(dest)
+        self.assertTrue(('wal', 'x') in self._get_rows(dest))
+
+    def test_copy_locked(self):
+        src = os.path.join(self.env.path, 'db', 'trac.db')
+        dest = os.path.join(self.dir, 'backup.db')
+        SQLiteConnector(self.env)._copy_locked(src, dest)
+        self.assertEqual(self._get_rows(src), self._get_rows(dest))
+
+    def test_backup_overwrites(self):
+        dest = os.path.join(self.dir, 'backup.db')
+        with open(dest, 'w') as f:
+            f.write('garbage')
+        self.env.backup(dest)
+        self.assertEqual(self._get_rows(os.path.join(self.env.path, 'db',
+                                                     'trac.db')),
+                         self._get_rows(dest))
+
+    def test_hotcopy(self):
+        dest = os.path.join(self.dir, 'copy')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertEqual(0, EnvironmentAdmin(self.env)._do_hotcopy(dest))
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertTrue('Hotcopy done.' in output)
+        self.assertTrue('100%' in output)
+        self.assertEqual(self._get_rows(os.path.join(self.env.path, 'db',
+                                                     'trac.db')),
+                         self._get_rows(os.path.join(dest, 'db', 'trac.db')))
+        self.assertTrue(os.path.exists(os.path.join(dest, 'conf',
+                                                    'trac.ini')))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(StreamTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(BackupTestCase, 'test'))
+    if sqlite_version >= (3, 7, 0):
+        suite.addTest(unittest.makeSuite(WALStreamTestCase, 'test'))
+        suite.addTest(unittest.makeSuite(SQLiteWALTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -11,9 +11,15 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from __future__ import with_statement
+
+import doctest
 import unittest
 
-from trac.db.util import sql_escape_percent
+import trac.db.util
+from trac.db.util import StatementCache, sql_escape_percent, statements
+from trac.test import EnvironmentStub
+from trac.util.concurrency import threading
 
 # TODO: test IterableCursor, ConnectionWrapper
 
@@ -32,9 +38,86 @@ class SQLEscapeTestCase(unittest.TestCase):
         self.assertEqual("'%%s %%i'", sql_escape_percent("'%s %i'"))
 
 
+class StatementCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.prepared = []
+        def prepare(sql):
+            self.prepared.append(sql)
+            return sql.upper()
+        self.cache = StatementCache(prepare, maxsize=3)
+
+    def test_hits_and_misses(self):
+        for sql in ('a', 'b', 'a', 'a', 'c'):
+            self.assertEqual(sql.upper(), self.cache.get(sql))
+        self.assertEqual(['a', 'b', 'c'], self.prepared)
+        self.assertEqual({'hits': 2, 'misses': 3, 'size': 3, 'maxsize': 3},
+                         self.cache.get_stats())
+
+    def test_bounded(self):
+        for sql in ('a', 'b', 'c', 'a', 'd', 'a', 'b'):
+            self.cache.get(sql)
+        # 'b' is the least recently used statement when 'd' is added
+        self.assertEqual(['a', 'b', 'c', 'd', 'b'], self.prepared)
+        self.assertEqual(3, self.cache.get_stats()['size'])
+
+    def test_concurrent_counts(self):
+        def get():
+            for i in xrange(1000):
+                self.cache.get('abcd'[i % 4])
+        threads = [threading.Thread(target=get) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = self.cache.get_stats()
+        self.assertEqual(4000, stats['hits'] + stats['misses'])
+        self.assertEqual(len(self.prepared), stats['misses'])
+
+    def test_disabled(self):
+        self.cache.maxsize = 0
+        self.cache.get('a')
+        self.cache.get('a')
+        self.assertEqual(['a', 'a'], self.prepared)
+        self.assertEqual(0, self.cache.get_stats()['size'])
+
+    def test_clear(self):
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.clear()
+        self.assertEqual({'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 3},
+                         self.cache.get_stats())
+
+
+class StatementsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_same_results_with_cache(self):
+        sql = "SELECT name, '%' FROM system WHERE name=%s"
+        rows = self.env.db_query(sql, ('database_version',))
+        hits = statements.hits
+        self.assertEqual(rows, self.env.db_query(sql, ('database_version',)))
+        self.assertEqual([('database_version', '%')], rows)
+        self.assertTrue(statements.hits > hits)
+
+    def test_check_select(self):
+        with self.env.db_query as db:
+            self.assertTrue(db.check_select("  SELECT 1"))
+            self.assertRaises(ValueError, db.check_select,
+                              "DELETE FROM system")
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(SQLEscapeTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(StatementCacheTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(StatementsTestCase, 'test'))
+    suite.addTest(doctest.DocTestSuite(trac.db.util))
     return suite
 
 if __name__ == '__main__':
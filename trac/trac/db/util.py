@@ -15,6 +15,27 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+from __future__ import with_statement
+
+import time
+
+from trac.util import LRUCache
+from trac.util.concurrency import ThreadLocal, threading
+
+_local = ThreadLocal(observer=None)
+
+
+def set_statement_observer(observer):
+    """Set the `observer` notified of the duration of each statement
+    executed by the current thread, or remove it if `None`.
+
+    The `observer` has a `statement_executed(sql, args, duration, rows)`
+    method, like the `profiler` of the `IterableCursor`.
+
+    :since 1.0.2:
+    """
+    _local.observer = observer
+
 
 def sql_escape_percent(sql):
     import re
@@ -22,18 +43,127 @@ def sql_escape_percent(sql):
                   lambda m: m.group(0).replace('%', '%%'), sql)
 
 
+class StatementCache(object):
+    """Bounded cache of the SQL statements prepared for their execution,
+    keyed by their SQL text.
+
+    The `prepare` callable computes the prepared form of a statement
+    from its key on a cache miss. When the cache is full, the least
+    recently used statements are discarded (see `~trac.util.LRUCache`).
+    A `maxsize` of 0 disables the cache.
+
+    >>> cache = StatementCache(lambda sql: sql.upper(), maxsize=2)
+    >>> cache.get('select 1'), cache.get('select 1')
+    ('SELECT 1', 'SELECT 1')
+    >>> sorted(cache.get_stats().items())
+    [('hits', 1), ('maxsize', 2), ('misses', 1), ('size', 1)]
+
+    :since 1.0.2:
+    """
+
+    def __init__(self, prepare, maxsize=1000):
+        self.prepare = prepare
+        self.hits = self.misses = 0
+        self._statements = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def _set_maxsize(self, maxsize):
+        self._statements.size = maxsize
+        if maxsize <= 0:
+            self._statements.clear()
+
+    maxsize = property(lambda self: self._statements.size, _set_maxsize)
+
+    def get(self, key):
+        statement = self._statements.get(key)
+        with self._lock:
+            if statement is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if statement is None:
+            statement = self.prepare(key)
+            if self.maxsize > 0:
+                self._statements[key] = statement
+        return statement
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+            self.hits = self.misses = 0
+
+    def get_stats(self):
+        """Return the `hits`, `misses`, `size` and `maxsize` of the cache
+        as a `dict`."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._statements), 'maxsize': self.maxsize}
+
+
+def _prepare_statement(sql):
+    return sql_escape_percent(sql), sql.lstrip().startswith('SELECT')
+
+# The SQL statements escaped for the use with parameters (see
+# `sql_escape_percent`), along with whether they are a SELECT
+statements = StatementCache(_prepare_statement)
+
+
+def fetch_batches(cursor, batch_size):
+    """Generate the rows of an executed `cursor` by fetching them in
+    batches of `batch_size` rows, and close the cursor at the end.
+
+    :since 1.0.2:
+    """
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cursor.close()
+
+
+def bulk_execute(cursor, query, params, chunk_size):
+    """Execute the SQL `query` with each tuple of the iterable `params`,
+    by calling `cursor.executemany` on chunks of at most `chunk_size`
+    tuples, and return the number of tuples.
+
+    :since 1.0.2:
+    """
+    count = 0
+    chunk = []
+    for args in params:
+        chunk.append(args)
+        if len(chunk) >= chunk_size:
+            cursor.executemany(query, chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        cursor.executemany(query, chunk)
+        count += len(chunk)
+    return count
+
+
 class IterableCursor(object):
     """Wrapper for DB-API cursor objects that makes the cursor iterable
     and escapes all "%"s used inside literal strings with parameterized
     queries.
 
     Iteration will generate the rows of a SELECT query one by one.
+
+    :since 1.0.2: the optional `profiler` (see `trac.db.profiler`) and
+                  the observer of the thread (see
+                  `set_statement_observer`) are notified of the duration
+                  of each statement.
     """
-    __slots__ = ['cursor', 'log']
+    __slots__ = ['cursor', 'log', 'profiler']
 
-    def __init__(self, cursor, log=None):
+    def __init__(self, cursor, log=None, profiler=None):
         self.cursor = cursor
         self.log = log
+        self.profiler = profiler
 
     def __getattr__(self, name):
         return getattr(self.cursor, name)
@@ -46,12 +176,27 @@ class IterableCursor(object):
             yield row
 
     def execute(self, sql, args=None):
+        observer = _local.observer
+        if self.profiler or observer:
+            start = time.time()
+            r = self._execute(sql, args)
+            duration = time.time() - start
+            rows = getattr(self.cursor, 'rows', None)
+            rows = self.cursor.rowcount if rows is None else len(rows)
+            if self.profiler:
+                self.profiler.statement_executed(sql, args, duration, rows)
+            if observer:
+                observer.statement_executed(sql, args, duration, rows)
+            return r
+        return self._execute(sql, args)
+
+    def _execute(self, sql, args):
         if self.log:
             self.log.debug('SQL: %s', sql)
             try:
                 if args:
                     self.log.debug('args: %r', args)
-                    r = self.cursor.execute(sql_escape_percent(sql), args)
+                    r = self.cursor.execute(statements.get(sql)[0], args)
                 else:
                     r = self.cursor.execute(sql)
                 rows = getattr(self.cursor, 'rows', None)
@@ -62,10 +207,25 @@ class IterableCursor(object):
                 self.log.debug('execute exception: %r', e)
                 raise
         if args:
-            return self.cursor.execute(sql_escape_percent(sql), args)
+            return self.cursor.execute(statements.get(sql)[0], args)
         return self.cursor.execute(sql)
 
     def executemany(self, sql, args):
+        observer = _local.observer
+        if (self.profiler or observer) and args:
+            start = time.time()
+            r = self._executemany(sql, args)
+            duration = time.time() - start
+            if self.profiler:
+                self.profiler.statement_executed(sql, args[0], duration,
+                                                 len(args))
+            if observer:
+                observer.statement_executed(sql, args[0], duration,
+                                            len(args))
+            return r
+        return self._executemany(sql, args)
+
+    def _executemany(self, sql, args):
         if self.log:
             self.log.debug('SQL: %r', sql)
             self.log.debug('args: %r', args)
@@ -73,7 +233,7 @@ class IterableCursor(object):
                 return
             try:
                 if args[0]:
-                    return self.cursor.executemany(sql_escape_percent(sql),
+                    return self.cursor.executemany(statements.get(sql)[0],
                                                    args)
                 return self.cursor.executemany(sql, args)
             except Exception, e:
@@ -82,7 +242,7 @@ class IterableCursor(object):
         if not args:
             return
         if args[0]:
-            return self.cursor.executemany(sql_escape_percent(sql), args)
+            return self.cursor.executemany(statements.get(sql)[0], args)
         return self.cursor.executemany(sql, args)
 
 
@@ -94,13 +254,17 @@ class ConnectionWrapper(object):
 
     :since 1.0: added a 'readonly' flag preventing the forwarding of
                 `commit` and `rollback`
+
+    :since 1.0.2: added a `profiler` attribute, which backends pass to
+                  the `IterableCursor` they create
     """
-    __slots__ = ('cnx', 'log', 'readonly')
+    __slots__ = ('cnx', 'log', 'readonly', 'profiler')
 
     def __init__(self, cnx, log=None, readonly=False):
         self.cnx = cnx
         self.log = log
         self.readonly = readonly
+        self.profiler = None
 
     def __getattr__(self, name):
         if self.readonly and name in ('commit', 'rollback'):
@@ -141,6 +305,42 @@ class ConnectionWrapper(object):
         cursor.close()
         return rows
 
+    def bulk_execute(self, query, params, chunk_size=1000):
+        """Execute an SQL `query` which doesn't return rows (typically an
+        INSERT) for each tuple of the iterable `params`, in
+        "executemany" calls on chunks of `chunk_size` tuples.
+
+        Unlike `executemany`, `params` can be a generator, which is
+        consumed one chunk at a time. Return the number of tuples.
+
+        :since 1.0.2:
+        """
+        if self.check_select(query):
+            raise ValueError("bulk_execute can't be used with a SELECT")
+        cursor = self.cursor()
+        try:
+            return bulk_execute(cursor, query, params, chunk_size)
+        finally:
+            cursor.close()
+
+    def stream(self, query, params=None, batch_size=1000):
+        """Execute an SQL SELECT `query` and return an iterator over the
+        rows, which are fetched in batches of `batch_size` rows
+        ("fetchmany").
+
+        The query is executed immediately. Backends override this
+        method for using a cursor which doesn't materialize the rows;
+        as the cursor is generally invalidated by a commit, the
+        connection should be dedicated to the iteration (see
+        `~trac.db.api.DatabaseManager.stream`).
+
+        :since 1.0.2:
+        """
+        self.check_select(query)
+        cursor = self.cursor()
+        cursor.execute(query, params)
+        return fetch_batches(cursor, batch_size)
+
     def check_select(self, query):
         """Verify if the query is compatible according to the readonly nature
         of the wrapped Connection.
@@ -149,7 +349,7 @@ class ConnectionWrapper(object):
         :raise: `ValueError` if this is not a SELECT and the wrapped
                 Connection is read-only.
         """
-        dql = query.lstrip().startswith('SELECT')
+        dql = statements.get(query)[1]
         if self.readonly and not dql:
             raise ValueError("a 'readonly' connection can only do a SELECT")
         return dql
@@ -17,7 +17,7 @@
 from trac.db import Table, Column, Index
 
 # Database version identifier. Used for automatic upgrades.
-db_version = 29
+db_version = 30
 
 def __mkreports(reports):
     """Utility function used to create report data in same syntax as the
@@ -72,6 +72,14 @@ schema = [
         Column('description'),
         Column('author'),
         Column('ipnr')],
+    Table('attachment_blob', key='hash')[
+        Column('hash'),
+        Column('size', type='int64'),
+        Column('refcount', type='int')],
+    Table('attachment_blob_ref', key='location')[
+        Column('location'),
+        Column('hash'),
+        Index(['hash'])],
 
     # Wiki system
     Table('wiki', key=('name', 'version'))[
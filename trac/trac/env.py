@@ -842,6 +842,8 @@ def open_environment(env_path=None, use_cache=False):
                 env = None
             if env is None:
                 env = env_cache.setdefault(env_path, open_environment(env_path))
+                from trac.web.chrome import Chrome
+                Chrome(env).preload()
             else:
                 CacheManager(env).reset_metadata()
     else:
@@ -928,50 +930,65 @@ class EnvironmentAdmin(Component):
         if os.path.exists(dest):
             raise TracError(_("hotcopy can't overwrite existing '%(dest)s'",
                               dest=path_to_unicode(dest)))
-        import shutil
-
-        # Bogus statement to lock the database while copying files
-        with self.env.db_transaction as db:
-            db("UPDATE system SET name=NULL WHERE name IS NULL")
-
-            printout(_("Hotcopying %(src)s to %(dst)s ...",
-                       src=path_to_unicode(self.env.path),
-                       dst=path_to_unicode(dest)))
-            db_str = self.env.config.get('trac', 'database')
-            prefix, db_path = db_str.split(':', 1)
-            skip = []
-
-            if prefix == 'sqlite':
-                db_path = os.path.join(self.env.path, os.path.normpath(db_path))
-                # don't copy the journal (also, this would fail on Windows)
-                skip = [db_path + '-journal', db_path + '-stmtjrnl']
-                if no_db:
-                    skip.append(db_path)
-
-            try:
-                copytree(self.env.path, dest, symlinks=1, skip=skip)
-                retval = 0
-            except shutil.Error, e:
-                retval = 1
-                printerr(_("The following errors happened while copying "
-                           "the environment:"))
-                for (src, dst, err) in e.args[0]:
-                    if src in err:
-                        printerr('  %s' % err)
-                    else:
-                        printerr("  %s: '%s'" % (err, path_to_unicode(src)))
-
-
-            # db backup for non-sqlite
-            if prefix != 'sqlite' and not no_db:
+        printout(_("Hotcopying %(src)s to %(dst)s ...",
+                   src=path_to_unicode(self.env.path),
+                   dst=path_to_unicode(dest)))
+        db_str = self.env.config.get('trac', 'database')
+        prefix, db_path = db_str.split(':', 1)
+
+        if prefix == 'sqlite':
+            db_path = os.path.join(self.env.path, os.path.normpath(db_path))
+            # The database is copied with the online backup of the
+            # connector, which locks the database for writing only when
+            # it can't copy it by steps, and the journals are not copied
+            # (also, this would fail on Windows)
+            skip = [db_path] + [db_path + suffix for suffix in
+                                ('-journal', '-stmtjrnl', '-wal', '-shm')]
+            retval = self._copy_environment(dest, skip)
+            relpath = os.path.relpath(db_path, self.env.path)
+            if not no_db and not relpath.startswith(os.pardir):
                 printout(_("Backing up database ..."))
-                sql_backup = os.path.join(dest, 'db',
-                                          '%s-db-backup.sql' % prefix)
-                self.env.backup(sql_backup)
+                DatabaseManager(self.env).backup(
+                    os.path.join(dest, relpath),
+                    progress=self._print_backup_progress)
+                printout()
+        else:
+            # Bogus statement to lock the database while copying files
+            with self.env.db_transaction as db:
+                db("UPDATE system SET name=NULL WHERE name IS NULL")
+                retval = self._copy_environment(dest, [])
+
+                # db backup for non-sqlite
+                if not no_db:
+                    printout(_("Backing up database ..."))
+                    sql_backup = os.path.join(dest, 'db',
+                                              '%s-db-backup.sql' % prefix)
+                    self.env.backup(sql_backup)
 
         printout(_("Hotcopy done."))
         return retval
 
+    def _copy_environment(self, dest, skip):
+        import shutil
+        try:
+            copytree(self.env.path, dest, symlinks=1, skip=skip)
+            return 0
+        except shutil.Error, e:
+            printerr(_("The following errors happened while copying "
+                       "the environment:"))
+            for (src, dst, err) in e.args[0]:
+                if src in err:
+                    printerr('  %s' % err)
+                else:
+                    printerr("  %s: '%s'" % (err, path_to_unicode(src)))
+            return 1
+
+    def _print_backup_progress(self, pages, total):
+        printout('\r' + _("  %(percent)d%% (%(pages)d/%(total)d pages)",
+                          percent=pages * 100 / max(total, 1), pages=pages,
+                          total=total), newline=False)
+        sys.stdout.flush()
+
     def _do_upgrade(self, no_backup=None):
         if no_backup not in (None, '-b', '--no-backup'):
             raise AdminCommandError(_("Invalid arguments"), show_usage=True)
@@ -98,3 +98,22 @@ jQuery(document).ready(function($){
     }, dataType: 'text' });
   });
 });
+
+/* When the change history is paged, go to the page showing a linked
+   comment (see `changelog_pages`). */
+jQuery(document).ready(function($){
+  function showCommentPage() {
+    var match = /^#comment:(\d+)$/.exec(location.hash);
+    if (!match || document.getElementById("comment:" + match[1]))
+      return;
+    var cnum = parseInt(match[1], 10);
+    $.each(window.changelog_pages || [], function(i, page) {
+      if (page[1] <= cnum && cnum <= page[2]) {
+        location.href = page[0] + location.hash;
+        return false;
+      }
+    });
+  }
+  $(window).on("hashchange", showCommentPage);
+  showCommentPage();
+});
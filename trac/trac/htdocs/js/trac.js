@@ -112,6 +112,27 @@
     textarea.rows = rows;
   }
 
+  // Load the attachments which are not listed on the page of a resource
+  $(document).on("click", "#attachments p.trac-more-attachments a",
+                 function() {
+    var more = $(this).parent();
+    var href = this.href;
+    $.ajax({url: href, dataType: "html",
+      success: function(data) {
+        var list = more.prev("ul, dl.attachments").append(data);
+        more.remove();
+        // all the viewable attachments are listed now
+        $("#attachments .trac-count").text(
+          "(" + list.children("li, dt").length + ")");
+      },
+      error: function() {
+        // fall back to the page listing all the attachments
+        window.location = href;
+      }
+    });
+    return false;
+  });
+
   // The following are defined for backwards compatibility with releases prior
   // to Trac 0.11
 
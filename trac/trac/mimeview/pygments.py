@@ -10,17 +10,23 @@
 #
 # Author: Matthew Good <matt@matt-good.net>
 
+from __future__ import with_statement
+
 from datetime import datetime
+from hashlib import sha1
+import marshal
 import os
 from pkg_resources import resource_filename
 import re
 
 from trac.core import *
-from trac.config import ListOption, Option
+from trac.config import IntOption, ListOption, Option
 from trac.env import ISystemInfoProvider
 from trac.mimeview.api import IHTMLPreviewRenderer, Mimeview
 from trac.prefs import IPreferencePanelProvider
-from trac.util import get_pkginfo
+from trac.util import AtomicFile, LRUCache, get_pkginfo
+from trac.util.concurrency import threading
+from trac.util.text import exception_to_unicode
 from trac.util.datefmt import http_date, localtz
 from trac.util.translation import _
 from trac.web.api import IRequestHandler, HTTPNotFound
@@ -62,9 +68,28 @@ class PygmentsRenderer(Component):
         to override the default quality ratio used by the
         Pygments render.""")
 
+    cache_size = IntOption('mimeviewer', 'pygments_cache_size', 50,
+        """Number of highlighted files kept in memory, so that viewing
+        them again doesn't need to highlight them again. Set to 0 to
+        disable the cache. (''since 1.0.2'')""")
+
+    cache_dir = Option('mimeviewer', 'pygments_cache_dir', 'cache/pygments',
+        """Directory where highlighted files are cached, in addition to
+        the memory cache. Relative paths are resolved relative to the
+        environment directory. Leave empty to only use the memory cache.
+        (''since 1.0.2'')""")
+
+    cache_dir_size = IntOption('mimeviewer', 'pygments_cache_dir_size', 1000,
+        """Maximum number of highlighted files kept in
+        `pygments_cache_dir`; the least recently used are removed first.
+        (''since 1.0.2'')""")
+
     expand_tabs = True
     returns_source = True
 
+    # Smaller content is highlighted faster than it is looked up
+    cache_min_size = 1024
+
     QUALITY_RATIO = 7
 
     EXAMPLE = """<!DOCTYPE html>
@@ -84,6 +109,9 @@ class PygmentsRenderer(Component):
 
     def __init__(self):
         self._types = None
+        self._cache = LRUCache(self.cache_size)
+        self._cache_dir_count = None
+        self._cache_dir_lock = threading.Lock()
 
     # ISystemInfoProvider methods
 
@@ -204,8 +232,108 @@ class PygmentsRenderer(Component):
         )
 
     def _generate(self, language, content):
-        lexer = get_lexer_by_name(language, stripnl=False)
-        return GenshiHtmlFormatter().generate(lexer.get_tokens(content))
+        formatter = GenshiHtmlFormatter()
+        if len(content) < self.cache_min_size or \
+                (self.cache_size <= 0 and not self.cache_dir):
+            lexer = get_lexer_by_name(language, stripnl=False)
+            return formatter.generate(lexer.get_tokens(content))
+
+        if isinstance(content, unicode):
+            digest = sha1(content.encode('utf-8'))
+        else:
+            digest = sha1(content)
+        digest.update('\0%s\0%s' % (language, pygments.__version__))
+        key = digest.hexdigest()
+        chunks = self._cache.get(key)
+        if chunks is None:
+            chunks = self._read_cached(key)
+            if chunks is None:
+                lexer = get_lexer_by_name(language, stripnl=False)
+                chunks = list(formatter._chunk(lexer.get_tokens(content)))
+                self._write_cached(key, chunks)
+            self._cache[key] = chunks
+        return formatter.generate_chunks(chunks)
+
+    def _get_cache_path(self, key):
+        if self.cache_dir:
+            return os.path.join(self.env.path, self.cache_dir, key[:2], key)
+
+    def _read_cached(self, key):
+        path = self._get_cache_path(key)
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'rb') as f:
+                    chunks = marshal.load(f)
+                os.utime(path, None)
+                return chunks
+            except (EnvironmentError, EOFError, ValueError, TypeError), e:
+                self.log.warning("Can't read cached highlighting %s: %s",
+                                 path, exception_to_unicode(e))
+
+    def _write_cached(self, key, chunks):
+        path = self._get_cache_path(key)
+        if not path:
+            return
+        try:
+            dir = os.path.dirname(path)
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+            f = AtomicFile(path, 'wb')
+            try:
+                f.write(marshal.dumps(chunks))
+            except EnvironmentError:
+                f.rollback()
+                raise
+            f.commit()
+            self._cache_file_added()
+        except EnvironmentError, e:
+            self.log.warning("Can't cache highlighting in %s: %s", path,
+                             exception_to_unicode(e))
+
+    def _cache_file_added(self):
+        """Keep track of the number of files in the cache directory, and
+        trim it when there are more than `cache_dir_size`.
+
+        The directory is only scanned by the first write of the process
+        and by the trims, which leave 10% of free room.
+        """
+        with self._cache_dir_lock:
+            if self._cache_dir_count is None:
+                self._cache_dir_count = len(self._get_cache_dir_files())
+            else:
+                self._cache_dir_count += 1
+            if self._cache_dir_count > self.cache_dir_size:
+                self._cache_dir_count = self._trim_cache_dir(
+                    self.cache_dir_size - self.cache_dir_size // 10)
+
+    def _get_cache_dir_files(self):
+        root = os.path.join(self.env.path, self.cache_dir)
+        files = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            files.extend(os.path.join(dirpath, filename)
+                         for filename in filenames)
+        return files
+
+    def _trim_cache_dir(self, keep):
+        """Remove the least recently used files from the cache directory
+        but the `keep` most recent ones, and return the number of files
+        left."""
+        files = self._get_cache_dir_files()
+        if len(files) <= keep:
+            return len(files)
+        entries = []
+        for path in files:
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort()
+        for mtime, path in entries[:len(entries) - keep]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        return min(len(entries), keep)
 
 
 class GenshiHtmlFormatter(HtmlFormatter):
@@ -238,12 +366,20 @@ class GenshiHtmlFormatter(HtmlFormatter):
             yield last_class, u''.join(text)
 
     def generate(self, tokens):
+        return self.generate_chunks(self._chunk(tokens))
+
+    def generate_chunks(self, chunks):
+        """Generate a stream from the `(css_class, text)` chunks returned
+        by `_chunk`.
+
+        :since 1.0.2:
+        """
         pos = (None, -1, -1)
         span = QName('span')
         class_ = QName('class')
 
         def _generate():
-            for c, text in self._chunk(tokens):
+            for c, text in chunks:
                 if c:
                     attrs = Attrs([(class_, c)])
                     yield START, (span, attrs), pos
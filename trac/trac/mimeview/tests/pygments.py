@@ -12,6 +12,8 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 import os
+import shutil
+import tempfile
 import unittest
 
 from genshi.core import Stream, TEXT
@@ -123,10 +125,96 @@ def hello():
         self.assertEqual('text/x-ini; charset=utf-8',
                          mimeview.get_mimetype('file.text/x-ini'))
 
+class PygmentsCacheTestCase(unittest.TestCase):
+
+    content = u'def hello():\n    return "Hello World!"\n' * 100
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[Chrome, PygmentsRenderer])
+        self.env.path = tempfile.mkdtemp(prefix='trac-tempenv-')
+        self.req = Mock(base_path='', chrome={}, args={},
+                        abs_href=Href('/'), href=Href('/'),
+                        session={}, perm=None, authname=None, tz=None)
+        self.context = web_context(self.req)
+        self.lexed = []
+        import trac.mimeview.pygments
+        self._get_lexer_by_name = trac.mimeview.pygments.get_lexer_by_name
+        def get_lexer_by_name(*args, **kwargs):
+            self.lexed.append(args[0])
+            return self._get_lexer_by_name(*args, **kwargs)
+        trac.mimeview.pygments.get_lexer_by_name = get_lexer_by_name
+
+    def tearDown(self):
+        import trac.mimeview.pygments
+        trac.mimeview.pygments.get_lexer_by_name = self._get_lexer_by_name
+        shutil.rmtree(self.env.path)
+
+    def _render(self, content):
+        return unicode(Mimeview(self.env).render(self.context,
+                                                 'text/x-python', content))
+
+    def _cached_files(self):
+        root = os.path.join(self.env.path, 'cache', 'pygments')
+        return sum((filenames for dirpath, dirnames, filenames
+                    in os.walk(root)), [])
+
+    def test_memory_cache(self):
+        result = self._render(self.content)
+        self.assertEqual(result, self._render(self.content))
+        self.assertEqual(['python'], self.lexed)
+        self.assertEqual(1, len(self._cached_files()))
+
+    def test_disk_cache(self):
+        result = self._render(self.content)
+        PygmentsRenderer(self.env)._cache.clear()
+        self.assertEqual(result, self._render(self.content))
+        self.assertEqual(['python'], self.lexed)
+
+    def test_different_content(self):
+        self._render(self.content)
+        self._render(self.content + u'hello()\n')
+        self.assertEqual(['python', 'python'], self.lexed)
+
+    def test_small_content_not_cached(self):
+        self._render(u'hello()\n')
+        self._render(u'hello()\n')
+        self.assertEqual(['python', 'python'], self.lexed)
+        self.assertEqual([], self._cached_files())
+
+    def test_cache_dir_size(self):
+        self.env.config.set('mimeviewer', 'pygments_cache_dir_size', 2)
+        for i in xrange(4):
+            self._render(self.content + u'# %d\n' % i)
+        self.assertEqual(2, len(self._cached_files()))
+
+    def test_cache_dir_trimmed_with_room(self):
+        self.env.config.set('mimeviewer', 'pygments_cache_dir_size', 10)
+        renderer = PygmentsRenderer(self.env)
+        trims = []
+        trim_cache_dir = renderer._trim_cache_dir
+        def count_trims(keep):
+            trims.append(keep)
+            return trim_cache_dir(keep)
+        renderer._trim_cache_dir = count_trims
+        for i in xrange(12):
+            self._render(self.content + u'# %d\n' % i)
+        self.assertEqual([9], trims)
+        self.assertEqual(10, len(self._cached_files()))
+
+    def test_cache_dir_disabled(self):
+        self.env.config.set('mimeviewer', 'pygments_cache_dir', '')
+        result = self._render(self.content)
+        self.assertEqual(result, self._render(self.content))
+        self.assertEqual(['python'], self.lexed)
+        self.assertFalse(os.path.exists(os.path.join(self.env.path,
+                                                     'cache')))
+
+
 def suite():
     suite = unittest.TestSuite()
     if have_pygments:
         suite.addTest(unittest.makeSuite(PygmentsRendererTestCase, 'test'))
+        suite.addTest(unittest.makeSuite(PygmentsCacheTestCase, 'test'))
     else:
         print 'SKIP: mimeview/tests/pygments (no pygments installed)'
     return suite
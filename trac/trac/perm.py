@@ -239,6 +239,21 @@ class DefaultPermissionStore(Component):
         # Invalidate cached property
         del self._all_permissions
 
+    def grant_permissions(self, permissions):
+        """Grants the permissions given as a list of `(username, action)`
+        tuples, with bulk inserts.
+
+        :since 1.0.2:
+        """
+        self.env.db_transaction.bulk_execute(
+            "INSERT INTO permission VALUES (%s, %s)", permissions)
+        for username, action in permissions:
+            self.log.info("Granted permission for %s to %s", action,
+                          username)
+
+        # Invalidate cached property
+        del self._all_permissions
+
     def revoke_permission(self, username, action):
         """Revokes a users' permission to perform the specified action."""
         self.env.db_transaction(
@@ -283,6 +298,14 @@ class DefaultPermissionPolicy(Component):
 
     def check_permission(self, action, username, resource, perm):
         # TODO: Precondition resource.neighborhood is None
+        return action in self.get_user_permissions(username) or None
+
+    def get_user_permissions(self, username):
+        """Return the permissions of the user as checked by the policy,
+        which are cached for `CACHE_EXPIRY` seconds.
+
+        :since 1.0.2:
+        """
         now = time()
 
         if now - self.last_reap > self.CACHE_REAP_TIME:
@@ -298,7 +321,7 @@ class DefaultPermissionPolicy(Component):
                           get_user_permissions(username)
             self.permission_cache[username] = (now, permissions)
 
-        return action in permissions or None
+        return permissions
 
 
 
@@ -346,6 +369,30 @@ class PermissionSystem(Component):
 
         self.store.grant_permission(username, action)
 
+    def grant_permissions(self, permissions):
+        """Grant the permissions given as a list of `(username, action)`
+        tuples, in a single transaction.
+
+        The permission store is used for bulk inserts when it provides a
+        `grant_permissions` method.
+
+        :since 1.0.2:
+        """
+        valid_actions = None
+        for username, action in permissions:
+            if action.isupper():
+                if valid_actions is None:
+                    valid_actions = set(self.get_actions())
+                if action not in valid_actions:
+                    raise TracError(_('%(name)s is not a valid action.',
+                                      name=action))
+        if hasattr(self.store, 'grant_permissions'):
+            self.store.grant_permissions(permissions)
+        else:
+            with self.env.db_transaction:
+                for username, action in permissions:
+                    self.store.grant_permission(username, action)
+
     def revoke_permission(self, username, action):
         """Revokes the permission of the specified user to perform an action."""
         self.store.revoke_permission(username, action)
@@ -730,6 +777,8 @@ class PermissionAdmin(Component):
 
     def _do_import(self, filename=None):
         permsys = PermissionSystem(self.env)
+        permissions = []
+        granted = set()
         try:
             with file_or_std(filename, 'rb') as f:
                 encoding = stream_encoding(f)
@@ -751,7 +800,9 @@ class PermissionAdmin(Component):
                               "names.", user=user, line=reader.line_num))
                     old_actions = self.get_user_perms(user)
                     for action in set(actions) - set(old_actions):
-                        permsys.grant_permission(user, action)
+                        if (user, action) not in granted:
+                            granted.add((user, action))
+                            permissions.append((user, action))
         except csv.Error, e:
             raise AdminCommandError(
                 _("Cannot import from %(filename)s line %(line)d: %(error)s ",
@@ -762,3 +813,4 @@ class PermissionAdmin(Component):
                 _("Cannot import from %(filename)s: %(error)s",
                   filename=path_to_unicode(filename or 'stdin'),
                   error=e.strerror))
+        permsys.grant_permissions(permissions)
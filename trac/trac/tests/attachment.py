@@ -1,17 +1,25 @@
 # -*- coding: utf-8 -*-
 
+from datetime import datetime
+from hashlib import sha256
 import os.path
 import shutil
 from StringIO import StringIO
+import sys
 import tempfile
 import unittest
+import zipfile
 
-from trac.attachment import Attachment, AttachmentModule
+from trac.attachment import Attachment, AttachmentAdmin, \
+                           AttachmentBlobStore, AttachmentModule
 from trac.core import Component, implements, TracError
 from trac.perm import IPermissionPolicy, PermissionCache
 from trac.resource import Resource, resource_exists
-from trac.test import EnvironmentStub
+from trac.test import EnvironmentStub, Mock
 from trac.tests.resource import TestResourceChangeListener
+from trac.util.datefmt import utc
+from trac.web.api import RequestDone
+from trac.web.href import Href
 
 
 hashes = {
@@ -40,6 +48,17 @@ class TicketOnlyViewsTicket(Component):
             return None
 
 
+class HiddenAttachments(Component):
+    implements(IPermissionPolicy)
+
+    hidden = ()
+
+    def check_permission(self, action, username, resource, perm):
+        if action == 'ATTACHMENT_VIEW' and resource and \
+                resource.realm == 'attachment' and resource.id in self.hidden:
+            return False
+
+
 class AttachmentTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -222,6 +241,243 @@ class AttachmentTestCase(unittest.TestCase):
         att.insert('file.txt', StringIO(''), 1)
         self.assertTrue(resource_exists(self.env, att.resource))
 
+    def test_download_as_zip(self):
+        parent = Resource('wiki', 'SomePage')
+        for filename, content in ((u'fïle.txt', 'Some text'),
+                                  ('empty.txt', '')):
+            attachment = Attachment(self.env, 'wiki', 'SomePage')
+            attachment.description = u'Désc'
+            attachment.insert(filename, StringIO(content), len(content))
+        missing = Attachment(self.env, 'wiki', 'SomePage')
+        missing.insert('missing.txt', StringIO('gone'), 4)
+        os.unlink(missing.path)
+        buf = StringIO()
+        headers = {}
+        req = Mock(send_response=lambda code: None,
+                   send_header=headers.__setitem__,
+                   end_headers=lambda streaming=False:
+                       headers.__setitem__('streaming', streaming),
+                   write=buf.write)
+        module = AttachmentModule(self.env)
+        self.assertRaises(RequestDone, module._download_as_zip, req, parent,
+                          list(Attachment.select(self.env, 'wiki',
+                                                 'SomePage')))
+        self.assertTrue(headers['streaming'])
+        self.assertFalse('Content-Length' in headers)
+        archive = zipfile.ZipFile(StringIO(buf.getvalue()))
+        self.assertEqual(None, archive.testzip())
+        self.assertEqual(['empty.txt', u'fïle.txt'],
+                         sorted(archive.namelist()))
+        self.assertEqual('Some text', archive.read(u'fïle.txt'))
+        self.assertEqual(u'Désc'.encode('utf-8'),
+                         archive.getinfo(u'fïle.txt').comment)
+
+    def _insert_attachments(self):
+        for filename, size, t in (('foo.txt', 30, 1), ('bar.jpg', 10, 3),
+                                  ('baz.txt', 20, 2), ('50%.txt', 0, 4)):
+            attachment = Attachment(self.env, 'ticket', 42)
+            attachment.insert(filename, StringIO(' ' * size), size,
+                              datetime(2013, 1, t, tzinfo=utc))
+
+    def _filenames(self, **kwargs):
+        return [attachment.filename for attachment
+                in Attachment.select_page(self.env, 'ticket', 42, **kwargs)]
+
+    def test_select_page_order(self):
+        self._insert_attachments()
+        self.assertEqual(['foo.txt', 'baz.txt', 'bar.jpg', '50%.txt'],
+                         self._filenames())
+        self.assertEqual(['50%.txt', 'bar.jpg', 'baz.txt', 'foo.txt'],
+                         self._filenames(order='name'))
+        self.assertEqual(['foo.txt', 'baz.txt', 'bar.jpg', '50%.txt'],
+                         self._filenames(order='size', desc=True))
+        self.assertRaises(ValueError, self._filenames, order='author')
+
+    def test_select_page_offset_limit(self):
+        self._insert_attachments()
+        self.assertEqual(['foo.txt', 'baz.txt'], self._filenames(limit=2))
+        self.assertEqual(['baz.txt', 'bar.jpg'],
+                         self._filenames(offset=1, limit=2))
+        self.assertEqual(['bar.jpg', '50%.txt'], self._filenames(offset=2))
+        self.assertEqual([], self._filenames(offset=4))
+
+    def test_select_page_filters(self):
+        self._insert_attachments()
+        self.assertEqual(['foo.txt', 'baz.txt', '50%.txt'],
+                         self._filenames(name='.txt'))
+        self.assertEqual(['50%.txt'], self._filenames(name='%'))
+        self.assertEqual(['baz.txt', 'bar.jpg'],
+                         self._filenames(min_size=10, max_size=20))
+        self.assertEqual(['baz.txt', 'bar.jpg'],
+                         self._filenames(start=datetime(2013, 1, 2,
+                                                        tzinfo=utc),
+                                         stop=datetime(2013, 1, 4,
+                                                       tzinfo=utc)))
+
+    def test_count(self):
+        self.assertEqual((0, 0), Attachment.count(self.env, 'ticket', 42))
+        self._insert_attachments()
+        self.assertEqual((4, 60), Attachment.count(self.env, 'ticket', 42))
+        self.assertEqual((2, 50), Attachment.count(self.env, 'ticket', 42,
+                                                   min_size=15))
+
+    def test_attachment_data_paged(self):
+        self._insert_attachments()
+        self.env.config.set('attachment', 'list_page_size', 3)
+        context = Mock(resource=Resource('ticket', 42), perm=self.perm,
+                       href=Href('/trac'))
+        module = AttachmentModule(self.env)
+        data = module.attachment_data(context)
+        self.assertEqual(['foo.txt', 'baz.txt', 'bar.jpg'],
+                         [a.filename for a in data['attachments']])
+        self.assertEqual(None, data['total'])
+        self.assertEqual(3, data['offset'])
+        self.assertEqual('/trac/zip-attachment/ticket/42/',
+                         data['download_href'])
+        data = module.attachment_data(context, limit=0)
+        self.assertEqual(4, len(data['attachments']))
+        self.assertEqual(4, data['total'])
+        self.assertEqual(None, data['offset'])
+        self.assertEqual(['bar.jpg', '50%.txt'],
+                         [a.filename for a in module.viewable_attachments(
+                             context, offset=2)])
+
+    def test_attachment_data_not_viewable(self):
+        attachment = Attachment(self.env, 'wiki', 'SomePage')
+        attachment.insert('foo.txt', StringIO(''), 0)
+        context = Mock(resource=Resource('wiki', 'SomePage'), perm=self.perm,
+                       href=Href('/trac'))
+        data = AttachmentModule(self.env).attachment_data(context)
+        self.assertEqual([], data['attachments'])
+        self.assertEqual(0, data['total'])
+
+    def _hide_attachments(self, *filenames):
+        self.env.config.set('trac', 'permission_policies',
+                            'HiddenAttachments, TicketOnlyViewsTicket, '
+                            'LegacyAttachmentPolicy')
+        HiddenAttachments(self.env).hidden = filenames
+        return PermissionCache(self.env)
+
+    def test_attachment_data_paged_not_viewable(self):
+        self._insert_attachments()
+        self.env.config.set('attachment', 'list_page_size', 2)
+        self.env.config.set('attachment', 'max_zip_size', 50)
+        context = Mock(resource=Resource('ticket', 42),
+                       perm=self._hide_attachments('baz.txt', 'bar.jpg'),
+                       href=Href('/trac'))
+        module = AttachmentModule(self.env)
+        data = module.attachment_data(context)
+        self.assertEqual(['foo.txt'],
+                         [a.filename for a in data['attachments']])
+        self.assertEqual(None, data['total'])
+        # The remaining attachments are loaded after the page of 2
+        self.assertEqual(2, data['offset'])
+        self.assertEqual(['50%.txt'],
+                         [a.filename for a in module.viewable_attachments(
+                             context, offset=data['offset'])])
+        # The size of the hidden attachments is not known to be viewable
+        self.assertEqual(None, data['download_href'])
+
+    def test_attachment_data_no_more_viewable(self):
+        self._insert_attachments()
+        self.env.config.set('attachment', 'list_page_size', 1)
+        self.env.config.set('attachment', 'max_zip_size', 50)
+        context = Mock(resource=Resource('ticket', 42),
+                       perm=self._hide_attachments('baz.txt', 'bar.jpg',
+                                                   '50%.txt'),
+                       href=Href('/trac'))
+        data = AttachmentModule(self.env).attachment_data(context)
+        self.assertEqual(['foo.txt'],
+                         [a.filename for a in data['attachments']])
+        self.assertEqual(1, data['total'])
+        self.assertEqual(None, data['offset'])
+        self.assertEqual('/trac/zip-attachment/ticket/42/',
+                         data['download_href'])
+
+
+class AttachmentBlobStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.path = tempfile.mkdtemp(prefix='trac-tempenv-')
+        self.env.config.set('attachment', 'content_store', 'enabled')
+        self.store = AttachmentBlobStore(self.env)
+
+    def tearDown(self):
+        shutil.rmtree(self.env.path)
+        self.env.reset_db()
+
+    def _insert(self, realm, id, filename, content):
+        attachment = Attachment(self.env, realm, id)
+        attachment.insert(filename, StringIO(content), len(content))
+        return attachment
+
+    def _blobs(self):
+        return sorted(self.env.db_query("""
+            SELECT hash, size, refcount FROM attachment_blob"""))
+
+    def test_insert_dedupe(self):
+        hash = sha256('content').hexdigest()
+        attachment1 = self._insert('wiki', 'SomePage', 'foo.txt', 'content')
+        attachment2 = self._insert('ticket', 42, 'bar.txt', 'content')
+        self.assertEqual(hash, attachment1.content_hash)
+        self.assertEqual(self.store.get_blob_path(hash), attachment1.path)
+        self.assertEqual(attachment1.path, attachment2.path)
+        self.assertFalse(os.path.exists(attachment1._resource_path))
+        self.assertEqual([(hash, 7, 2)], self._blobs())
+        with attachment2.open() as f:
+            self.assertEqual('content', f.read())
+
+    def test_insert_unique_filename(self):
+        self._insert('wiki', 'SomePage', 'foo.txt', 'content')
+        attachment = self._insert('wiki', 'SomePage', 'foo.txt', 'other')
+        self.assertEqual('foo.2.txt', attachment.filename)
+        self.assertEqual(2, len(self._blobs()))
+
+    def test_delete(self):
+        attachment1 = self._insert('wiki', 'SomePage', 'foo.txt', 'content')
+        attachment2 = self._insert('wiki', 'OtherPage', 'foo.txt', 'content')
+        path = attachment1.path
+        attachment1.delete()
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(1, self._blobs()[0][2])
+        attachment2.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual([], self._blobs())
+        self.assertEqual([], self.env.db_query("""
+            SELECT * FROM attachment_blob_ref"""))
+
+    def test_reparent(self):
+        attachment = self._insert('wiki', 'SomePage', 'foo.txt', 'content')
+        path = attachment.path
+        attachment.reparent('ticket', 123)
+        self.assertEqual(path, attachment.path)
+        self.assertEqual(path, Attachment(self.env, 'ticket', 123,
+                                          'foo.txt').path)
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(1, len(self.env.db_query("""
+            SELECT * FROM attachment_blob_ref""")))
+
+    def test_convert(self):
+        self.env.config.set('attachment', 'content_store', 'disabled')
+        attachment1 = self._insert('wiki', 'SomePage', 'foo.txt', 'content')
+        attachment2 = self._insert('ticket', 42, 'bar.txt', 'content')
+        attachment3 = self._insert('ticket', 42, 'baz.txt', 'other')
+        legacy_path = attachment1.path
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            AttachmentAdmin(self.env)._do_convert()
+        finally:
+            sys.stdout = stdout
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertEqual(attachment1.path, attachment2.path)
+        self.assertEqual([(sha256('content').hexdigest(), 7, 2),
+                          (sha256('other').hexdigest(), 5, 1)],
+                         sorted(self._blobs(), key=lambda row: -row[2]))
+        with attachment3.open() as f:
+            self.assertEqual('other', f.read())
+
 
 class AttachmentResourceChangeListenerTestCase(unittest.TestCase):
     DUMMY_PARENT_REALM = "wiki"
@@ -229,12 +485,14 @@ class AttachmentResourceChangeListenerTestCase(unittest.TestCase):
 
     def setUp(self):
         self.env = EnvironmentStub(default_data=True)
+        self.env.path = tempfile.mkdtemp(prefix='trac-tempenv-')
         self.listener = TestResourceChangeListener(self.env)
         self.listener.resource_type = Attachment
         self.listener.callback = self.listener_callback
 
     def tearDown(self):
         self.env.reset_db()
+        shutil.rmtree(self.env.path)
 
     def test_change_listener_created(self):
         attachment = self._create_attachment()
@@ -278,6 +536,7 @@ class AttachmentResourceChangeListenerTestCase(unittest.TestCase):
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(AttachmentTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(AttachmentBlobStoreTestCase, 'test'))
     suite.addTest(unittest.makeSuite(
         AttachmentResourceChangeListenerTestCase, 'test'))
     return suite
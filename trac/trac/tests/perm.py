@@ -132,6 +132,20 @@ class PermissionSystemTestCase(unittest.TestCase):
         for res in self.perm.get_all_permissions():
             self.failIf(res not in expected)
 
+    def test_grant_permissions(self):
+        permissions = [('bob', 'TEST_CREATE'), ('jane', 'TEST_DELETE'),
+                       ('jane', 'TEST_MODIFY'), ('jane', 'group1')]
+        self.perm.grant_permissions(permissions)
+        self.assertEqual(sorted(permissions),
+                         sorted(self.perm.get_all_permissions()))
+        self.assertEqual({'TEST_DELETE': True, 'TEST_MODIFY': True},
+                         self.perm.get_user_permissions('jane'))
+
+    def test_grant_permissions_invalid_action(self):
+        self.assertRaises(TracError, self.perm.grant_permissions,
+                          [('bob', 'TEST_CREATE'), ('bob', 'TEST_UNKNOWN')])
+        self.assertEqual([], self.perm.get_all_permissions())
+
     def test_expand_actions_iter_7467(self):
         # Check that expand_actions works with iterators (#7467)
         perms = set(['EMAIL_VIEW', 'TRAC_ADMIN', 'TEST_DELETE', 'TEST_MODIFY',
@@ -28,7 +28,7 @@ from trac.resource import IResourceManager, ResourceSystem
 from trac.util import Ranges, as_int
 from trac.util.text import shorten_line
 from trac.util.translation import _, N_, gettext
-from trac.wiki import IWikiSyntaxProvider, WikiParser
+from trac.wiki import IWikiSyntaxProvider, WikiParser, depends_on
 
 
 class ITicketActionController(Interface):
@@ -124,6 +124,26 @@ class ITicketChangeListener(Interface):
         """Called when a ticket is deleted."""
 
 
+class ITicketBatchChangeListener(Interface):
+    """Extension point interface for components that require notification
+    when a set of tickets has been modified at once (''since 1.0.2'').
+
+    Components implementing this interface are notified only once for all
+    the tickets saved by `save_ticket_changes`, and don't receive the
+    individual `ITicketChangeListener.ticket_changed` nor
+    `IResourceChangeListener.resource_changed` calls for those tickets.
+    """
+
+    def tickets_changed(changes, comment, author):
+        """Called when several tickets have been modified in the same
+        transaction.
+
+        `changes` is a list of `(ticket, old_values)` tuples, where
+        `old_values` is a dictionary containing the previous values of
+        the fields that have changed in `ticket`.
+        """
+
+
 class ITicketManipulator(Interface):
     """Miscellaneous manipulation of ticket workflow features."""
 
@@ -203,6 +223,7 @@ class TicketSystem(Component):
 
     ticket_field_providers = ExtensionPoint(ITicketFieldProvider)
     change_listeners = ExtensionPoint(ITicketChangeListener)
+    batch_change_listeners = ExtensionPoint(ITicketBatchChangeListener)
     milestone_change_listeners = ExtensionPoint(IMilestoneChangeListener)
 
     ticket_custom_section = ConfigSection('ticket-custom',
@@ -521,6 +542,7 @@ class TicketSystem(Component):
             r = Ranges(link)
             if len(r) == 1:
                 num = r.a
+                depends_on(formatter.context, 'tickets')
                 ticket = formatter.resource('ticket', num)
                 from trac.ticket.model import Ticket
                 if Ticket.id_is_valid(num) and \
@@ -575,6 +597,7 @@ class TicketSystem(Component):
                 title = _("Comment %(cnum)s for Ticket #%(id)s", cnum=cnum,
                           id=resource.id)
                 if 'TICKET_VIEW' in formatter.perm(resource):
+                    depends_on(formatter.context, 'tickets')
                     for status, in self.env.db_query(
                             "SELECT status FROM ticket WHERE id=%s", (id,)):
                         return tag.a(label, href=href, title=title,
@@ -21,7 +21,7 @@ from datetime import datetime
 from genshi.builder import tag
 
 from trac.core import *
-from trac.ticket import TicketSystem, Ticket
+from trac.ticket import TicketSystem, Ticket, save_ticket_changes
 from trac.ticket.notification import BatchTicketNotifyEmail
 from trac.util.datefmt import utc
 from trac.util.text import exception_to_unicode, to_unicode
@@ -144,6 +144,7 @@ class BatchModifyModule(Component):
         """Save all of the changes to tickets."""
         when = datetime.now(utc)
         list_fields = self._get_list_fields()
+        tickets = []
         with self.env.db_transaction as db:
             for id in selected_tickets:
                 t = Ticket(self.env, int(id))
@@ -164,7 +165,12 @@ class BatchModifyModule(Component):
                     _values.update(controller.get_ticket_changes(req, t,
                                                                  action))
                 t.populate(_values)
-                t.save_changes(req.authname, comment, when=when)
+                tickets.append((t, controllers))
+            # Write all the changes at once, the change listeners are
+            # notified in a single batch
+            save_ticket_changes(self.env, [t for t, c in tickets],
+                                req.authname, comment, when=when)
+            for t, controllers in tickets:
                 for controller in controllers:
                     controller.apply_action_side_effects(req, t, action)
         try:
@@ -415,6 +415,7 @@ Read TracWorkflow for more information (don't forget to 'wiki upgrade' as well)
 
 class WorkflowMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ()
     _description = cleandoc_(
     """Render a workflow graph.
 
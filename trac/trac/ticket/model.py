@@ -34,7 +34,15 @@ from trac.util.datefmt import from_utimestamp, to_utimestamp, utc, utcmax
 from trac.util.translation import _
 
 __all__ = ['Ticket', 'Type', 'Status', 'Resolution', 'Priority', 'Severity',
-           'Component', 'Milestone', 'Version', 'group_milestones']
+           'Component', 'Milestone', 'Version', 'group_milestones',
+           'save_ticket_changes']
+
+
+def _reset_report_cache(env):
+    """Discard the cached report results, for changes which bypass the
+    ticket and milestone change listeners."""
+    from trac.ticket.report import ReportModule
+    ReportModule(env).reset_report_cache()
 
 
 def _fixup_cc_list(cc_value):
@@ -254,11 +262,10 @@ class Ticket(object):
                 tkt_id = db.get_last_id(cursor, 'ticket')
 
             # Insert custom fields
-            if custom_fields:
-                db.executemany(
-                    """INSERT INTO ticket_custom (ticket, name, value)
-                       VALUES (%s, %s, %s)
-                    """, [(tkt_id, c, self[c]) for c in custom_fields])
+            db.bulk_execute("""INSERT INTO ticket_custom (ticket, name, value)
+                               VALUES (%s, %s, %s)
+                               """, [(tkt_id, c, self[c])
+                                     for c in custom_fields])
 
         self.id = tkt_id
         self.resource = self.resource(id=tkt_id)
@@ -282,6 +289,36 @@ class Ticket(object):
         :since 1.0: the `cnum` parameter is deprecated, and threading should
         be controlled with the `replyto` argument
         """
+        if not self._prepare_changes(comment):
+            return False # Not modified
+
+        if when is None:
+            when = datetime.now(utc)
+        when_ts = to_utimestamp(when)
+
+        with self.env.db_transaction as db:
+            # find cnum if it isn't provided
+            if not cnum:
+                cnum = self._next_cnum(db, replyto)
+            _write_ticket_changes(self.env, [(self, cnum)], author, comment,
+                                  when_ts)
+
+        old_values = self._old
+        self._old = {}
+        self.values['changetime'] = when
+
+        for listener in TicketSystem(self.env).change_listeners:
+            listener.ticket_changed(self, comment, author, old_values)
+        context = dict(comment=comment, author=author)
+        ResourceSystem(self.env).resource_changed(self, old_values, context)
+
+        return int(cnum.rsplit('.', 1)[-1])
+
+    def _prepare_changes(self, comment):
+        """Normalize the pending changes before they get saved.
+
+        Returns `False` if there's nothing to save, `True` otherwise.
+        """
         assert self.exists, "Cannot update a new ticket"
 
         if 'cc' in self.values:
@@ -290,11 +327,7 @@ class Ticket(object):
         props_unchanged = all(self.values.get(k) == v
                               for k, v in self._old.iteritems())
         if (not comment or not comment.strip()) and props_unchanged:
-            return False # Not modified
-
-        if when is None:
-            when = datetime.now(utc)
-        when_ts = to_utimestamp(when)
+            return False
 
         if 'component' in self.values:
             # If the component is changed on a 'new' ticket
@@ -314,72 +347,29 @@ class Ticket(object):
                     # If the old component has been removed from the database
                     # we just leave the owner as is.
                     pass
-
-        with self.env.db_transaction as db:
-            db("UPDATE ticket SET changetime=%s WHERE id=%s",
-               (when_ts, self.id))
-
-            # find cnum if it isn't provided
-            if not cnum:
-                num = 0
-                for ts, old in db("""
-                        SELECT DISTINCT tc1.time, COALESCE(tc2.oldvalue,'')
-                        FROM ticket_change AS tc1
-                        LEFT OUTER JOIN ticket_change AS tc2
-                        ON tc2.ticket=%s AND tc2.time=tc1.time
-                           AND tc2.field='comment'
-                        WHERE tc1.ticket=%s ORDER BY tc1.time DESC
-                        """, (self.id, self.id)):
-                    # Use oldvalue if available, else count edits
-                    try:
-                        num += int(old.rsplit('.', 1)[-1])
-                        break
-                    except ValueError:
-                        num += 1
-                cnum = str(num + 1)
-                if replyto:
-                    cnum = '%s.%s' % (replyto, cnum)
-
-            # store fields
-            for name in self._old.keys():
-                if name in self.custom_fields:
-                    for row in db("""SELECT * FROM ticket_custom
-                                     WHERE ticket=%s and name=%s
-                                     """, (self.id, name)):
-                        db("""UPDATE ticket_custom SET value=%s
-                              WHERE ticket=%s AND name=%s
-                              """, (self[name], self.id, name))
-                        break
-                    else:
-                        db("""INSERT INTO ticket_custom (ticket,name,value)
-                              VALUES(%s,%s,%s)
-                              """, (self.id, name, self[name]))
-                else:
-                    db("UPDATE ticket SET %s=%%s WHERE id=%%s"
-                       % name, (self[name], self.id))
-                db("""INSERT INTO ticket_change
-                        (ticket,time,author,field,oldvalue,newvalue)
-                      VALUES (%s, %s, %s, %s, %s, %s)
-                      """, (self.id, when_ts, author, name, self._old[name],
-                            self[name]))
-
-            # always save comment, even if empty
-            # (numbering support for timeline)
-            db("""INSERT INTO ticket_change
-                    (ticket,time,author,field,oldvalue,newvalue)
-                  VALUES (%s,%s,%s,'comment',%s,%s)
-                  """, (self.id, when_ts, author, cnum, comment))
-
-        old_values = self._old
-        self._old = {}
-        self.values['changetime'] = when
-
-        for listener in TicketSystem(self.env).change_listeners:
-            listener.ticket_changed(self, comment, author, old_values)
-        context = dict(comment=comment, author=author)
-        ResourceSystem(self.env).resource_changed(self, old_values, context)
-
-        return int(cnum.rsplit('.', 1)[-1])
+        return True
+
+    def _next_cnum(self, db, replyto=None):
+        """Compute the number of the next comment on this ticket."""
+        num = 0
+        for ts, old in db("""
+                SELECT DISTINCT tc1.time, COALESCE(tc2.oldvalue,'')
+                FROM ticket_change AS tc1
+                LEFT OUTER JOIN ticket_change AS tc2
+                ON tc2.ticket=%s AND tc2.time=tc1.time
+                   AND tc2.field='comment'
+                WHERE tc1.ticket=%s ORDER BY tc1.time DESC
+                """, (self.id, self.id)):
+            # Use oldvalue if available, else count edits
+            try:
+                num += int(old.rsplit('.', 1)[-1])
+                break
+            except ValueError:
+                num += 1
+        cnum = str(num + 1)
+        if replyto:
+            cnum = '%s.%s' % (replyto, cnum)
+        return cnum
 
     def get_changelog(self, when=None, db=None):
         """Return the changelog as a list of tuples of the form
@@ -521,6 +511,7 @@ class Ticket(object):
             # Update last changed time
             db("UPDATE ticket SET changetime=%s WHERE id=%s",
                (when_ts, self.id))
+            _reset_report_cache(self.env)
 
         self._fetch_ticket(self.id)
 
@@ -577,6 +568,7 @@ class Ticket(object):
             # Update last changed time
             db("UPDATE ticket SET changetime=%s WHERE id=%s",
                (when_ts, self.id))
+            _reset_report_cache(self.env)
 
         self.values['changetime'] = when
 
@@ -676,6 +668,97 @@ class Ticket(object):
             return (ts, author, comment)
 
 
+def save_ticket_changes(env, tickets, author=None, comment=None, when=None):
+    """Store the pending changes of several tickets in a single transaction.
+
+    All the `ticket`, `ticket_custom` and `ticket_change` rows are written
+    by bulk statements, as `Ticket.save_changes` does. Once the transaction
+    is committed, the components implementing `ITicketBatchChangeListener`
+    are notified once for all the changes, while the other change listeners
+    are notified for each ticket as `Ticket.save_changes` would do.
+
+    Returns the list of `(ticket, old_values)` tuples for the tickets that
+    were actually modified.
+
+    :since 1.0.2:
+    """
+    tickets = [t for t in tickets if t._prepare_changes(comment)]
+    if not tickets:
+        return []
+
+    if when is None:
+        when = datetime.now(utc)
+    when_ts = to_utimestamp(when)
+
+    with env.db_transaction as db:
+        _write_ticket_changes(env, [(t, t._next_cnum(db)) for t in tickets],
+                              author, comment, when_ts)
+
+    changes = []
+    for t in tickets:
+        changes.append((t, t._old))
+        t._old = {}
+        t.values['changetime'] = when
+
+    ts = TicketSystem(env)
+    batch_listeners = list(ts.batch_change_listeners)
+    for listener in batch_listeners:
+        listener.tickets_changed(changes, comment, author)
+    rs = ResourceSystem(env)
+    context = dict(comment=comment, author=author)
+    for t, old_values in changes:
+        for listener in ts.change_listeners:
+            if listener not in batch_listeners:
+                listener.ticket_changed(t, comment, author, old_values)
+        for listener in rs.change_listeners:
+            if listener not in batch_listeners and \
+                    listener.match_resource(t):
+                listener.resource_changed(t, old_values, context)
+    return changes
+
+
+def _write_ticket_changes(env, changes, author, comment, when_ts):
+    """Write the pending changes of the tickets of the `(ticket, cnum)`
+    tuples in `changes`, within the current transaction.
+
+    The tickets having the same modified fields are updated by the same
+    statement, and all the rows are written in chunks of
+    `[trac] bulk_chunk_size` tuples.
+    """
+    std_values = {}
+    custom_values = []
+    change_rows = []
+    for t, cnum in changes:
+        std_names = tuple(sorted(name for name in t._old
+                                 if name not in t.custom_fields))
+        std_values.setdefault(std_names, []).append(
+            [when_ts] + [t[name] for name in std_names] + [t.id])
+        for name in t._old:
+            if name in t.custom_fields:
+                custom_values.append((t.id, name, t[name]))
+            change_rows.append((t.id, when_ts, author, name, t._old[name],
+                                t[name]))
+        # always save comment, even if empty
+        # (numbering support for timeline)
+        change_rows.append((t.id, when_ts, author, 'comment', cnum, comment))
+
+    bulk_execute = env.db_transaction.bulk_execute
+    for std_names, args in std_values.iteritems():
+        bulk_execute("UPDATE ticket SET %s WHERE id=%%s"
+                     % ','.join('%s=%%s' % name for name
+                                in ('changetime',) + std_names), args)
+    if custom_values:
+        bulk_execute("DELETE FROM ticket_custom WHERE ticket=%s AND name=%s",
+                     [(id, name) for id, name, value in custom_values])
+        bulk_execute("""INSERT INTO ticket_custom (ticket,name,value)
+                        VALUES (%s,%s,%s)
+                        """, custom_values)
+    bulk_execute("""INSERT INTO ticket_change
+                      (ticket,time,author,field,oldvalue,newvalue)
+                    VALUES (%s,%s,%s,%s,%s,%s)
+                    """, change_rows)
+
+
 def simplify_whitespace(name):
     """Strip spaces and remove duplicate spaces within names"""
     if name:
@@ -729,6 +812,7 @@ class AbstractEnum(object):
                 except ValueError:
                     pass # Ignore cast error for this non-essential operation
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         ResourceSystem(self.env).resource_deleted(self)
         self.value = self._old_value = None
@@ -755,6 +839,7 @@ class AbstractEnum(object):
             db("INSERT INTO enum (type, name, value) VALUES (%s, %s, %s)",
                (self.type, self.name, self.value))
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         self._old_name = self.name
         self._old_value = self.value
@@ -781,6 +866,7 @@ class AbstractEnum(object):
                    % (self.ticket_col, self.ticket_col),
                    (self.name, self._old_name))
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         old_values = dict()
         if self.name != self._old_name:
@@ -871,6 +957,7 @@ class Component(object):
             self.env.log.info("Deleting component %s", self.name)
             db("DELETE FROM component WHERE name=%s", (self.name,))
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         ResourceSystem(self.env).resource_deleted(self)
         self.name = self._old_name = None
@@ -893,6 +980,7 @@ class Component(object):
                   """, (self.name, self.owner, self.description))
             self._old_name = self.name
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         ResourceSystem(self.env).resource_created(self)
 
@@ -920,6 +1008,7 @@ class Component(object):
                    (self.name, self._old_name))
                 self._old_name = self.name
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         #todo:add support of old_values for owner and description fields
         old_values = dict()
@@ -1191,6 +1280,7 @@ class Version(object):
             self.env.log.info("Deleting version %s", self.name)
             db("DELETE FROM version WHERE name=%s", (self.name,))
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         ResourceSystem(self.env).resource_deleted(self)
         self.name = self._old_name = None
@@ -1212,6 +1302,7 @@ class Version(object):
                 (self.name, to_utimestamp(self.time), self.description))
             self._old_name = self.name
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         ResourceSystem(self.env).resource_created(self)
 
@@ -1239,6 +1330,7 @@ class Version(object):
                    (self.name, self._old_name))
                 self._old_name = self.name
             TicketSystem(self.env).reset_ticket_fields()
+            _reset_report_cache(self.env)
 
         #todo: add support of old_values for time and description fields
         old_values = dict()
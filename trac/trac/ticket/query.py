@@ -28,7 +28,7 @@ from genshi.builder import tag
 
 from trac.config import Option, IntOption
 from trac.core import *
-from trac.db import get_column_names
+from trac.db import DatabaseManager, get_column_names
 from trac.mimeview.api import IContentConverter, Mimeview
 from trac.resource import Resource
 from trac.ticket.api import TicketSystem
@@ -140,6 +140,8 @@ class Query(object):
                 else:
                     clause.pop(k)
         self.constraint_cols = constraint_cols
+        # Only match the tickets changed after that time (since 1.0.2)
+        self.changed_since = None
 
     _clause_splitter = re.compile(r'(?<!\\)&')
     _item_splitter = re.compile(r'(?<!\\)\|')
@@ -285,6 +287,20 @@ class Query(object):
         self.env.log.debug("Count results in Query: %d", cnt)
         return cnt
 
+    def get_changetime(self, req=None, cached_ids=None, authname=None,
+                       tzinfo=None, locale=None):
+        """Return a `(count, changetime)` tuple giving the number of
+        matching tickets and the time of their most recent change, or
+        `None` if no ticket matches the query.
+
+        :since 1.0.2:
+        """
+        sql, args = self.get_sql(req, cached_ids, authname, tzinfo, locale)
+        for count, changetime in self.env.db_query(
+                "SELECT COUNT(*), MAX(changetime) FROM (%s) AS x" % sql,
+                args):
+            return count, from_utimestamp(changetime) if count else None
+
     def execute(self, req=None, db=None, cached_ids=None, authname=None,
                 tzinfo=None, href=None, locale=None):
         """Retrieve the list of matching tickets.
@@ -616,13 +632,23 @@ class Query(object):
         args = []
         errors = []
         clauses = filter(None, (get_clause_sql(c) for c in self.constraints))
+        since_sql = None
+        if self.changed_since is not None:
+            since_sql = "%s>%%s" % db.cast('t.changetime', 'int64')
+            args.insert(0, to_utimestamp(self.changed_since))
         if clauses:
             sql.append("\nWHERE ")
+            if since_sql:
+                sql.append(since_sql + " AND (")
             sql.append(" OR ".join('(%s)' % c for c in clauses))
             if cached_ids:
                 sql.append(" OR ")
                 sql.append("id in (%s)" %
                            (','.join([str(id) for id in cached_ids])))
+            if since_sql:
+                sql.append(")")
+        elif since_sql:
+            sql.append("\nWHERE " + since_sql)
 
         sql.append("\nORDER BY ")
         order_cols = [(self.order, self.desc)]
@@ -959,12 +985,14 @@ class QueryModule(Component):
                      query.get_href(req.href, format=conversion[0]),
                      conversion[1], conversion[4], conversion[0])
 
-        if format:
-            filename = 'query' if format != 'rss' else None
-            Mimeview(self.env).send_converted(req, 'trac.ticket.Query', query,
-                                              format, filename=filename)
+        with DatabaseManager(self.env).profiling('query'):
+            if format:
+                filename = 'query' if format != 'rss' else None
+                Mimeview(self.env).send_converted(req, 'trac.ticket.Query',
+                                                  query, format,
+                                                  filename=filename)
 
-        return self.display_html(req, query)
+            return self.display_html(req, query)
 
     # Internal methods
 
@@ -1166,6 +1194,15 @@ class QueryModule(Component):
         query_href = query.get_href(context.href)
         if 'description' not in query.rows:
             query.rows.append('description')
+        since = req.args.get('since')
+        if since:
+            query.changed_since = user_time(req, parse_date, since)
+        # Pollers get a "304 Not Modified" response until a matching ticket
+        # is changed, or a ticket stops matching the query
+        count, changetime = query.get_changetime(req)
+        req.check_modified(changetime or from_utimestamp(0),
+                           [query_href, query.page, since, count],
+                           last_modified=True)
         results = query.execute(req)
         data = {
             'context': context,
@@ -1202,6 +1239,7 @@ class QueryModule(Component):
 
 class TicketQueryMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ('tickets',)
     _description = cleandoc_(
     """Wiki macro listing tickets that match certain criteria.
 
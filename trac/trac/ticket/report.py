@@ -24,13 +24,16 @@ from StringIO import StringIO
 
 from genshi.builder import tag
 
-from trac.config import IntOption
+from trac.cache import cached
+from trac.config import IntOption, ListOption
 from trac.core import *
-from trac.db import get_column_names
+from trac.db import DatabaseManager, get_column_names
 from trac.perm import IPermissionRequestor
 from trac.resource import Resource, ResourceNotFound
-from trac.ticket.api import TicketSystem
-from trac.util import as_int, content_disposition
+from trac.ticket.api import IMilestoneChangeListener, \
+                           ITicketBatchChangeListener, \
+                           ITicketChangeListener, TicketSystem
+from trac.util import LRUCache, as_int, content_disposition
 from trac.util.datefmt import format_datetime, format_time, from_utimestamp
 from trac.util.presentation import Paginator
 from trac.util.text import exception_to_unicode, to_unicode, quote_query_string
@@ -110,7 +113,9 @@ def split_sql(sql, clause_re, skel=None):
 
 class ReportModule(Component):
 
-    implements(INavigationContributor, IPermissionRequestor, IRequestHandler,
+    implements(IMilestoneChangeListener, INavigationContributor,
+               IPermissionRequestor, IRequestHandler,
+               ITicketBatchChangeListener, ITicketChangeListener,
                IWikiSyntaxProvider)
 
     items_per_page = IntOption('report', 'items_per_page', 100,
@@ -121,6 +126,46 @@ class ReportModule(Component):
         """Number of tickets displayed in the rss feeds for reports
         (''since 0.11'')""")
 
+    cache_size = IntOption('report', 'cache_size', 100,
+        """Number of report results kept in memory. The cached results
+        are discarded whenever a ticket, a ticket comment, a milestone,
+        a component, a version or a ticket enum value (priority,
+        severity, ...) is changed. Set to 0 to disable the cache.
+        (''since 1.0.2'')""")
+
+    uncached_reports = ListOption('report', 'uncached_reports', '',
+        doc="""Comma-separated list of report numbers for which the
+        results are never cached, e.g. reports depending on the current
+        time or on data other than the ticket data listed above.
+        (''since 1.0.2'')""")
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        self.reset_report_cache()
+
+    def milestone_changed(self, milestone, old_values):
+        self.reset_report_cache()
+
+    def milestone_deleted(self, milestone):
+        self.reset_report_cache()
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self.reset_report_cache()
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.reset_report_cache()
+
+    def ticket_deleted(self, ticket):
+        self.reset_report_cache()
+
+    # ITicketBatchChangeListener methods
+
+    def tickets_changed(self, changes, comment, author):
+        self.reset_report_cache()
+
     # INavigationContributor methods
 
     def get_active_navigation_item(self, req):
@@ -671,6 +716,48 @@ class ReportModule(Component):
 
     def execute_paginated_report(self, req, db, id, sql, args,
                                  limit=0, offset=0):
+        key = None
+        if id != -1 and self.cache_size > 0 and \
+                str(id) not in self.uncached_reports:
+            # Only the arguments actually used by the report are part of
+            # the key, so e.g. $USER only matters if the report uses it
+            used_args = args.copy()
+            sub_sql, values, missing_args = self.sql_sub_vars(sql, used_args)
+            key = (id, sub_sql, tuple(values), req.args.get('sort', ''),
+                   req.args.get('asc', '1'), limit, offset)
+        res = self._report_cache.get(key) if key else None
+        if res is None:
+            with DatabaseManager(self.env).profiling('report:%s' % id):
+                res = self._execute_paginated_report(req, db, id, sql, args,
+                                                     limit, offset)
+            if key and len(res) != 2:
+                self._report_cache[key] = res
+        else:
+            self.log.debug("Report {%d} results retrieved from cache", id)
+            args.clear()
+            args.update(used_args)
+        if len(res) == 2:
+            return res
+        cols, rows, num_items, missing_args, limit_offset = res
+        return list(cols), list(rows), num_items, list(missing_args), \
+               limit_offset
+
+    def reset_report_cache(self):
+        """Discard the cached report results.
+
+        This increments the generation of the cached results, so they are
+        discarded by all the processes sharing the environment.
+
+        :since 1.0.2:
+        """
+        del self._report_cache
+
+    @cached
+    def _report_cache(self):
+        return LRUCache(self.cache_size)
+
+    def _execute_paginated_report(self, req, db, id, sql, args, limit,
+                                  offset):
         sql, args, missing_args = self.sql_sub_vars(sql, args, db)
         if not sql:
             raise TracError(_("Report {%(num)s} has no SQL query.", num=id))
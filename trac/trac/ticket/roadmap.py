@@ -33,19 +33,21 @@ from trac.search import ISearchSource, search_to_regexps, shorten_result
 from trac.util import as_bool
 from trac.util.datefmt import parse_date, utc, to_utimestamp, to_datetime, \
                               get_datetime_format_hint, format_date, \
-                              format_datetime, from_utimestamp, user_time
+                              format_datetime, from_utimestamp, \
+                              pretty_timedelta, user_time
 from trac.util.text import CRLF
 from trac.util.translation import _, tag_
 from trac.ticket.api import TicketSystem
 from trac.ticket.model import Milestone, MilestoneCache, Ticket, \
                               group_milestones
-from trac.timeline.api import ITimelineEventProvider
-from trac.web import IRequestHandler, RequestDone
+from trac.timeline.api import ITimelineEventProvider, \
+                             ITimelineEventValidator
+from trac.web import IRequestHandler, IRequestValidator, RequestDone
 from trac.web.chrome import (Chrome, INavigationContributor,
                              add_link, add_notice, add_script, add_stylesheet,
                              add_warning, auth_link, prevnext_nav, web_context)
 from trac.wiki.api import IWikiSyntaxProvider
-from trac.wiki.formatter import format_to
+from trac.wiki.formatter import depends_on, format_to, is_cacheable_wiki
 
 
 class ITicketGroupStatsProvider(Interface):
@@ -380,10 +382,18 @@ def grouped_stats_data(env, stats_provider, tickets, by, per_group_stats_data):
     return data
 
 
+def _milestone_times(milestone):
+    """Return the due and completion dates of `milestone` relative to
+    now, as shown on the roadmap and milestone pages."""
+    return [pretty_timedelta(date) if date else None
+            for date in (milestone.due, milestone.completed)]
+
+
 class RoadmapModule(Component):
     """Give an overview over all the milestones."""
 
-    implements(INavigationContributor, IPermissionRequestor, IRequestHandler)
+    implements(INavigationContributor, IPermissionRequestor, IRequestHandler,
+               IRequestValidator)
 
     stats_provider = ExtensionOption('roadmap', 'stats_provider',
                                      ITicketGroupStatsProvider,
@@ -461,6 +471,19 @@ class RoadmapModule(Component):
         add_stylesheet(req, 'common/css/roadmap.css')
         return 'roadmap.html', data, None
 
+    # IRequestValidator methods
+
+    def get_request_validator(self, req):
+        # The milestones and the tickets are validated by the generations
+        # of their caches, only the relative dates remain
+        if 'MILESTONE_VIEW' not in req.perm:
+            return None
+        milestones = Milestone.select(self.env, True)
+        if not all(is_cacheable_wiki(self.env, m.description)
+                   for m in milestones):
+            return None
+        return from_utimestamp(0), [_milestone_times(m) for m in milestones]
+
     # Internal methods
 
     def _render_ics(self, req, milestones):
@@ -584,8 +607,8 @@ class MilestoneModule(Component):
     """View and edit individual milestones."""
 
     implements(INavigationContributor, IPermissionRequestor, IRequestHandler,
-               ITimelineEventProvider, IWikiSyntaxProvider, IResourceManager,
-               ISearchSource)
+               ITimelineEventProvider, ITimelineEventValidator,
+               IWikiSyntaxProvider, IResourceManager, ISearchSource)
 
     stats_provider = ExtensionOption('milestone', 'stats_provider',
                                      ITicketGroupStatsProvider,
@@ -645,6 +668,19 @@ class MilestoneModule(Component):
             return format_to(self.env, None, context.child(resource=milestone),
                              description)
 
+    # ITimelineEventValidator methods
+
+    def get_timeline_validators(self, req, start, stop, filters):
+        if 'milestone' in filters:
+            milestones = sorted((completed, name, description)
+                                for name, due, completed, description
+                                in MilestoneCache(self.env).milestones
+                                                           .itervalues()
+                                if completed and start <= completed <= stop)
+            yield (milestones[-1][0] if milestones else None), milestones
+            yield AttachmentModule(self.env).get_timeline_validator(
+                Resource('milestone'), start, stop)
+
     # IRequestHandler methods
 
     def match_request(self, req):
@@ -690,6 +726,24 @@ class MilestoneModule(Component):
 
         return self._render_view(req, milestone)
 
+    # IRequestValidator methods
+
+    def get_request_validator(self, req):
+        if set(req.args) - set(['id', 'by']):
+            return None
+        try:
+            milestone = Milestone(self.env, req.args.get('id'))
+        except ResourceNotFound:
+            return None
+        if not milestone.name or \
+                'MILESTONE_VIEW' not in req.perm(milestone.resource) or \
+                not is_cacheable_wiki(self.env, milestone.description):
+            return None
+        return from_utimestamp(0), \
+               [milestone.name, _milestone_times(milestone)] + \
+               AttachmentModule(self.env) \
+               .attachment_validator(milestone.resource)
+
     # Internal methods
 
     def _do_delete(self, req, milestone):
@@ -908,6 +962,7 @@ class MilestoneModule(Component):
                                  query + fragment)
 
     def _render_link(self, context, name, label, extra=''):
+        depends_on(context, 'tickets')
         try:
             milestone = Milestone(self.env, name)
         except TracError:
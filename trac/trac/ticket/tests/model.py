@@ -12,10 +12,11 @@ from trac.attachment import Attachment
 from trac.core import TracError, implements
 from trac.resource import ResourceNotFound
 from trac.ticket.model import (
-    Ticket, Component, Milestone, Priority, Type, Version
+    Ticket, Component, Milestone, Priority, Type, Version, save_ticket_changes
 )
 from trac.ticket.api import (
-    IMilestoneChangeListener, ITicketChangeListener, TicketSystem
+    IMilestoneChangeListener, ITicketBatchChangeListener,
+    ITicketChangeListener, TicketSystem
 )
 from trac.test import EnvironmentStub
 from trac.tests.resource import TestResourceChangeListener
@@ -42,6 +43,15 @@ class TestTicketChangeListener(core.Component):
         self.ticket = ticket
 
 
+class TestTicketBatchChangeListener(core.Component):
+    implements(ITicketBatchChangeListener)
+
+    def tickets_changed(self, changes, comment, author):
+        self.changes = changes
+        self.comment = comment
+        self.author = author
+
+
 class TicketTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -412,6 +422,103 @@ class TicketTestCase(unittest.TestCase):
         self.assertEqual('deleted', listener.action)
         self.assertEqual(ticket, listener.ticket)
 
+    def test_save_ticket_changes(self):
+        id1 = self._insert_ticket('Test1', reporter='joe', component='foo')
+        id2 = self._insert_ticket('Test2', reporter='joe', foo='bar')
+        ticket1 = Ticket(self.env, id1)
+        ticket1.save_changes('jane', 'Comment 1')
+        ticket1['component'] = 'bar'
+        ticket1['foo'] = 'new'
+        ticket2 = Ticket(self.env, id2)
+        ticket2['component'] = 'bar'
+        ticket2['foo'] = 'baz'
+        ticket3 = Ticket(self.env, id2)  # unchanged, without comment
+        now = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+
+        changes = save_ticket_changes(self.env, [ticket1, ticket2],
+                                      'jim', 'Batch', now)
+        self.assertEqual([(ticket1, {'component': 'foo', 'foo': None}),
+                          (ticket2, {'component': '', 'foo': 'bar'})],
+                         changes)
+        self.assertEqual([], save_ticket_changes(self.env, [ticket3], 'jim'))
+
+        ticket1 = Ticket(self.env, id1)
+        self.assertEqual('bar', ticket1['component'])
+        self.assertEqual('new', ticket1['foo'])
+        self.assertEqual(now, ticket1.time_changed)
+        self.assertEqual([(now, 'jim', 'comment', '2', 'Batch', True),
+                          (now, 'jim', 'component', 'foo', 'bar', True),
+                          (now, 'jim', 'foo', '', 'new', True)],
+                         list(ticket1.get_changelog(now)))
+        ticket2 = Ticket(self.env, id2)
+        self.assertEqual('bar', ticket2['component'])
+        self.assertEqual('baz', ticket2['foo'])
+        self.assertEqual([(now, 'jim', 'comment', '1', 'Batch', True),
+                          (now, 'jim', 'component', '', 'bar', True),
+                          (now, 'jim', 'foo', 'bar', 'baz', True)],
+                         list(ticket2.get_changelog(now)))
+
+    def test_save_ticket_changes_chunked(self):
+        self.env.config.set('trac', 'bulk_chunk_size', 1)
+        tickets = [Ticket(self.env, self._insert_ticket('Test%d' % i,
+                                                        foo='bar'))
+                   for i in xrange(3)]
+        tickets[0]['component'] = 'bar'
+        tickets[1]['component'] = 'bar'
+        tickets[1]['foo'] = 'baz'
+        tickets[2]['foo'] = 'baz'
+        tickets[2]['cbon'] = '1'
+        save_ticket_changes(self.env, tickets, 'jim', 'Batch')
+
+        values = [(t['component'], t['foo'], t['cbon'])
+                  for t in (Ticket(self.env, t.id) for t in tickets)]
+        self.assertEqual([('bar', 'bar', None), ('bar', 'baz', None),
+                          ('', 'baz', '1')], values)
+        self.assertEqual(8, self.env.db_query("""
+            SELECT COUNT(*) FROM ticket_change WHERE author='jim'
+            """)[0][0])
+
+    def test_save_changes_custom_and_standard_fields(self):
+        tkt_id = self._insert_ticket('Test', reporter='joe', foo='bar')
+        ticket = Ticket(self.env, tkt_id)
+        ticket['component'] = 'bar'
+        ticket['foo'] = 'baz'
+        ticket['cbon'] = '1'
+        now = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        self.assertEqual(1, ticket.save_changes('jim', 'Comment', now))
+
+        self.assertEqual([('cbon', '1'), ('foo', 'baz')], self.env.db_query(
+            """SELECT name, value FROM ticket_custom WHERE ticket=%s
+               ORDER BY name""", (tkt_id,)))
+        self.assertEqual([('bar', to_utimestamp(now))], self.env.db_query(
+            "SELECT component, changetime FROM ticket WHERE id=%s",
+            (tkt_id,)))
+        self.assertEqual([(now, 'jim', 'cbon', '', '1', True),
+                          (now, 'jim', 'comment', '1', 'Comment', True),
+                          (now, 'jim', 'component', '', 'bar', True),
+                          (now, 'jim', 'foo', 'bar', 'baz', True)],
+                         list(Ticket(self.env, tkt_id).get_changelog(now)))
+
+    def test_batch_change_listener(self):
+        listener = TestTicketChangeListener(self.env)
+        batch_listener = TestTicketBatchChangeListener(self.env)
+        tickets = []
+        for summary in ('Test1', 'Test2'):
+            ticket = Ticket(self.env, self._insert_ticket(summary,
+                                                          component='foo'))
+            ticket['component'] = 'bar'
+            tickets.append(ticket)
+
+        save_ticket_changes(self.env, tickets, 'jim', 'Batch')
+        self.assertEqual([(tickets[0], {'component': 'foo'}),
+                          (tickets[1], {'component': 'foo'})],
+                         batch_listener.changes)
+        self.assertEqual('Batch', batch_listener.comment)
+        self.assertEqual('jim', batch_listener.author)
+        self.assertEqual('changed', listener.action)
+        self.assertEqual(tickets[1], listener.ticket)
+        self.assertEqual({'component': 'foo'}, listener.old_values)
+
 
 class TicketCommentTestCase(unittest.TestCase):
 
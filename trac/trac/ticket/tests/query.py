@@ -1,4 +1,7 @@
+from datetime import datetime
+
 from trac.test import Mock, EnvironmentStub, MockPerm, locale_en
+from trac.ticket.model import Ticket
 from trac.ticket.query import Query, QueryModule, TicketQueryMacro
 from trac.util.datefmt import utc
 from trac.web.chrome import web_context
@@ -492,6 +495,35 @@ ORDER BY COALESCE(t.id,0)=0,t.id""")
         self.assertEqual(['anonymous'], args)
         tickets = query.execute(self.req)
 
+    def test_changed_since(self):
+        query = Query.from_string(self.env, 'owner=$USER&order=id')
+        query.changed_since = datetime(2008, 8, 1, tzinfo=utc)
+        sql, args = query.get_sql(req=self.req)
+        self.assertEqualSQL(sql,
+"""SELECT t.id AS id,t.summary AS summary,t.owner AS owner,t.type AS type,t.status AS status,t.priority AS priority,t.milestone AS milestone,t.time AS time,t.changetime AS changetime,priority.value AS priority_value
+FROM ticket AS t
+  LEFT OUTER JOIN enum AS priority ON (priority.type='priority' AND priority.name=priority)
+WHERE %(cast_changetime)s>%%s AND (((COALESCE(t.owner,'')=%%s)))
+ORDER BY COALESCE(t.id,0)=0,t.id""" % {
+          'cast_changetime': self.env.get_read_db().cast('t.changetime',
+                                                         'int64')})
+        self.assertEqual([1217548800000000L, 'anonymous'], args)
+        tickets = query.execute(self.req)
+
+    def test_get_changetime(self):
+        query = Query.from_string(self.env, 'owner=joe&order=id')
+        self.assertEqual((0, None), query.get_changetime(self.req))
+        for owner, day in (('joe', 1), ('joe', 3), ('jim', 5)):
+            ticket = Ticket(self.env)
+            ticket['owner'] = owner
+            ticket.insert(datetime(2008, 8, day, tzinfo=utc))
+        self.assertEqual((2, datetime(2008, 8, 3, tzinfo=utc)),
+                         query.get_changetime(self.req))
+        query.changed_since = datetime(2008, 8, 3, tzinfo=utc)
+        self.assertEqual((0, None), query.get_changetime(self.req))
+        query.changed_since = datetime(2008, 8, 2, tzinfo=utc)
+        self.assertEqual(1, len(query.execute(self.req)))
+
     def test_csv_escape(self):
         query = Mock(get_columns=lambda: ['col1'],
                      execute=lambda r: [{'id': 1,
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
+from __future__ import with_statement
+
 import doctest
+from datetime import datetime
 
 from trac.db.mysql_backend import MySQLConnection
+from trac.ticket.model import Component, Priority, Ticket, Version
 from trac.ticket.report import ReportModule
 from trac.test import EnvironmentStub, Mock
+from trac.util.datefmt import utc
 from trac.web.api import Request, RequestDone
 import trac
 
@@ -99,6 +104,115 @@ class ReportTestCase(unittest.TestCase):
                          'type=r%C3%A9sum%C3%A9&report=' + str(id),
                          headers_sent['Location'])
 
+    def _execute_report(self, sql, id=1, **kwargs):
+        req = Mock(args={}, authname='joe')
+        args = self.report_module.get_var_args(req)
+        args.update(kwargs)
+        with self.env.db_query as db:
+            cols, rows, num_items, missing_args, limit_offset = \
+                self.report_module.execute_paginated_report(req, db, id, sql,
+                                                            args)
+        return rows
+
+    def _insert_ticket(self, summary):
+        ticket = Ticket(self.env)
+        ticket['reporter'] = 'joe'
+        ticket['summary'] = summary
+        ticket.insert()
+        return ticket
+
+    def test_report_cache(self):
+        sql = "SELECT summary FROM ticket ORDER BY id"
+        self._insert_ticket('Foo')
+        self.assertEqual([('Foo',)], self._execute_report(sql))
+        self.env.db_transaction("UPDATE ticket SET summary='Bar'")
+        self.assertEqual([('Foo',)], self._execute_report(sql))
+        self._insert_ticket('Baz')
+        self.assertEqual([('Bar',), ('Baz',)], self._execute_report(sql))
+
+    def test_report_cache_key_user(self):
+        ticket = self._insert_ticket('Foo')
+        sql = "SELECT summary FROM ticket WHERE reporter=$USER"
+        self.assertEqual([('Foo',)], self._execute_report(sql))
+        self.assertEqual([], self._execute_report(sql, USER='jim'))
+        self.assertEqual([('Foo',)], self._execute_report(sql, USER='joe'))
+
+    def test_report_cache_enum_changes(self):
+        sql = "SELECT priority FROM ticket"
+        priority = Priority(self.env)
+        priority.name = 'major'
+        priority.insert()
+        ticket = self._insert_ticket('Foo')
+        ticket['priority'] = 'major'
+        ticket.save_changes('joe')
+        self.assertEqual([('major',)], self._execute_report(sql))
+        priority.name = 'important'
+        priority.update()
+        self.assertEqual([('important',)], self._execute_report(sql))
+
+    def test_report_cache_enum_order(self):
+        sql = """SELECT p.value FROM ticket t
+                 LEFT JOIN enum p ON p.name=t.priority AND p.type='priority'
+                 """
+        for name in ('blocker', 'major'):
+            priority = Priority(self.env)
+            priority.name = name
+            priority.insert()
+        ticket = self._insert_ticket('Foo')
+        ticket['priority'] = 'major'
+        ticket.save_changes('joe')
+        self.assertEqual([('2',)], self._execute_report(sql))
+        Priority(self.env, 'blocker').delete()
+        self.assertEqual([('1',)], self._execute_report(sql))
+
+    def test_report_cache_component_version_changes(self):
+        sql = "SELECT component, version FROM ticket"
+        component = Component(self.env)
+        component.name = 'component1'
+        component.insert()
+        version = Version(self.env)
+        version.name = '1.0'
+        version.insert()
+        ticket = self._insert_ticket('Foo')
+        ticket['component'] = 'component1'
+        ticket['version'] = '1.0'
+        ticket.save_changes('joe')
+        self.assertEqual([('component1', '1.0')], self._execute_report(sql))
+        component.name = 'component3'
+        component.update()
+        self.assertEqual([('component3', '1.0')], self._execute_report(sql))
+        version.name = '1.0.1'
+        version.update()
+        self.assertEqual([('component3', '1.0.1')],
+                         self._execute_report(sql))
+
+    def test_report_cache_comment_changes(self):
+        sql = """SELECT newvalue FROM ticket_change
+                 WHERE field='comment' ORDER BY time"""
+        ticket = self._insert_ticket('Foo')
+        ticket.save_changes('joe', 'Comment 1', when=datetime(2001, 1, 1,
+                                                              tzinfo=utc))
+        ticket.save_changes('joe', 'Comment 2', when=datetime(2001, 1, 2,
+                                                              tzinfo=utc))
+        self.assertEqual([('Comment 1',), ('Comment 2',)],
+                         self._execute_report(sql))
+        ticket.modify_comment(datetime(2001, 1, 1, tzinfo=utc), 'joe',
+                              'Edited comment')
+        self.assertEqual([('Edited comment',), ('Comment 2',)],
+                         self._execute_report(sql))
+        ticket.delete_change(cdate=datetime(2001, 1, 2, tzinfo=utc))
+        self.assertEqual([('Edited comment',)], self._execute_report(sql))
+
+    def test_uncached_report(self):
+        self.env.config.set('report', 'uncached_reports', '2')
+        sql = "SELECT summary FROM ticket"
+        self._insert_ticket('Foo')
+        self.assertEqual([('Foo',)], self._execute_report(sql, id=1))
+        self.assertEqual([('Foo',)], self._execute_report(sql, id=2))
+        self.env.db_transaction("UPDATE ticket SET summary='Bar'")
+        self.assertEqual([('Foo',)], self._execute_report(sql, id=1))
+        self.assertEqual([('Bar',)], self._execute_report(sql, id=2))
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -0,0 +1,212 @@
+from datetime import datetime, timedelta
+import os.path
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+from trac.attachment import Attachment
+from trac.core import ComponentMeta
+from trac.test import EnvironmentStub, Mock, MockPerm
+from trac.ticket.model import Ticket
+from trac.ticket.web_ui import TicketModule
+from trac.util.datefmt import utc
+from trac.web.href import Href
+from trac.wiki.macros import WikiMacroBase
+
+
+class ChangelogCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.path = os.path.join(tempfile.gettempdir(), 'trac-tempenv')
+        os.mkdir(self.env.path)
+        self.module = TicketModule(self.env)
+        self.created = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        ticket = Ticket(self.env)
+        ticket['reporter'] = 'joe'
+        ticket['summary'] = 'Foo'
+        ticket.insert(self.created)
+        self.ticket = Ticket(self.env, ticket.id)
+
+    def tearDown(self):
+        shutil.rmtree(self.env.path)
+        self.env.reset_db()
+
+    def _save_changes(self, comment, when, **kwargs):
+        for name, value in kwargs.iteritems():
+            self.ticket[name] = value
+        self.ticket.save_changes('jim', comment, when)
+
+    def _changes(self):
+        return [(c['date'], c['cnum'], c['comment'], sorted(c['fields']))
+                for c in self.module.grouped_changelog_entries(self.ticket)]
+
+    def test_changes_appended(self):
+        t1 = self.created + timedelta(days=1)
+        t2 = self.created + timedelta(days=2)
+        self._save_changes('Comment 1', t1, component='foo')
+        self.assertEqual([(t1, 1, 'Comment 1', ['component'])],
+                         self._changes())
+        self._save_changes('Comment 2', t2, milestone='bar')
+        self.assertEqual([(t1, 1, 'Comment 1', ['component']),
+                          (t2, 2, 'Comment 2', ['milestone'])],
+                         self._changes())
+        key, entries = self.module._changelog_cache.get(self.ticket.id)
+        self.assertEqual(2, len(entries))
+
+    def test_entries_are_copied(self):
+        t1 = self.created + timedelta(days=1)
+        self._save_changes('Comment 1', t1, component='foo')
+        for change in self.module.grouped_changelog_entries(self.ticket):
+            change['fields']['component']['rendered'] = 'foo'
+            del change['fields']['component']
+        self.assertEqual([(t1, 1, 'Comment 1', ['component'])],
+                         self._changes())
+
+    def test_attachment_invalidates_cache(self):
+        self.assertEqual([], self._changes())
+        attachment = Attachment(self.env, 'ticket', self.ticket.id)
+        attachment.insert('foo.txt', StringIO(), 0,
+                          t=self.created + timedelta(days=1))
+        changes = list(self.module.grouped_changelog_entries(self.ticket))
+        self.assertEqual(1, len(changes))
+        self.assertEqual(['attachment'], changes[0]['fields'].keys())
+
+    def test_cache_disabled(self):
+        self.env.config.set('ticket', 'changelog_cache_size', 0)
+        self._save_changes('Comment 1', self.created + timedelta(days=1))
+        self.assertEqual(1, len(self._changes()))
+        self.assertEqual(None,
+                         self.module._changelog_cache.get(self.ticket.id))
+
+
+class ChangelogPagingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.config.set('ticket', 'changelog_page_size', 2)
+        self.module = TicketModule(self.env)
+        created = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        ticket = Ticket(self.env)
+        ticket['reporter'] = 'joe'
+        ticket['summary'] = 'Foo'
+        ticket.insert(created)
+        for i in xrange(5):
+            ticket.save_changes('jim', 'Comment %d' % (i + 1),
+                                created + timedelta(days=i + 1))
+        self.ticket = Ticket(self.env, ticket.id)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_ticket_data(self, **args):
+        req = Mock(method='GET', args=args, perm=MockPerm(),
+                   href=Href('/trac'), abs_href=Href('http://x/trac'),
+                   authname='joe', session={}, chrome={}, tz=utc,
+                   locale=None, lc_time=None)
+        data = {}
+        self.module._insert_ticket_data(req, self.ticket, data, 'joe', {})
+        return data, req.chrome['script_data']['changelog_pages']
+
+    def test_last_page_by_default(self):
+        data, pages = self._insert_ticket_data()
+        self.assertEqual([5], [c['cnum'] for c in data['changes']])
+        self.assertEqual([('/trac/ticket/1?cpage=1', 1, 2),
+                          ('/trac/ticket/1?cpage=2', 3, 4),
+                          ('/trac/ticket/1?cpage=3', 5, 5)], pages)
+
+    def test_page_of_replied_comment(self):
+        data, pages = self._insert_ticket_data(replyto='3')
+        self.assertEqual([3, 4], [c['cnum'] for c in data['changes']])
+        data, pages = self._insert_ticket_data(cnum_edit='1')
+        self.assertEqual([1, 2], [c['cnum'] for c in data['changes']])
+        data, pages = self._insert_ticket_data(replyto='1', cpage='2')
+        self.assertEqual([3, 4], [c['cnum'] for c in data['changes']])
+
+    def test_only_shown_changes_rendered(self):
+        rendered = []
+        def render_property_changes(req, ticket, fields, resource=None):
+            rendered.append(resource.version)
+        self.module._render_property_changes = render_property_changes
+        self._insert_ticket_data(cpage='2')
+        self.assertEqual([3, 4], rendered)
+
+
+class RequestValidatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._old_registry = ComponentMeta._registry
+        ComponentMeta._registry = dict((interface, list(components))
+                                       for interface, components
+                                       in self._old_registry.iteritems())
+        class UncachedMacro(WikiMacroBase):
+            def expand_macro(self, formatter, name, content):
+                return 'uncached'
+        self.env = EnvironmentStub(default_data=True)
+        self.module = TicketModule(self.env)
+        self.created = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        ticket = Ticket(self.env)
+        ticket['reporter'] = 'joe'
+        ticket['summary'] = 'Foo'
+        ticket.insert(self.created)
+        self.ticket = Ticket(self.env, ticket.id)
+
+    def tearDown(self):
+        ComponentMeta._registry = self._old_registry
+        self.env.reset_db()
+
+    def _get_validator(self, **args):
+        args.setdefault('id', str(self.ticket.id))
+        req = Mock(path_info='/ticket/%s' % args['id'], args=args,
+                   perm=MockPerm())
+        return self.module.get_request_validator(req)
+
+    def test_ticket_change(self):
+        validator = self._get_validator()
+        self.assertEqual(self.created, validator[0])
+        self.assertEqual(validator, self._get_validator())
+        when = self.created + timedelta(days=1)
+        self.ticket.save_changes('jim', 'Comment', when)
+        self.assertEqual(when, self._get_validator()[0])
+
+    def test_comment_edit(self):
+        self.ticket.save_changes('jim', 'Comment',
+                                 self.created + timedelta(days=1))
+        validator = self._get_validator()
+        self.ticket.modify_comment(self.ticket.get_change(1)['date'], 'jim',
+                                   'Edited comment')
+        self.assertNotEqual(validator, self._get_validator())
+
+    def test_uncached_macro(self):
+        self.ticket.save_changes('jim', 'See [[Uncached]]',
+                                 self.created + timedelta(days=1))
+        self.assertEqual(None, self._get_validator())
+
+    def test_texts_read_when_ticket_changed(self):
+        self.ticket.save_changes('jim', 'Comment',
+                                 self.created + timedelta(days=1))
+        validator = self._get_validator()
+        self.env.db_transaction("""
+            UPDATE ticket_change SET newvalue='See [[Uncached]]'
+            WHERE ticket=%s AND field='comment'
+            """, (self.ticket.id,))
+        self.assertEqual(validator, self._get_validator())
+        self.ticket.save_changes('jim', 'Other comment',
+                                 self.created + timedelta(days=2))
+        self.assertEqual(None, self._get_validator())
+
+    def test_not_validated(self):
+        self.assertEqual(None, self._get_validator(version='1'))
+        self.assertEqual(None, self._get_validator(id='42'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ChangelogCacheTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ChangelogPagingTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RequestValidatorTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
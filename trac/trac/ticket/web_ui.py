@@ -34,30 +34,44 @@ from trac.resource import (
     get_resource_shortname
 )
 from trac.search import ISearchSource, search_to_sql, shorten_result
-from trac.ticket.api import TicketSystem, ITicketManipulator
+from trac.ticket.api import (
+    TicketSystem, ITicketChangeListener, ITicketManipulator
+)
 from trac.ticket.model import Milestone, Ticket, group_milestones
 from trac.ticket.notification import TicketNotifyEmail
-from trac.timeline.api import ITimelineEventProvider
-from trac.util import as_bool, as_int, get_reporter_id
+from trac.timeline.api import ITimelineEventProvider, \
+                             ITimelineEventValidator
+from trac.util import LRUCache, as_bool, as_int, get_reporter_id
 from trac.util.datefmt import (
-    format_datetime, from_utimestamp, to_utimestamp, utc
+    format_datetime, from_utimestamp, pretty_timedelta, to_utimestamp, utc
 )
 from trac.util.text import (
     exception_to_unicode, empty, obfuscate_email_address, shorten_line,
     to_unicode
 )
-from trac.util.presentation import separated
+from trac.util.presentation import Paginator, separated
 from trac.util.translation import _, tag_, tagn_, N_, gettext, ngettext
 from trac.versioncontrol.diff import get_diff_options, diff_blocks
 from trac.web import (
-    IRequestHandler, RequestDone, arg_list_to_args, parse_arg_list
+    IRequestHandler, IRequestValidator, RequestDone, arg_list_to_args,
+    parse_arg_list
 )
 from trac.web.chrome import (
     Chrome, INavigationContributor, ITemplateProvider,
     add_ctxtnav, add_link, add_notice, add_script, add_script_data,
     add_stylesheet, add_warning, auth_link, prevnext_nav, web_context
 )
-from trac.wiki.formatter import format_to, format_to_html, format_to_oneliner
+from trac.wiki.formatter import format_to, format_to_html, \
+                                format_to_oneliner, is_cacheable_wiki
+
+
+def _copy_changelog_entry(change):
+    change = dict(change)
+    change['fields'] = dict((field, dict(values)) for field, values
+                            in change['fields'].iteritems())
+    change['comment_history'] = dict((rev, dict(values)) for rev, values
+                                     in change['comment_history'].iteritems())
+    return change
 
 
 class InvalidTicket(TracError):
@@ -68,7 +82,9 @@ class InvalidTicket(TracError):
 class TicketModule(Component):
 
     implements(IContentConverter, INavigationContributor, IRequestHandler,
-               ISearchSource, ITemplateProvider, ITimelineEventProvider)
+               IRequestValidator, ISearchSource, ITemplateProvider,
+               ITicketChangeListener, ITimelineEventProvider,
+               ITimelineEventValidator)
 
     ticket_manipulators = ExtensionPoint(ITicketManipulator)
 
@@ -106,8 +122,21 @@ class TicketModule(Component):
             [TracQuery#UsingTracLinks Trac links].
             (''since 0.12'')""")
 
+    changelog_cache_size = IntOption('ticket', 'changelog_cache_size', 100,
+        """Number of tickets for which the grouped change history, and the
+        data validating the ticket pages, are kept in memory. Set to 0 to
+        disable the cache. (''since 1.0.2'')""")
+
+    changelog_page_size = IntOption('ticket', 'changelog_page_size', 0,
+        """Maximum number of entries of the change history to show on a
+        ticket page, the most recent ones being shown first. Older entries
+        can be browsed page by page. Set to 0 to always show the whole
+        change history. (''since 1.0.2'')""")
+
     def __init__(self):
         self._warn_for_default_attr = set()
+        self._changelog_cache = LRUCache(self.changelog_cache_size)
+        self._validator_cache = LRUCache(self.changelog_cache_size)
 
     def __getattr__(self, name):
         """Delegate access to ticket default Options which were move to
@@ -179,6 +208,44 @@ class TicketModule(Component):
             return self._process_ticket_request(req)
         return self._process_newticket_request(req)
 
+    # IRequestValidator methods
+
+    def get_request_validator(self, req):
+        # Only the view of a ticket is validated, when none of the wiki
+        # texts it shows have macros depending on the time
+        if req.path_info == '/newticket' or set(req.args) != set(['id']):
+            return None
+        try:
+            id = int(req.args['id'])
+        except ValueError:
+            return None
+        for time, changetime, changes in self.env.db_query("""
+                SELECT t.time, t.changetime, COUNT(c.time)
+                FROM ticket AS t
+                LEFT OUTER JOIN ticket_change AS c ON (c.ticket=t.id)
+                WHERE t.id=%s GROUP BY t.time, t.changetime
+                """, (id,)):
+            break
+        else:
+            return None
+        resource = Resource('ticket', id)
+        if 'TICKET_VIEW' not in req.perm(resource):
+            return None
+        # The wiki texts and the change times are only read again when
+        # the ticket changed
+        key = (time, changetime, changes)
+        cached = self._validator_cache.get(id)
+        if cached is None or cached[0] != key:
+            cached = (key, self._get_validator_times(id))
+            self._validator_cache[id] = cached
+        times = cached[1]
+        if times is None:
+            return None
+        return from_utimestamp(changetime), \
+               [id, changes] + \
+               [pretty_timedelta(time) for time in times] + \
+               AttachmentModule(self.env).attachment_validator(resource)
+
     # ITemplateProvider methods
 
     def get_htdocs_dirs(self):
@@ -413,6 +480,26 @@ class TicketModule(Component):
                                     shorten_lines=flavor == 'oneliner')
             return descr + format_to(self.env, None, t_context, message)
 
+    # ITimelineEventValidator methods
+
+    def get_timeline_validators(self, req, start, stop, filters):
+        tables = []
+        if 'ticket' in filters or 'ticket_details' in filters:
+            tables.append('ticket_change')
+        if 'ticket' in filters:
+            tables.append('ticket')
+        with self.env.db_query as db:
+            for table in tables:
+                for ts, count in db("""
+                        SELECT MAX(time), COUNT(*) FROM %s
+                        WHERE time>=%%s AND time<=%%s
+                        """ % table, (to_utimestamp(start),
+                                      to_utimestamp(stop))):
+                    yield (from_utimestamp(ts) if count else None), count
+        if 'ticket_details' in filters:
+            yield AttachmentModule(self.env).get_timeline_validator(
+                Resource('ticket'), start, stop)
+
     def _render_batched_timeline_event(self, context, field, event):
         tickets, verb, info, summary, status, resolution, type, \
                 description, comment, cid = event[3]
@@ -1577,7 +1664,8 @@ class TicketModule(Component):
         skip = False
         start_time = data.get('start_time', ticket['changetime'])
         conflicts = set()
-        for change in self.rendered_changelog_entries(req, ticket):
+        # The changes are only rendered once the shown page is known
+        for change in self._viewable_changelog_entries(req, ticket):
             # change['permanent'] is false for attachment changes; true for
             # other changes.
             if change['permanent']:
@@ -1671,10 +1759,41 @@ class TicketModule(Component):
             if chrome.format_author(req, ticket[user]) == ticket[user]:
                 data['%s_link' % user] = self._query_link(req, user,
                                                           ticket[user])
+        changes_paginator = None
+        page_size = self.changelog_page_size
+        if page_size > 0 and len(changes) > page_size and \
+                ticket.resource.version is None:
+            num_pages = (len(changes) + page_size - 1) // page_size
+            page = as_int(req.args.get('cpage'), None, 1, num_pages) or \
+                   self._get_changelog_page(req, changes, page_size) or \
+                   num_pages
+            changes_paginator = Paginator(changes, page - 1, page_size)
+            changes_paginator.shown_pages = [
+                {'href': req.href.ticket(ticket.id, cpage=p)
+                         if p != page else None,
+                 'string': str(p),
+                 'title': _("Page %(num)d", num=p)}
+                for p in changes_paginator.get_shown_pages(21)]
+            # Links to the comments of the other pages lead to their page
+            changelog_pages = []
+            for p in xrange(num_pages):
+                cnums = [change['cnum'] for change
+                         in changes[p * page_size:(p + 1) * page_size]
+                         if 'cnum' in change]
+                if cnums:
+                    changelog_pages.append((req.href.ticket(ticket.id,
+                                                            cpage=p + 1),
+                                            cnums[0], cnums[-1]))
+            add_script_data(req, changelog_pages=changelog_pages)
+            changes = changes_paginator.items
+        for change in changes:
+            self._render_changelog_entry(req, ticket, change)
+
         data.update({
             'context': context, 'conflicts': conflicts,
             'fields': fields, 'fields_map': fields_map,
-            'changes': changes, 'replies': replies,
+            'changes': changes, 'changes_paginator': changes_paginator,
+            'replies': replies,
             'attachments': AttachmentModule(self.env).attachment_data(context),
             'action_controls': action_controls, 'action': selected_action,
             'change_preview': change_preview, 'closetime': closetime,
@@ -1684,11 +1803,31 @@ class TicketModule(Component):
         """Iterate on changelog entries, consolidating related changes
         in a `dict` object.
         """
+        for group in self._viewable_changelog_entries(req, ticket, when):
+            self._render_changelog_entry(req, ticket, group)
+            yield group
+
+    def _get_changelog_page(self, req, changes, page_size):
+        """Return the number of the page of `changes` containing the
+        comment being edited or replied to, if any."""
+        for arg in ('cnum_edit', 'cnum_hist', 'replyto'):
+            cnum = as_int(req.args.get(arg), None)
+            if cnum is not None:
+                for i, change in enumerate(changes):
+                    if change.get('cnum') == cnum:
+                        return i // page_size + 1
+
+    def _render_changelog_entry(self, req, ticket, group):
+        resource = ticket.resource(version=group.get('cnum'))
+        self._render_property_changes(req, ticket, group['fields'], resource)
+
+    def _viewable_changelog_entries(self, req, ticket, when=None):
+        """Iterate on the changelog entries the user is allowed to view,
+        without rendering them."""
         attachment_realm = ticket.resource.child('attachment')
         for group in self.grouped_changelog_entries(ticket, when=when):
             t = ticket.resource(version=group.get('cnum', None))
             if 'TICKET_VIEW' in req.perm(t):
-                self._render_property_changes(req, ticket, group['fields'], t)
                 if 'attachment' in group['fields']:
                     filename = group['fields']['attachment']['new']
                     attachment = attachment_realm(id=filename)
@@ -1771,9 +1910,55 @@ class TicketModule(Component):
         """Iterate on changelog entries, consolidating related changes
         in a `dict` object.
 
+        The whole change history of a ticket is cached in memory, see
+        the `[ticket] changelog_cache_size` option.
+
         :since 1.0: the `db` parameter is no longer needed and will be removed
         in version 1.1.1
         """
+        if when is not None or self.changelog_cache_size <= 0:
+            return self._group_changelog_entries(ticket, when)
+        key = self._changelog_key(ticket)
+        cached = self._changelog_cache.get(ticket.id)
+        if cached is None or cached[0] != key:
+            cached = (key, list(self._group_changelog_entries(ticket)))
+            self._changelog_cache[ticket.id] = cached
+        # Entries are modified when they get rendered
+        return (_copy_changelog_entry(change) for change in cached[1])
+
+    def _get_validator_times(self, id):
+        """Return the sorted times shown on the page of ticket `id`, or
+        `None` if a wiki text of the ticket isn't cacheable.
+        """
+        ticket = Ticket(self.env, id)
+        texts = [ticket[field['name']] for field in ticket.fields
+                 if field['type'] == 'textarea']
+        times = set([ticket['time'], ticket['changetime']])
+        for time, field, newvalue in self.env.db_query("""
+                SELECT time, field, newvalue FROM ticket_change
+                WHERE ticket=%s
+                """, (id,)):
+            if field == 'comment':
+                texts.append(newvalue)
+            times.add(from_utimestamp(time))
+        if not all(is_cacheable_wiki(self.env, text) for text in texts):
+            return None
+        return sorted(times)
+
+    def _changelog_key(self, ticket):
+        """Return the key identifying the current state of the change
+        history of `ticket`.
+
+        Attachments don't update the `changetime` of the ticket, so their
+        number and most recent time are part of the key.
+        """
+        for count, max_time in self.env.db_query("""
+                SELECT COUNT(*), MAX(time) FROM attachment
+                WHERE type='ticket' AND id=%s
+                """, (str(ticket.id),)):
+            return to_utimestamp(ticket.time_changed), count, max_time
+
+    def _group_changelog_entries(self, ticket, when=None):
         field_labels = TicketSystem(self.env).get_ticket_field_labels()
         changelog = ticket.get_changelog(when=when)
         autonum = 0 # used for "root" numbers
@@ -1821,3 +2006,35 @@ class TicketModule(Component):
             last_comment = comment_history[max(comment_history)]
             last_comment['comment'] = current['comment']
             yield current
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        pass
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        cached = self._changelog_cache.get(ticket.id)
+        if cached is None:
+            return
+        key, entries = cached
+        # Append the new entries only if the cached ones were up to date
+        # with the change right before this one
+        when = ticket.time_changed
+        when_ts = to_utimestamp(when)
+        for prev_ts, in self.env.db_query("""
+                SELECT MAX(time) FROM ticket_change
+                WHERE ticket=%s AND time<%s
+                """, (ticket.id, when_ts)):
+            if prev_ts is None:
+                prev_ts = to_utimestamp(ticket.time_created)
+            if key[0] == prev_ts:
+                entries = entries + \
+                          list(self._group_changelog_entries(ticket, when))
+                self._changelog_cache[ticket.id] = \
+                    ((when_ts,) + key[1:], entries)
+                return
+        self._changelog_cache.pop(ticket.id)
+
+    def ticket_deleted(self, ticket):
+        self._changelog_cache.pop(ticket.id)
+        self._validator_cache.pop(ticket.id)
@@ -71,3 +71,25 @@ class ITimelineEventProvider(Interface):
         """
 
 
+
+
+class ITimelineEventValidator(Interface):
+    """Extension point interface for timeline event providers which can
+    cheaply tell whether their events changed, without retrieving them.
+
+    The timeline feed answers a poller with a "304 Not Modified" response
+    before retrieving any event when all the providers of the requested
+    events implement this interface and their events didn't change.
+
+    :since 1.0.2:
+    """
+
+    def get_timeline_validators(req, start, stop, filters):
+        """Return an iterable of `(time, extra)` tuples, which change
+        whenever the events returned by `get_timeline_events` for the same
+        parameters change.
+
+        `time` is the time of the most recent event, or `None` if there's
+        no event, and `extra` is a value changing with the events
+        otherwise, e.g. their number.
+        """
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.core import Component, implements
+from trac.test import EnvironmentStub, Mock, MockPerm
+from trac.ticket.model import Ticket
+from trac.ticket.web_ui import TicketModule
+from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.web_ui import TimelineModule
+from trac.util.datefmt import utc
+from trac.web.api import RequestDone
+from trac.web.href import Href
+
+
+class UnvalidatedEventProvider(Component):
+    implements(ITimelineEventProvider)
+
+    def get_timeline_filters(self, req):
+        yield ('unvalidated', 'Unvalidated events')
+
+    def get_timeline_events(self, req, start, stop, filters):
+        self.env.unvalidated_events_retrieved = True
+        return []
+
+    def render_timeline_event(self, context, field, event):
+        pass
+
+
+class TimelineFeedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', TicketModule],
+                                   disable=[UnvalidatedEventProvider])
+        self.env.unvalidated_events_retrieved = False
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _validate_feed(self, **args):
+        validated = []
+        def check_modified(datetime, extra='', last_modified=False):
+            validated.append(extra)
+            raise RequestDone
+        args['format'] = 'rss'
+        req = Mock(args=args, session={}, perm=MockPerm(), tz=utc,
+                   locale=None, lc_time=None, href=Href('/trac'),
+                   authname='joe', check_modified=check_modified)
+        self.assertRaises(RequestDone,
+                          TimelineModule(self.env).process_request, req)
+        return validated[0]
+
+    def _insert_ticket(self):
+        ticket = Ticket(self.env)
+        ticket['reporter'] = 'joe'
+        ticket['summary'] = 'Summary'
+        ticket.insert()
+        return ticket
+
+    def test_validated_before_retrieving_events(self):
+        self._insert_ticket()
+        etag = self._validate_feed(ticket='on')
+        self.assertEqual(etag, self._validate_feed(ticket='on'))
+        self.assertFalse(self.env.unvalidated_events_retrieved)
+
+    def test_validator_changes_with_events(self):
+        ticket = self._insert_ticket()
+        etag = self._validate_feed(ticket='on', ticket_details='on')
+        ticket.save_changes('joe', 'Comment')
+        self.assertNotEqual(etag, self._validate_feed(ticket='on',
+                                                      ticket_details='on'))
+
+    def test_unvalidated_provider(self):
+        self.env.enable_component(UnvalidatedEventProvider)
+        self._validate_feed(ticket='on', unvalidated='on')
+        self.assertTrue(self.env.unvalidated_events_retrieved)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TimelineFeedTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
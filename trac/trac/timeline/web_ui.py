@@ -26,7 +26,8 @@ from genshi.builder import tag
 from trac.config import IntOption, BoolOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
-from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.api import ITimelineEventProvider, \
+                             ITimelineEventValidator
 from trac.util import as_int
 from trac.util.datefmt import format_date, format_datetime, format_time, \
                               parse_date, to_utimestamp, to_datetime, utc, \
@@ -48,6 +49,7 @@ class TimelineModule(Component):
                IRequestFilter, ITemplateProvider, IWikiSyntaxProvider)
 
     event_providers = ExtensionPoint(ITimelineEventProvider)
+    event_validators = ExtensionPoint(ITimelineEventValidator)
 
     default_daysback = IntOption('timeline', 'default_daysback', 30,
         """Default number of days displayed in the Timeline, in days.
@@ -151,8 +153,13 @@ class TimelineModule(Component):
                 'lastvisit': lastvisit}
 
         available_filters = []
+        provider_filters = []
         for event_provider in self.event_providers:
-            available_filters += event_provider.get_timeline_filters(req) or []
+            event_filters = list(event_provider.get_timeline_filters(req)
+                                 or [])
+            available_filters += event_filters
+            provider_filters.append((event_provider,
+                                     [f[0] for f in event_filters]))
 
         # check the request or session for enabled filters, or use default
         filters = [f[0] for f in available_filters if f[0] in req.args]
@@ -176,6 +183,14 @@ class TimelineModule(Component):
                                 timedelta(days=daysback + 1),
                             req.tz)
 
+        # Only retrieve the events which happened after the `since` time,
+        # e.g. the date of the most recent event previously retrieved
+        since = req.args.get('since')
+        if since:
+            since = user_time(req, parse_date, since) + \
+                    timedelta(microseconds=1)
+            start = max(start, since)
+
         # create author include and exclude sets
         include = set()
         exclude = set()
@@ -186,6 +201,19 @@ class TimelineModule(Component):
             else:
                 include.add(name)
 
+        # Pollers get a "304 Not Modified" response before any event is
+        # retrieved, if the providers can tell that their events didn't
+        # change
+        if format == 'rss':
+            validators = self._get_validators(req, start, stop, filters,
+                                              provider_filters)
+            if validators is not None:
+                times = [time for time, extra in validators if time]
+                req.check_modified(max(times) if times else start,
+                                   [filters, authors, start, maxrows] +
+                                   [extra for time, extra in validators],
+                                   last_modified=True)
+
         # gather all events for the given period of time
         events = []
         for provider in self.event_providers:
@@ -209,6 +237,11 @@ class TimelineModule(Component):
         data['events'] = events
 
         if format == 'rss':
+            if validators is None:
+                req.check_modified(events[0]['date'] if events else start,
+                                   [filters, authors, daysback, maxrows,
+                                    len(events)],
+                                   last_modified=True)
             data['email_map'] = Chrome(self.env).get_email_map()
             rss_context = web_context(req, absurls=True)
             rss_context.set_hints(wiki_flavor='html', shorten_lines=False)
@@ -347,6 +380,27 @@ class TimelineModule(Component):
 
     # Internal methods
 
+    def _get_validators(self, req, start, stop, filters, provider_filters):
+        """Return the `(time, extra)` validators of the events of the
+        enabled `filters`, or `None` if a provider of these events doesn't
+        implement `ITimelineEventValidator`.
+        """
+        validators = []
+        for provider, event_filters in provider_filters:
+            if not any(f in filters for f in event_filters):
+                continue
+            if provider not in self.event_validators:
+                return None
+            try:
+                validators.extend(provider.get_timeline_validators(
+                                  req, start, stop, filters) or [])
+            except Exception, e:
+                self.log.warning("Timeline event validator %s failed: %s",
+                                 provider.__class__.__name__,
+                                 exception_to_unicode(e))
+                return None
+        return validators
+
     def _event_data(self, provider, event):
         """Compose the timeline event date from the event tuple and prepared
         provider methods"""
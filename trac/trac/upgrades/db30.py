@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+from trac.db import Table, Column, Index, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the tables of the content-addressed attachment store."""
+    tables = [
+        Table('attachment_blob', key='hash')[
+            Column('hash'),
+            Column('size', type='int64'),
+            Column('refcount', type='int')],
+        Table('attachment_blob_ref', key='location')[
+            Column('location'),
+            Column('hash'),
+            Index(['hash'])],
+    ]
+    db_connector, _ = DatabaseManager(env).get_connector()
+    for table in tables:
+        for stmt in db_connector.to_sql(table):
+            cursor.execute(stmt)
@@ -28,12 +28,14 @@ from pkg_resources import find_distributions
 import random
 import re
 import shutil
+import struct
 import sys
 import tempfile
 import time
 from urllib import quote, unquote, urlencode
 
 from .compat import any, md5, sha1, sorted
+from .concurrency import threading
 from .text import exception_to_unicode, to_unicode, getpreferredencoding
 
 # -- req, session and web utils
@@ -398,6 +400,171 @@ class file_or_std(object):
             self.file.close()
 
 
+class ZipStreamWriter(object):
+    """Write a ZIP archive to a stream which is only written to, like
+    the body of a response.
+
+    Unlike with `zipfile.ZipFile`, each file is compressed and written
+    as soon as it is added, in blocks of `blocksize` bytes, so that the
+    memory used doesn't depend on the size of the archive. The sizes and
+    CRC of each file are written in a data descriptor following its
+    data. The "zip64" extensions are used for the files of `size`
+    larger than `zip64_limit`, or of unknown `size`, and for the central
+    directory when needed.
+
+    :since 1.0.2:
+    """
+
+    blocksize = 65536
+    zip64_limit = 0xffffffff
+
+    def __init__(self, write, compression=None):
+        """Create the archive.
+
+        :param write: function called with the successive parts of the
+                      archive
+        :param compression: `zipfile.ZIP_DEFLATED` (the default) or
+                            `zipfile.ZIP_STORED`
+        """
+        import zipfile
+        self._write = write
+        self.compression = zipfile.ZIP_DEFLATED if compression is None \
+                           else compression
+        self._offset = 0
+        self._entries = []
+
+    def add_file(self, filename, fileobj, date_time, size=None, comment=None,
+                 mode=0644):
+        """Add the content of the `fileobj` file-like object to the
+        archive.
+
+        :param filename: the name of the file in the archive, as an
+                         `unicode` or utf-8 encoded `str` string
+        :param date_time: the `(year, month, day, hour, minute, second)`
+                          tuple of the modification time
+        :param size: the expected size of the content, if known
+        :param comment: the comment of the file in the archive
+        :param mode: the permissions of the file
+        """
+        import zipfile
+        import zlib
+        zip64 = size is None or size + (size >> 7) >= self.zip64_limit
+        header = self._add_entry(filename, date_time, comment,
+                                 0100000 | mode, self.compression, zip64)
+        compressor = None
+        if self.compression == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                          zlib.DEFLATED, -15)
+        crc = usize = csize = 0
+        while True:
+            data = fileobj.read(self.blocksize)
+            if not data:
+                break
+            usize += len(data)
+            crc = zlib.crc32(data, crc)
+            if compressor:
+                data = compressor.compress(data)
+            csize += len(data)
+            self._emit(data)
+        if compressor:
+            data = compressor.flush()
+            csize += len(data)
+            self._emit(data)
+        crc &= 0xffffffff
+        if not zip64 and max(usize, csize) >= self.zip64_limit:
+            raise zipfile.LargeZipFile("File size larger than expected: %s"
+                                       % header['filename'])
+        fmt = '<4sLQQ' if zip64 else '<4sLLL'
+        self._emit(struct.pack(fmt, 'PK\x07\x08', crc, csize, usize))
+        header.update(crc=crc, csize=csize, usize=usize)
+
+    def add_dir(self, dirname, date_time, comment=None, mode=0755):
+        """Add a directory entry to the archive.
+
+        See `add_file` for the parameter descriptions.
+        """
+        import zipfile
+        if isinstance(dirname, unicode):
+            dirname = dirname.encode('utf-8')
+        if not dirname.endswith('/'):
+            dirname += '/'
+        header = self._add_entry(dirname, date_time, comment, 040000 | mode,
+                                 zipfile.ZIP_STORED, False)
+        self._emit(struct.pack('<4sLLL', 'PK\x07\x08', 0, 0, 0))
+        header.update(crc=0, csize=0, usize=0)
+
+    def close(self):
+        """Write the central directory of the archive."""
+        start = self._offset
+        for entry in self._entries:
+            extra = []
+            csize, usize, offset = entry['csize'], entry['usize'], \
+                                   entry['offset']
+            if entry['zip64']:
+                extra += [usize, csize]
+                csize = usize = 0xffffffff
+            if offset >= self.zip64_limit:
+                extra.append(offset)
+                offset = 0xffffffff
+            extra = struct.pack('<HH%dQ' % len(extra), 1, 8 * len(extra),
+                                *extra) if extra else ''
+            version = 45 if extra else 20
+            self._emit(struct.pack('<4sBBHHHHHLLLHHHHHLL', 'PK\x01\x02',
+                                   version, 3, version, entry['flags'],
+                                   entry['compression'], entry['time'],
+                                   entry['date'], entry['crc'], csize, usize,
+                                   len(entry['filename']), len(extra),
+                                   len(entry['comment']), 0, 0,
+                                   entry['attr'] << 16, offset))
+            self._emit(entry['filename'])
+            self._emit(extra)
+            self._emit(entry['comment'])
+        count = len(self._entries)
+        size = self._offset - start
+        if count >= 0xffff or max(size, start) >= self.zip64_limit:
+            end64 = self._offset
+            self._emit(struct.pack('<4sQHHLLQQQQ', 'PK\x06\x06', 44, 45, 45,
+                                   0, 0, count, count, size, start))
+            self._emit(struct.pack('<4sLQL', 'PK\x06\x07', 0, end64, 1))
+            count = min(count, 0xffff)
+            size = min(size, 0xffffffff)
+            start = min(start, 0xffffffff)
+        self._emit(struct.pack('<4sHHHHLLH', 'PK\x05\x06', 0, 0, count,
+                               count, size, start, 0))
+        self._entries = []
+
+    def _add_entry(self, filename, date_time, comment, attr, compression,
+                   zip64):
+        if isinstance(filename, unicode):
+            filename = filename.encode('utf-8')
+        if isinstance(comment, unicode):
+            comment = comment.encode('utf-8')
+        year, month, day, hour, minute, second = date_time[:6]
+        if year < 1980:
+            year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+        # data descriptor, utf-8 filename
+        flags = 0x08 | 0x800
+        entry = {'filename': filename, 'comment': comment or '',
+                 'attr': attr, 'compression': compression, 'flags': flags,
+                 'date': (year - 1980) << 9 | month << 5 | day,
+                 'time': hour << 11 | minute << 5 | second // 2,
+                 'offset': self._offset, 'zip64': zip64}
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else ''
+        self._emit(struct.pack('<4sHHHHHLLLHH', 'PK\x03\x04',
+                               45 if zip64 else 20, flags, compression,
+                               entry['time'], entry['date'], 0, 0, 0,
+                               len(filename), len(extra)))
+        self._emit(filename)
+        self._emit(extra)
+        self._entries.append(entry)
+        return entry
+
+    def _emit(self, data):
+        if data:
+            self._write(data)
+            self._offset += len(data)
+
+
 # -- sys utils
 
 def fq_class_name(obj):
@@ -996,6 +1163,57 @@ class lazy(object):
         return result
 
 
+class LRUCache(object):
+    """A thread-safe mapping retaining at most `size` items, discarding
+    the least recently used ones first.
+
+    :since 1.0.2:
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._items = {}
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            self._tick += 1
+            item[0] = self._tick
+            return item[1]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._tick += 1
+            self._items[key] = [self._tick, value]
+            if len(self._items) > self.size:
+                # Discard a quarter of the items at once, so that the cost
+                # of sorting is spread over the following insertions
+                keep = self.size - self.size // 4
+                items = sorted(self._items.iteritems(),
+                               key=lambda item: item[1][0])
+                for key, item in items[:len(items) - keep]:
+                    del self._items[key]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
 # -- algorithmic utilities
 
 DIGITS = re.compile(r'(\d+)')
@@ -19,6 +19,8 @@ import random
 import re
 import tempfile
 import unittest
+import zipfile
+from StringIO import StringIO
 
 from trac import util
 from trac.util.tests import concurrency, datefmt, presentation, text, html
@@ -168,6 +170,108 @@ class SafeReprTestCase(unittest.TestCase):
                          "type(s) for +: 'int' and 'str')>", sr)
 
 
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = util.LRUCache(4)
+        cache['a'] = 1
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(2, cache.get('b', 2))
+        self.assertEqual(1, cache.pop('a'))
+        self.assertFalse('a' in cache)
+
+    def test_discard_least_recently_used(self):
+        cache = util.LRUCache(4)
+        for i in xrange(4):
+            cache[i] = str(i)
+        cache.get(0)
+        cache[4] = '4'
+        self.assertEqual(3, len(cache))
+        self.assertEqual([0, 3, 4], sorted(k for k in xrange(5) if k in cache))
+
+
+class ZipStreamWriterTestCase(unittest.TestCase):
+
+    date_time = (2013, 3, 20, 12, 34, 56)
+
+    def _write(self, files, zip64_limit=None):
+        parts = []
+        writer = util.ZipStreamWriter(parts.append)
+        if zip64_limit is not None:
+            writer.zip64_limit = zip64_limit
+        for name, content in files:
+            if content is None:
+                writer.add_dir(name, self.date_time)
+            else:
+                writer.add_file(name, StringIO(content), self.date_time,
+                                size=len(content), comment=u'Cömment')
+        writer.close()
+        return parts
+
+    def _open(self, parts):
+        archive = zipfile.ZipFile(StringIO(''.join(parts)))
+        self.assertEqual(None, archive.testzip())
+        return archive
+
+    def test_read_with_zipfile(self):
+        content = ''.join(chr(random.randint(0, 63)) for i in xrange(100000))
+        archive = self._open(self._write([(u'dir', None),
+                                          (u'dir/fïle.txt', content),
+                                          ('empty', '')]))
+        self.assertEqual(['dir/', u'dir/fïle.txt', 'empty'],
+                         archive.namelist())
+        self.assertEqual(content, archive.read(u'dir/fïle.txt'))
+        self.assertEqual('', archive.read('empty'))
+        info = archive.getinfo(u'dir/fïle.txt')
+        self.assertEqual(self.date_time, info.date_time)
+        self.assertEqual(u'Cömment'.encode('utf-8'), info.comment)
+        self.assertEqual(0100644, info.external_attr >> 16)
+        self.assertEqual(040755, archive.getinfo('dir/').external_attr >> 16)
+
+    def test_stored(self):
+        parts = []
+        writer = util.ZipStreamWriter(parts.append, zipfile.ZIP_STORED)
+        writer.add_file('file.txt', StringIO('content'), self.date_time)
+        writer.close()
+        self.assertTrue('content' in ''.join(parts))
+        self.assertEqual('content', self._open(parts).read('file.txt'))
+
+    def test_zip64(self):
+        archive = self._open(self._write([('a', 'a' * 1000),
+                                          ('b', 'b' * 1000)],
+                                         zip64_limit=100))
+        self.assertEqual('a' * 1000, archive.read('a'))
+        self.assertEqual('b' * 1000, archive.read('b'))
+
+    def test_unexpected_size(self):
+        writer = util.ZipStreamWriter(lambda data: None)
+        writer.zip64_limit = 100
+        self.assertRaises(zipfile.LargeZipFile, writer.add_file, 'a',
+                          StringIO(os.urandom(200)), self.date_time, size=10)
+
+    def test_bounded_memory(self):
+        class Content(object):
+            """Generate 16MB of content without keeping it in memory."""
+            remaining = 16 * 1024 * 1024
+            max_read = 0
+            def read(self, size):
+                self.max_read = max(self.max_read, size)
+                size = min(size, self.remaining)
+                self.remaining -= size
+                return os.urandom(size)
+        written = []
+        def write(data):
+            written.append(len(data))
+        content = Content()
+        writer = util.ZipStreamWriter(write)
+        writer.add_file('large', content, self.date_time)
+        writer.close()
+        self.assertEqual(0, content.remaining)
+        self.assertTrue(content.max_read <= writer.blocksize)
+        self.assertTrue(max(written) <= 2 * writer.blocksize)
+        self.assertTrue(sum(written) > 16 * 1024 * 1024)
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -176,6 +280,8 @@ def suite():
     suite.addTest(unittest.makeSuite(RandomTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ContentDispositionTestCase, 'test'))
     suite.addTest(unittest.makeSuite(SafeReprTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(LRUCacheTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ZipStreamWriterTestCase, 'test'))
     suite.addTest(concurrency.suite())
     suite.addTest(datefmt.suite())
     suite.addTest(presentation.suite())
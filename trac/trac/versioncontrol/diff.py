@@ -14,15 +14,137 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+from bisect import bisect_left
 import difflib
+from hashlib import sha1
 import re
 
 from genshi import Markup, escape
 
+from trac.util import LRUCache
 from trac.util.text import expandtabs
 
-__all__ = ['diff_blocks', 'get_change_extent', 'get_diff_options',
-           'unified_diff']
+__all__ = ['PatienceMatcher', 'diff_blocks', 'get_change_extent',
+           'get_diff_options', 'unified_diff']
+
+
+class PatienceMatcher(difflib.SequenceMatcher):
+    """A `difflib.SequenceMatcher` for lists of lines, which stays fast
+    on large lists.
+
+    Small lists are compared by `difflib.SequenceMatcher`. For larger
+    ones, the lines are replaced by integers, the common leading and
+    trailing lines are matched, then the lines occurring once in both
+    lists are used as anchors (as in the "patience diff" algorithm) and
+    only the lines between anchors are compared by
+    `difflib.SequenceMatcher`. When there are more than `max_cost` pairs
+    of lines to compare between two anchors, they are reported as
+    changed without being compared.
+
+    :since 1.0.2:
+    """
+
+    #: Lists with less pairs of lines are compared by `SequenceMatcher`
+    min_cost = 250000
+
+    #: Lists of lines with more pairs of lines are not compared
+    max_cost = 100000000
+
+    def __init__(self, a, b):
+        self.isjunk = None
+        self.a = a
+        self.b = b
+        self.matching_blocks = self.opcodes = None
+        self.fullbcount = None
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is not None:
+            return self.matching_blocks
+        a, b = self.a, self.b
+        if len(a) * len(b) <= self.min_cost:
+            matcher = difflib.SequenceMatcher(None, a, b)
+            self.matching_blocks = matcher.get_matching_blocks()
+            return self.matching_blocks
+        ids = {}
+        a = [ids.setdefault(line, len(ids)) for line in a]
+        b = [ids.setdefault(line, len(ids)) for line in b]
+        blocks = []
+        self._match(a, 0, len(a), b, 0, len(b), blocks)
+        self.matching_blocks = matching_blocks = []
+        for i, j, n in blocks:
+            if matching_blocks:
+                i1, j1, n1 = matching_blocks[-1]
+                if i1 + n1 == i and j1 + n1 == j:
+                    matching_blocks[-1] = (i1, j1, n1 + n)
+                    continue
+            matching_blocks.append((i, j, n))
+        matching_blocks.append((len(a), len(b), 0))
+        return matching_blocks
+
+    def _match(self, a, alo, ahi, b, blo, bhi, blocks):
+        # Common leading lines
+        i, j = alo, blo
+        while i < ahi and j < bhi and a[i] == b[j]:
+            i += 1
+            j += 1
+        if i > alo:
+            blocks.append((alo, blo, i - alo))
+        alo, blo = i, j
+        # Common trailing lines
+        n = 0
+        while alo < ahi - n and blo < bhi - n and \
+                a[ahi - n - 1] == b[bhi - n - 1]:
+            n += 1
+        ahi -= n
+        bhi -= n
+        if alo < ahi and blo < bhi:
+            anchors = self._get_anchors(a, alo, ahi, b, blo, bhi)
+            if anchors:
+                for i, j in anchors:
+                    self._match(a, alo, i, b, blo, j, blocks)
+                    blocks.append((i, j, 1))
+                    alo, blo = i + 1, j + 1
+                self._match(a, alo, ahi, b, blo, bhi, blocks)
+            elif (ahi - alo) * (bhi - blo) <= self.max_cost:
+                matcher = difflib.SequenceMatcher(None, a[alo:ahi],
+                                                  b[blo:bhi])
+                for i, j, size in matcher.get_matching_blocks():
+                    if size:
+                        blocks.append((alo + i, blo + j, size))
+        if n:
+            blocks.append((ahi, bhi, n))
+
+    def _get_anchors(self, a, alo, ahi, b, blo, bhi):
+        """Return the longest increasing sequence of `(i, j)` positions
+        of the lines occurring once in both ranges."""
+        apos = {}
+        for i in xrange(alo, ahi):
+            apos[a[i]] = i if a[i] not in apos else None
+        bpos = {}
+        for j in xrange(blo, bhi):
+            line = b[j]
+            if apos.get(line) is not None:
+                bpos[line] = j if line not in bpos else None
+        pairs = sorted((apos[line], j) for line, j in bpos.iteritems()
+                       if j is not None)
+        # Patience sorting of the positions in `b`
+        tails, tails_j, prev = [], [], []
+        for k, (i, j) in enumerate(pairs):
+            pos = bisect_left(tails_j, j)
+            prev.append(tails[pos - 1] if pos else None)
+            if pos == len(tails):
+                tails.append(k)
+                tails_j.append(j)
+            else:
+                tails[pos] = k
+                tails_j[pos] = j
+        anchors = []
+        k = tails[-1] if tails else None
+        while k is not None:
+            anchors.append(pairs[k])
+            k = prev[k]
+        anchors.reverse()
+        return anchors
 
 
 def get_change_extent(str1, str2):
@@ -78,7 +200,7 @@ def get_hunks(fromlines, tolines, context=None):
 
     See `get_filtered_hunks` for the parameter descriptions.
     """
-    matcher = difflib.SequenceMatcher(None, fromlines, tolines)
+    matcher = PatienceMatcher(fromlines, tolines)
     if context is None:
         return (hunk for hunk in [matcher.get_opcodes()])
     else:
@@ -180,6 +302,8 @@ def hdf_diff(*args, **kwargs):
     """:deprecated: use `diff_blocks` (will be removed in 1.1.1)"""
     return diff_blocks(*args, **kwargs)
 
+_diff_blocks_cache = LRUCache(32)
+
 def diff_blocks(fromlines, tolines, context=None, tabwidth=8,
                 ignore_blank_lines=0, ignore_case=0, ignore_space_changes=0):
     """Return an array that is adequate for adding to the data dictionary
@@ -187,7 +311,30 @@ def diff_blocks(fromlines, tolines, context=None, tabwidth=8,
     See `get_filtered_hunks` for the parameter descriptions.
 
     See also the diff_div.html template.
+
+    The results are cached by content and parameters, and must not be
+    modified.
     """
+    def digest(lines):
+        text = '\n'.join(lines)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return sha1(text).digest()
+
+    key = (len(fromlines), digest(fromlines), len(tolines), digest(tolines),
+           context, tabwidth,
+           bool(ignore_blank_lines), bool(ignore_case),
+           bool(ignore_space_changes))
+    changes = _diff_blocks_cache.get(key)
+    if changes is None:
+        changes = _diff_blocks(list(fromlines), list(tolines), context,
+                               tabwidth, ignore_blank_lines, ignore_case,
+                               ignore_space_changes)
+        _diff_blocks_cache[key] = changes
+    return changes
+
+def _diff_blocks(fromlines, tolines, context, tabwidth, ignore_blank_lines,
+                 ignore_case, ignore_space_changes):
 
     type_map = {'replace': 'mod', 'delete': 'rem', 'insert': 'add',
                 'equal': 'unmod'}
@@ -206,8 +206,89 @@ class DiffTestCase(unittest.TestCase):
         self.assertEquals(str(block['changed']['lines'][0]),
                           'aa<ins>x</ins>b')
 
+    def test_diff_blocks_cached(self):
+        fromlines, tolines = ['A', 'B', 'C'], ['A', 'b', 'C']
+        changes = diff.diff_blocks(fromlines, tolines)
+        self.assertEqual(['A', 'B', 'C'], fromlines)
+        self.assertEqual(['A', 'b', 'C'], tolines)
+        self.assertTrue(changes is diff.diff_blocks(list(fromlines),
+                                                    list(tolines)))
+        self.assertFalse(changes is diff.diff_blocks(fromlines, tolines,
+                                                     context=1))
+        self.assertFalse(changes is diff.diff_blocks(fromlines, ['A', 'b']))
+
+
+class PatienceMatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.fromlines = ['line %d' % i for i in xrange(1000)]
+
+    def _check_opcodes(self, fromlines, tolines):
+        opcodes = diff.PatienceMatcher(fromlines, tolines).get_opcodes()
+        i = j = 0
+        for tag, i1, i2, j1, j2 in opcodes:
+            self.assertEqual((i, j), (i1, j1))
+            if tag == 'equal':
+                self.assertEqual(fromlines[i1:i2], tolines[j1:j2])
+            i, j = i2, j2
+        self.assertEqual((len(fromlines), len(tolines)), (i, j))
+        return opcodes
+
+    def test_small(self):
+        self.assertEqual([('equal', 0, 1, 0, 1), ('replace', 1, 2, 1, 2),
+                          ('equal', 2, 3, 2, 3)],
+                         self._check_opcodes(['A', 'B', 'C'],
+                                             ['A', 'b', 'C']))
+
+    def test_changes(self):
+        tolines = self.fromlines[:]
+        tolines[10] = 'changed'
+        tolines[500:500] = ['inserted'] * 2
+        del tolines[900:905]
+        self.assertEqual([('equal', 0, 10, 0, 10),
+                          ('replace', 10, 11, 10, 11),
+                          ('equal', 11, 500, 11, 500),
+                          ('insert', 500, 500, 500, 502),
+                          ('equal', 500, 898, 502, 900),
+                          ('delete', 898, 903, 900, 900),
+                          ('equal', 903, 1000, 900, 997)],
+                         self._check_opcodes(self.fromlines, tolines))
+
+    def test_moved_lines(self):
+        tolines = self.fromlines[:]
+        tolines[700:700] = tolines[100:200]
+        del tolines[100:200]
+        opcodes = self._check_opcodes(self.fromlines, tolines)
+        self.assertEqual(900, sum(i2 - i1 for tag, i1, i2, j1, j2
+                                  in opcodes if tag == 'equal'))
+
+    def test_repeated_lines(self):
+        fromlines = ['x', 'y'] * 500
+        tolines = fromlines[:]
+        tolines[600:600] = ['z']
+        self.assertEqual([('equal', 0, 600, 0, 600),
+                          ('insert', 600, 600, 600, 601),
+                          ('equal', 600, 1000, 601, 1001)],
+                         self._check_opcodes(fromlines, tolines))
+
+    def test_max_cost(self):
+        matcher = diff.PatienceMatcher
+        max_cost = matcher.max_cost
+        matcher.max_cost = 1000
+        try:
+            fromlines = ['x', 'y'] * 500
+            tolines = ['y', 'x'] * 500
+            self.assertEqual([('replace', 0, 1000, 0, 1000)],
+                             self._check_opcodes(fromlines, tolines))
+        finally:
+            matcher.max_cost = max_cost
+
+
 def suite():
-    return unittest.makeSuite(DiffTestCase, 'test')
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(DiffTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(PatienceMatcherTestCase, 'test'))
+    return suite
 
 if __name__ == '__main__':
     unittest.main()
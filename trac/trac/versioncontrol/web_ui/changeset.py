@@ -34,8 +34,10 @@ from trac.mimeview.api import Mimeview
 from trac.perm import IPermissionRequestor
 from trac.resource import Resource, ResourceNotFound
 from trac.search import ISearchSource, search_to_sql, shorten_result
-from trac.timeline.api import ITimelineEventProvider
-from trac.util import as_bool, content_disposition, embedded_numbers, pathjoin
+from trac.timeline.api import ITimelineEventProvider, \
+                             ITimelineEventValidator
+from trac.util import ZipStreamWriter, as_bool, content_disposition, \
+                      embedded_numbers, pathjoin
 from trac.util.datefmt import from_utimestamp, pretty_timedelta
 from trac.util.text import exception_to_unicode, to_unicode, \
                            unicode_urlencode, shorten_line, CRLF
@@ -122,7 +124,8 @@ class ChangesetModule(Component):
     """
 
     implements(INavigationContributor, IPermissionRequestor, IRequestHandler,
-               ITimelineEventProvider, IWikiSyntaxProvider, ISearchSource)
+               ITimelineEventProvider, ITimelineEventValidator,
+               IWikiSyntaxProvider, ISearchSource)
 
     property_diff_renderers = ExtensionPoint(IPropertyDiffRenderer)
 
@@ -760,39 +763,27 @@ class ChangesetModule(Component):
         req.send_header('Content-Disposition',
                         content_disposition('attachment', filename + '.zip'))
 
-        from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED as compression
-
-        buf = StringIO()
-        zipfile = ZipFile(buf, 'w', compression)
+        # Each file is sent as soon as it is compressed, as the whole
+        # changeset could be too large to be kept in memory
+        req.end_headers(streaming=True)
+        zipfile = ZipStreamWriter(req.write)
         for old_node, new_node, kind, change in repos.get_changes(
             new_path=data['new_path'], new_rev=data['new_rev'],
             old_path=data['old_path'], old_rev=data['old_rev']):
             if (kind == Node.FILE or kind == Node.DIRECTORY) and \
                     change != Changeset.DELETE \
                     and new_node.is_viewable(req.perm):
-                zipinfo = ZipInfo()
-                # Note: unicode filenames are not supported by zipfile.
-                # UTF-8 is not supported by all Zip tools either,
-                # but as some do, UTF-8 is the best option here.
-                zipinfo.filename = new_node.path.strip('/').encode('utf-8')
-                zipinfo.flag_bits |= 0x800 # filename is encoded with utf-8
-                zipinfo.date_time = new_node.last_modified.utctimetuple()[:6]
-                zipinfo.compress_type = compression
-                # setting zipinfo.external_attr is needed since Python 2.5
+                # UTF-8 is not supported by all Zip tools, but as some
+                # do, UTF-8 is the best option here.
+                filename = new_node.path.strip('/')
+                date_time = new_node.last_modified.utctimetuple()[:6]
                 if new_node.isfile:
-                    zipinfo.external_attr = 0644 << 16L
-                    content = new_node.get_content().read()
+                    zipfile.add_file(filename, new_node.get_content(),
+                                     date_time,
+                                     size=new_node.get_content_length())
                 elif new_node.isdir:
-                    zipinfo.filename += '/'
-                    zipinfo.external_attr = 040755 << 16L
-                    content = ''
-                zipfile.writestr(zipinfo, content)
+                    zipfile.add_dir(filename, date_time)
         zipfile.close()
-
-        zip_str = buf.getvalue()
-        req.send_header("Content-Length", len(zip_str))
-        req.end_headers()
-        req.write(zip_str)
         raise RequestDone
 
     def title_for_diff(self, data):
@@ -1041,6 +1032,25 @@ class ChangesetModule(Component):
             return _("%(title)s: %(message)s",
                      title=title, message=shorten_line(message))
 
+    # ITimelineEventValidator methods
+
+    def get_timeline_validators(self, req, start, stop, filters):
+        all_repos = 'changeset' in filters
+        repo_filters = set(f for f in filters if f.startswith('repo-'))
+        if all_repos or repo_filters:
+            rm = RepositoryManager(self.env)
+            for repos in sorted(rm.get_real_repositories(),
+                                key=lambda repos: repos.reponame):
+                if all_repos or ('repo-' + repos.reponame) in repo_filters:
+                    # the changesets only change with the youngest revision
+                    try:
+                        rev = repos.youngest_rev
+                        date = repos.get_changeset(rev).date \
+                               if rev is not None else None
+                    except TracError:
+                        rev = date = None
+                    yield date, (repos.reponame, rev)
+
     # IWikiSyntaxProvider methods
 
     CHANGESET_ID = r"(?:[0-9]+|[a-fA-F0-9]{8,})" # only "long enough" hexa ids
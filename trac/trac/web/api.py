@@ -102,6 +102,29 @@ class IRequestFilter(Interface):
         """
 
 
+class IRequestValidator(Interface):
+    """Extension point interface for request handlers which can tell
+    cheaply whether their response changed, so that conditional requests
+    are answered with a "304 Not Modified" response before the request
+    is processed.
+
+    :since 1.0.2:
+    """
+
+    def get_request_validator(req):
+        """Return a `(datetime, extra)` tuple validating the response of
+        the handler to the GET or HEAD request `req`, or `None` if the
+        response can't be validated.
+
+        `datetime` is the last modification time of the requested
+        resource, and `extra` a list of the other values the response
+        depends on, like the version of the resource. The user, the
+        preferences in the session, the permissions of the user, the
+        cached data of the environment and the installed plugins are
+        added by the dispatcher.
+        """
+
+
 class ITemplateStreamFilter(Interface):
     """Transform the generated content by filtering the Genshi event stream
     generated by the template, prior to its serialization.
@@ -165,6 +188,36 @@ for code in [code for code in HTTP_STATUS if code >= 400]:
 del code, exc_name
 
 
+# Encodings of the pre-compressed siblings of static files, by preference
+_PRECOMPRESSED_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def _parse_accept_encoding(header):
+    """Return the set of content-codings accepted in an "Accept-Encoding"
+    header, leaving out those with a quality value of zero.
+
+    >>> sorted(_parse_accept_encoding('gzip;q=1.0, identity; q=0.5, br;q=0'))
+    ['gzip', 'identity']
+    """
+    accepted = set()
+    for item in (header or '').split(','):
+        params = item.split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            key, sep, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if q > 0:
+            accepted.add(name)
+    return accepted
+
+
 class _FieldStorage(cgi.FieldStorage):
     """Our own version of cgi.FieldStorage, with tweaks."""
 
@@ -289,6 +342,7 @@ class Request(object):
         self._write = None
         self._status = '200 OK'
         self._response = None
+        self._streaming = False
 
         self._outheaders = []
         self._outcharset = None
@@ -302,6 +356,7 @@ class Request(object):
             '_inheaders': Request._parse_headers
         }
         self.redirect_listeners = []
+        self.timings = None
 
         self.base_url = self.environ.get('trac.base_url')
         if not self.base_url:
@@ -413,14 +468,24 @@ class Request(object):
             self._content_length = int(value)
         self._outheaders.append((name, unicode(value).encode('utf-8')))
 
-    def end_headers(self):
+    def end_headers(self, streaming=False):
         """Must be called after all headers have been sent and before the
         actual content is written.
+
+        :since 1.0.2: if `streaming` is `True`, the content can be
+        written without a "Content-Length" header, when its length isn't
+        known in advance. The connection is then closed at the end of
+        the response.
         """
+        self._streaming = streaming
         self._send_cookie_headers()
+        if self.timings is not None:
+            server_timing = self.timings.get_server_timing()
+            if server_timing:
+                self._outheaders.append(('Server-Timing', server_timing))
         self._write = self._start_response(self._status, self._outheaders)
 
-    def check_modified(self, datetime, extra=''):
+    def check_modified(self, datetime, extra='', last_modified=False):
         """Check the request "If-None-Match" header against an entity tag.
 
         The entity tag is generated from the specified last modified time
@@ -434,16 +499,31 @@ class Request(object):
         this method sends a "304 Not Modified" response to the client.
         Otherwise, it adds the entity tag as an "ETag" header to the response
         so that consecutive requests can be cached.
+
+        :since 1.0.2: if `last_modified` is `True`, a "Last-Modified"
+        header is sent as well. When the request has no "If-None-Match"
+        header and there's no `extra` variant, the "If-Modified-Since"
+        header is checked against it. The time alone doesn't validate the
+        `extra` variants, e.g. the number of items of a feed.
         """
         if isinstance(extra, list):
             m = md5()
             for elt in extra:
                 m.update(repr(elt))
             extra = m.hexdigest()
-        etag = 'W/"%s/%s/%s"' % (self.authname, http_date(datetime), extra)
+        lastmod = http_date(datetime)
+        etag = 'W/"%s/%s/%s"' % (self.authname, lastmod, extra)
         inm = self.get_header('If-None-Match')
-        if (not inm or inm != etag):
+        if inm:
+            modified = inm != etag
+        elif last_modified and not extra:
+            modified = self.get_header('If-Modified-Since') != lastmod
+        else:
+            modified = True
+        if modified:
             self.send_header('ETag', etag)
+            if last_modified:
+                self.send_header('Last-Modified', lastmod)
         else:
             self.send_response(304)
             self.send_header('Content-Length', 0)
@@ -546,7 +626,8 @@ class Request(object):
         self.end_headers()
         raise RequestDone
 
-    def send_file(self, path, mimetype=None):
+    def send_file(self, path, mimetype=None, etag=None, max_age=None,
+                  precompressed=False):
         """Send a local file to the browser.
 
         This method includes the "Last-Modified", "Content-Type" and
@@ -554,25 +635,64 @@ class Request(object):
         attributes. It also checks the last modification time of the local file
         against the "If-Modified-Since" provided by the user agent, and sends a
         "304 Not Modified" response if it matches.
+
+        :since 1.0.2: if `etag` is given, it is sent as a strong "ETag"
+        header and checked against the "If-None-Match" header of the
+        request. If `max_age` is given, a "Cache-Control" header allows
+        the user agent to cache the file for that many seconds. If
+        `precompressed` is `True`, a `.br` or `.gz` sibling of the file
+        is sent instead when the user agent accepts that encoding and
+        the sibling is not older than the file.
         """
         if not os.path.isfile(path):
             raise HTTPNotFound(_("File %(path)s not found", path=path))
 
+        if not mimetype:
+            mimetype = mimetypes.guess_type(path)[0] or \
+                       'application/octet-stream'
+
         stat = os.stat(path)
+        encoding = None
+        if precompressed:
+            accepted = _parse_accept_encoding(
+                self.get_header('Accept-Encoding'))
+            for name, ext in _PRECOMPRESSED_ENCODINGS:
+                if name not in accepted:
+                    continue
+                try:
+                    encoded_stat = os.stat(path + ext)
+                except OSError:
+                    continue
+                if encoded_stat.st_mtime >= stat.st_mtime:
+                    path, stat, encoding = path + ext, encoded_stat, name
+                    break
+            self.send_header('Vary', 'Accept-Encoding')
+
         mtime = datetime.fromtimestamp(stat.st_mtime, localtz)
         last_modified = http_date(mtime)
-        if last_modified == self.get_header('If-Modified-Since'):
+        if etag:
+            etag = '"%s%s"' % (etag, '-' + encoding if encoding else '')
+            self.send_header('ETag', etag)
+        if max_age is not None:
+            self.send_header('Cache-Control', 'public, max-age=%d' % max_age)
+
+        inm = self.get_header('If-None-Match')
+        if inm and etag:
+            not_modified = inm.strip() == '*' or \
+                           etag in [tag.strip() for tag in inm.split(',')]
+        else:
+            not_modified = last_modified == \
+                           self.get_header('If-Modified-Since')
+        if not_modified:
             self.send_response(304)
             self.send_header('Content-Length', 0)
             self.end_headers()
             raise RequestDone
 
-        if not mimetype:
-            mimetype = mimetypes.guess_type(path)[0] or \
-                       'application/octet-stream'
-
         self.send_response(200)
         self.send_header('Content-Type', mimetype)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
         self.send_header('Content-Length', stat.st_size)
         self.send_header('Last-Modified', last_modified)
         use_xsendfile = getattr(self, 'use_xsendfile', False)
@@ -605,14 +725,15 @@ class Request(object):
         which has been specified in the ''Content-Type'' header
         or 'utf-8' otherwise.
 
-        Note that the ''Content-Length'' header must have been specified.
+        Note that the ''Content-Length'' header must have been specified,
+        unless the headers were sent with `end_headers(streaming=True)`.
         Its value either corresponds to the length of `data`, or, if there
         are multiple calls to `write`, to the cumulated length of the `data`
         arguments.
         """
         if not self._write:
             self.end_headers()
-        if not hasattr(self, '_content_length'):
+        if not hasattr(self, '_content_length') and not self._streaming:
             raise RuntimeError("No Content-Length header set")
         if isinstance(data, unicode):
             raise ValueError("Can't send unicode content")
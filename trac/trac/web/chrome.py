@@ -23,18 +23,22 @@ web content are also using facilities provided here.
 
 from __future__ import with_statement
 
+import cPickle
 import datetime
 from functools import partial
+from hashlib import md5, sha1
 import itertools
 import os.path
 import pkg_resources
 import pprint
 import re
+import sys
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
 
+import genshi
 from genshi import Markup
 from genshi.builder import tag, Element
 from genshi.core import Attrs, START
@@ -43,17 +47,18 @@ from genshi.output import DocType
 from genshi.template import TemplateLoader, MarkupTemplate, NewTextTemplate
 
 from trac import __version__ as VERSION
+from trac.admin import AdminCommandError, IAdminCommandProvider
 from trac.config import *
 from trac.core import *
 from trac.env import IEnvironmentSetupParticipant, ISystemInfoProvider
 from trac.mimeview.api import RenderingContext, get_mimetype
 from trac.resource import *
-from trac.util import compat, get_reporter_id, presentation, get_pkginfo, \
-                      pathjoin, translation
+from trac.util import AtomicFile, compat, get_reporter_id, presentation, \
+                      get_pkginfo, pathjoin, translation
 from trac.util.html import escape, plaintext
 from trac.util.text import pretty_size, obfuscate_email_address, \
                            shorten_line, unicode_quote_plus, to_unicode, \
-                           javascript_quote, exception_to_unicode
+                           javascript_quote, exception_to_unicode, printout
 from trac.util.datefmt import (
     pretty_timedelta, format_datetime, format_date, format_time,
     from_utimestamp, http_date, utc, get_date_format_jquery_ui, is_24_hours,
@@ -67,6 +72,14 @@ from trac.wiki import IWikiSyntaxProvider
 from trac.wiki.formatter import format_to, format_to_html, format_to_oneliner
 
 
+# Pre-compressed siblings of static files, skipped when hashing the files
+_PRECOMPRESSED_SUFFIXES = ('.br', '.gz')
+
+# Suffixes of the files of the templates directories which are templates
+_MARKUP_TEMPLATE_SUFFIXES = ('.html', '.rss', '.xml')
+_TEXT_TEMPLATE_SUFFIXES = ('.txt',)
+
+
 class INavigationContributor(Interface):
     """Extension point interface for components that contribute items to the
     navigation.
@@ -131,23 +144,38 @@ def add_link(req, rel, href, title=None, mimetype=None, classname=None,
     links.setdefault(rel, []).append(link)
     linkset.add(linkid)
 
-def add_stylesheet(req, filename, mimetype='text/css', media=None):
-    """Add a link to a style sheet to the chrome info so that it gets included
-    in the generated HTML page.
+def _chrome_resource_href(req, filename):
+    """Return the URL of a static resource added with `add_stylesheet` or
+    `add_script`.
 
-    If the filename is absolute (i.e. starts with a slash), the generated link
-    will be based off the application root path. If it is relative, the link
-    will be based off the `/chrome/` path.
+    The URL of a resource below `/chrome/` carries the content hash of the
+    file, so that it can be cached by the user agent until it changes.
     """
     if filename.startswith(('http://', 'https://')):
-        href = filename
-    elif filename.startswith('common/') and 'htdocs_location' in req.chrome:
+        return filename
+    if filename.startswith('common/') and 'htdocs_location' in req.chrome:
         href = Href(req.chrome['htdocs_location'])(filename[7:])
     else:
         href = req.href
         if not filename.startswith('/'):
             href = href.chrome
         href = href(filename)
+    get_fingerprint = req.chrome.get('static_fingerprint')
+    if get_fingerprint and not filename.startswith('/'):
+        fingerprint = get_fingerprint(filename)
+        if fingerprint:
+            href += '?v=' + fingerprint
+    return href
+
+def add_stylesheet(req, filename, mimetype='text/css', media=None):
+    """Add a link to a style sheet to the chrome info so that it gets included
+    in the generated HTML page.
+
+    If the filename is absolute (i.e. starts with a slash), the generated link
+    will be based off the application root path. If it is relative, the link
+    will be based off the `/chrome/` path.
+    """
+    href = _chrome_resource_href(req, filename)
     add_link(req, 'stylesheet', href, mimetype=mimetype, media=media)
 
 def add_script(req, filename, mimetype='text/javascript', charset='utf-8',
@@ -162,15 +190,7 @@ def add_script(req, filename, mimetype='text/javascript', charset='utf-8',
     if filename in scriptset:
         return False # Already added that script
 
-    if filename.startswith(('http://', 'https://')):
-        href = filename
-    elif filename.startswith('common/') and 'htdocs_location' in req.chrome:
-        href = Href(req.chrome['htdocs_location'])(filename[7:])
-    else:
-        href = req.href
-        if not filename.startswith('/'):
-            href = href.chrome
-        href = href(filename)
+    href = _chrome_resource_href(req, filename)
     script = {'href': href, 'type': mimetype, 'charset': charset,
               'prefix': Markup('<!--[if %s]>' % ie_if) if ie_if else None,
               'suffix': Markup('<![endif]-->') if ie_if else None}
@@ -319,6 +339,89 @@ def _save_messages(req, url, permanent):
             req.session['chrome.%s.%d' % (type_, i)] = escape(message, False)
 
 
+class PrecompiledTemplateLoader(TemplateLoader):
+    """Template loader storing the parsed templates in `cache_dir`, so
+    that other processes load them without parsing them again.
+
+    A template is stored right after it has been parsed, before the
+    `callback` of the loader is applied and before the template is
+    prepared, as the preparation inlines the templates it includes. The
+    stored template is used as long as the modification time and the
+    size of its file don't change.
+
+    :since 1.0.2:
+    """
+
+    def __init__(self, search_path=None, cache_dir=None, log=None,
+                 **kwargs):
+        TemplateLoader.__init__(self, search_path, **kwargs)
+        self.cache_dir = cache_dir
+        self.log = log
+
+    def _instantiate(self, cls, fileobj, filepath, filename, encoding=None):
+        if encoding is None:
+            encoding = self.default_encoding
+        if not self.cache_dir:
+            return TemplateLoader._instantiate(self, cls, fileobj, filepath,
+                                               filename, encoding)
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return TemplateLoader._instantiate(self, cls, fileobj, filepath,
+                                               filename, encoding)
+        key = md5(repr((cls.__module__, cls.__name__, filepath, filename,
+                        encoding, self.variable_lookup, self.allow_exec))) \
+              .hexdigest()
+        path = os.path.join(self.cache_dir, key[:2], key)
+        # the parsed templates contain code objects, which depend on the
+        # Python version
+        stamp = (st.st_mtime, st.st_size, genshi.__version__, sys.version)
+        tmpl = self._read_cached(path, cls, stamp)
+        if tmpl is None:
+            tmpl = TemplateLoader._instantiate(self, cls, fileobj, filepath,
+                                               filename, encoding)
+            self._write_cached(path, tmpl, stamp)
+        return tmpl
+
+    def _read_cached(self, path, cls, stamp):
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                entry_stamp, state = cPickle.load(f)
+        except Exception, e:
+            if self.log:
+                self.log.warning("Can't read cached template %s: %s", path,
+                                 exception_to_unicode(e))
+            return None
+        if entry_stamp != stamp:
+            return None
+        tmpl = cls.__new__(cls)
+        tmpl.__setstate__(state)
+        tmpl.loader = self
+        return tmpl
+
+    def _write_cached(self, path, tmpl, stamp):
+        state = tmpl.__getstate__()
+        state['loader'] = None
+        try:
+            dir = os.path.dirname(path)
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+            f = AtomicFile(path, 'wb')
+            try:
+                cPickle.dump((stamp, state), f, cPickle.HIGHEST_PROTOCOL)
+            except Exception:
+                f.rollback()
+                raise
+            f.commit()
+        except Exception, e:
+            if self.log:
+                self.log.warning("Can't cache template %s in %s: %s",
+                                 tmpl.filepath, path,
+                                 exception_to_unicode(e))
+
+
 # Mappings for removal of control characters
 _translate_nop = "".join([chr(i) for i in range(256)])
 _invalid_control_chars = "".join([chr(i) for i in range(32)
@@ -489,7 +592,29 @@ class Chrome(Component):
         format. (''since 1.0'')
         """)
 
+    static_max_age = IntOption('trac', 'static_max_age', 31536000,
+        """Number of seconds during which the browser can cache the static
+        resources below `/chrome/`, when they are requested with the hash
+        of their content which Trac adds to their URL. Set this to 0 to
+        leave the hash out of the URLs. (''since 1.0.2'')""")
+
+    template_cache_dir = Option('trac', 'template_cache_dir', '',
+        """Directory where the parsed templates are stored, so that new
+        processes load them without parsing them again. Relative paths
+        are resolved relative to the environment directory; the products
+        of a multi-product environment use the directory of the global
+        environment. Leave empty to parse the templates in each process.
+        (''since 1.0.2'')""")
+
+    preload_templates = ListOption('trac', 'preload_templates', '',
+        doc="""Templates loaded when the web frontend opens the
+        environment, rather than when they are first rendered, e.g.
+        `layout.html, theme.html, wiki_view.html, ticket.html`. Use `*`
+        for all the templates of the templates directories.
+        (''since 1.0.2'')""")
+
     templates = None
+    static_files = None
 
     # default doctype for 'text/html' output
     default_html_doctype = DocType.XHTML_STRICT
@@ -602,19 +727,18 @@ class Chrome(Component):
         prefix = req.args['prefix']
         filename = req.args['filename']
 
-        dirs = []
-        for provider in self.template_providers:
-            for dir in [os.path.normpath(dir[1]) for dir
-                        in provider.get_htdocs_dirs() or []
-                        if dir[0] == prefix]:
-                dirs.append(dir)
-                path = os.path.normpath(os.path.join(dir, filename))
-                assert os.path.commonprefix([dir, path]) == dir
-                if os.path.isfile(path):
-                    req.send_file(path, get_mimetype(path))
-
-        self.log.warning('File %s not found in any of %s', filename, dirs)
-        raise HTTPNotFound('File %s not found', filename)
+        path = self._find_static_file(prefix, filename)
+        if path is None:
+            self.log.warning('File %s not found in any of %s', filename,
+                             list(self._get_htdocs_dirs(prefix)))
+            raise HTTPNotFound('File %s not found', filename)
+
+        fingerprint = self.get_static_fingerprint(prefix + '/' + filename)
+        max_age = None
+        if fingerprint and req.args.get('v') == fingerprint:
+            max_age = self.static_max_age
+        req.send_file(path, get_mimetype(path), etag=fingerprint,
+                      max_age=max_age, precompressed=True)
 
     # ITemplateProvider methods
 
@@ -645,6 +769,27 @@ class Chrome(Component):
 
     # Public API methods
 
+    def get_static_fingerprint(self, filename):
+        """Return a hash of the content of the static resource `filename`,
+        given relative to `/chrome/` (e.g. `common/css/trac.css`), or
+        `None` if there's no such file.
+
+        The hashes of all the files in the htdocs directories are computed
+        on the first call. They are only computed again for modified files
+        when `[trac] auto_reload` is enabled.
+
+        :since 1.0.2:
+        """
+        if self.static_files is None:
+            self.static_files = self._scan_static_files()
+        entry = self.static_files.get(filename, False)
+        if entry is False or self.auto_reload:
+            prefix, sep, name = filename.partition('/')
+            path = self._find_static_file(prefix, name)
+            entry = self._hash_static_file(path, entry) if path else None
+            self.static_files[filename] = entry
+        return entry[3] if entry else None
+
     def get_all_templates_dirs(self):
         """Return a list of the names of all known templates directories."""
         dirs = []
@@ -667,6 +812,8 @@ class Chrome(Component):
 
         htdocs_location = self.htdocs_location or req.href.chrome('common')
         chrome['htdocs_location'] = htdocs_location.rstrip('/') + '/'
+        if self.static_max_age > 0:
+            chrome['static_fingerprint'] = self.get_static_fingerprint
 
         # HTML <head> links
         add_link(req, 'start', req.href.wiki())
@@ -933,8 +1080,10 @@ class Chrome(Component):
         `MarkupTemplate`.
         """
         if not self.templates:
-            self.templates = TemplateLoader(
-                self.get_all_templates_dirs(), auto_reload=self.auto_reload,
+            self.templates = PrecompiledTemplateLoader(
+                self.get_all_templates_dirs(),
+                cache_dir=self.get_template_cache_dir(), log=self.log,
+                auto_reload=self.auto_reload,
                 max_cache_size=self.genshi_cache_size,
                 default_encoding="utf-8",
                 variable_lookup='lenient', callback=lambda template:
@@ -947,6 +1096,70 @@ class Chrome(Component):
 
         return self.templates.load(filename, cls=cls)
 
+    def get_template_cache_dir(self):
+        """Return the absolute path of the directory of the parsed
+        templates, or `None` if they are not stored.
+
+        :since 1.0.2:
+        """
+        if self.template_cache_dir:
+            env = getattr(self.env, 'parent', None) or self.env
+            return os.path.normpath(os.path.join(env.path,
+                                                 self.template_cache_dir))
+
+    def get_all_templates(self):
+        """Return the sorted names of the templates of all the templates
+        directories.
+
+        :since 1.0.2:
+        """
+        names = set()
+        for dir in self.get_all_templates_dirs():
+            for dirpath, dirnames, filenames in os.walk(dir):
+                for filename in filenames:
+                    if filename.endswith(_MARKUP_TEMPLATE_SUFFIXES +
+                                         _TEXT_TEMPLATE_SUFFIXES):
+                        path = os.path.join(dirpath, filename)
+                        names.add(os.path.relpath(path, dir)
+                                  .replace(os.sep, '/'))
+        return sorted(names)
+
+    def warm_up_templates(self, filenames=None):
+        """Load the templates `filenames`, or all the templates of the
+        templates directories, so that they are parsed before they are
+        rendered.
+
+        Return the list of `(filename, exception)` tuples of the templates
+        which couldn't be loaded.
+
+        :since 1.0.2:
+        """
+        if filenames is None:
+            filenames = self.get_all_templates()
+        errors = []
+        for filename in filenames:
+            method = 'text' if filename.endswith(_TEXT_TEMPLATE_SUFFIXES) \
+                     else None
+            try:
+                self.load_template(filename, method)
+            except Exception, e:
+                errors.append((filename, e))
+        return errors
+
+    def preload(self):
+        """Load the templates of the `[trac] preload_templates` option.
+
+        :since 1.0.2:
+        """
+        filenames = self.preload_templates
+        if not filenames:
+            return
+        if '*' in filenames:
+            filenames = None
+        for filename, e in self.warm_up_templates(filenames):
+            self.log.warning("Can't preload template %s: %s", filename,
+                             exception_to_unicode(e))
+
     def render_template(self, req, filename, data, content_type=None,
                         fragment=False):
         """Render the `filename` using the `data` for the context.
@@ -959,6 +1172,15 @@ class Chrome(Component):
         When `fragment` is specified, the (filtered) Genshi stream is
         returned.
         """
+        timings = getattr(req, 'timings', None)
+        if timings is None or fragment:
+            return self._render_template(req, filename, data, content_type,
+                                         fragment)
+        with timings.measure('render'):
+            return self._render_template(req, filename, data, content_type,
+                                         fragment)
+
+    def _render_template(self, req, filename, data, content_type, fragment):
         if content_type is None:
             content_type = 'text/html'
         method = {'text/html': 'xhtml',
@@ -1171,3 +1393,83 @@ class Chrome(Component):
         for kind, data, pos in stream:
             return pos
 
+
+    # Static resources
+
+    def _get_htdocs_dirs(self, prefix):
+        for provider in self.template_providers:
+            for dir_prefix, dir in provider.get_htdocs_dirs() or []:
+                if dir_prefix == prefix and dir:
+                    yield os.path.normpath(dir)
+
+    def _find_static_file(self, prefix, filename):
+        for dir in self._get_htdocs_dirs(prefix):
+            path = os.path.normpath(os.path.join(dir, filename))
+            assert os.path.commonprefix([dir, path]) == dir
+            if os.path.isfile(path):
+                return path
+
+    def _hash_static_file(self, path, entry=None):
+        stat = os.stat(path)
+        if entry and entry[:3] == (path, stat.st_mtime, stat.st_size):
+            return entry
+        digest = sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), ''):
+                digest.update(chunk)
+        return path, stat.st_mtime, stat.st_size, digest.hexdigest()[:16]
+
+    def _scan_static_files(self):
+        files = {}
+        for provider in self.template_providers:
+            for prefix, dir in provider.get_htdocs_dirs() or []:
+                if not dir or not os.path.isdir(dir):
+                    continue
+                for dirpath, dirnames, filenames in os.walk(dir):
+                    for name in filenames:
+                        if name.endswith(_PRECOMPRESSED_SUFFIXES):
+                            continue
+                        path = os.path.join(dirpath, name)
+                        relpath = os.path.relpath(path, dir)
+                        key = prefix + '/' + relpath.replace(os.sep, '/')
+                        if key not in files:
+                            files[key] = self._hash_static_file(
+                                os.path.normpath(path))
+        self.log.debug("Computed the content hash of %d static files",
+                       len(files))
+        return files
+
+
+class TemplateAdmin(Component):
+    """trac-admin command provider for the templates."""
+
+    implements(IAdminCommandProvider)
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('templates warmup', '[template] [...]',
+               """Parse templates and store them in the template cache
+
+               Without arguments, all the templates of the templates
+               directories are parsed. The templates are stored in the
+               directory of the `[trac] template_cache_dir` option.
+               """,
+               self._complete_warmup, self._do_warmup)
+
+    def _complete_warmup(self, args):
+        return Chrome(self.env).get_all_templates()
+
+    def _do_warmup(self, *filenames):
+        chrome = Chrome(self.env)
+        cache_dir = chrome.get_template_cache_dir()
+        if not cache_dir:
+            raise AdminCommandError(_("The [trac] template_cache_dir option "
+                                      "is not set."))
+        filenames = list(filenames) or chrome.get_all_templates()
+        errors = chrome.warm_up_templates(filenames)
+        for filename, e in errors:
+            printout(_("Can't parse %(template)s: %(error)s",
+                       template=filename, error=exception_to_unicode(e)))
+        printout(_("%(count)s templates parsed into %(dir)s.",
+                   count=len(filenames) - len(errors), dir=cache_dir))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+"""Timing of the processing phases of web requests.
+
+The `RequestDispatcher` measures the time spent in the request filters,
+the request handler and the template rendering, as well as the number
+and duration of the SQL statements executed for each request. These
+timings are passed to the `IRequestTimingListener` components once the
+request has been processed.
+
+:since 1.0.2:
+"""
+
+from __future__ import with_statement
+
+import json
+import logging
+import logging.handlers
+import os
+import time
+
+from trac.config import IntOption, Option
+from trac.core import *
+from trac.util.concurrency import threading
+from trac.util.text import exception_to_unicode
+
+__all__ = ['IRequestTimingListener', 'RequestTimings']
+
+
+class IRequestTimingListener(Interface):
+    """Extension point interface for components that want to be notified
+    of the timings of the requests.
+
+    :since 1.0.2:
+    """
+
+    def request_timed(req, timings):
+        """Called after the request `req` has been dispatched, with its
+        `RequestTimings`.
+        """
+
+
+class RequestTimings(object):
+    """Per-phase timings of a request, in seconds.
+
+    The phases are measured with the `measure` context manager, and
+    the SQL statements are counted through the `statement_executed`
+    method of the profiler interface of the `IterableCursor`.
+    """
+
+    def __init__(self, server_timing=False):
+        self.server_timing = server_timing
+        self.start = time.time()
+        self.phases = []
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.total = None
+        self.profile = None
+        self._measures = []
+
+    def measure(self, phase):
+        """Return a context manager adding the time spent in its scope to
+        `phase`."""
+        return _Measure(self, phase)
+
+    def add(self, phase, duration):
+        for item in self.phases:
+            if item[0] == phase:
+                item[1] += duration
+                break
+        else:
+            self.phases.append([phase, duration])
+
+    def statement_executed(self, sql, args, duration, rows):
+        self.sql_count += 1
+        self.sql_time += duration
+
+    def finish(self):
+        """Stop the measure of the total time of the request."""
+        self.total = time.time() - self.start
+
+    def get_server_timing(self):
+        """Return the value of the `Server-Timing` header, or `None` if
+        the header shouldn't be sent.
+
+        The header is built when the response starts. When a phase is
+        still being measured at that time, e.g. when the request handler
+        sends the response itself, its time so far is reported, and the
+        SQL statements executed afterwards are not counted.
+
+        >>> timings = RequestTimings(server_timing=True)
+        >>> timings.add('handler', 0.0125)
+        >>> timings.statement_executed('SELECT 1', None, 0.002, 1)
+        >>> timings.total = 0.05
+        >>> timings.get_server_timing()
+        'handler;dur=12.5, sql;dur=2.0;desc="SQL (1)", total;dur=50.0'
+        """
+        if not self.server_timing:
+            return None
+        now = time.time()
+        phases = [list(item) for item in self.phases]
+        for measure in self._measures:
+            elapsed = now - measure.start
+            for item in phases:
+                if item[0] == measure.phase:
+                    item[1] += elapsed
+                    break
+            else:
+                phases.append([measure.phase, elapsed])
+        metrics = ['%s;dur=%.1f' % (phase, duration * 1000)
+                   for phase, duration in phases]
+        if self.sql_count:
+            metrics.append('sql;dur=%.1f;desc="SQL (%d)"'
+                           % (self.sql_time * 1000, self.sql_count))
+        total = self.total
+        if total is None:
+            total = now - self.start
+        metrics.append('total;dur=%.1f' % (total * 1000))
+        return ', '.join(metrics)
+
+    def to_dict(self):
+        return {'start': self.start, 'total': self.total,
+                'phases': dict(self.phases), 'sql_count': self.sql_count,
+                'sql_time': self.sql_time, 'profile': self.profile}
+
+
+class _Measure(object):
+
+    def __init__(self, timings, phase):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.time()
+        self.timings._measures.append(self)
+
+    def __exit__(self, et, ev, tb):
+        self.timings._measures.remove(self)
+        self.timings.add(self.phase, time.time() - self.start)
+
+
+class RequestTimingLog(Component):
+    """Append the timings of each request to a rotating log, as JSON
+    records (one per line)."""
+
+    implements(IRequestTimingListener)
+
+    request_timing_log = Option('trac', 'request_timing_log', '',
+        """Path of the log of the per-phase timings of each request.
+        A relative path is resolved against the log directory of the
+        environment. Leave empty to disable the log.
+        (''since 1.0.2'')""")
+
+    request_timing_log_size = IntOption('trac', 'request_timing_log_size',
+                                        1024,
+        """Size in KiB above which the request timing log is rotated.
+        (''since 1.0.2'')""")
+
+    request_timing_log_count = IntOption('trac', 'request_timing_log_count',
+                                         5,
+        """Number of rotated request timing logs kept.
+        (''since 1.0.2'')""")
+
+    def __init__(self):
+        self._logger = None
+        self._path = None
+        self._lock = threading.Lock()
+
+    # IRequestTimingListener methods
+
+    def request_timed(self, req, timings):
+        logger = self._get_logger()
+        if logger:
+            record = timings.to_dict()
+            record.update(method=req.method, path=req.path_info,
+                          query=req.query_string)
+            logger.info(json.dumps(record))
+
+    # Internal methods
+
+    def _get_logger(self):
+        path = self.request_timing_log
+        if not path:
+            return None
+        if not os.path.isabs(path):
+            path = os.path.join(self.env.get_log_dir(), path)
+        with self._lock:
+            if path != self._path:
+                if self._logger:
+                    for handler in self._logger.handlers:
+                        handler.close()
+                self._logger = None
+                self._path = path
+                try:
+                    handler = logging.handlers.RotatingFileHandler(
+                        path, maxBytes=self.request_timing_log_size * 1024,
+                        backupCount=self.request_timing_log_count)
+                except IOError, e:
+                    self.log.warning("Can't open request timing log %s: %s",
+                                     path, exception_to_unicode(e))
+                    return None
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                # Not registered in the logging module, so that the log
+                # is not shared by the environments
+                self._logger = logging.Logger('trac.timing')
+                self._logger.addHandler(handler)
+            return self._logger
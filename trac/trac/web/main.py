@@ -16,6 +16,9 @@
 # Author: Christopher Lenz <cmlenz@gmx.de>
 #         Matthew Good <trac@matt-good.net>
 
+from __future__ import with_statement
+
+import cProfile
 import cgi
 import dircache
 import fnmatch
@@ -27,21 +30,25 @@ import pkg_resources
 from pprint import pformat, pprint
 import re
 import sys
+import time
 
 from genshi.builder import Fragment, tag
 from genshi.output import DocType
 from genshi.template import TemplateLoader
 
 from trac import __version__ as TRAC_VERSION
-from trac.config import BoolOption, ExtensionOption, Option, \
+from trac.config import BoolOption, ExtensionOption, IntOption, Option, \
                         OrderedExtensionsOption
+from trac.cache import CacheManager
 from trac.core import *
+from trac.db.util import set_statement_observer
 from trac.env import open_environment
 from trac.loader import get_plugin_info, match_plugins_to_frames
-from trac.perm import PermissionCache, PermissionError
+from trac.perm import PermissionCache, PermissionError, PermissionSystem
 from trac.resource import ResourceNotFound
 from trac.util import arity, get_frame_info, get_last_traceback, hex_entropy, \
-                      read_file, safe_repr, translation
+                      lazy, read_file, safe_repr, translation
+from trac.util.compat import md5
 from trac.util.concurrency import threading
 from trac.util.datefmt import format_datetime, localtz, timezone, user_time
 from trac.util.text import exception_to_unicode, shorten_line, to_unicode
@@ -50,6 +57,7 @@ from trac.util.translation import _, get_negotiated_locale, has_babel, \
 from trac.web.api import *
 from trac.web.chrome import Chrome
 from trac.web.href import Href
+from trac.web.instrumentation import IRequestTimingListener, RequestTimings
 from trac.web.session import Session
 
 #: This URL is used for semi-automatic bug reports (see
@@ -91,6 +99,7 @@ class RequestDispatcher(Component):
 
     authenticators = ExtensionPoint(IAuthenticator)
     handlers = ExtensionPoint(IRequestHandler)
+    validators = ExtensionPoint(IRequestValidator)
 
     filters = OrderedExtensionsOption('trac', 'request_filters',
                                       IRequestFilter,
@@ -128,6 +137,22 @@ class RequestDispatcher(Component):
         like Apache with `mod_xsendfile` or lighttpd. (''since 1.0'')
         """)
 
+    server_timing = BoolOption('trac', 'server_timing', 'false',
+        """When true, send a `Server-Timing` header with the time spent in
+        the request filters, the request handler, the template rendering
+        and the SQL statements, for display in the developer tools of the
+        browsers. (''since 1.0.2'')
+        """)
+
+    profile_files = IntOption('trac', 'profile_files', 10,
+        """Number of profile data files written by the `__profile`
+        requests of the administrators which are kept in the log
+        directory, the oldest ones being removed first.
+        (''since 1.0.2'')
+        """)
+
+    timing_listeners = ExtensionPoint(IRequestTimingListener)
+
     # Public API
 
     def authenticate(self, req):
@@ -161,22 +186,44 @@ class RequestDispatcher(Component):
             'use_xsendfile': self._get_use_xsendfile,
         })
 
+        req.timings = RequestTimings(self.server_timing)
+        set_statement_observer(req.timings)
+        try:
+            if '__profile' in req.args and 'TRAC_ADMIN' in req.perm:
+                self._profile(req, chrome)
+            else:
+                self._dispatch(req, chrome)
+        finally:
+            set_statement_observer(None)
+            req.timings.finish()
+            for listener in self.timing_listeners:
+                try:
+                    listener.request_timed(req, req.timings)
+                except Exception, e:
+                    self.log.error("Exception caught while notifying the "
+                                   "request timings: %s",
+                                   exception_to_unicode(e, traceback=True))
+
+    # Internal methods
+
+    def _dispatch(self, req, chrome):
         try:
             try:
                 # Select the component that should handle the request
                 chosen_handler = None
                 try:
-                    for handler in self.handlers:
-                        if handler.match_request(req):
-                            chosen_handler = handler
-                            break
-                    if not chosen_handler:
-                        if not req.path_info or req.path_info == '/':
-                            chosen_handler = self.default_handler
-                    # pre-process any incoming request, whether a handler
-                    # was found or not
-                    chosen_handler = self._pre_process_request(req,
-                                                            chosen_handler)
+                    with req.timings.measure('pre'):
+                        for handler in self.handlers:
+                            if handler.match_request(req):
+                                chosen_handler = handler
+                                break
+                        if not chosen_handler:
+                            if not req.path_info or req.path_info == '/':
+                                chosen_handler = self.default_handler
+                        # pre-process any incoming request, whether a
+                        # handler was found or not
+                        chosen_handler = self._pre_process_request(
+                            req, chosen_handler)
                 except TracError, e:
                     raise HTTPInternalError(e)
                 if not chosen_handler:
@@ -210,8 +257,16 @@ class RequestDispatcher(Component):
                         raise HTTPBadRequest(_('Missing or invalid form token.'
                                                ' %(msg)s', msg=msg))
 
+                # Answer with a "304 Not Modified" response before
+                # processing the request, if the response didn't change
+                if req.method in ('GET', 'HEAD') and \
+                        chosen_handler in self.validators:
+                    with req.timings.measure('pre'):
+                        self._check_modified(req, chosen_handler)
+
                 # Process the request and render the template
-                resp = chosen_handler.process_request(req)
+                with req.timings.measure('handler'):
+                    resp = chosen_handler.process_request(req)
                 if resp:
                     if len(resp) == 2: # old Clearsilver template and HDF data
                         self.log.error("Clearsilver template are no longer "
@@ -220,8 +275,9 @@ class RequestDispatcher(Component):
                             _("Clearsilver templates are no longer supported, "
                               "please contact your Trac administrator."))
                     # Genshi
-                    template, data, content_type = \
-                              self._post_process_request(req, *resp)
+                    with req.timings.measure('post'):
+                        template, data, content_type = \
+                                  self._post_process_request(req, *resp)
                     if 'hdfdump' in req.args:
                         req.perm.require('TRAC_ADMIN')
                         # debugging helper - no need to render first
@@ -233,7 +289,8 @@ class RequestDispatcher(Component):
                                                     content_type)
                     req.send(output, content_type or 'text/html')
                 else:
-                    self._post_process_request(req)
+                    with req.timings.measure('post'):
+                        self._post_process_request(req)
             except RequestDone:
                 raise
             except:
@@ -255,7 +312,66 @@ class RequestDispatcher(Component):
         except TracError, e:
             raise HTTPInternalError(e)
 
-    # Internal methods
+    def _check_modified(self, req, handler):
+        """Validate the response of `handler` against the "If-None-Match"
+        header of `req`, see `IRequestValidator`."""
+        validator = handler.get_request_validator(req)
+        if validator is None:
+            return
+        datetime, extra = validator
+        product = getattr(self.env, 'product', None)
+        form_token = req.incookie.get('trac_form_token')
+        permissions = PermissionSystem(self.env) \
+                      .get_user_permissions(req.authname)
+        extra = list(extra) + [
+            product.prefix if product else None, self._generation,
+            self.config._lastmtime, CacheManager(self.env).get_generations(),
+            str(req.locale), sorted(req.session.iteritems()),
+            sorted(permissions), form_token.value if form_token else None]
+        req.check_modified(datetime, extra)
+
+    @lazy
+    def _generation(self):
+        # changes when Trac or the plugins are upgraded
+        from trac.core import ComponentMeta
+        components = sorted('%s.%s' % (cls.__module__, cls.__name__)
+                            for cls in ComponentMeta._components)
+        return md5(repr((self.env.get_systeminfo(), components))).hexdigest()
+
+    def _profile(self, req, chrome):
+        """Dispatch the request under the control of the profiler, and
+        save the profile data to the log directory."""
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(self._dispatch, req, chrome)
+        finally:
+            log_dir = self.env.get_log_dir()
+            path = os.path.join(log_dir,
+                                'profile-%d.prof' % int(time.time() * 1000))
+            try:
+                if not os.path.isdir(log_dir):
+                    os.makedirs(log_dir)
+                profile.dump_stats(path)
+            except (IOError, OSError), e:
+                self.log.warning("Can't write profile data to %s: %s", path,
+                                 exception_to_unicode(e))
+            else:
+                req.timings.profile = path
+                self.log.info("Profile data of %r written to %s", req, path)
+                self._remove_old_profiles(log_dir)
+
+    def _remove_old_profiles(self, log_dir):
+        """Remove the oldest profile data files of the log directory,
+        keeping the `[trac] profile_files` most recent ones."""
+        names = sorted((name for name in os.listdir(log_dir)
+                        if re.match(r'profile-\d+\.prof$', name)),
+                       key=lambda name: int(name[8:-5]))
+        for name in names[:-max(1, self.profile_files)]:
+            try:
+                os.remove(os.path.join(log_dir, name))
+            except OSError, e:
+                self.log.warning("Can't remove profile data %s: %s", name,
+                                 exception_to_unicode(e))
 
     def _get_perm(self, req):
         if isinstance(req.session, FakeSession):
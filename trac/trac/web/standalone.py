@@ -24,14 +24,13 @@ import os
 import socket
 import select
 import sys
-from SocketServer import ThreadingMixIn
 
 from trac import __version__ as VERSION
 from trac.hooks import load_bootstrap_handler
 from trac.util import autoreload, daemon
 from trac.web.auth import BasicAuthentication, DigestAuthentication
 from trac.web.main import dispatch_request
-from trac.web.wsgi import WSGIServer, WSGIRequestHandler
+from trac.web.wsgi import ThreadPoolMixIn, WSGIServer, WSGIRequestHandler
 
 
 class AuthenticationMiddleware(object):
@@ -117,14 +116,24 @@ class TracEnvironMiddleware(object):
         return self.application(environ, start_response)
 
 
-class TracHTTPServer(ThreadingMixIn, WSGIServer):
+class TracHTTPServer(ThreadPoolMixIn, WSGIServer):
     daemon_threads = True
+    # Seconds an idle keep-alive connection is kept open
+    keepalive_timeout = 15
 
     def __init__(self, server_address, application, env_parent_dir, env_paths,
-                 use_http_11=False):
+                 use_http_11=False, workers=None, max_queue=None,
+                 keepalive_timeout=None):
+        if workers is not None:
+            self.workers = workers
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if keepalive_timeout is not None:
+            self.keepalive_timeout = keepalive_timeout
         request_handlers = (TracHTTPRequestHandler, TracHTTP11RequestHandler)
         WSGIServer.__init__(self, server_address, application,
                             request_handler=request_handlers[bool(use_http_11)])
+        self.environ['tracd.stats'] = self.get_stats
 
     if sys.version_info < (2, 6):
         def serve_forever(self, poll_interval=0.5):
@@ -201,6 +210,20 @@ def main():
                       help='use HTTP/1.0 protocol version instead of HTTP/1.1')
     parser.add_option('--http11', action='store_true', dest='http11',
                       help='use HTTP/1.1 protocol version (default)')
+    parser.add_option('--workers', action='store', type='int',
+                      dest='workers', metavar='N',
+                      help='number of threads handling the requests '
+                           '(default %d)' % TracHTTPServer.workers)
+    parser.add_option('--max-queue', action='store', type='int',
+                      dest='max_queue', metavar='N',
+                      help='number of connections waiting for a thread '
+                           'before the server answers with 503 errors '
+                           '(default %d)' % TracHTTPServer.max_queue)
+    parser.add_option('--keepalive-timeout', action='store', type='float',
+                      dest='keepalive_timeout', metavar='SECONDS',
+                      help='time an idle connection is kept open, unless '
+                           'other connections are waiting for a thread '
+                           '(default %d)' % TracHTTPServer.keepalive_timeout)
     parser.add_option('-e', '--env-parent-dir', action='store',
                       dest='env_parent_dir', metavar='PARENTDIR',
                       help='parent directory of the project environments')
@@ -324,7 +347,11 @@ def main():
             try:
                 httpd = TracHTTPServer(server_address, wsgi_app,
                                        options.env_parent_dir, args,
-                                       use_http_11=options.http11)
+                                       use_http_11=options.http11,
+                                       workers=options.workers,
+                                       max_queue=options.max_queue,
+                                       keepalive_timeout=
+                                           options.keepalive_timeout)
             except socket.error, e:
                 print 'Error starting Trac server on %s' % loc
                 print '[Errno %s] %s' % e.args
@@ -334,6 +361,7 @@ def main():
             print 'Serving on %s' % loc
             if options.http11:
                 print 'Using HTTP/1.1 protocol version'
+            print 'Using %d worker threads' % httpd.workers
             httpd.serve_forever()
     elif options.protocol in ('scgi', 'ajp', 'fcgi'):
         def serve():
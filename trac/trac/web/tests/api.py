@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 
+from __future__ import with_statement
+
 from trac.test import Mock
+from trac.util.datefmt import utc
 from trac.web.api import Request, RequestDone, parse_arg_list
 
+from datetime import datetime
+import os
+import shutil
 from StringIO import StringIO
+import tempfile
 import unittest
 
 
@@ -108,6 +115,19 @@ class RequestTestCase(unittest.TestCase):
         # anyway we're not supposed to send unicode, so we get a ValueError
         self.assertRaises(ValueError, req.write, u'Föö')
 
+    def test_write_streaming(self):
+        buf = StringIO()
+        def start_response(status, headers):
+            self.assertFalse('content-length' in
+                             [name.lower() for name, value in headers])
+            return buf.write
+        req = Request(self._make_environ(), start_response)
+        req.send_header('Content-Type', 'application/zip')
+        req.end_headers(streaming=True)
+        req.write('first')
+        req.write('second')
+        self.assertEqual('firstsecond', buf.getvalue())
+
     def test_invalid_cookies(self):
         environ = self._make_environ(HTTP_COOKIE='bad:key=value;')
         req = Request(environ, None)
@@ -145,6 +165,159 @@ class RequestTestCase(unittest.TestCase):
         req = Request(environ, None)
         self.assertEqual('bar', req.args['action'])
 
+    def _check_modified(self, last_modified=False, extra='x', **kwargs):
+        status_sent = []
+        headers_sent = {}
+        def start_response(status, headers):
+            status_sent.append(status)
+            headers_sent.update(dict(headers))
+        req = Request(self._make_environ(**kwargs), start_response)
+        req.authname = 'joe'
+        try:
+            req.check_modified(datetime(2013, 1, 2, 3, 4, 5, 0, utc), extra,
+                               last_modified=last_modified)
+        except RequestDone:
+            return status_sent[0], headers_sent
+        return None, req._outheaders
+
+    def test_check_modified_etag(self):
+        etag = 'W/"joe/Wed, 02 Jan 2013 03:04:05 GMT/x"'
+        status, headers = self._check_modified()
+        self.assertEqual(None, status)
+        self.assertEqual([('ETag', etag)], headers)
+        status, headers = self._check_modified(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual('304 Not Modified', status)
+        status, headers = self._check_modified(
+            HTTP_IF_MODIFIED_SINCE='Wed, 02 Jan 2013 03:04:05 GMT')
+        self.assertEqual(None, status)
+
+    def test_check_modified_last_modified(self):
+        lastmod = 'Wed, 02 Jan 2013 03:04:05 GMT'
+        status, headers = self._check_modified(True)
+        self.assertEqual(None, status)
+        self.assertEqual(('Last-Modified', lastmod), headers[1])
+        status, headers = self._check_modified(
+            True, '', HTTP_IF_MODIFIED_SINCE=lastmod)
+        self.assertEqual('304 Not Modified', status)
+        status, headers = self._check_modified(
+            True, '', HTTP_IF_MODIFIED_SINCE=lastmod,
+            HTTP_IF_NONE_MATCH='W/"y"')
+        self.assertEqual(None, status)
+
+    def test_check_modified_last_modified_extra(self):
+        # The time alone doesn't validate the `extra` variant
+        status, headers = self._check_modified(
+            True, ['count', 2],
+            HTTP_IF_MODIFIED_SINCE='Wed, 02 Jan 2013 03:04:05 GMT')
+        self.assertEqual(None, status)
+        self.assertEqual('Last-Modified', headers[1][0])
+
+
+class SendFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='trac-')
+        self.path = os.path.join(self.dir, 'trac.css')
+        self._create_file(self.path, 'body { color: black }')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _create_file(self, path, content, mtime=1356998400):
+        with open(path, 'wb') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def _send_file(self, method='GET', **kwargs):
+        status_sent = []
+        headers_sent = {}
+        def start_response(status, headers):
+            status_sent.append(status)
+            headers_sent.update(dict(headers))
+        environ = {'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(''),
+                   'REQUEST_METHOD': method, 'SERVER_NAME': 'example.org',
+                   'SERVER_PORT': 80, 'SCRIPT_NAME': '/trac'}
+        environ.update((key, value) for key, value in kwargs.items()
+                       if key.startswith('HTTP_'))
+        req = Request(environ, start_response)
+        options = dict((key, value) for key, value in kwargs.items()
+                       if not key.startswith('HTTP_'))
+        self.assertRaises(RequestDone, req.send_file, self.path, 'text/css',
+                          **options)
+        content = None
+        if req._response:
+            content = ''.join(req._response)
+            req._response.close()
+        return status_sent[0], headers_sent, content
+
+    def test_send_file(self):
+        status, headers, content = self._send_file()
+        self.assertEqual('200 Ok', status)
+        self.assertEqual('text/css', headers['Content-Type'])
+        self.assertEqual('21', headers['Content-Length'])
+        self.assertEqual('body { color: black }', content)
+        self.assertFalse('ETag' in headers)
+        self.assertFalse('Cache-Control' in headers)
+        status, headers, content = self._send_file(
+            HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+        self.assertEqual('304 Not Modified', status)
+
+    def test_send_file_etag(self):
+        status, headers, content = self._send_file(etag='1234', max_age=60)
+        self.assertEqual('200 Ok', status)
+        self.assertEqual('"1234"', headers['ETag'])
+        self.assertEqual('public, max-age=60', headers['Cache-Control'])
+        last_modified = headers['Last-Modified']
+        status, headers, content = self._send_file(
+            etag='1234', HTTP_IF_NONE_MATCH='"0000", "1234"')
+        self.assertEqual('304 Not Modified', status)
+        self.assertEqual('"1234"', headers['ETag'])
+        self.assertEqual(None, content)
+        status, headers, content = self._send_file(
+            etag='5678', HTTP_IF_NONE_MATCH='"1234"',
+            HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual('200 Ok', status)
+
+    def test_send_file_precompressed(self):
+        self._create_file(self.path + '.gz', 'gzipped')
+        status, headers, content = self._send_file(
+            etag='1234', precompressed=True,
+            HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual('text/css', headers['Content-Type'])
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', headers['Vary'])
+        self.assertEqual('"1234-gzip"', headers['ETag'])
+        self.assertEqual('7', headers['Content-Length'])
+        self.assertEqual('gzipped', content)
+        status, headers, content = self._send_file(
+            etag='1234', precompressed=True,
+            HTTP_ACCEPT_ENCODING='gzip;q=0, deflate')
+        self.assertFalse('Content-Encoding' in headers)
+        self.assertEqual('Accept-Encoding', headers['Vary'])
+        self.assertEqual('"1234"', headers['ETag'])
+        self.assertEqual('body { color: black }', content)
+        status, headers, content = self._send_file(
+            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse('Content-Encoding' in headers)
+
+    def test_send_file_precompressed_outdated(self):
+        self._create_file(self.path + '.gz', 'gzipped', 1356998399)
+        self._create_file(self.path + '.br', 'brotli')
+        status, headers, content = self._send_file(
+            precompressed=True, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse('Content-Encoding' in headers)
+        self.assertEqual('body { color: black }', content)
+        status, headers, content = self._send_file(
+            precompressed=True, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual('br', headers['Content-Encoding'])
+        self.assertEqual('brotli', content)
+
+    def test_send_file_head(self):
+        status, headers, content = self._send_file('HEAD')
+        self.assertEqual('200 Ok', status)
+        self.assertEqual('21', headers['Content-Length'])
+        self.assertEqual(None, content)
+
 
 class ParseArgListTestCase(unittest.TestCase):
 
@@ -170,6 +343,7 @@ class ParseArgListTestCase(unittest.TestCase):
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(RequestTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(SendFileTestCase, 'test'))
     suite.addTest(unittest.makeSuite(ParseArgListTestCase, 'test'))
     return suite
 
@@ -11,14 +11,22 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from __future__ import with_statement
+
+from genshi.template import TemplateLoader
+
 from trac.core import Component, implements
 from trac.test import EnvironmentStub
 from trac.tests.contentgen import random_sentence
 from trac.web.chrome import (
-    Chrome, INavigationContributor, add_link, add_meta, add_notice, add_script,
-    add_script_data, add_stylesheet, add_warning)
+    Chrome, INavigationContributor, ITemplateProvider, add_link, add_meta,
+    add_notice, add_script, add_script_data, add_stylesheet, add_warning)
 from trac.web.href import Href
 
+from hashlib import sha1
+import os
+import shutil
+import tempfile
 import unittest
 
 class Request(object):
@@ -305,8 +313,198 @@ class ChromeTestCase(unittest.TestCase):
         self.assertEqual('test2', items[1]['name'])
 
 
+class StaticFingerprintTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        from trac.core import ComponentMeta
+        self._old_registry = ComponentMeta._registry
+        ComponentMeta._registry = {}
+        self.dir = tempfile.mkdtemp(prefix='trac-')
+        htdocs_dir = self.dir
+        class HtdocsProvider(Component):
+            implements(ITemplateProvider)
+            def get_htdocs_dirs(self):
+                return [('test', htdocs_dir)]
+            def get_templates_dirs(self):
+                return []
+        os.mkdir(os.path.join(self.dir, 'js'))
+        self._create_file('js/test.js', 'alert(1);')
+        self._create_file('js/test.js.gz', 'gzipped')
+
+    def tearDown(self):
+        from trac.core import ComponentMeta
+        ComponentMeta._registry = self._old_registry
+        shutil.rmtree(self.dir)
+
+    def _create_file(self, filename, content):
+        with open(os.path.join(self.dir, filename), 'wb') as f:
+            f.write(content)
+
+    def test_get_static_fingerprint(self):
+        chrome = Chrome(self.env)
+        fingerprint = sha1('alert(1);').hexdigest()[:16]
+        self.assertEqual(fingerprint,
+                         chrome.get_static_fingerprint('test/js/test.js'))
+        self.assertEqual(['test/js/test.js'], chrome.static_files.keys())
+        self.assertEqual(None, chrome.get_static_fingerprint('test/js/x.js'))
+        self.assertEqual(None, chrome.get_static_fingerprint('other/x.js'))
+
+    def test_get_static_fingerprint_auto_reload(self):
+        chrome = Chrome(self.env)
+        fingerprint = chrome.get_static_fingerprint('test/js/test.js')
+        self._create_file('js/test.js', 'alert(42);')
+        self.assertEqual(fingerprint,
+                         chrome.get_static_fingerprint('test/js/test.js'))
+        self.env.config.set('trac', 'auto_reload', True)
+        self.assertEqual(sha1('alert(42);').hexdigest()[:16],
+                         chrome.get_static_fingerprint('test/js/test.js'))
+
+    def test_fingerprinted_href(self):
+        chrome = Chrome(self.env)
+        req = Request(href=Href('/trac.cgi'))
+        req.chrome['static_fingerprint'] = chrome.get_static_fingerprint
+        add_script(req, 'test/js/test.js')
+        add_script(req, 'test/js/x.js')
+        add_stylesheet(req, '/test/js/test.js')
+        fingerprint = chrome.get_static_fingerprint('test/js/test.js')
+        self.assertEqual('/trac.cgi/chrome/test/js/test.js?v=' + fingerprint,
+                         req.chrome['scripts'][0]['href'])
+        self.assertEqual('/trac.cgi/chrome/test/js/x.js',
+                         req.chrome['scripts'][1]['href'])
+        self.assertEqual('/trac.cgi/test/js/test.js',
+                         req.chrome['links']['stylesheet'][0]['href'])
+
+    def _process_request(self, **args):
+        sent = []
+        def send_file(*args, **kwargs):
+            sent.append((args, kwargs))
+        req = Request(args=args, send_file=send_file)
+        Chrome(self.env).process_request(req)
+        return sent[0]
+
+    def test_process_request(self):
+        fingerprint = sha1('alert(1);').hexdigest()[:16]
+        path = os.path.join(self.dir, 'js', 'test.js')
+        args, kwargs = self._process_request(prefix='test',
+                                             filename='js/test.js')
+        self.assertEqual((path, 'application/javascript'), args)
+        self.assertEqual({'etag': fingerprint, 'max_age': None,
+                          'precompressed': True}, kwargs)
+        args, kwargs = self._process_request(prefix='test',
+                                             filename='js/test.js',
+                                             v=fingerprint)
+        self.assertEqual(31536000, kwargs['max_age'])
+        args, kwargs = self._process_request(prefix='test',
+                                             filename='js/test.js', v='old')
+        self.assertEqual(None, kwargs['max_age'])
+
+    def test_static_max_age_disables_fingerprints(self):
+        self.env.config.set('trac', 'static_max_age', 0)
+        req = Request(abs_href=Href('http://example.org/trac.cgi'),
+                      href=Href('/trac.cgi'), base_path='/trac.cgi',
+                      path_info='',
+                      add_redirect_listener=lambda listener: None)
+        chrome = Chrome(self.env).prepare_request(req)
+        self.assertFalse('static_fingerprint' in chrome)
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        from trac.core import ComponentMeta
+        self._old_registry = ComponentMeta._registry
+        ComponentMeta._registry = {}
+        self.env.path = tempfile.mkdtemp(prefix='trac-')
+        self.env.config.set('trac', 'template_cache_dir', 'cache/templates')
+        templates_dir = self.dir = os.path.join(self.env.path, 'templates')
+        class TemplatesProvider(Component):
+            implements(ITemplateProvider)
+            def get_htdocs_dirs(self):
+                return []
+            def get_templates_dirs(self):
+                return [templates_dir]
+        os.mkdir(self.dir)
+        self._create_file('test.html', '<p xmlns:py="http://genshi.edgewall'
+                                       '.org/">${name.upper()}</p>')
+        self._create_file('test.txt', 'Hello ${name}')
+        self.parsed = []
+        self._instantiate = TemplateLoader._instantiate
+        def instantiate(loader, cls, fileobj, filepath, filename,
+                        encoding=None):
+            self.parsed.append(filename)
+            return self._instantiate(loader, cls, fileobj, filepath,
+                                     filename, encoding)
+        TemplateLoader._instantiate = instantiate
+
+    def tearDown(self):
+        from trac.core import ComponentMeta
+        ComponentMeta._registry = self._old_registry
+        TemplateLoader._instantiate = self._instantiate
+        shutil.rmtree(self.env.path)
+
+    def _create_file(self, filename, content):
+        with open(os.path.join(self.dir, filename), 'wb') as f:
+            f.write(content)
+
+    def _render(self, filename, method=None):
+        chrome = Chrome(self.env)
+        chrome.templates = None  # as in a new process
+        template = chrome.load_template(filename, method)
+        return template.generate(name='trac').render(method or 'xhtml')
+
+    def _cached_files(self):
+        cache_dir = os.path.join(self.env.path, 'cache', 'templates')
+        return [filename
+                for dirpath, dirnames, filenames in os.walk(cache_dir)
+                for filename in filenames]
+
+    def test_parsed_once(self):
+        self.assertEqual('<p>TRAC</p>', self._render('test.html'))
+        self.assertEqual('<p>TRAC</p>', self._render('test.html'))
+        self.assertEqual('Hello trac', self._render('test.txt', 'text'))
+        self.assertEqual('Hello trac', self._render('test.txt', 'text'))
+        self.assertEqual(['test.html', 'test.txt'], self.parsed)
+        self.assertEqual(2, len(self._cached_files()))
+
+    def test_modified_template(self):
+        self._render('test.html')
+        self._create_file('test.html', '<p xmlns:py="http://genshi.edgewall'
+                                       '.org/">${name.lower()}!</p>')
+        self.assertEqual('<p>trac!</p>', self._render('test.html'))
+        self.assertEqual(['test.html', 'test.html'], self.parsed)
+        self.assertEqual(1, len(self._cached_files()))
+
+    def test_cache_disabled(self):
+        self.env.config.set('trac', 'template_cache_dir', '')
+        self._render('test.html')
+        self._render('test.html')
+        self.assertEqual(['test.html', 'test.html'], self.parsed)
+        self.assertEqual([], self._cached_files())
+
+    def test_warm_up_templates(self):
+        chrome = Chrome(self.env)
+        self.assertEqual(['test.html', 'test.txt'],
+                         chrome.get_all_templates())
+        self.assertEqual([], chrome.warm_up_templates())
+        self._create_file('invalid.html', '<p>')
+        errors = chrome.warm_up_templates()
+        self.assertEqual(['invalid.html'], [name for name, e in errors])
+        self.assertEqual(2, len(self._cached_files()))
+
+    def test_preload(self):
+        self.env.config.set('trac', 'preload_templates', 'test.html')
+        Chrome(self.env).preload()
+        self.assertEqual(['test.html'], self.parsed)
+
+
 def suite():
-    return unittest.makeSuite(ChromeTestCase, 'test')
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ChromeTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(StaticFingerprintTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(TemplateCacheTestCase, 'test'))
+    return suite
 
 if __name__ == '__main__':
     unittest.main(defaultTest='suite')
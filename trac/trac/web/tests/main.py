@@ -11,12 +11,25 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from trac.cache import CacheManager, key_to_id
+from trac.core import Component, implements
+from trac.perm import PermissionSystem
+from trac.test import EnvironmentStub
 from trac.util import create_file
-from trac.web.main import get_environments
+from trac.util.datefmt import from_utimestamp
+from trac.web.api import IRequestHandler, IRequestValidator, Request, \
+                         RequestDone
+from trac.web.main import RequestDispatcher, get_environments
+import trac.web.instrumentation
 
+from StringIO import StringIO
+import doctest
+import json
+import os.path
+import re
+import shutil
 import tempfile
 import unittest
-import os.path
 
 
 class EnvironmentsTestCase(unittest.TestCase):
@@ -74,9 +87,185 @@ class EnvironmentsTestCase(unittest.TestCase):
                           get_environments(self.environ))
 
 
+class TimingTestHandler(Component):
+
+    implements(IRequestHandler)
+
+    def match_request(self, req):
+        return req.path_info == '/timing-test'
+
+    def process_request(self, req):
+        self.env.db_query("SELECT name FROM system")
+        req.send('ok', 'text/plain')
+
+
+class RequestTimingsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.web.*', 'trac.perm.*',
+                                           TimingTestHandler])
+        self.env.path = tempfile.mkdtemp(prefix='trac-tempenv-')
+        os.mkdir(self.env.get_log_dir())
+        PermissionSystem(self.env).grant_permission('admin', 'TRAC_ADMIN')
+        self.headers = None
+
+    def tearDown(self):
+        self.env.reset_db()
+        shutil.rmtree(self.env.path)
+
+    def _dispatch(self, query_string='', authname='anonymous'):
+        def start_response(status, headers):
+            self.headers = dict(headers)
+            return lambda data: None
+        environ = {'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(''),
+                   'REQUEST_METHOD': 'GET', 'SERVER_NAME': 'example.org',
+                   'SERVER_PORT': 80, 'SCRIPT_NAME': '/trac',
+                   'PATH_INFO': '/timing-test', 'QUERY_STRING': query_string,
+                   'REMOTE_USER': authname}
+        req = Request(environ, start_response)
+        self.assertRaises(RequestDone, RequestDispatcher(self.env).dispatch,
+                          req)
+        return req
+
+    def test_server_timing_header(self):
+        self._dispatch()
+        self.assertFalse('Server-Timing' in self.headers)
+        self.env.config.set('trac', 'server_timing', 'enabled')
+        self._dispatch()
+        server_timing = self.headers['Server-Timing']
+        self.assertTrue(server_timing.startswith('pre;dur='))
+        # the handler sends the response itself
+        self.assertTrue(re.search(r', handler;dur=[\d.]+, ', server_timing))
+        self.assertTrue(re.search(r'sql;dur=[\d.]+;desc="SQL \(\d+\)", '
+                                  r'total;dur=[\d.]+$', server_timing))
+
+    def test_timing_log(self):
+        self.env.config.set('trac', 'request_timing_log', 'timing.log')
+        self._dispatch()
+        self._dispatch('format=txt')
+        f = open(os.path.join(self.env.get_log_dir(), 'timing.log'))
+        try:
+            records = [json.loads(line) for line in f]
+        finally:
+            f.close()
+        self.assertEqual(['', 'format=txt'],
+                         [record['query'] for record in records])
+        record = records[0]
+        self.assertEqual('/timing-test', record['path'])
+        self.assertEqual(['handler', 'pre'], sorted(record['phases']))
+        self.assertTrue(record['sql_count'] > 0)
+        self.assertTrue(record['total'] >= record['phases']['handler'])
+        self.assertEqual(None, record['profile'])
+
+    def test_profile(self):
+        req = self._dispatch('__profile=1')
+        self.assertEqual(None, req.timings.profile)
+        req = self._dispatch('__profile=1', 'admin')
+        self.assertTrue(os.path.isfile(req.timings.profile))
+
+    def test_old_profiles_removed(self):
+        self.env.config.set('trac', 'profile_files', 2)
+        log_dir = self.env.get_log_dir()
+        for ms in (1000, 2000, 3000):
+            open(os.path.join(log_dir, 'profile-%d.prof' % ms), 'w').close()
+        req = self._dispatch('__profile=1', 'admin')
+        self.assertEqual(sorted(['profile-3000.prof',
+                                 os.path.basename(req.timings.profile)]),
+                         sorted(name for name in os.listdir(log_dir)
+                                if name.endswith('.prof')))
+
+
+class ValidatorTestHandler(Component):
+
+    implements(IRequestHandler, IRequestValidator)
+
+    processed = 0
+    version = 1
+
+    def match_request(self, req):
+        return req.path_info == '/validator-test'
+
+    def process_request(self, req):
+        ValidatorTestHandler.processed += 1
+        req.send('version %d' % self.version, 'text/plain')
+
+    def get_request_validator(self, req):
+        if 'uncached' not in req.args:
+            return from_utimestamp(0), [self.version]
+
+
+class RequestValidatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.web.*', 'trac.perm.*',
+                                           ValidatorTestHandler])
+        ValidatorTestHandler.processed = 0
+        ValidatorTestHandler.version = 1
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _dispatch(self, etag=None, query_string='', method='GET'):
+        response = {}
+        def start_response(status, headers):
+            response.update(status=status, headers=dict(headers))
+            return lambda data: None
+        environ = {'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(''),
+                   'REQUEST_METHOD': method, 'SERVER_NAME': 'example.org',
+                   'SERVER_PORT': 80, 'SCRIPT_NAME': '/trac',
+                   'PATH_INFO': '/validator-test',
+                   'QUERY_STRING': query_string}
+        if etag:
+            environ['HTTP_IF_NONE_MATCH'] = etag
+        req = Request(environ, start_response)
+        self.assertRaises(RequestDone, RequestDispatcher(self.env).dispatch,
+                          req)
+        return response['status'], response['headers'].get('ETag')
+
+    def test_not_modified(self):
+        status, etag = self._dispatch()
+        self.assertEqual('200 Ok', status)
+        self.assertTrue(etag.startswith('W/"anonymous/'))
+        self.assertEqual(('304 Not Modified', None), self._dispatch(etag))
+        self.assertEqual(1, ValidatorTestHandler.processed)
+
+    def test_modified_resource(self):
+        status, etag = self._dispatch()
+        ValidatorTestHandler.version = 2
+        status, new_etag = self._dispatch(etag)
+        self.assertEqual('200 Ok', status)
+        self.assertNotEqual(etag, new_etag)
+
+    def test_modified_cache(self):
+        status, etag = self._dispatch()
+        cache_manager = CacheManager(self.env)
+        cache_manager.invalidate(key_to_id('ValidatorTestCache'))
+        cache_manager.reset_metadata()  # done by `open_environment`
+        status, new_etag = self._dispatch(etag)
+        self.assertEqual('200 Ok', status)
+        self.assertNotEqual(etag, new_etag)
+
+    def test_modified_permissions(self):
+        status, etag = self._dispatch()
+        PermissionSystem(self.env).grant_permission('anonymous',
+                                                    'TRAC_ADMIN')
+        status, new_etag = self._dispatch(etag)
+        self.assertEqual('200 Ok', status)
+        self.assertNotEqual(etag, new_etag)
+
+    def test_not_validated(self):
+        status, etag = self._dispatch()
+        self.assertEqual(('200 Ok', None),
+                         self._dispatch(etag, 'uncached=1'))
+        self.assertEqual(2, ValidatorTestHandler.processed)
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(EnvironmentsTestCase, 'test'))
+    suite.addTest(doctest.DocTestSuite(trac.web.instrumentation))
+    suite.addTest(unittest.makeSuite(RequestTimingsTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RequestValidatorTestCase, 'test'))
     return suite
 
 
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import httplib
+import time
+import unittest
+
+from trac.util.concurrency import threading
+from trac.web.wsgi import ThreadPoolMixIn, WSGIRequestHandler, WSGIServer
+
+
+class HTTP11RequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PoolServer(ThreadPoolMixIn, WSGIServer):
+    workers = 2
+    max_queue = 1
+    keepalive_timeout = 1
+
+
+class ThreadPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.threads = set()
+        def application(environ, start_response):
+            self.threads.add(threading.currentThread().getName())
+            self.release.wait(5)
+            body = environ['PATH_INFO']
+            headers = [('Content-Type', 'text/plain')]
+            if body != '/streamed':
+                headers.append(('Content-Length', str(len(body))))
+            write = start_response('200 OK', headers)
+            write(body[:4])
+            return [body[4:]]
+        self.server = PoolServer(('127.0.0.1', 0), application,
+                                 request_handler=HTTP11RequestHandler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _connect(self):
+        return httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+
+    def _get(self, cnx, path):
+        cnx.request('GET', path)
+        response = cnx.getresponse()
+        return response.status, response.read()
+
+    def _wait_for(self, condition):
+        for i in xrange(100):
+            if condition(self.server.get_stats()):
+                return
+            time.sleep(0.05)
+        self.fail(self.server.get_stats())
+
+    def test_requests_handled_by_workers(self):
+        for i in xrange(6):
+            self.assertEqual((200, '/%d' % i),
+                             self._get(self._connect(), '/%d' % i))
+        self.assertTrue(self.threads <= set(['tracd-worker-0',
+                                             'tracd-worker-1']))
+        self._wait_for(lambda stats: stats['handled'] == 6)
+        stats = self.server.get_stats()
+        self.assertEqual(2, stats['workers'])
+        self.assertEqual(0, stats['busy'])
+        self.assertEqual(0, stats['rejected'])
+
+    def test_keepalive(self):
+        cnx = self._connect()
+        self.assertEqual((200, '/1'), self._get(cnx, '/1'))
+        self.assertEqual((200, '/2'), self._get(cnx, '/2'))
+        self._wait_for(lambda stats: stats['busy'] == 1)
+        self.assertEqual(0, self.server.get_stats()['handled'])
+        cnx.close()
+        self._wait_for(lambda stats: stats['handled'] == 1)
+
+    def test_idle_timeout(self):
+        cnx = self._connect()
+        self.assertEqual((200, '/1'), self._get(cnx, '/1'))
+        # The connection is closed after `keepalive_timeout` seconds
+        self._wait_for(lambda stats: stats['handled'] == 1)
+        cnx.close()
+
+    def test_streamed_response_closes_connection(self):
+        cnx = self._connect()
+        cnx.request('GET', '/streamed')
+        response = cnx.getresponse()
+        self.assertEqual('close', response.getheader('Connection'))
+        self.assertEqual('/streamed', response.read())
+        self._wait_for(lambda stats: stats['handled'] == 1)
+        cnx.close()
+
+    def test_backpressure(self):
+        self.release.clear()
+        connections = []
+        for i in xrange(3):
+            # 2 connections are handled and 1 is queued
+            cnx = self._connect()
+            cnx.request('GET', '/%d' % i)
+            connections.append(cnx)
+            self._wait_for(lambda stats: stats['busy'] == min(i + 1, 2)
+                                         and stats['queued'] == max(i - 1, 0))
+        cnx = self._connect()
+        self.assertEqual(503, self._get(cnx, '/rejected')[0])
+        stats = self.server.get_stats()
+        self.assertEqual(1, stats['rejected'])
+        self.assertEqual(1, stats['max_queued'])
+        self.release.set()
+        for i, cnx in enumerate(connections):
+            response = cnx.getresponse()
+            self.assertEqual((200, '/%d' % i),
+                             (response.status, response.read()))
+            cnx.close()
+
+    def test_idle_connections_yield_to_waiting_ones(self):
+        self.server.keepalive_timeout = 30
+        idle = [self._connect() for i in xrange(2)]
+        for i, cnx in enumerate(idle):
+            self.assertEqual((200, '/%d' % i), self._get(cnx, '/%d' % i))
+        self._wait_for(lambda stats: stats['busy'] == 2)
+        # The idle connections are closed instead of waiting for
+        # `keepalive_timeout` seconds
+        start = time.time()
+        self.assertEqual((200, '/waiting'),
+                         self._get(self._connect(), '/waiting'))
+        self.assertTrue(time.time() - start < 5)
+        for cnx in idle:
+            cnx.close()
+
+    def test_server_close_with_full_queue(self):
+        self.release.clear()
+        connections = []
+        for i in xrange(3):
+            cnx = self._connect()
+            cnx.request('GET', '/%d' % i)
+            connections.append(cnx)
+            self._wait_for(lambda stats: stats['busy'] == min(i + 1, 2)
+                                         and stats['queued'] == max(i - 1, 0))
+        self.server.shutdown()
+        thread = threading.Thread(target=self.server.server_close)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.isAlive())
+        # The queued connection is closed without a response
+        self.assertRaises(httplib.BadStatusLine, connections[2].getresponse)
+        self.release.set()
+        for i, cnx in enumerate(connections[:2]):
+            response = cnx.getresponse()
+            self.assertEqual((200, '/%d' % i),
+                             (response.status, response.read()))
+        for cnx in connections:
+            cnx.close()
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ThreadPoolTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
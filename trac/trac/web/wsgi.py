@@ -14,13 +14,20 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+from __future__ import with_statement
+
 import errno
+import shutil
 import socket
 import sys
+import time
+import Queue
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
-from SocketServer import ForkingMixIn, ThreadingMixIn
+from SocketServer import ForkingMixIn, TCPServer, ThreadingMixIn
 import urllib
 
+from trac.util.concurrency import threading
+
 
 class _ErrorsWrapper(object):
 
@@ -127,8 +134,23 @@ class WSGIGateway(object):
 
 class WSGIRequestHandler(BaseHTTPRequestHandler):
 
+    # Interval in seconds at which an idle connection checks whether
+    # other connections are waiting for a worker
+    idle_poll_interval = 0.5
+
     def setup_environ(self):
-        self.raw_requestline = self.rfile.readline()
+        # Wait at most `keepalive_timeout` seconds for the next request
+        idle_timeout = getattr(self.server, 'keepalive_timeout', None)
+        if idle_timeout:
+            if not self._wait_for_request(idle_timeout):
+                self.close_connection = 1
+                return
+            self.connection.settimeout(idle_timeout)
+        try:
+            self.raw_requestline = self.rfile.readline()
+        finally:
+            if idle_timeout:
+                self.connection.settimeout(self.timeout)
         if (self.rfile.closed or              # disconnect
                 not self.raw_requestline or   # empty request
                 not self.parse_request()):    # invalid request
@@ -176,12 +198,44 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
 
         return environ
 
+    def _wait_for_request(self, timeout):
+        """Wait at most `timeout` seconds for data on the connection.
+
+        Return `False` if no data arrived in time, or as soon as other
+        connections are waiting for a worker of the server, so that an
+        idle client doesn't keep a worker from serving them.
+        """
+        rbuf = getattr(self.rfile, '_rbuf', None)
+        if rbuf is not None and rbuf.tell():
+            return True # the next request was already read (pipelining)
+        requests_waiting = getattr(self.server, 'requests_waiting', None)
+        deadline = time.time() + timeout
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.connection.settimeout(min(remaining,
+                                               self.idle_poll_interval))
+                try:
+                    # data or disconnect, which is detected when reading
+                    self.connection.recv(1, socket.MSG_PEEK)
+                    return True
+                except socket.timeout:
+                    if requests_waiting and requests_waiting():
+                        return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
     def handle_one_request(self):
         try:
             environ = self.setup_environ()
         except (IOError, socket.error), e:
             environ = None
-            if e.args[0] in (errno.EPIPE, errno.ECONNRESET, 10053, 10054):
+            if isinstance(e, socket.timeout):
+                # idle connection
+                self.close_connection = 1
+            elif e.args[0] in (errno.EPIPE, errno.ECONNRESET, 10053, 10054):
                 # client disconnect
                 self.close_connection = 1
             else:
@@ -189,6 +243,11 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
         if environ:
             gateway = self.server.gateway(self, environ)
             gateway.run(self.server.application)
+            # don't keep a worker waiting on this connection while other
+            # connections are waiting for a worker
+            requests_waiting = getattr(self.server, 'requests_waiting', None)
+            if requests_waiting and requests_waiting():
+                self.close_connection = 1
         # else we had no request or a bad request: we simply exit (#3043)
 
     def finish(self):
@@ -200,6 +259,8 @@ class WSGIRequestHandler(BaseHTTPRequestHandler):
 
 class WSGIServerGateway(WSGIGateway):
 
+    sendfile_blocksize = 65536
+
     def __init__(self, handler, environ):
         WSGIGateway.__init__(self, environ, handler.rfile,
                              _ErrorsWrapper(lambda x: handler.log_error('%s', x)))
@@ -216,6 +277,11 @@ class WSGIServerGateway(WSGIGateway):
                 self.handler.send_response(int(status[:3]))
                 for name, value in headers:
                     self.handler.send_header(name, value)
+                if int(status[:3]) not in (204, 304) and \
+                        not any(name.lower() == 'content-length'
+                                for name, value in headers):
+                    # the end of the connection marks the end of the content
+                    self.handler.send_header('Connection', 'close')
                 self.handler.end_headers()
             self.handler.wfile.write(data)
         except (IOError, socket.error), e:
@@ -225,6 +291,145 @@ class WSGIServerGateway(WSGIGateway):
             else:
                 raise
 
+    def _sendfile(self, fileobj):
+        """Copy the file to the connection in large blocks, instead of
+        iterating over the `wsgi.file_wrapper` in small chunks.
+
+        :since 1.0.2:
+        """
+        self._write('')
+        if self.handler.wfile.closed:
+            return
+        try:
+            shutil.copyfileobj(fileobj, self.handler.wfile,
+                               self.sendfile_blocksize)
+        except (IOError, socket.error), e:
+            if e.args[0] in (errno.EPIPE, errno.ECONNRESET, 10053, 10054):
+                # client disconnect
+                self.handler.close_connection = 1
+            else:
+                raise
+
+
+class ThreadPoolMixIn:
+    """Mix-in class for a `TCPServer` handling the connections in a
+    bounded pool of worker threads, instead of starting a thread for
+    each connection like `ThreadingMixIn`.
+
+    The accepted connections wait in a queue until a worker is
+    available. When `max_queue` connections are already waiting, the
+    connection is answered with a "503 Service Unavailable" response and
+    closed.
+
+    :since 1.0.2:
+    """
+
+    workers = 10
+    max_queue = 50
+    daemon_threads = True
+
+    def server_activate(self):
+        TCPServer.server_activate(self)
+        self._queue = Queue.Queue(max(self.max_queue, 1))
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('busy', 'handled', 'rejected',
+                                     'max_queued'), 0)
+        self._threads = []
+        for i in xrange(max(self.workers, 1)):
+            thread = threading.Thread(target=self._process_requests,
+                                      name='tracd-worker-%d' % i)
+            thread.setDaemon(self.daemon_threads)
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except Queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            self.reject_request(request, client_address)
+        else:
+            queued = self._queue.qsize()
+            with self._lock:
+                if queued > self._stats['max_queued']:
+                    self._stats['max_queued'] = queued
+
+    def reject_request(self, request, client_address):
+        """Answer a connection which can't be queued with a 503 error."""
+        body = 'Server busy, please try again later.\n'
+        try:
+            request.settimeout(5)
+            request.sendall('HTTP/1.0 503 Service Unavailable\r\n'
+                            'Content-Type: text/plain\r\n'
+                            'Content-Length: %d\r\n'
+                            'Retry-After: 5\r\n'
+                            'Connection: close\r\n\r\n%s'
+                            % (len(body), body))
+        except socket.error:
+            pass
+        self._shutdown_request(request)
+
+    def requests_waiting(self):
+        """Return `True` if connections are waiting for a worker."""
+        return not self._queue.empty()
+
+    def get_stats(self):
+        """Return the statistics of the worker pool as a `dict`: the
+        number of `workers`, of `busy` workers, of `queued` connections
+        and the `max_queue` limit, the `max_queued` connections so far,
+        and the number of `handled` and `rejected` connections.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(workers=len(self._threads), queued=self._queue.qsize(),
+                     max_queue=self.max_queue)
+        return stats
+
+    def server_close(self):
+        TCPServer.server_close(self)
+        # close the connections still waiting for a worker
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None:
+                self._shutdown_request(item[0])
+        # stop the workers, each one passing the sentinel to the next
+        self._stop_next_worker()
+        self._threads = []
+
+    def _stop_next_worker(self):
+        try:
+            self._queue.put_nowait(None)
+        except Queue.Full:
+            pass
+
+    def _process_requests(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._stop_next_worker()
+                break
+            request, client_address = item
+            with self._lock:
+                self._stats['busy'] += 1
+            try:
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+            finally:
+                self._shutdown_request(request)
+                with self._lock:
+                    self._stats['busy'] -= 1
+                    self._stats['handled'] += 1
+
+    def _shutdown_request(self, request):
+        # `shutdown_request` was added in Python 2.6
+        getattr(self, 'shutdown_request', self.close_request)(request)
+
 
 class WSGIServer(HTTPServer):
 
@@ -234,7 +439,8 @@ class WSGIServer(HTTPServer):
 
         self.application = application
 
-        gateway.wsgi_multithread = isinstance(self, ThreadingMixIn)
+        gateway.wsgi_multithread = isinstance(self, (ThreadingMixIn,
+                                                     ThreadPoolMixIn))
         gateway.wsgi_multiprocess = isinstance(self, ForkingMixIn)
         self.gateway = gateway
 
@@ -150,8 +150,7 @@ class WikiAdmin(Component):
                              '127.0.0.1', %s FROM wiki WHERE name=%s
                       """, (title, to_utimestamp(datetime.now(utc)), data,
                             title))
-            if not old:
-                del WikiSystem(self.env).pages
+                WikiSystem(self.env).update_pages(title)
         return True
 
     def load_pages(self, dir, ignore=[], create_only=[], replace=False):
@@ -16,6 +16,7 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+from bisect import bisect_left, insort
 import re
 
 from genshi.builder import tag
@@ -251,6 +252,105 @@ def validate_page_name(pagename):
            all(part not in ('', '.', '..') for part in pagename.split('/'))
 
 
+class PageCatalogue(frozenset):
+    """The names of the existing wiki pages.
+
+    The names are also kept sorted, so that the pages having a given
+    prefix can be retrieved without going through all the pages.
+
+    :since 1.0.2:
+    """
+
+    def __new__(cls, names=()):
+        self = frozenset.__new__(cls, names)
+        self._names = sorted(self)
+        return self
+
+    def iter_names(self, prefix=None, depth=None):
+        """Iterate over the sorted page names.
+
+        :param prefix: if given, only names that start with that
+          prefix are included.
+        :param depth: if given, only names with at most `depth` more
+          `/` than the prefix are included.
+        """
+        names = self._names
+        prefix = prefix or ''
+        start = bisect_left(names, prefix)
+        if depth is not None:
+            depth += prefix.count('/')
+        while start < len(names):
+            name = names[start]
+            if not name.startswith(prefix):
+                break
+            if depth is not None and name.count('/') > depth:
+                # Skip the pages below the ancestor at the maximum depth
+                ancestor = '/'.join(name.split('/')[:depth + 1])
+                start = bisect_left(names, ancestor + '0', start)
+                continue
+            yield name
+            start += 1
+
+    def get_existing(self, names):
+        """Return the set of the given names which are existing
+        pages."""
+        return set(name for name in names if name in self)
+
+    def updated(self, added=(), removed=()):
+        """Return a copy of the catalogue with the `added` pages and
+        without the `removed` pages."""
+        return PageCatalogue(self.union(added).difference(removed))
+
+
+class RecentPages(object):
+    """The version and time of the latest version of the existing wiki
+    pages, indexed by time so that the latest modified pages can be
+    retrieved without going through all the pages.
+
+    :since 1.0.2:
+    """
+
+    def __init__(self, entries=()):
+        """Create the index from `(name, version, time)` tuples."""
+        self._latest = dict((name, (version, time))
+                            for name, version, time in entries)
+        self._recent = sorted((time, name) for name, (version, time)
+                              in self._latest.iteritems())
+
+    def get_latest(self, name):
+        """Return the `(version, time)` of the latest version of the
+        page, or `None` if the page doesn't exist."""
+        return self._latest.get(name)
+
+    def iter_recent(self, prefix=None):
+        """Iterate over the `(name, version, time)` of the pages,
+        latest modified first.
+
+        :param prefix: if given, only names that start with that
+          prefix are included.
+        """
+        for time, name in reversed(self._recent):
+            if not prefix or name.startswith(prefix):
+                yield (name,) + self._latest[name]
+
+    def updated(self, name, entry):
+        """Return a copy of the index with the given page updated.
+
+        :param entry: the `(version, time)` of the latest version of
+          the page, or `None` if the page doesn't exist anymore.
+        """
+        copy = RecentPages()
+        copy._latest = latest = dict(self._latest)
+        copy._recent = recent = self._recent[:]
+        old = latest.pop(name, None)
+        if old is not None:
+            del recent[bisect_left(recent, (old[1], name))]
+        if entry is not None:
+            latest[name] = entry
+            insort(recent, (entry[1], name))
+        return copy
+
+
 class WikiSystem(Component):
     """Wiki system manager."""
 
@@ -285,26 +385,95 @@ class WikiSystem(Component):
 
     @cached
     def pages(self):
-        """Return the names of all existing wiki pages."""
-        return set(name for name, in
-                   self.env.db_query("SELECT DISTINCT name FROM wiki"))
+        """Return the names of all existing wiki pages, as a
+        `PageCatalogue`."""
+        return PageCatalogue(name for name, in
+                             self.env.db_query("SELECT DISTINCT name FROM wiki"))
+
+    @cached
+    def _recent_pages(self):
+        return RecentPages(self.env.db_query("""
+            SELECT name, max(version), max(time) FROM wiki GROUP BY name
+            """))
 
     # Public API
 
-    def get_pages(self, prefix=None):
-        """Iterate over the names of existing Wiki pages.
+    def get_pages(self, prefix=None, depth=None):
+        """Iterate over the names of existing Wiki pages, in sorted
+        order.
 
         :param prefix: if given, only names that start with that
           prefix are included.
+        :param depth: if given, only names with at most `depth` more
+          `/` than the prefix are included (''since 1.0.2'').
         """
-        for page in self.pages:
-            if not prefix or page.startswith(prefix):
-                yield page
+        return self.pages.iter_names(prefix, depth)
+
+    def get_recent_pages(self, prefix=None, limit=None):
+        """Iterate over the `(name, version, time)` of the latest
+        version of the existing Wiki pages, latest modified first.
+
+        :param prefix: if given, only names that start with that
+          prefix are included.
+        :param limit: if given, the maximum number of pages.
+
+        :since 1.0.2:
+        """
+        for idx, entry in enumerate(self._recent_pages.iter_recent(prefix)):
+            if limit and idx >= limit:
+                break
+            yield entry
 
     def has_page(self, pagename):
         """Whether a page with the specified name exists."""
         return pagename.rstrip('/') in self.pages
 
+    def get_existing_pages(self, pagenames):
+        """Return the set of the specified page names which are
+        existing pages.
+
+        :since 1.0.2:
+        """
+        return self.pages.get_existing(pagename.rstrip('/')
+                                       for pagename in pagenames)
+
+    def update_pages(self, *pagenames):
+        """Update the cached entries of the specified pages after they
+        were created, modified, deleted or renamed.
+
+        Unlike invalidating the `pages` attribute, this doesn't reload
+        all the pages, and should be called in the transaction modifying
+        the pages. The names of the pages are only invalidated in other
+        processes when pages are created or deleted.
+
+        :since 1.0.2:
+        """
+        entries = {}
+        for pagename in pagenames:
+            for version, time in self.env.db_query("""
+                    SELECT max(version), max(time) FROM wiki
+                    WHERE name=%s""", (pagename,)):
+                break
+            entries[pagename] = (version, time) \
+                                if version is not None else None
+        def update_recent(recent_pages):
+            for pagename, entry in entries.iteritems():
+                if entry != recent_pages.get_latest(pagename):
+                    recent_pages = recent_pages.updated(pagename, entry)
+            return recent_pages
+        WikiSystem._recent_pages.update(self, update_recent)
+        # The names only change when a page is deleted, or created (its
+        # latest version is the first one)
+        if any(entry is None or entry[0] == 1
+               for entry in entries.itervalues()):
+            def update_names(pages):
+                return pages.updated(
+                    added=[pagename for pagename, entry
+                           in entries.iteritems() if entry is not None],
+                    removed=[pagename for pagename, entry
+                             in entries.iteritems() if entry is None])
+            WikiSystem.pages.update(self, update_names)
+
     # IWikiSyntaxProvider methods
 
     XML_NAME = r"[\w:](?<!\d)(?:[\w:.-]*[\w-])?"
@@ -411,6 +580,8 @@ class WikiSystem(Component):
         else:
             pagename = self._resolve_scoped_name(pagename, referrer)
         label = unquote_label(label)
+        from trac.wiki.formatter import depends_on
+        depends_on(formatter.context, 'pages')
         if 'WIKI_VIEW' in formatter.perm('wiki', pagename, version):
             href = formatter.href.wiki(pagename, version=version) + query \
                    + fragment
@@ -447,22 +618,25 @@ class WikiSystem(Component):
         if len(referrer) == 1:           # Non-hierarchical referrer
             return pagename
         # Test for pages with same name, higher in the hierarchy
-        for i in range(len(referrer) - 1, 0, -1):
-            name = '/'.join(referrer[:i]) + '/' + pagename
-            if self.has_page(name):
-                return name
-        if self.has_page(pagename):
-            return pagename
+        candidates = ['/'.join(referrer[:i]) + '/' + pagename
+                      for i in range(len(referrer) - 1, 0, -1)]
+        candidates.append(pagename)
         # If we are on First/Second/Third, and pagename is Second/Other,
         # resolve to First/Second/Other instead of First/Second/Second/Other
         # See http://trac.edgewall.org/ticket/4507#comment:12
+        anchors = []
         if '/' in pagename:
             (first, rest) = pagename.split('/', 1)
             for (i, part) in enumerate(referrer):
                 if first == part:
-                    anchor = '/'.join(referrer[:i + 1])
-                    if self.has_page(anchor):
-                        return anchor + '/' + rest
+                    anchors.append('/'.join(referrer[:i + 1]))
+        existing = self.get_existing_pages(candidates + anchors)
+        for name in candidates:
+            if name in existing:
+                return name
+        for anchor in anchors:
+            if anchor in existing:
+                return anchor + '/' + rest
         # Assume the user wants a sibling of referrer
         return '/'.join(referrer[:-1]) + '/' + pagename
 
@@ -42,7 +42,8 @@ from trac.wiki.parser import WikiParser, parse_processor_args
 __all__ = ['wiki_to_html', 'wiki_to_oneliner', 'wiki_to_outline',
            'Formatter', 'format_to', 'format_to_html', 'format_to_oneliner',
            'extract_link', 'split_url_into_path_query_fragment',
-           'concat_path_query_fragment']
+           'concat_path_query_fragment', 'depends_on', 'RenderRecorder',
+           'is_cacheable_wiki']
 
 
 def system_message(msg, text=None):
@@ -108,6 +109,111 @@ def _markup_to_unicode(markup):
     return to_unicode(markup)
 
 
+def depends_on(context, *dependencies):
+    """Record that the wiki markup rendered in `context` depends on
+    `dependencies`, for the cache of rendered wiki pages.
+
+    The dependencies are the same as the ones returned by
+    `WikiMacroBase.get_macro_dependencies`. Nothing is recorded when the
+    output of `context` isn't going to be cached.
+
+    :since 1.0.2:
+    """
+    recorder = context.get_hint('render_recorder') if context else None
+    if recorder is not None:
+        recorder.dependencies.update(dependencies)
+
+
+def _get_macro_dependencies(macro_provider, name):
+    get_dependencies = getattr(macro_provider, 'get_macro_dependencies', None)
+    return get_dependencies(name) if get_dependencies else None
+
+
+_macro_call_re = re.compile(r'\[\[(\w+)|\{\{\{\s*#!(\w+)')
+
+def is_cacheable_wiki(env, text):
+    """Return whether the rendering of the wiki `text` only depends on
+    the content of the environment, i.e. whether none of the macros it
+    calls depends on the current time or has unknown dependencies.
+
+    The check looks for the macro calls in the text without parsing it,
+    so it may reject a text which only mentions a macro in a code block.
+
+    :since 1.0.2:
+    """
+    if not text or ('[[' not in text and '{{{' not in text):
+        return True
+    names = set(match.group(1) or match.group(2)
+                for match in _macro_call_re.finditer(text))
+    for macro_provider in WikiSystem(env).macro_providers:
+        for name in macro_provider.get_macros() or []:
+            if name in names:
+                dependencies = _get_macro_dependencies(macro_provider, name)
+                if dependencies is None or 'time' in dependencies:
+                    return False
+    return True
+
+
+class RenderRecorder(object):
+    """Record what wiki markup depends on while it is rendered, so that
+    the result can be cached.
+
+    The recorder is given to the formatter in the `render_recorder` hint
+    of the rendering context. Macros which can't be cached are not
+    expanded during the rendering: they are replaced by placeholders, and
+    `expand` renders them each time the cached result is used.
+
+    :since 1.0.2:
+    """
+
+    _placeholder_re = re.compile(r'<!--trac-fragment:([0-9a-f]+):(\d+)-->')
+
+    def __init__(self):
+        self.dependencies = set()
+        self.fragments = []
+        self._nonce = os.urandom(8).encode('hex')
+
+    def defer(self, processor, text):
+        """Return a placeholder for the expansion of `processor`."""
+        self.fragments.append({'name': processor.name,
+                               'args': processor.args, 'text': text,
+                               'resource': processor.formatter.resource,
+                               'inline': False})
+        return Markup('<!--trac-fragment:%s:%d-->' %
+                      (self._nonce, len(self.fragments) - 1))
+
+    def set_inline(self, placeholder):
+        """Mark the fragment of `placeholder` as being expanded inline."""
+        match = self._placeholder_re.match(placeholder)
+        self.fragments[int(match.group(2))]['inline'] = True
+
+    def expand(self, env, context, html):
+        """Replace the placeholders in `html` by the expansion of their
+        macro in `context`."""
+        if not self.fragments:
+            return html
+        def replace(match):
+            if match.group(1) != self._nonce:
+                return match.group(0)
+            fragment = self.fragments[int(match.group(2))]
+            formatter = Formatter(env, context.child(fragment['resource']))
+            processor = WikiProcessor(formatter, fragment['name'],
+                                      fragment['args'])
+            try:
+                result = processor.process(fragment['text'])
+                if fragment['inline']:
+                    result = processor.ensure_inline(result)
+            except Exception, e:
+                env.log.error("Macro %s(%s) failed: %s", fragment['name'],
+                              fragment['text'],
+                              exception_to_unicode(e, traceback=True))
+                result = system_message(
+                    "Error: Macro %s(%s) failed" % (fragment['name'],
+                                                   fragment['text']), e)
+            return _markup_to_unicode(result)
+        return Markup(self._placeholder_re.sub(replace, html))
+
+
 class ProcessorError(TracError):
     pass
 
@@ -133,6 +239,7 @@ class WikiProcessor(object):
         self.args = args
         self.error = None
         self.macro_provider = None
+        self._placeholder = None
 
         # FIXME: move these tables outside of __init__
         builtin_processors = {'html': self._html_processor,
@@ -352,10 +459,28 @@ class WikiProcessor(object):
             text = system_message(tag('Error: Failed to load processor ',
                                       tag.code(self.name)),
                                   self.error)
+        elif self.macro_provider and not self._is_cacheable():
+            self._placeholder = self._recorder.defer(self, text)
+            return self._placeholder
         else:
             text = self.processor(text)
         return text or ''
 
+    def _is_cacheable(self):
+        """Check whether the output of the macro can be cached, and record
+        its dependencies if so."""
+        context = self.formatter.context
+        self._recorder = context.get_hint('render_recorder') if context \
+                         else None
+        if self._recorder is None:
+            return True
+        dependencies = _get_macro_dependencies(self.macro_provider,
+                                               self.name)
+        if dependencies is None or 'time' in dependencies:
+            return False
+        self._recorder.dependencies.update(dependencies)
+        return True
+
     def is_inline(self, text):
         if callable(self.inline_check):
             return self.inline_check(text)
@@ -363,6 +488,10 @@ class WikiProcessor(object):
             return self.inline_check
 
     def ensure_inline(self, text):
+        if self._placeholder is not None and text is self._placeholder:
+            # the expansion is made inline when the placeholder is replaced
+            self._recorder.set_inline(text)
+            return text
         content_for_span = None
         interrupt_paragraph = False
         if isinstance(text, Element):
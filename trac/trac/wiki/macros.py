@@ -52,6 +52,9 @@ class WikiMacroBase(Component):
     #: A macro description
     _description = None
 
+    #: What the macro output depends on, see `get_macro_dependencies`
+    _dependencies = None
+
     def get_macros(self):
         """Yield the name of the macro based on the class name."""
         name = self.__class__.__name__
@@ -68,6 +71,28 @@ class WikiMacroBase(Component):
         doc = inspect.getdoc(self.__class__)
         return to_unicode(doc) if doc else ''
 
+    def get_macro_dependencies(self, name):
+        """Return what the output of the macro depends on, besides its
+        arguments, so that the pages using it can be kept in the cache of
+        rendered wiki pages.
+
+        The dependencies are a sequence containing any of:
+         - `'pages'`: the list or the content of the wiki pages,
+         - `'tickets'`: the tickets and milestones,
+         - `'attachments'`: the attachments of any resource,
+         - `'user'`: the user viewing the page, which is always taken
+           into account as the pages are cached for each user,
+         - `'time'`: the current time.
+
+        An empty sequence means the output only depends on the arguments.
+        With `None`, the default, or `'time'`, the macro is expanded each
+        time the page is viewed, while the rest of the page can still be
+        taken from the cache.
+
+        :since 1.0.2:
+        """
+        return self._dependencies
+
     def parse_macro(self, parser, name, content):
         raise NotImplementedError
 
@@ -80,6 +105,7 @@ class WikiMacroBase(Component):
 
 class TitleIndexMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ('pages',)
     _description = cleandoc_(
     """Insert an alphabetic list of all wiki pages into the output.
 
@@ -120,7 +146,6 @@ class TitleIndexMacro(WikiMacroBase):
         minsize = max(int(kw.get('min', 1)), 1)
         minsize_group = max(minsize, 2)
         depth = int(kw.get('depth', -1))
-        start = prefix.count('/') if prefix else 0
         format = kw.get('format', '')
 
         def parse_list(name):
@@ -137,11 +162,11 @@ class TitleIndexMacro(WikiMacroBase):
 
         wiki = formatter.wiki
 
-        pages = sorted(page for page in wiki.get_pages(prefix)
-                       if (depth < 0 or depth >= page.count('/') - start)
-                       and 'WIKI_VIEW' in formatter.perm('wiki', page)
-                       and any(fnmatchcase(page, inc) for inc in includes)
-                       and not any(fnmatchcase(page, exc) for exc in excludes))
+        pages = [page for page in wiki.get_pages(prefix,
+                                                 depth if depth >= 0 else None)
+                 if 'WIKI_VIEW' in formatter.perm('wiki', page)
+                 and any(fnmatchcase(page, inc) for inc in includes)
+                 and not any(fnmatchcase(page, exc) for exc in excludes)]
 
         if format == 'compact':
             return tag(
@@ -293,6 +318,7 @@ class TitleIndexMacro(WikiMacroBase):
 
 class RecentChangesMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ('pages',)
     _description = cleandoc_(
     """List all pages that have recently been modified, ordered by the
     time they were last modified.
@@ -323,20 +349,10 @@ class RecentChangesMacro(WikiMacroBase):
         limit = int(args[1].strip()) if len(args) > 1 else None
         group = kw.get('group', 'date')
 
-        sql = """SELECT name, max(version) AS max_version,
-                        max(time) AS max_time FROM wiki"""
-        args = []
-        if prefix:
-            sql += " WHERE name LIKE %s"
-            args.append(prefix + '%')
-        sql += " GROUP BY name ORDER BY max_time DESC"
-        if limit:
-            sql += " LIMIT %s"
-            args.append(limit)
-
         entries_per_date = []
         prevdate = None
-        for name, version, ts in self.env.db_query(sql, args):
+        for name, version, ts in formatter.wiki.get_recent_pages(prefix,
+                                                                 limit):
             if not 'WIKI_VIEW' in formatter.perm('wiki', name, version):
                 continue
             req = formatter.req
@@ -371,6 +387,7 @@ class RecentChangesMacro(WikiMacroBase):
 
 class PageOutlineMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ()
     _description = cleandoc_(
     """Display a structural outline of the current wiki page, each item in the
     outline being a link to the corresponding heading.
@@ -437,6 +454,7 @@ class PageOutlineMacro(WikiMacroBase):
 
 class ImageMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ('attachments',)
     _description = cleandoc_(
     """Embed an image in wiki-formatted text.
 
@@ -661,6 +679,7 @@ class ImageMacro(WikiMacroBase):
 
 class MacroListMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ()
     _description = cleandoc_(
     """Display a list of all installed Wiki macros, including documentation if
     available.
@@ -723,6 +742,7 @@ class MacroListMacro(WikiMacroBase):
 
 class TracIniMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ()
     _description = cleandoc_(
     """Produce documentation for the Trac configuration file.
 
@@ -792,6 +812,7 @@ class TracIniMacro(WikiMacroBase):
 
 class KnownMimeTypesMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ()
     _description = cleandoc_(
     """List all known mime-types which can be used as WikiProcessors.
 
@@ -830,6 +851,7 @@ class KnownMimeTypesMacro(WikiMacroBase):
 
 class TracGuideTocMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ()
     _description = cleandoc_(
     """Display a table of content for the Trac guide.
 
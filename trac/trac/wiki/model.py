@@ -101,9 +101,9 @@ class WikiPage(object):
             if version is None or version == self.version:
                 self._fetch(self.name, None)
 
+            # Update page name cache
+            WikiSystem(self.env).update_pages(self.name)
             if not self.exists:
-                # Invalidate page name cache
-                del WikiSystem(self.env).pages
                 # Delete orphaned attachments
                 from trac.attachment import Attachment
                 Attachment.delete_all(self.env, 'wiki', self.name)
@@ -144,12 +144,11 @@ class WikiPage(object):
                             self.readonly))
                 self.version += 1
                 self.resource = self.resource(version=self.version)
+                # Update page name cache
+                WikiSystem(self.env).update_pages(self.name)
             else:
                 db("UPDATE wiki SET readonly=%s WHERE name=%s",
                    (self.readonly, self.name))
-            if self.version == 1:
-                # Invalidate page name cache
-                del WikiSystem(self.env).pages
 
         self.author = author
         self.comment = comment
@@ -202,8 +201,8 @@ class WikiPage(object):
                                   name=new_name))
 
             db("UPDATE wiki SET name=%s WHERE name=%s", (new_name, old_name))
-            # Invalidate page name cache
-            del WikiSystem(self.env).pages
+            # Update page name cache
+            WikiSystem(self.env).update_pages(old_name, new_name)
             # Reparent attachments
             from trac.attachment import Attachment
             Attachment.reparent_all(self.env, 'wiki', old_name, 'wiki',
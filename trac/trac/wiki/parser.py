@@ -22,6 +22,7 @@ import re
 
 from trac.core import *
 from trac.notification import EMAIL_LOOKALIKE_PATTERN
+from trac.util import LRUCache
 
 class WikiParser(Component):
     """Wiki text parser."""
@@ -165,6 +166,10 @@ class WikiParser(Component):
 
     _set_anchor_wc_re = re.compile(_set_anchor(XML_NAME, r'\|\s*') + r'$')
 
+    # Compiled rules shared by the parsers using the same syntax, like the
+    # parsers of the products of an environment
+    _shared_rules = LRUCache(32)
+
     def __init__(self):
         self._compiled_rules = None
         self._link_resolvers = None
@@ -199,10 +204,16 @@ class WikiParser(Component):
                     syntax.append('(?P<i%d>%s)' % (i, regexp))
                     i += 1
             syntax += self._post_rules[:]
-            helper_re = re.compile(r'\?P<([a-z\d_]+)>')
-            for rule in syntax:
-                helpers += helper_re.findall(rule)[1:]
-            rules = re.compile('(?:' + '|'.join(syntax) + ')', re.UNICODE)
+            key = tuple(syntax)
+            shared = self._shared_rules.get(key)
+            if shared is None:
+                helper_re = re.compile(r'\?P<([a-z\d_]+)>')
+                for rule in syntax:
+                    helpers += helper_re.findall(rule)[1:]
+                rules = re.compile('(?:' + '|'.join(syntax) + ')', re.UNICODE)
+                self._shared_rules[key] = rules, helpers
+            else:
+                rules, helpers = shared
             self._external_handlers = handlers
             self._helper_patterns = helpers
             self._compiled_rules = rules
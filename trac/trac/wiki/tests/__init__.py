@@ -4,7 +4,7 @@ import unittest
 import trac.wiki.api
 import trac.wiki.formatter
 import trac.wiki.parser
-from trac.wiki.tests import formatter, macros, model, wikisyntax
+from trac.wiki.tests import formatter, macros, model, parser, web_ui, wikisyntax
 from trac.wiki.tests.functional import functionalSuite
 
 def suite():
@@ -13,6 +13,8 @@ def suite():
     suite.addTest(formatter.suite())
     suite.addTest(macros.suite())
     suite.addTest(model.suite())
+    suite.addTest(parser.suite())
+    suite.addTest(web_ui.suite())
     suite.addTest(wikisyntax.suite())
     suite.addTest(doctest.DocTestSuite(trac.wiki.api))
     suite.addTest(doctest.DocTestSuite(trac.wiki.formatter))
@@ -10,11 +10,12 @@ import tempfile
 import unittest
 
 from trac.attachment import Attachment
+from trac.cache import CacheManager
 from trac.core import *
 from trac.test import EnvironmentStub
 from trac.tests.resource import TestResourceChangeListener
 from trac.util.datefmt import utc, to_utimestamp
-from trac.wiki import WikiPage, IWikiChangeListener
+from trac.wiki import WikiPage, WikiSystem, IWikiChangeListener
 
 
 class TestWikiChangeListener(Component):
@@ -332,11 +333,127 @@ class WikiResourceChangeListenerTestCase(unittest.TestCase):
         self.wiki_name = resource.name
         self.wiki_text = resource.text
 
+class PageCatalogueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.wiki = WikiSystem(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_pages(self, *pages):
+        self.env.db_transaction.executemany(
+            "INSERT INTO wiki (name, version, time, text) VALUES (%s,%s,%s,'')",
+            pages)
+        del self.wiki.pages
+        del self.wiki._recent_pages
+
+    def _time(self, t):
+        return datetime(2013, 1, 1, 0, 0, t, 0, utc)
+
+    def _save_page(self, name, t):
+        page = WikiPage(self.env, name)
+        page.text = 'Version %d' % (page.version + 1)
+        page.save('joe', 'Testing', '::1', self._time(t))
+        return page
+
+    def test_get_pages(self):
+        self._insert_pages(('A/D', 1, 1), ('A', 1, 2), ('A/B/C', 1, 3),
+                           ('AB', 1, 4), ('A/B', 1, 5), ('B/A', 1, 6))
+        self.assertEqual(['A', 'A/B', 'A/B/C', 'A/D', 'AB', 'B/A'],
+                         list(self.wiki.get_pages()))
+        self.assertEqual(['A', 'A/B', 'A/B/C', 'A/D', 'AB'],
+                         list(self.wiki.get_pages('A')))
+        self.assertEqual(['A/B', 'A/D'], list(self.wiki.get_pages('A/', 0)))
+        self.assertEqual(['A', 'AB'], list(self.wiki.get_pages(depth=0)))
+        self.assertEqual(['A', 'A/B', 'A/D', 'AB', 'B/A'],
+                         list(self.wiki.get_pages(depth=1)))
+        self.assertEqual([], list(self.wiki.get_pages('C')))
+
+    def test_get_recent_pages(self):
+        self._insert_pages(('A', 1, 10), ('A', 2, 40), ('B', 1, 30),
+                           ('AB', 1, 20))
+        self.assertEqual([('A', 2, 40), ('B', 1, 30), ('AB', 1, 20)],
+                         list(self.wiki.get_recent_pages()))
+        self.assertEqual([('A', 2, 40), ('B', 1, 30)],
+                         list(self.wiki.get_recent_pages(limit=2)))
+        self.assertEqual([('A', 2, 40), ('AB', 1, 20)],
+                         list(self.wiki.get_recent_pages('A')))
+
+    def test_get_existing_pages(self):
+        self._insert_pages(('A', 1, 1), ('A/B', 1, 1))
+        self.assertEqual(set(['A', 'A/B']),
+                         self.wiki.get_existing_pages(['A/', 'A/B', 'C']))
+
+    def test_incremental_updates(self):
+        self._save_page('A', 1)
+        self.assertTrue(self.wiki.has_page('A'))
+        self.assertEqual(1, len(list(self.wiki.get_recent_pages())))
+        # A page inserted behind the back of the cache isn't seen, as
+        # the catalogue isn't reloaded
+        self.env.db_transaction(
+            "INSERT INTO wiki (name, version, time) VALUES ('C', 1, 0)")
+        self._save_page('B', 2)
+        self._save_page('A', 3)
+        self.assertEqual(['A', 'B'], list(self.wiki.get_pages()))
+        ts = lambda t: to_utimestamp(self._time(t))
+        self.assertEqual([('A', 2, ts(3)), ('B', 1, ts(2))],
+                         list(self.wiki.get_recent_pages()))
+
+        WikiPage(self.env, 'A').delete(version=2)
+        self.assertEqual([('B', 1, ts(2)), ('A', 1, ts(1))],
+                         list(self.wiki.get_recent_pages()))
+        WikiPage(self.env, 'B').rename('D')
+        self.assertEqual(['A', 'D'], list(self.wiki.get_pages()))
+        WikiPage(self.env, 'A').delete()
+        self.assertEqual(['D'], list(self.wiki.get_pages()))
+        self.assertFalse(self.wiki.has_page('A'))
+
+        del self.wiki.pages
+        self.assertEqual(['C', 'D'], list(self.wiki.get_pages()))
+
+    def _generations(self):
+        CacheManager(self.env).reset_metadata() # new request
+        generations = dict(CacheManager(self.env).get_generations())
+        return (generations.get(WikiSystem.pages.get_id(WikiSystem)),
+                generations.get(WikiSystem._recent_pages.get_id(WikiSystem)))
+
+    def test_names_invalidated_on_creation_only(self):
+        self._save_page('A', 1)
+        created = self._generations()
+        self._save_page('A', 2)
+        edited = self._generations()
+        self.assertEqual(created[0], edited[0])
+        self.assertNotEqual(created[1], edited[1])
+        self._save_page('B', 3)
+        self.assertNotEqual(edited[0], self._generations()[0])
+
+    def test_rolled_back_update(self):
+        self._save_page('A', 1)
+        self.assertEqual(['A'], list(self.wiki.get_pages()))
+        try:
+            with self.env.db_transaction:
+                self._save_page('RolledBack', 2)
+                raise ValueError
+        except ValueError:
+            pass
+        # A page created in another process
+        self.env.db_transaction(
+            "INSERT INTO wiki (name, version, time) VALUES ('C', 1, 0)")
+        self.env.db_transaction(
+            "UPDATE cache SET generation=generation+1 WHERE id=%s",
+            (WikiSystem.pages.get_id(WikiSystem),))
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(['A', 'C'], list(self.wiki.get_pages()))
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(WikiPageTestCase, 'test'))
     suite.addTest(unittest.makeSuite(
         WikiResourceChangeListenerTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(PageCatalogueTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.core import Component, ComponentMeta, implements
+from trac.test import EnvironmentStub
+from trac.wiki.api import IWikiSyntaxProvider
+from trac.wiki.parser import WikiParser
+
+
+class SharedRulesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._old_registry = ComponentMeta._registry
+        ComponentMeta._registry = dict((interface, list(components))
+                                       for interface, components
+                                       in self._old_registry.iteritems())
+        class SyntaxProvider(Component):
+            implements(IWikiSyntaxProvider)
+            def get_wiki_syntax(self):
+                yield r'!?\bXYZ-\d+\b', self._format_xyz
+            def get_link_resolvers(self):
+                return []
+            def _format_xyz(self, formatter, match, fullmatch):
+                return match
+        self.provider = SyntaxProvider
+        self.env1 = EnvironmentStub()
+        self.env2 = EnvironmentStub()
+
+    def tearDown(self):
+        ComponentMeta._registry = self._old_registry
+
+    def test_same_syntax_shares_rules(self):
+        parser1 = WikiParser(self.env1)
+        parser2 = WikiParser(self.env2)
+        self.assertTrue(parser1.rules is parser2.rules)
+        self.assertEqual(parser1.helper_patterns, parser2.helper_patterns)
+        # the handlers are bound to the components of each environment
+        handlers1 = parser1.external_handlers.values()
+        handlers2 = parser2.external_handlers.values()
+        self.assertTrue(self.provider(self.env1)._format_xyz in handlers1)
+        self.assertTrue(self.provider(self.env2)._format_xyz in handlers2)
+        self.assertFalse(self.provider(self.env1)._format_xyz in handlers2)
+
+    def test_different_syntax_compiles_rules(self):
+        env2 = EnvironmentStub(disable=[self.provider])
+        parser1 = WikiParser(self.env1)
+        parser2 = WikiParser(env2)
+        self.assertFalse(parser1.rules is parser2.rules)
+        self.assertTrue(parser1.rules.search('see XYZ-42'))
+        self.assertFalse(parser2.rules.search('see XYZ-42'))
+
+
+def suite():
+    return unittest.makeSuite(SharedRulesTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from datetime import datetime
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+from trac.attachment import Attachment
+from trac.core import ComponentMeta
+from trac.perm import DefaultPermissionPolicy, PermissionCache, \
+                      PermissionSystem
+from trac.test import EnvironmentStub, Mock, MockPerm
+from trac.ticket.model import Ticket
+from trac.util.datefmt import utc
+from trac.web.chrome import web_context
+from trac.web.href import Href
+from trac.wiki.macros import WikiMacroBase
+from trac.wiki.model import WikiPage
+from trac.wiki.web_ui import WikiModule
+
+
+class RenderCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._old_registry = ComponentMeta._registry
+        ComponentMeta._registry = dict((interface, list(components))
+                                       for interface, components
+                                       in self._old_registry.iteritems())
+        calls = self.calls = {'Cached': 0, 'Uncached': 0}
+        class CachedMacro(WikiMacroBase):
+            _dependencies = ()
+            def expand_macro(self, formatter, name, content):
+                calls[name] += 1
+                return 'cached-%d' % calls[name]
+        class UncachedMacro(WikiMacroBase):
+            def expand_macro(self, formatter, name, content):
+                calls[name] += 1
+                return '<div>uncached-%d %s</div>' % (calls[name], content)
+        self.env = EnvironmentStub(default_data=True)
+        self.module = WikiModule(self.env)
+
+    def tearDown(self):
+        ComponentMeta._registry = self._old_registry
+        self.env.reset_db()
+
+    def _create_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Testing', '::1',
+                  datetime(2013, 1, 1, 0, 0, 0, 0, utc))
+        return page
+
+    def _render(self, page, authname='anonymous', perm=None):
+        req = Mock(href=Href('/'), abs_href=Href('http://example.org/'),
+                   perm=perm or MockPerm(), authname=authname, locale=None,
+                   session={}, tz=utc, args={}, chrome={})
+        context = web_context(req, page.resource)
+        return unicode(self.module._render_page_html(req, context, page,
+                                                     page.text))
+
+    def test_cached(self):
+        page = self._create_page('TestPage', 'Some [[Cached]] text')
+        html = self._render(page)
+        self.assertEqual(html, self._render(page))
+        self.assertEqual(1, self.calls['Cached'])
+        self.assertTrue('cached-1' in html)
+
+    def test_cached_per_user(self):
+        page = self._create_page('TestPage', 'Some [[Cached]] text')
+        self._render(page)
+        self._render(page, 'joe')
+        self._render(page, 'joe')
+        self.assertEqual(2, self.calls['Cached'])
+
+    def test_new_version(self):
+        page = self._create_page('TestPage', 'Some [[Cached]] text')
+        self._render(page)
+        page.text = 'Other [[Cached]] text'
+        page.save('joe', 'Changed', '::1')
+        self.assertTrue('cached-2' in self._render(page))
+
+    def test_uncached_fragments(self):
+        page = self._create_page('TestPage', '[[Cached]] and [[Uncached]]\n'
+                                             '{{{#!Uncached\nblock\n}}}\n')
+        html = self._render(page)
+        self.assertTrue('cached-1' in html)
+        self.assertTrue('<p>\ncached-1 and </p><div>uncached-1 None</div><p>'
+                        in html, html)
+        self.assertTrue('<div>uncached-2 block\n</div>' in html, html)
+        html = self._render(page)
+        self.assertEqual(1, self.calls['Cached'])
+        self.assertEqual(4, self.calls['Uncached'])
+        self.assertTrue('<div>uncached-3 None</div>' in html, html)
+        self.assertTrue('<div>uncached-4 block\n</div>' in html, html)
+
+    def test_page_change_invalidates_cache(self):
+        page = self._create_page('TestPage', '[[Cached]] OtherPage')
+        self.assertTrue('class="missing wiki"' in self._render(page))
+        self._render(page)
+        self.assertEqual(1, self.calls['Cached'])
+        self._create_page('OtherPage', 'Text')
+        html = self._render(page)
+        self.assertEqual(2, self.calls['Cached'])
+        self.assertTrue('<a class="wiki" href="/wiki/OtherPage">' in html,
+                        html)
+
+    def test_ticket_change_invalidates_cache(self):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'Summary'
+        ticket['status'] = 'new'
+        ticket.insert()
+        page = self._create_page('TestPage', '[[Cached]] #1')
+        other = self._create_page('OtherPage', '[[Cached]] text')
+        self.assertTrue('class="new ticket"' in self._render(page))
+        self._render(other)
+        ticket['status'] = 'closed'
+        ticket.save_changes('joe', 'Closed')
+        self.assertTrue('class="closed ticket"' in self._render(page))
+        self._render(other)
+        self.assertEqual(3, self.calls['Cached'])
+
+    def test_attachment_change_invalidates_cache(self):
+        self.env.path = tempfile.mkdtemp(prefix='trac-tempenv-')
+        try:
+            page = self._create_page('TestPage',
+                                     '[[Image(x.png)]] attachment:y.txt')
+            html = self._render(page)
+            self.assertTrue('No image &#34;x.png&#34; attached' in html, html)
+            self.assertTrue('class="missing attachment"' in html, html)
+            self.assertEqual(html, self._render(page))
+            for filename in ('x.png', 'y.txt'):
+                attachment = Attachment(self.env, 'wiki', 'TestPage')
+                attachment.insert(filename, StringIO(''), 0)
+            html = self._render(page)
+            self.assertFalse('No image &#34;x.png&#34;' in html, html)
+            self.assertTrue('src="/raw-attachment/wiki/TestPage/x.png"'
+                            in html, html)
+            self.assertTrue('<a class="attachment" '
+                            'href="/attachment/wiki/TestPage/y.txt"' in html,
+                            html)
+        finally:
+            shutil.rmtree(self.env.path)
+
+    def test_permission_change_invalidates_cache(self):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'Secret summary'
+        ticket['status'] = 'new'
+        ticket.insert()
+        page = self._create_page('TestPage', '[[Cached]] #1')
+        perm = PermissionCache(self.env, 'anonymous')
+        self.assertTrue('Secret summary' in self._render(page, perm=perm))
+        PermissionSystem(self.env).revoke_permission('anonymous',
+                                                     'TICKET_VIEW')
+        DefaultPermissionPolicy(self.env).permission_cache.clear() # expiry
+        perm = PermissionCache(self.env, 'anonymous')
+        html = self._render(page, perm=perm)
+        self.assertFalse('Secret summary' in html, html)
+        self.assertEqual(2, self.calls['Cached'])
+
+    def test_cache_disabled(self):
+        self.env.config.set('wiki', 'render_cache_size', 0)
+        page = self._create_page('TestPage', 'Some [[Cached]] text')
+        self._render(page)
+        self._render(page)
+        self.assertEqual(2, self.calls['Cached'])
+
+
+class RequestValidatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._old_registry = ComponentMeta._registry
+        ComponentMeta._registry = dict((interface, list(components))
+                                       for interface, components
+                                       in self._old_registry.iteritems())
+        class CachedMacro(WikiMacroBase):
+            _dependencies = ('pages',)
+            def expand_macro(self, formatter, name, content):
+                return 'cached'
+        class TimeMacro(WikiMacroBase):
+            _dependencies = ('time',)
+            def expand_macro(self, formatter, name, content):
+                return 'time'
+        self.env = EnvironmentStub(default_data=True)
+        self.module = WikiModule(self.env)
+
+    def tearDown(self):
+        ComponentMeta._registry = self._old_registry
+        self.env.reset_db()
+
+    def _create_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Testing', '::1',
+                  datetime(2013, 1, 1, 0, 0, 0, 0, utc))
+        return page
+
+    def _get_validator(self, **args):
+        args.setdefault('page', 'TestPage')
+        req = Mock(args=args, perm=MockPerm())
+        return self.module.get_request_validator(req)
+
+    def test_new_version(self):
+        page = self._create_page('TestPage', 'Some [[Cached]] text')
+        validator = self._get_validator()
+        self.assertEqual(page.time, validator[0])
+        self.assertEqual(validator, self._get_validator())
+        page.text = 'Other text'
+        page.save('joe', 'Changed', '::1')
+        self.assertNotEqual(validator, self._get_validator())
+
+    def test_time_dependent_macro(self):
+        self._create_page('TestPage', 'Now: [[Time]]')
+        self.assertEqual(None, self._get_validator())
+        self._create_page('OtherPage', '{{{#!Time\n}}}')
+        self.assertEqual(None, self._get_validator(page='OtherPage'))
+
+    def test_not_validated(self):
+        self._create_page('TestPage', 'Some text')
+        self.assertEqual(None, self._get_validator(version='1'))
+        self.assertEqual(None, self._get_validator(action='edit'))
+        self.assertEqual(None, self._get_validator(page='MissingPage'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(RenderCacheTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RequestValidatorTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
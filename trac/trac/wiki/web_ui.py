@@ -18,31 +18,37 @@
 
 from __future__ import with_statement
 
+from hashlib import md5
 import pkg_resources
 import re
 
 from genshi.builder import tag
 
 from trac.attachment import AttachmentModule
+from trac.cache import cached
 from trac.config import IntOption
 from trac.core import *
 from trac.mimeview.api import IContentConverter, Mimeview
-from trac.perm import IPermissionRequestor
+from trac.perm import DefaultPermissionPolicy, IPermissionRequestor
 from trac.resource import *
 from trac.search import ISearchSource, search_to_sql, shorten_result
-from trac.timeline.api import ITimelineEventProvider
-from trac.util import get_reporter_id
-from trac.util.datefmt import from_utimestamp, to_utimestamp
+from trac.timeline.api import ITimelineEventProvider, \
+                             ITimelineEventValidator
+from trac.util import LRUCache, get_reporter_id
+from trac.util.datefmt import from_utimestamp, pretty_timedelta, \
+                              to_utimestamp
 from trac.util.text import shorten_line
 from trac.util.translation import _, tag_
 from trac.versioncontrol.diff import get_diff_options, diff_blocks
-from trac.web.api import IRequestHandler
+from trac.web.api import IRequestHandler, IRequestValidator
 from trac.web.chrome import (Chrome, INavigationContributor, ITemplateProvider,
                              add_ctxtnav, add_link, add_notice, add_script,
                              add_stylesheet, add_warning, prevnext_nav,
                              web_context)
-from trac.wiki.api import IWikiPageManipulator, WikiSystem, validate_page_name
-from trac.wiki.formatter import format_to, OneLinerFormatter
+from trac.wiki.api import IWikiChangeListener, IWikiPageManipulator, \
+                          WikiSystem, validate_page_name
+from trac.wiki.formatter import RenderRecorder, format_to, format_to_html, \
+                                is_cacheable_wiki, OneLinerFormatter
 from trac.wiki.model import WikiPage
 
 
@@ -56,14 +62,25 @@ class InvalidWikiPage(TracError):
 class WikiModule(Component):
 
     implements(IContentConverter, INavigationContributor, IPermissionRequestor,
-               IRequestHandler, ITimelineEventProvider, ISearchSource,
-               ITemplateProvider)
+               IRequestHandler, IRequestValidator, IResourceChangeListener,
+               ITimelineEventProvider, ITimelineEventValidator,
+               ISearchSource, ITemplateProvider, IWikiChangeListener)
 
     page_manipulators = ExtensionPoint(IWikiPageManipulator)
 
     max_size = IntOption('wiki', 'max_size', 262144,
         """Maximum allowed wiki page size in bytes. (''since 0.11.2'')""")
 
+    render_cache_size = IntOption('wiki', 'render_cache_size', 100,
+        """Number of rendered wiki pages kept in memory. A page is cached
+        for each user, language and time zone, and discarded when a wiki
+        page changes, or when a ticket, a milestone or an attachment
+        changes if the page depends on them. Set to 0 to disable the cache.
+        (''since 1.0.2'')""")
+
+    def __init__(self):
+        self._render_cache = LRUCache(self.render_cache_size)
+
     PAGE_TEMPLATES_PREFIX = 'PageTemplates/'
     DEFAULT_PAGE_TEMPLATE = 'DefaultPage'
 
@@ -177,6 +194,63 @@ class WikiModule(Component):
                                                   format, versioned_page.name)
             return self._render_view(req, versioned_page)
 
+    # IRequestValidator methods
+
+    def get_request_validator(self, req):
+        # Only the latest version of a page is validated, when none of
+        # its macros depend on the time
+        if set(req.args) - set(['page']) or self.page_manipulators:
+            return None
+        page = WikiPage(self.env, req.args.get('page', 'WikiStart'))
+        if not page.exists or 'WIKI_VIEW' not in req.perm(page.resource) \
+                or not is_cacheable_wiki(self.env, page.text):
+            return None
+        return page.time, [page.name, page.version, page.readonly,
+                           pretty_timedelta(page.time)] + \
+                          AttachmentModule(self.env) \
+                          .attachment_validator(page.resource)
+
+    # IResourceChangeListener methods
+
+    def match_resource(self, resource):
+        realm = getattr(getattr(resource, 'resource', None), 'realm', None)
+        return realm in ('ticket', 'milestone', 'attachment')
+
+    def resource_created(self, resource, context):
+        self._invalidate_generation(resource)
+
+    def resource_changed(self, resource, old_values, context):
+        self._invalidate_generation(resource)
+
+    def resource_deleted(self, resource, context):
+        self._invalidate_generation(resource)
+
+    def resource_version_deleted(self, resource, context):
+        self._invalidate_generation(resource)
+
+    def _invalidate_generation(self, resource):
+        if resource.resource.realm == 'attachment':
+            del self._attachments_generation
+        else:
+            del self._tickets_generation
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        del self._pages_generation
+
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        del self._pages_generation
+
+    def wiki_page_deleted(self, page):
+        del self._pages_generation
+
+    def wiki_page_version_deleted(self, page):
+        del self._pages_generation
+
+    def wiki_page_renamed(self, page, old_name):
+        del self._pages_generation
+
     # ITemplateProvider methods
 
     def get_htdocs_dirs(self):
@@ -684,6 +758,8 @@ class WikiModule(Component):
         data.update({
             'context': context,
             'text': text,
+            'page_html': self._render_page_html(req, context, page, text)
+                         if page.exists else None,
             'latest_version': latest_page.version,
             'attachments': AttachmentModule(self.env).attachment_data(context),
             'default_template': self.DEFAULT_PAGE_TEMPLATE,
@@ -695,6 +771,61 @@ class WikiModule(Component):
         add_script(req, 'common/js/folding.js')
         return 'wiki_view.html', data, None
 
+    def _render_page_html(self, req, context, page, text):
+        """Render the `text` of `page`, or retrieve it from the cache."""
+        if self.render_cache_size <= 0 or not text:
+            return format_to_html(self.env, context, text)
+        product = getattr(self.env, 'product', None)
+        permissions_key = self._get_permissions_key(req.authname)
+        key = (product.prefix if product else None, req.href(), page.name,
+               page.version, md5(text.encode('utf-8')).hexdigest(),
+               req.authname, permissions_key,
+               str(req.locale), req.session.get('tz'),
+               req.session.get('lc_time'), req.session.get('dateinfo'))
+        generations = {'pages': self._pages_generation,
+                       'tickets': self._tickets_generation,
+                       'attachments': self._attachments_generation}
+        entry = self._render_cache.get(key)
+        if entry is not None:
+            html, recorder, entry_generations = entry
+            if all(entry_generations[dependency] is generations[dependency]
+                   for dependency in recorder.dependencies
+                   if dependency in generations):
+                self.log.debug("Rendered wiki page %s retrieved from cache",
+                               page.name)
+                return recorder.expand(self.env, context, html)
+        recorder = RenderRecorder()
+        render_context = context.child()
+        render_context.set_hints(render_recorder=recorder)
+        html = format_to_html(self.env, render_context, text)
+        if permissions_key == self._get_permissions_key(req.authname):
+            # the permissions didn't expire while rendering
+            self._render_cache[key] = (html, recorder, generations)
+        return recorder.expand(self.env, context, html)
+
+    @cached
+    def _pages_generation(self):
+        return object()
+
+    @cached
+    def _tickets_generation(self):
+        return object()
+
+    @cached
+    def _attachments_generation(self):
+        return object()
+
+    def _get_permissions_key(self, username):
+        # Links are rendered according to the permissions of the user, so
+        # a page rendered before a permission is granted or revoked can't
+        # be reused afterwards. The permissions are the ones cached by the
+        # policy, which are the ones the rendering sees.
+        permissions = DefaultPermissionPolicy(self.env) \
+                      .get_user_permissions(username)
+        return md5(' '.join(sorted(action for action, granted
+                                   in permissions.iteritems()
+                                   if granted)).encode('utf-8')).hexdigest()
+
     def _wiki_ctxtnav(self, req, page):
         """Add the normal wiki ctxtnav entries."""
         add_ctxtnav(req, _('Start Page'), req.href.wiki('WikiStart'))
@@ -747,6 +878,18 @@ class WikiModule(Component):
                              ' (', tag.a(_('diff'), href=diff_href), ')')
             return markup
 
+    # ITimelineEventValidator methods
+
+    def get_timeline_validators(self, req, start, stop, filters):
+        if 'wiki' in filters:
+            for ts, count in self.env.db_query("""
+                    SELECT MAX(time), COUNT(*) FROM wiki
+                    WHERE time>=%s AND time<=%s
+                    """, (to_utimestamp(start), to_utimestamp(stop))):
+                yield (from_utimestamp(ts) if count else None), count
+            yield AttachmentModule(self.env).get_timeline_validator(
+                Resource('wiki'), start, stop)
+
     # ISearchSource methods
 
     def get_search_filters(self, req):
@@ -272,6 +272,7 @@ In [changeset:"%s"]:
 
 class CommitTicketReferenceMacro(WikiMacroBase):
     _domain = 'messages'
+    _dependencies = ()
     _description = cleandoc_(
     """Insert a changeset message into the output.
 